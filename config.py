@@ -89,12 +89,20 @@ LEARNING_RATE = 0.001           #only used when OPTIMIZER specified
 LEARNING_RATE_DECAY = 0.0       #only used when OPTIMIZER specified
 SEND_BEST_MODEL_TO_PI = False   #change to true to automatically send best model during training
 CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs, but crater if not enough mem.
+CACHE_IMAGES_MAX_BYTES = 2 * 1024 ** 3 #byte budget of the image cache (LRU). 0 or None keeps every image.
+PREFETCH_BATCHES = 4            #how many batches to decode ahead of the one being trained. 0 disables prefetching.
+PREFETCH_WORKERS = 4            #threads used to decode and scale the prefetched batches.
+PICKLE_EXTRACT_WORKERS = 4      #processes used to extract tub pickles before training. 1 extracts in the training process.
+PICKLE_EXTRACT_PACKED = False   #write tub pickles into a packed tub ({tub}.packed) instead of json/jpg files.
 
 PRUNE_CNN = False               #This will remove weights from your model. The primary goal is to increase performance.
 PRUNE_PERCENT_TARGET = 75       # The desired percentage of pruning.
 PRUNE_PERCENT_PER_ITERATION = 20 # Percenge of pruning that is perform per iteration.
 PRUNE_VAL_LOSS_DEGRADATION_LIMIT = 0.2 # The max amout of validation loss that is permitted during pruning.
 PRUNE_EVAL_PERCENT_OF_DATASET = .05  # percent of dataset used to perform evaluation of model.
+PRUNE_MAX_ITERATIONS = 0        # max prune/fine tune iterations. 0 means no limit.
+PRUNE_TIME_BUDGET = 0           # seconds the prune/fine tune iterations may take. 0 means no limit.
+PRUNE_FINE_TUNE_EPOCHS = 0      # max fine tune epochs per iteration (early stop still applies). 0 uses MAX_EPOCHS.
 
 #Pi login information
 #When using the continuous train option, these credentials will
@@ -233,6 +233,7 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
         'float',
         'str', 'float',
     ]
+    use_imu_fifo = cfg.HAVE_IMU and getattr(cfg, 'IMU_FIFO', False)
     if cfg.HAVE_IMU:
         mpu_items = []
         mpu_types = []
@@ -248,6 +249,9 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
                 bus=cfg.MPU6050_I2C_BUS, 
                 address=cfg.MPU6050_I2C_ADDRESS, 
                 depth=cfg.MPU6050_DEPTH,
+                sample_rate=getattr(cfg, 'MPU6050_SAMPLE_RATE', 100),
+                fifo=use_imu_fifo,
+                fifo_rate=getattr(cfg, 'MPU6050_FIFO_RATE', 200),
                 debug=use_debug)
 
         elif cfg.IMU_TYPE == 'mpu9250':
@@ -263,10 +267,19 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
                 mpu9250_address=cfg.MPU9250_I2C_ADDRESS, 
                 ak8963_address=cfg.AK8963_I2C_ADDRESS,
                 depth=cfg.MPU9250_DEPTH,
+                sample_rate=getattr(cfg, 'MPU9250_SAMPLE_RATE', 100),
+                magnet_rate=getattr(cfg, 'AK8963_SAMPLE_RATE', 8),
+                fifo=use_imu_fifo,
+                fifo_rate=getattr(cfg, 'MPU9250_FIFO_RATE', 200),
                 debug=use_debug)
         else:
             raise ValueError('unknown IMU_TYPE = {}'.format(str(cfg.IMU_TYPE)))
 
+        # FIFOモードの場合は前回以降の全サンプルを imu/batch として出力する
+        if use_imu_fifo:
+            mpu_items.append('imu/batch')
+            mpu_types.append('str')
+
         # Veihcle上のIMUデータを初期化
         for i in range(len(mpu_items)):
             _item = mpu_items[i]
@@ -278,8 +291,8 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
             else:
                 raise ValueError('unknown type:{}'.format(_type))
         
-        # IMUパーツの追加
-        V.add(imu, outputs=mpu_items)
+        # IMUパーツの追加(IMU_THREADED=True の場合は別スレッドで読み込む)
+        V.add(imu, outputs=mpu_items, threaded=getattr(cfg, 'IMU_THREADED', False))
 
     '''
     2D マップ画像 (usnav/x, usnav/y, imu/recent を使用する)
@@ -290,6 +303,9 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
     map_types = [
         'float', 'float', 'str',
     ]
+    if use_imu_fifo:
+        map_items.append('imu/batch')
+        map_types.append('str')
     if use_map or cfg.CAMERA_TYPE == "MAP":
         '''
         2D マップ画像でカメラの代替とする場合
@@ -304,10 +320,12 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
                 '''
                 # 2D マップ生成パーツを追加
                 from parts import MapImageCreator
-                creator = MapImageCreator(base_image_path=cfg.MAP_BASE_IMAGE_PATH, debug=use_debug)
+                # 描画したエージェントの姿勢も出力する(イメージ送信の変化判定用)
+                creator = MapImageCreator(base_image_path=cfg.MAP_BASE_IMAGE_PATH,
+                    output_pose=True, debug=use_debug)
                 V.add(creator,
                     inputs=map_items,
-                    outputs=['cam/image_array'])
+                    outputs=['cam/image_array', 'map/pose'])
             else:
                 raise ValueError('2D map needs mpu9250 data')
         else:
@@ -993,6 +1011,10 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
     else:
         inputs += tub_imu_inputs
         types += tub_imu_input_types
+        if use_imu_fifo:
+            # FIFOモードの全サンプル(encode_recent形式で格納)
+            inputs += ['imu/batch']
+            types += ['str']
 
     if cfg.RECORD_DURING_AI:
         '''
@@ -1006,11 +1028,25 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
     Tubデータ書き込み
     '''
     th = TubHandler(path=cfg.DATA_PATH)
-    if write_both_images:
+    tub_kwargs = {}
+    if write_both_images or getattr(cfg, 'TUB_ASYNC_WRITE', False) or cfg.HAVE_IMU:
+        '''
+        前方画像も書き込む場合、非同期書き込みする場合、もしくは
+        imu/recent(nd.array)を文字列化して書き込む場合
+        '''
         from parts.datastore import TubHandler as NewTubHandler
         th = NewTubHandler(path=cfg.DATA_PATH)
-    tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta)
+        tub_kwargs = {
+            'async_write':      getattr(cfg, 'TUB_ASYNC_WRITE', False),
+            'queue_size':       getattr(cfg, 'TUB_WRITE_QUEUE_SIZE', 100),
+            'write_policy':     getattr(cfg, 'TUB_WRITE_POLICY', 'block'),
+            'write_batch_size': getattr(cfg, 'TUB_WRITE_BATCH_SIZE', 10),
+            'fsync':            getattr(cfg, 'TUB_WRITE_FSYNC', False),
+        }
+    tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta, **tub_kwargs)
     V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+    # Tubディレクトリ切替時に差し替えるため、Vehicle上のエントリを保持する
+    tub_entries = [V.parts[-1]]
 
 
     if cfg.PUB_CAMERA_IMAGES:
@@ -1047,9 +1083,16 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
             '''
     
             def new_tub_dir():
-                V.parts.pop()
-                tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta)
+                # 後から追加されたパーツ(Publisher等)があるため、元のTubエントリと同じ位置で差し替える
+                old_entry = tub_entries[0]
+                position = [i for i, entry in enumerate(V.parts) if entry is old_entry][0]
+                tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta, **tub_kwargs)
                 V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+                new_entry = V.parts.pop()
+                V.parts[position] = new_entry
+                tub_entries[0] = new_entry
+                # 書き込み待ちレコードを書き出して元のTubを停止する
+                old_entry['part'].shutdown()
                 ctr.set_tub(tub)
 
             # ボタン割当
@@ -1073,35 +1116,69 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
     if use_aws or cfg.USE_AWS_AS_DEFAULT:
         print('Start aws configuration')
         from parts.broker import AWSShadowClientFactory, PowerReporter
-        factory = AWSShadowClientFactory(cfg.AWS_CONFIG_PATH, cfg.AWS_THING_NAME)
+        # Publisherパーツの送信はバックグラウンドの送信ワーカで行うか
+        factory = AWSShadowClientFactory(cfg.AWS_CONFIG_PATH, cfg.AWS_THING_NAME,
+            async_publish=getattr(cfg, 'AWS_ASYNC_PUBLISH', True), debug=use_debug)
+        # 辞書型データをバイナリ形式(DATA_TYPE_BIN トピック)で送信するか
+        use_aws_bin = getattr(cfg, 'AWS_USE_BIN', False)
+        # 各Publisherパーツの代わりに FramePublisher で1つのフレームにまとめて送信するか
+        use_aws_frame = getattr(cfg, 'AWS_USE_FRAME', False)
+        frame_keys = []
+        frame_image_keys = []
         # Power ON 情報の送信
         power = PowerReporter(factory, debug=use_debug)
         power.on()
 
         # Tubデータ(json)送信
-        from parts.broker.pub import Publisher
-        pub_tub = Publisher(factory, debug=use_debug)
-        V.add(pub_tub, inputs=[
+        tub_items = [
             'user/angle', 'user/throttle', 'user/lift_throttle',
             'pilot/angle', 'pilot/throttle', 'pilot/lift_throttle',
             'user/mode'
-        ])
+        ]
+        if use_aws_frame:
+            frame_keys.extend(tub_items)
+        else:
+            from parts.broker.pub import Publisher
+            pub_tub = Publisher(factory, debug=use_debug, use_bin=use_aws_bin)
+            V.add(pub_tub, inputs=tub_items)
+
+        # イメージを回線容量に合わせて間引き・画質調整して送信するか
+        if getattr(cfg, 'AWS_IMAGE_ADAPTIVE', False):
+            from parts.broker.pub import AdaptiveImageEncoder
+            new_image_encoder = lambda: AdaptiveImageEncoder(
+                target_bitrate=getattr(cfg, 'AWS_IMAGE_TARGET_BITRATE', None),
+                quality=getattr(cfg, 'AWS_IMAGE_QUALITY', 75),
+                min_quality=getattr(cfg, 'AWS_IMAGE_MIN_QUALITY', 30),
+                scales=getattr(cfg, 'AWS_IMAGE_SCALES', [1.0, 0.5]),
+                diff_threshold=getattr(cfg, 'AWS_IMAGE_DIFF_THRESHOLD', 2.0),
+                keyframe_interval=getattr(cfg, 'AWS_IMAGE_KEYFRAME_INTERVAL', 1.0),
+                debug=use_debug)
+        else:
+            new_image_encoder = lambda: None
 
         # Tubデータ(イメージ)送信
-        from parts.broker.pub import ImagePublisher
-        pub_img = ImagePublisher(factory, debug=use_debug)
-        V.add(pub_img, inputs=[
-            'cam/image_array',
-        ])
+        if use_aws_frame:
+            frame_image_keys.append('cam/image_array')
+        else:
+            from parts.broker.pub import ImagePublisher
+            pub_img = ImagePublisher(factory, debug=use_debug, encoder=new_image_encoder())
+            image_items = ['cam/image_array']
+            if use_map or cfg.CAMERA_TYPE == "MAP":
+                # 2D マップ画像の場合はエージェントの姿勢が変化した場合のみ送信する
+                image_items.append('map/pose')
+            V.add(pub_img, inputs=image_items)
 
         # fwdイメージデータ送信
         if write_both_images:
-            from parts.broker.pub import FwdImagePublisher
-            pub_fwd_img = FwdImagePublisher(factory, debug=use_debug)
             from parts.datastore import FWD_CAMERA_KEY
-            V.add(pub_fwd_img, inputs=[
-                FWD_CAMERA_KEY,
-            ])
+            if use_aws_frame:
+                frame_image_keys.append(FWD_CAMERA_KEY)
+            else:
+                from parts.broker.pub import FwdImagePublisher
+                pub_fwd_img = FwdImagePublisher(factory, debug=use_debug, encoder=new_image_encoder())
+                V.add(pub_fwd_img, inputs=[
+                    FWD_CAMERA_KEY,
+                ])
 
         '''
         ジョイスティックデータの送信
@@ -1110,9 +1187,12 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
             '''
             ジョイスティックを使用している場合
             '''
-            from parts.broker.pub import JoystickPublisher
-            pub_joy = JoystickPublisher(factory, debug=use_debug)
-            V.add(pub_joy, inputs=joystick_items)
+            if use_aws_frame:
+                frame_keys.extend([key for key in joystick_items if key not in frame_keys])
+            else:
+                from parts.broker.pub import JoystickPublisher
+                pub_joy = JoystickPublisher(factory, debug=use_debug, use_bin=use_aws_bin)
+                V.add(pub_joy, inputs=joystick_items)
 
         '''
         Marvelmind システムデータの送信
@@ -1125,25 +1205,34 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
                 '''
                 Marvelmind 位置情報を使用している場合
                 '''
-                from parts.broker.pub import USNavPublisher
-                pub_usn = USNavPublisher(factory, debug=use_debug)
-                V.add(pub_usn, inputs=usnav_items)
+                if use_aws_frame:
+                    frame_keys.extend([key for key in usnav_items if key not in frame_keys])
+                else:
+                    from parts.broker.pub import USNavPublisher
+                    pub_usn = USNavPublisher(factory, debug=use_debug, use_bin=use_aws_bin)
+                    V.add(pub_usn, inputs=usnav_items)
 
             if cfg.USE_HEDGE_USNAV_RAW:
                 '''
                 Marvelmind 距離情報を使用している場合
                 '''
-                from parts.broker.pub import USNavRawPublisher
-                pub_raw = USNavRawPublisher(factory, debug=use_debug)
-                V.add(pub_raw, inputs=usnav_raw_items)
+                if use_aws_frame:
+                    frame_keys.extend([key for key in usnav_raw_items if key not in frame_keys])
+                else:
+                    from parts.broker.pub import USNavRawPublisher
+                    pub_raw = USNavRawPublisher(factory, debug=use_debug, use_bin=use_aws_bin)
+                    V.add(pub_raw, inputs=usnav_raw_items)
 
             if cfg.USE_HEDGE_IMU:
                 '''
                 Marvelmind IMU情報を使用している場合
                 '''
-                from parts.broker.pub import IMUPublisher
-                pub_imu = IMUPublisher(factory, debug=use_debug)
-                V.add(pub_imu, inputs=imu_items)
+                if use_aws_frame:
+                    frame_keys.extend([key for key in imu_items if key not in frame_keys])
+                else:
+                    from parts.broker.pub import IMUPublisher
+                    pub_imu = IMUPublisher(factory, debug=use_debug, use_bin=use_aws_bin)
+                    V.add(pub_imu, inputs=imu_items)
 
         '''
         MPU9250/MPU6050 データの送信
@@ -1156,17 +1245,50 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
                 '''
                 MPU6050を使用している場合
                 '''
-                from parts.broker.pub import Mpu6050Publisher
-                pub_mpu = Mpu6050Publisher(factory, debug=use_debug)
-                V.add(pub_mpu, inputs=mpu_items)
+                if use_aws_frame:
+                    frame_keys.extend([key for key in mpu6050_items if key not in frame_keys])
+                else:
+                    from parts.broker.pub import Mpu6050Publisher
+                    pub_mpu = Mpu6050Publisher(factory, debug=use_debug, use_bin=use_aws_bin)
+                    V.add(pub_mpu, inputs=mpu6050_items)
             
             elif cfg.IMU_TYPE == 'mpu9250':
                 '''
                 MPU6050を使用している場合
                 '''
-                from parts.broker.pub import Mpu9250Publisher
-                pub_mpu = Mpu9250Publisher(factory, debug=use_debug)
-                V.add(pub_mpu, inputs=mpu_items)
+                if use_aws_frame:
+                    frame_keys.extend([key for key in mpu9250_items if key not in frame_keys])
+                else:
+                    from parts.broker.pub import Mpu9250Publisher
+                    pub_mpu = Mpu9250Publisher(factory, debug=use_debug, use_bin=use_aws_bin)
+                    V.add(pub_mpu, inputs=mpu9250_items)
+
+        '''
+        フレームデータの送信
+        '''
+        if use_aws_frame:
+            from parts.broker.pub import FramePublisher
+            pub_frame = FramePublisher(factory, frame_keys, frame_image_keys,
+                window=getattr(cfg, 'AWS_FRAME_WINDOW', 1), debug=use_debug)
+            V.add(pub_frame, inputs=frame_keys + frame_image_keys)
+
+    '''
+    パーツ別処理時間の計測
+    '''
+    profiler = None
+    if getattr(cfg, 'PROFILE_PARTS', False):
+        from parts import LatencyProfiler
+        profiler = LatencyProfiler(cfg.DRIVE_LOOP_HZ,
+            part_names=getattr(cfg, 'PROFILE_PART_NAMES', None), debug=use_debug)
+        # 追加済みパーツの run/run_threaded をラップする
+        profiler.instrument(V)
+        # ループ1回分の合計処理時間を記録するため最後に追加する
+        V.add(profiler)
+        if (use_aws or cfg.USE_AWS_AS_DEFAULT) and getattr(cfg, 'PROFILE_PUBLISH', False):
+            from parts.broker.pub import ProfilePublisher
+            pub_profile = ProfilePublisher(factory, profiler,
+                interval=getattr(cfg, 'PROFILE_PUBLISH_INTERVAL', 10.0), debug=use_debug)
+            V.add(pub_profile)
 
     '''
     運転ループ
@@ -1186,6 +1308,9 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
             print('Stop running')
         # pigpio 利用停止
         pgio.stop()
+        # パーツ別処理時間の表示・保存
+        if profiler is not None:
+            profiler.dump(getattr(cfg, 'PROFILE_DUMP_PATH', None))
         if use_aws or cfg.USE_AWS_AS_DEFAULT:
             if power is not None:
                 # Power Off 情報の送信
@@ -1194,6 +1319,8 @@ def drive(cfg, model_path=None, use_joystick=False, use_hedge=False, use_aws=Fal
                 power.off()
                 # 送信するまで待機
                 time.sleep(1)
+            # 送信ワーカの停止と切断
+            factory.disconnect()
         print('Stopped')
 
 
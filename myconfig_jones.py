@@ -112,12 +112,20 @@ PWM_INPUT_THRESHOLD = 0.1
 # LEARNING_RATE_DECAY = 0.0       #only used when OPTIMIZER specified
 # SEND_BEST_MODEL_TO_PI = False   #change to true to automatically send best model during training
 # CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs, but crater if not enough mem.
+# CACHE_IMAGES_MAX_BYTES = 2 * 1024 ** 3 #byte budget of the image cache (LRU). 0 or None keeps every image.
+# PREFETCH_BATCHES = 4            #how many batches to decode ahead of the one being trained. 0 disables prefetching.
+# PREFETCH_WORKERS = 4            #threads used to decode and scale the prefetched batches.
+# PICKLE_EXTRACT_WORKERS = 4      #processes used to extract tub pickles before training. 1 extracts in the training process.
+# PICKLE_EXTRACT_PACKED = False   #write tub pickles into a packed tub ({tub}.packed) instead of json/jpg files.
 # 
 # PRUNE_CNN = False               #This will remove weights from your model. The primary goal is to increase performance.
 # PRUNE_PERCENT_TARGET = 75       # The desired percentage of pruning.
 # PRUNE_PERCENT_PER_ITERATION = 20 # Percenge of pruning that is perform per iteration.
 # PRUNE_VAL_LOSS_DEGRADATION_LIMIT = 0.2 # The max amout of validation loss that is permitted during pruning.
 # PRUNE_EVAL_PERCENT_OF_DATASET = .05  # percent of dataset used to perform evaluation of model.
+# PRUNE_MAX_ITERATIONS = 0        # max prune/fine tune iterations. 0 means no limit.
+# PRUNE_TIME_BUDGET = 0           # seconds the prune/fine tune iterations may take. 0 means no limit.
+# PRUNE_FINE_TUNE_EPOCHS = 0      # max fine tune epochs per iteration (early stop still applies). 0 uses MAX_EPOCHS.
 #
 TARGET_H = 120
 TARGET_W = 160
@@ -202,6 +210,31 @@ HAVE_AWS = False
 USE_AWS_AS_DEFAULT = False
 AWS_CONFIG_PATH = 'conf/aws/jones.yml'
 AWS_THING_NAME = 'jones'
+AWS_USE_BIN = False                 # 辞書型データをJSONではなくバイナリ形式で送信する
+AWS_ASYNC_PUBLISH = True            # Publisherの送信をバックグラウンドで行う(トピック毎に最新のみ送信)
+AWS_USE_FRAME = False               # 各Publisherの代わりにFramePublisherで全データを1メッセージにまとめて送信する
+AWS_FRAME_WINDOW = 1                # 1フレームにまとめるティック数(イメージはフレーム毎に最終ティックのみ送信)
+AWS_IMAGE_ADAPTIVE = False          # イメージを回線容量に合わせて間引き・画質調整して送信する
+AWS_IMAGE_TARGET_BITRATE = 2000000  # イメージ送信の目標ビットレート(bps、None で制限なし)
+AWS_IMAGE_QUALITY = 75              # JPEG品質の初期値
+AWS_IMAGE_MIN_QUALITY = 30          # JPEG品質の下限(下限到達後は解像度を下げる)
+AWS_IMAGE_SCALES = [1.0, 0.5]       # 解像度倍率の候補(大きい順)
+AWS_IMAGE_DIFF_THRESHOLD = 2.0      # 前回送信イメージとの平均輝度差がこの値未満なら送信しない
+AWS_IMAGE_KEYFRAME_INTERVAL = 1.0   # 変化がなくてもこの秒数経過したら送信する
+
+# Tub Writer
+TUB_ASYNC_WRITE = True              # バックグラウンドスレッドでTubデータを書き込む
+TUB_WRITE_QUEUE_SIZE = 100          # 書き込み待ちレコードの最大件数
+TUB_WRITE_POLICY = 'block'          # 待ち行列満杯時の動作 'block' or 'drop_oldest'
+TUB_WRITE_BATCH_SIZE = 10           # 1回にまとめて書き込む最大件数
+TUB_WRITE_FSYNC = False             # バッチ毎にディスクへ同期する
+
+# Part Profiler
+PROFILE_PARTS = False               # 運転ループ上のパーツ別処理時間(p50/p95/p99・周期超過回数)を計測する
+PROFILE_PART_NAMES = None           # 計測対象パーツのクラス名のリスト(None で全パーツ)
+PROFILE_DUMP_PATH = None            # 停止時に集計結果を保存するJSONファイルパス(None で表示のみ)
+PROFILE_PUBLISH = False             # 集計結果をAWS IoT CoreへPublishする(AWS利用時のみ)
+PROFILE_PUBLISH_INTERVAL = 10.0     # 集計結果のPublish間隔(秒)
 
 # #For the categorical model, this limits the upper bound of the learned throttle
 # #it's very IMPORTANT that this value is matched from the training PC config.py and the robot.py
@@ -215,15 +248,25 @@ AWS_THING_NAME = 'jones'
 # HAVE_IMU = False                #when true, this add a Mpu6050 part and records the data. Can be used with a 
 HAVE_IMU = True
 IMU_TYPE = 'mpu9250'
+# IMUを別スレッドで一定周期読み込む場合True
+IMU_THREADED = True
+# IMUのハードウェアFIFOを使用し全サンプルを imu/batch として記録する場合True
+# (IMU_THREADED=True の場合、*_SAMPLE_RATE はFIFO読み出し周波数となる)
+IMU_FIFO = False
 # # MPU6050
 MPU6050_DEPTH = 3
 MPU6050_I2C_ADDRESS = 0x68
 MPU6050_I2C_BUS = 1
+MPU6050_SAMPLE_RATE = 100       # IMU_THREADED=True 時のサンプリング周波数(Hz)
+MPU6050_FIFO_RATE = 200         # IMU_FIFO=True 時のFIFO格納周波数(Hz)
 # # MPU9250
 MPU9250_DEPTH = 3
 MPU9250_I2C_ADDRESS = 0x68
 MPU9250_I2C_BUS = 1
+MPU9250_SAMPLE_RATE = 100       # IMU_THREADED=True 時のサンプリング周波数(Hz)
+MPU9250_FIFO_RATE = 200         # IMU_FIFO=True 時のFIFO格納周波数(Hz)
 AK8963_I2C_ADDRESS = 0x0C
+AK8963_SAMPLE_RATE = 8          # IMU_THREADED=True 時の磁束密度読み込み周波数(Hz、AK8963は連続8Hzモードで動作)
 # 
 # #SOMBRERO
 # HAVE_SOMBRERO = False           #set to true when using the sombrero hat from the Donkeycar store. This will enable pwm on the hat.
@@ -14,6 +14,8 @@ import numpy as np
 import math
 # 摩擦抵抗値に対する指定色を定義した辞書
 color_list = {0.001: '#E5E5E5', 0.3: '#00CB65', 0.002: '#00984C'}   # to be refactored
+# エージェント画像を事前描画する際の角度の刻み(単位：度)
+SPRITE_ANGLE_STEP = 1.0
 
 
 class MobileVision:
@@ -585,6 +587,107 @@ class SpoolMobileVision(MobileVision):
             b.drawImage(ImageDraw.Draw(vision))
         return vision
 
+    def get_vision_array(self, x, y, angle):
+        """
+        最新の2D Map を nd.array 形式で返却する。
+        ベースイメージは初回のみデコードし、エージェント画像は量子化した角度ごとに
+        事前描画したものを使用する。前回と今回のエージェント矩形範囲のみを
+        再利用バッファ上で更新するため、返却値は次回呼び出し時に上書きされる。
+        引数：
+            x           エージェントのX座標
+            y           エージェントのY座標
+            angle       エージェントの方向(単位：度、0から360)
+        戻り値：
+            vision      nd.array形式の2D Map（エージェント表示有、再利用バッファ）
+        """
+        if getattr(self, 'vision_array', None) is None:
+            self.vision_array = self.get_landscape_array().copy()
+            self.vision_rect = None
+        base = self.get_landscape_array()
+        vision = self.vision_array
+        # 前回エージェントを描画した範囲をベースイメージへ戻す
+        if self.vision_rect is not None:
+            top, bottom, left, right = self.vision_rect
+            vision[top:bottom, left:right] = base[top:bottom, left:right]
+            self.vision_rect = None
+
+        sprite, mask, offset_x, offset_y = self.get_sprite(angle)
+        left = int(round(x * self.scale + self.margin_x)) + offset_x
+        top = int(round(y * self.scale + self.margin_y)) + offset_y
+        height, width = mask.shape
+        # 画像範囲外にはみ出す部分を切り取る
+        img_height, img_width = vision.shape[:2]
+        s_top, s_left = max(0, -top), max(0, -left)
+        s_bottom = height - max(0, top + height - img_height)
+        s_right = width - max(0, left + width - img_width)
+        if s_top < s_bottom and s_left < s_right:
+            rect = (top + s_top, top + s_bottom, left + s_left, left + s_right)
+            np.copyto(vision[rect[0]:rect[1], rect[2]:rect[3]],
+                sprite[s_top:s_bottom, s_left:s_right],
+                where=mask[s_top:s_bottom, s_left:s_right, np.newaxis])
+            self.vision_rect = rect
+        return vision
+
+    def get_landscape_array(self):
+        """
+        ベースイメージを nd.array 形式で返却する(初回のみデコードする)。
+        引数：
+            なし
+        戻り値：
+            landscape_array ベースイメージ(nd.array形式、書き込み不可)
+        """
+        if getattr(self, 'landscape_array', None) is None:
+            self.landscape_array = np.array(self.landscape_img.convert('RGB'))
+            self.landscape_array.flags.writeable = False
+        return self.landscape_array
+
+    def get_sprite(self, angle):
+        """
+        SPRITE_ANGLE_STEP 度単位に量子化した角度のエージェント画像を返却する。
+        未描画の角度の場合は描画してキャッシュする。
+        引数：
+            angle       エージェントの方向(単位：度)
+        戻り値：
+            sprite      エージェント画像(nd.array形式、(高さ, 幅, 3))
+            mask        エージェントが描画されている画素の場合真となる配列(高さ, 幅)
+            offset_x    エージェント中心からみた画像左端のX方向オフセット
+            offset_y    エージェント中心からみた画像上端のY方向オフセット
+        """
+        if getattr(self, 'sprites', None) is None:
+            self.sprites = {}
+        steps = int(round(360.0 / SPRITE_ANGLE_STEP))
+        key = int(round((angle % 360) / SPRITE_ANGLE_STEP)) % steps
+        if key not in self.sprites:
+            self.sprites[key] = self.draw_sprite(key * SPRITE_ANGLE_STEP)
+        return self.sprites[key]
+
+    def draw_sprite(self, angle):
+        """
+        エージェントを構成する描画オブジェクトを透過画像上に描画し、
+        描画範囲のみを切り出して返却する。
+        引数：
+            angle       エージェントの方向(単位：度)
+        戻り値：
+            get_sprite と同じ
+        """
+        # 描画オブジェクトの中で最も重心から遠い頂点までの距離
+        radius = max([np.max(np.hypot(polygon[0], polygon[1])) for polygon in
+            [Folk.polygon, Chassis.polygon, Right_wheel.polygon, Left_wheel.polygon, Tail_wheel.polygon]])
+        center = int(math.ceil(radius * self.scale)) + 2
+        size = center * 2 + 1
+        img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        for b in self.loader:
+            loader = type(b)(self.id, 0, 0, angle, center, center, self.scale, None, None)
+            loader.drawImage(draw)
+        rgba = np.array(img)
+        rows = np.flatnonzero(rgba[:, :, 3].any(axis=1))
+        cols = np.flatnonzero(rgba[:, :, 3].any(axis=0))
+        rgba = rgba[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        sprite = np.ascontiguousarray(rgba[:, :, :3])
+        mask = rgba[:, :, 3] > 0
+        return sprite, mask, int(cols[0]) - center, int(rows[0]) - center
+
     def update_vision(self, x, y, angle):
         """
         インスタンス変数self.canvasを最新の2D Map として更新する。
@@ -15,15 +15,105 @@
      You should have received a copy of the GNU Lesser General Public License
      along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import math
 import warnings
 import numpy as np
-from numpy.linalg import norm
 from .quaternion import Quaternion
 
 
+def _madgwick_step(q0, q1, q2, q3, gx, gy, gz, ax, ay, az, mx, my, mz, beta, dt):
+    """
+    Perform one MARG update step on plain floats without allocating arrays.
+    Returns the normalised quaternion as a tuple, or None if the accelerometer
+    or magnetometer measurement is zero.
+    """
+    # Normalise accelerometer measurement
+    n = math.sqrt(ax * ax + ay * ay + az * az)
+    if n == 0:
+        return None
+    ax, ay, az = ax / n, ay / n, az / n
+
+    # Normalise magnetometer measurement
+    n = math.sqrt(mx * mx + my * my + mz * mz)
+    if n == 0:
+        return None
+    mx, my, mz = mx / n, my / n, mz / n
+
+    # Reference direction of Earth's magnetic field: h = q * (0, m) * q.conj()
+    tw = -q1 * mx - q2 * my - q3 * mz
+    tx = q0 * mx + q2 * mz - q3 * my
+    ty = q0 * my - q1 * mz + q3 * mx
+    tz = q0 * mz + q1 * my - q2 * mx
+    hx = -tw * q1 + tx * q0 - ty * q3 + tz * q2
+    hy = -tw * q2 + tx * q3 + ty * q0 - tz * q1
+    hz = -tw * q3 - tx * q2 + ty * q1 + tz * q0
+    bx = math.sqrt(hx * hx + hy * hy)
+    bz = hz
+
+    # Gradient descent algorithm corrective step
+    f0 = 2 * (q1 * q3 - q0 * q2) - ax
+    f1 = 2 * (q0 * q1 + q2 * q3) - ay
+    f2 = 2 * (0.5 - q1 * q1 - q2 * q2) - az
+    f3 = 2 * bx * (0.5 - q2 * q2 - q3 * q3) + 2 * bz * (q1 * q3 - q0 * q2) - mx
+    f4 = 2 * bx * (q1 * q2 - q0 * q3) + 2 * bz * (q0 * q1 + q2 * q3) - my
+    f5 = 2 * bx * (q0 * q2 + q1 * q3) + 2 * bz * (0.5 - q1 * q1 - q2 * q2) - mz
+    # step = j.T.dot(f)
+    s0 = (-2 * q2 * f0 + 2 * q1 * f1
+          - 2 * bz * q2 * f3 + (-2 * bx * q3 + 2 * bz * q1) * f4 + 2 * bx * q2 * f5)
+    s1 = (2 * q3 * f0 + 2 * q0 * f1 - 4 * q1 * f2
+          + 2 * bz * q3 * f3 + (2 * bx * q2 + 2 * bz * q0) * f4 + (2 * bx * q3 - 4 * bz * q1) * f5)
+    s2 = (-2 * q0 * f0 + 2 * q3 * f1 - 4 * q2 * f2
+          + (-4 * bx * q2 - 2 * bz * q0) * f3 + (2 * bx * q1 + 2 * bz * q3) * f4 + (2 * bx * q0 - 4 * bz * q2) * f5)
+    s3 = (2 * q1 * f0 + 2 * q2 * f1
+          + (-4 * bx * q3 + 2 * bz * q1) * f3 + (-2 * bx * q0 + 2 * bz * q2) * f4 + 2 * bx * q1 * f5)
+    return _integrate(q0, q1, q2, q3, gx, gy, gz, s0, s1, s2, s3, beta, dt)
+
+
+def _madgwick_imu_step(q0, q1, q2, q3, gx, gy, gz, ax, ay, az, beta, dt):
+    """
+    Perform one IMU update step on plain floats without allocating arrays.
+    Returns the normalised quaternion as a tuple, or None if the accelerometer
+    measurement is zero.
+    """
+    # Normalise accelerometer measurement
+    n = math.sqrt(ax * ax + ay * ay + az * az)
+    if n == 0:
+        return None
+    ax, ay, az = ax / n, ay / n, az / n
+
+    # Gradient descent algorithm corrective step
+    f0 = 2 * (q1 * q3 - q0 * q2) - ax
+    f1 = 2 * (q0 * q1 + q2 * q3) - ay
+    f2 = 2 * (0.5 - q1 * q1 - q2 * q2) - az
+    s0 = -2 * q2 * f0 + 2 * q1 * f1
+    s1 = 2 * q3 * f0 + 2 * q0 * f1 - 4 * q1 * f2
+    s2 = -2 * q0 * f0 + 2 * q3 * f1 - 4 * q2 * f2
+    s3 = 2 * q1 * f0 + 2 * q2 * f1
+    return _integrate(q0, q1, q2, q3, gx, gy, gz, s0, s1, s2, s3, beta, dt)
+
+
+def _integrate(q0, q1, q2, q3, gx, gy, gz, s0, s1, s2, s3, beta, dt):
+    """
+    Apply the normalised corrective step and the gyroscope rate to the quaternion.
+    """
+    n = math.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+    if n != 0:
+        s0, s1, s2, s3 = s0 / n, s1 / n, s2 / n, s3 / n  # normalise step magnitude
+
+    # Compute rate of change of quaternion: (q * (0, g)) * 0.5 - beta * step
+    d0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz) - beta * s0
+    d1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy) - beta * s1
+    d2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx) - beta * s2
+    d3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx) - beta * s3
+
+    # Integrate to yield quaternion
+    q0, q1, q2, q3 = q0 + d0 * dt, q1 + d1 * dt, q2 + d2 * dt, q3 + d3 * dt
+    n = math.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 / n, q1 / n, q2 / n, q3 / n  # normalise quaternion
+
+
 class MadgwickAHRS:
     samplePeriod = 1 / 256
-    quaternion = Quaternion(1, 0, 0, 0)
     beta = 1
 
     def __init__(self, sampleperiod=None, quaternion=None, beta=None):
@@ -34,6 +124,7 @@ class MadgwickAHRS:
         :param beta: Algorithm gain beta
         :return:
         """
+        self.quaternion = Quaternion(1, 0, 0, 0)
         if sampleperiod is not None:
             self.samplePeriod = sampleperiod
         if quaternion is not None:
@@ -41,6 +132,15 @@ class MadgwickAHRS:
         if beta is not None:
             self.beta = beta
 
+    def _get_quaternion(self):
+        # built on access only, the filter state is kept as plain floats
+        return Quaternion(*self._q)
+
+    def _set_quaternion(self, quaternion):
+        self._q = tuple(float(v) for v in Quaternion(quaternion).q)
+
+    quaternion = property(_get_quaternion, _set_quaternion)
+
     def update(self, gyroscope, accelerometer, magnetometer):
         """
         Perform one update step with data from a AHRS sensor array
@@ -49,54 +149,16 @@ class MadgwickAHRS:
         :param magnetometer: A three-element array containing the magnetometer data. Can be any unit since a normalized value is used.
         :return:
         """
-        q = self.quaternion
-        gyroscope = np.array(gyroscope, dtype=float).flatten()
-        accelerometer = np.array(accelerometer, dtype=float).flatten()
-        magnetometer = np.array(magnetometer, dtype=float).flatten()
-
-        # Normalise accelerometer measurement
-        if norm(accelerometer) is 0:
-            warnings.warn("accelerometer is zero")
+        gx, gy, gz = gyroscope
+        ax, ay, az = accelerometer
+        mx, my, mz = magnetometer
+        q = _madgwick_step(*self._q, float(gx), float(gy), float(gz),
+                           float(ax), float(ay), float(az), float(mx), float(my), float(mz),
+                           self.beta, self.samplePeriod)
+        if q is None:
+            warnings.warn("accelerometer or magnetometer is zero")
             return
-        accelerometer /= norm(accelerometer)
-
-        # Normalise magnetometer measurement
-        if norm(magnetometer) is 0:
-            warnings.warn("magnetometer is zero")
-            return
-        magnetometer /= norm(magnetometer)
-
-        # Reference direction of Earth's magnetic field
-        h = q * (Quaternion(0, magnetometer[0], magnetometer[1], magnetometer[2]) * q.conj())
-        # the filter's reference direction of the earth's magnetic field
-        b = np.array([0, norm(h[1:3]), 0, h[3]])
-
-        # Gradient descent algorithm corrective step
-        f = np.array([
-            2 * (q[1] * q[3] - q[0] * q[2]) - accelerometer[0],
-            2 * (q[0] * q[1] + q[2] * q[3]) - accelerometer[1],
-            2 * (0.5 - q[1] ** 2 - q[2] ** 2) - accelerometer[2],
-            2 * b[1] * (0.5 - q[2] ** 2 - q[3] ** 2) + 2 * b[3] * (q[1] * q[3] - q[0] * q[2]) - magnetometer[0],
-            2 * b[1] * (q[1] * q[2] - q[0] * q[3]) + 2 * b[3] * (q[0] * q[1] + q[2] * q[3]) - magnetometer[1],
-            2 * b[1] * (q[0] * q[2] + q[1] * q[3]) + 2 * b[3] * (0.5 - q[1] ** 2 - q[2] ** 2) - magnetometer[2]
-        ])
-        j = np.array([
-            [-2 * q[2], 2 * q[3], -2 * q[0], 2 * q[1]],
-            [2 * q[1], 2 * q[0], 2 * q[3], 2 * q[2]],
-            [0, -4 * q[1], -4 * q[2], 0],
-            [-2 * b[3] * q[2], 2 * b[3] * q[3], -4 * b[1] * q[2] - 2 * b[3] * q[0], -4 * b[1] * q[3] + 2 * b[3] * q[1]],
-            [-2 * b[1] * q[3] + 2 * b[3] * q[1], 2 * b[1] * q[2] + 2 * b[3] * q[0], 2 * b[1] * q[1] + 2 * b[3] * q[3], -2 * b[1] * q[0] + 2 * b[3] * q[2]],
-            [2 * b[1] * q[2], 2 * b[1] * q[3] - 4 * b[3] * q[1], 2 * b[1] * q[0] - 4 * b[3] * q[2], 2 * b[1] * q[1]]
-        ])
-        step = j.T.dot(f)
-        step /= norm(step)  # normalise step magnitude
-
-        # Compute rate of change of quaternion
-        qdot = (q * Quaternion(0, gyroscope[0], gyroscope[1], gyroscope[2])) * 0.5 - self.beta * step.T
-
-        # Integrate to yield quaternion
-        q += qdot * self.samplePeriod
-        self.quaternion = Quaternion(q / norm(q))  # normalise quaternion
+        self._q = q
 
     def update_imu(self, gyroscope, accelerometer):
         """
@@ -104,33 +166,60 @@ class MadgwickAHRS:
         :param gyroscope: A three-element array containing the gyroscope data in radians per second.
         :param accelerometer: A three-element array containing the accelerometer data. Can be any unit since a normalized value is used.
         """
-        q = self.quaternion
-        gyroscope = np.array(gyroscope, dtype=float).flatten()
-        accelerometer = np.array(accelerometer, dtype=float).flatten()
-
-        # Normalise accelerometer measurement
-        if norm(accelerometer) is 0:
+        gx, gy, gz = gyroscope
+        ax, ay, az = accelerometer
+        q = _madgwick_imu_step(*self._q, float(gx), float(gy), float(gz),
+                               float(ax), float(ay), float(az),
+                               self.beta, self.samplePeriod)
+        if q is None:
             warnings.warn("accelerometer is zero")
             return
-        accelerometer /= norm(accelerometer)
-
-        # Gradient descent algorithm corrective step
-        f = np.array([
-            2 * (q[1] * q[3] - q[0] * q[2]) - accelerometer[0],
-            2 * (q[0] * q[1] + q[2] * q[3]) - accelerometer[1],
-            2 * (0.5 - q[1] ** 2 - q[2] ** 2) - accelerometer[2]
-        ])
-        j = np.array([
-            [-2 * q[2], 2 * q[3], -2 * q[0], 2 * q[1]],
-            [2 * q[1], 2 * q[0], 2 * q[3], 2 * q[2]],
-            [0, -4 * q[1], -4 * q[2], 0]
-        ])
-        step = j.T.dot(f)
-        step /= norm(step)  # normalise step magnitude
-
-        # Compute rate of change of quaternion
-        qdot = (q * Quaternion(0, gyroscope[0], gyroscope[1], gyroscope[2])) * 0.5 - self.beta * step.T
-
-        # Integrate to yield quaternion
-        q += qdot * self.samplePeriod
-        self.quaternion = Quaternion(q / norm(q))  # normalise quaternion
+        self._q = q
+
+    def update_batch(self, samples, sampleperiods=None):
+        """
+        Filter a whole sequence of AHRS samples in one call, e.g. for offline replay.
+        :param samples: An (N, 9) array of gyroscope (rad/s), accelerometer and magnetometer data per row.
+        :param sampleperiods: Optional (N,) array of sample periods, samplePeriod is used when omitted.
+        :return: An (N, 4) array containing the quaternion after each sample.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if samples.ndim != 2 or samples.shape[1] != 9:
+            raise ValueError("Expecting an (N, 9) array of gyroscope, accelerometer and magnetometer data")
+        if sampleperiods is None:
+            dts = [self.samplePeriod] * len(samples)
+        else:
+            dts = np.broadcast_to(np.asarray(sampleperiods, dtype=float), (len(samples),)).tolist()
+        result = np.empty((len(samples), 4))
+        q, beta = self._q, self.beta
+        for i, (row, dt) in enumerate(zip(samples.tolist(), dts)):
+            updated = _madgwick_step(*q, *row, beta, dt)
+            if updated is not None:  # skip samples with zero accelerometer or magnetometer
+                q = updated
+            result[i] = q
+        self._q = q
+        return result
+
+    def update_imu_batch(self, samples, sampleperiods=None):
+        """
+        Filter a whole sequence of IMU samples in one call, e.g. for offline replay.
+        :param samples: An (N, 6) array of gyroscope (rad/s) and accelerometer data per row.
+        :param sampleperiods: Optional (N,) array of sample periods, samplePeriod is used when omitted.
+        :return: An (N, 4) array containing the quaternion after each sample.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if samples.ndim != 2 or samples.shape[1] != 6:
+            raise ValueError("Expecting an (N, 6) array of gyroscope and accelerometer data")
+        if sampleperiods is None:
+            dts = [self.samplePeriod] * len(samples)
+        else:
+            dts = np.broadcast_to(np.asarray(sampleperiods, dtype=float), (len(samples),)).tolist()
+        result = np.empty((len(samples), 4))
+        q, beta = self._q, self.beta
+        for i, (row, dt) in enumerate(zip(samples.tolist(), dts)):
+            updated = _madgwick_imu_step(*q, *row, beta, dt)
+            if updated is not None:  # skip samples with zero accelerometer
+                q = updated
+            result[i] = q
+        self._q = q
+        return result
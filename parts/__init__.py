@@ -7,4 +7,5 @@ from .sensors.range import get_range_part
 from .sensors.navigation import HedgehogController, FormerHedgehogPusher
 from .clock import Timestamp
 from .led_status import LED, RGB_LED
-from .image import MapImageCreator
\ No newline at end of file
+from .image import MapImageCreator
+from .profiler import LatencyProfiler, ProfiledPart
@@ -2,6 +2,7 @@
 import os
 import yaml
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTShadowClient
+from .worker import PublishWorker
 
 class AWSConfig:
 
@@ -68,10 +69,13 @@ class AWSConfig:
 class AWSShadowClientFactory(AWSConfig):
 
 
-    def __init__(self, conf_path, client_id):
+    def __init__(self, conf_path, client_id, async_publish=True, debug=False):
         super().__init__(conf_path, client_id)
         self._shadow_handler = None
         self._shadow_client = None
+        self._publish_worker = None
+        self.async_publish = async_publish
+        self.debug = debug
 
     def get_shadow_handler(self):
         if self._shadow_handler is None:
@@ -82,6 +86,20 @@ class AWSShadowClientFactory(AWSConfig):
     def get_mqtt_client(self):
         return self._get_shadow_client().getMQTTConnection() #.get_mqtt_connection()
 
+    def get_publish_worker(self):
+        """
+        Publisherパーツ間で共有する送信ワーカを取得する。
+        引数：
+            なし
+        戻り値：
+            PublishWorker オブジェクト、async_publish が偽の場合 None
+        """
+        if not self.async_publish:
+            return None
+        if self._publish_worker is None:
+            self._publish_worker = PublishWorker(self.get_mqtt_client(), debug=self.debug)
+        return self._publish_worker
+
     def _get_shadow_client(self):
         if self._shadow_client is not None:
             return self._shadow_client
@@ -109,6 +127,9 @@ class AWSShadowClientFactory(AWSConfig):
         shadow_client.configureLastWill(topic, payload, 0)
 
     def disconnect(self):
+        if self._publish_worker is not None:
+            self._publish_worker.shutdown()
+            self._publish_worker = None
         if self._shadow_client is not None:
             try:
                 self._shadow_client.disconnect()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+DATA_TYPE_BIN トピックで送受信するバイナリメッセージのエンコード・デコードを行うモジュール。
+JSONメッセージと同じキー・値の辞書を、スキーマ毎に固定された struct レイアウトで
+パックする。キー文字列はペイロードに含めない。
+
+メッセージ形式(リトルエンディアン)：
+    uint8   バージョン(CODEC_VERSION)
+    uint8   スキーマID
+    固定長フィールド(スキーマ定義順、'd':float64、'?':bool)
+    可変長フィールド(スキーマ定義順)
+        's'     uint16 バイト長 + UTF-8文字列
+        'a'     uint16 行数 + uint16 列数 + float64配列
+
+フレームメッセージ(SCHEMA_FRAME)は任意のキーを複数ティック分まとめるため、
+固定レイアウトではなくキー名と型タグ付きの値を格納する(FrameSchema 参照)。
+"""
+import struct
+import numpy as np
+
+""" バージョン """
+CODEC_VERSION = 1
+
+""" スキーマID """
+SCHEMA_TUB_USER = 1
+SCHEMA_TUB = 2
+SCHEMA_HEDGE_USNAV = 3
+SCHEMA_HEDGE_USNAV_RAW = 4
+SCHEMA_HEDGE_IMU = 5
+SCHEMA_MPU6050 = 6
+SCHEMA_MPU9250 = 7
+SCHEMA_JOYSTICK = 8
+SCHEMA_FRAME = 9
+
+_HEADER = struct.Struct('<BB')
+_LENGTH = struct.Struct('<H')
+_SHAPE = struct.Struct('<HH')
+_FIXED_KINDS = ['d', '?']
+_FRAME_HEADER = struct.Struct('<qqHH')
+_BYTES_LENGTH = struct.Struct('<I')
+_TAG = struct.Struct('<c')
+_TAGGED = {
+    b'd': struct.Struct('<d'),
+    b'q': struct.Struct('<q'),
+    b'?': struct.Struct('<?'),
+}
+
+class MessageSchema:
+    """
+    1種類のメッセージのフィールド構成を保持し、エンコード・デコードを行うクラス。
+    """
+    def __init__(self, schema_id, fields):
+        """
+        固定長フィールドの struct をコンパイルする。
+        引数：
+            schema_id   スキーマID
+            fields      (キー, 種別) のリスト、種別は 'd', '?', 's', 'a' のいずれか
+        戻り値：
+            なし
+        """
+        self.schema_id = schema_id
+        self.keys = [key for key, _ in fields]
+        self.fixed_keys = [key for key, kind in fields if kind in _FIXED_KINDS]
+        self.variable = [(key, kind) for key, kind in fields if kind not in _FIXED_KINDS]
+        self.fixed = struct.Struct(_HEADER.format + ''.join(
+            [kind for _, kind in fields if kind in _FIXED_KINDS]))
+
+    def encode(self, message):
+        """
+        辞書をバイナリメッセージに変換する。
+        引数：
+            message     JSONメッセージと同じキーを持つ辞書
+        戻り値：
+            バイナリメッセージ(bytes)
+        """
+        chunks = [self.fixed.pack(CODEC_VERSION, self.schema_id,
+            *[message[key] for key in self.fixed_keys])]
+        for key, kind in self.variable:
+            chunks.append(_ENCODERS[kind](message[key]))
+        return b''.join(chunks)
+
+    def decode(self, payload):
+        """
+        バイナリメッセージを辞書に変換する。
+        引数：
+            payload     バイナリメッセージ
+        戻り値：
+            JSONメッセージと同じキーを持つ辞書
+        """
+        values = self.fixed.unpack_from(payload, 0)
+        message = dict(zip(self.fixed_keys, values[_HEADER.size:]))
+        pos = self.fixed.size
+        for key, kind in self.variable:
+            message[key], pos = _DECODERS[kind](payload, pos)
+        return message
+
+def _encode_str(value):
+    data = str(value).encode('utf-8')
+    return _LENGTH.pack(len(data)) + data
+
+def _decode_str(payload, pos):
+    (length,) = _LENGTH.unpack_from(payload, pos)
+    pos += _LENGTH.size
+    return bytes(payload[pos:pos + length]).decode('utf-8'), pos + length
+
+def _encode_array(value):
+    if value is None:
+        return _SHAPE.pack(0, 0)
+    data = np.ascontiguousarray(value, dtype='<f8')
+    if data.ndim == 1:
+        data = data.reshape(1, -1)
+    return _SHAPE.pack(*data.shape) + data.tobytes()
+
+def _decode_array(payload, pos):
+    rows, cols = _SHAPE.unpack_from(payload, pos)
+    pos += _SHAPE.size
+    size = rows * cols * 8
+    data = np.frombuffer(payload, dtype='<f8', count=rows * cols, offset=pos)
+    return data.reshape(rows, cols), pos + size
+
+_ENCODERS = {'s': _encode_str, 'a': _encode_array}
+_DECODERS = {'s': _decode_str, 'a': _decode_array}
+
+class FrameSchema:
+    """
+    複数ティック分の任意のキーの値をまとめたフレームメッセージの
+    エンコード・デコードを行うクラス。
+
+    フレーム部の形式(ヘッダの後)：
+        int64   先頭行のシーケンス番号
+        int64   参照するイメージのシーケンス番号(イメージなしの場合 -1)
+        uint16  キー数
+        uint16  行数
+        キー名('s' と同じ形式)をキー数分
+        型タグ(1バイト) + 値 を 行数 x キー数 分
+            'n' None、'd' float64、'q' int64、'?' bool、
+            's' 文字列、'b' uint32 バイト長 + バイト列、'a' float64配列
+    """
+    def __init__(self, schema_id):
+        """
+        スキーマIDを保持する。
+        引数：
+            schema_id   スキーマID
+        戻り値：
+            なし
+        """
+        self.schema_id = schema_id
+
+    def encode(self, message):
+        """
+        フレーム辞書をバイナリメッセージに変換する。
+        引数：
+            message     'seq', 'image_seq', 'keys', 'rows' をキーに持つ辞書
+        戻り値：
+            バイナリメッセージ(bytes)
+        例外：
+            ValueError  エンコードできない型の値が含まれる場合
+        """
+        keys = message['keys']
+        rows = message['rows']
+        chunks = [_HEADER.pack(CODEC_VERSION, self.schema_id),
+            _FRAME_HEADER.pack(message['seq'], message.get('image_seq', -1), len(keys), len(rows))]
+        chunks.extend([_encode_str(key) for key in keys])
+        for row in rows:
+            if len(row) != len(keys):
+                raise ValueError('row length {} != keys length {}'.format(str(len(row)), str(len(keys))))
+            chunks.extend([_encode_tagged(value) for value in row])
+        return b''.join(chunks)
+
+    def decode(self, payload):
+        """
+        バイナリメッセージをフレーム辞書に変換する。
+        引数：
+            payload     バイナリメッセージ
+        戻り値：
+            'seq', 'image_seq', 'keys', 'rows' をキーに持つ辞書
+        """
+        seq, image_seq, key_count, row_count = _FRAME_HEADER.unpack_from(payload, _HEADER.size)
+        pos = _HEADER.size + _FRAME_HEADER.size
+        keys = []
+        for _ in range(key_count):
+            key, pos = _decode_str(payload, pos)
+            keys.append(key)
+        rows = []
+        for _ in range(row_count):
+            row = []
+            for _ in range(key_count):
+                value, pos = _decode_tagged(payload, pos)
+                row.append(value)
+            rows.append(row)
+        return {'seq': seq, 'image_seq': image_seq, 'keys': keys, 'rows': rows}
+
+def _encode_tagged(value):
+    if value is None:
+        return b'n'
+    if isinstance(value, (bool, np.bool_)):
+        return b'?' + _TAGGED[b'?'].pack(bool(value))
+    if isinstance(value, (int, np.integer)):
+        return b'q' + _TAGGED[b'q'].pack(int(value))
+    if isinstance(value, (float, np.floating)):
+        return b'd' + _TAGGED[b'd'].pack(float(value))
+    if isinstance(value, str):
+        return b's' + _encode_str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return b'b' + _BYTES_LENGTH.pack(len(value)) + bytes(value)
+    if isinstance(value, (np.ndarray, list, tuple)):
+        return b'a' + _encode_array(value)
+    raise ValueError('unsupported frame value type = {}'.format(str(type(value))))
+
+def _decode_tagged(payload, pos):
+    (tag,) = _TAG.unpack_from(payload, pos)
+    pos += _TAG.size
+    if tag == b'n':
+        return None, pos
+    if tag in _TAGGED:
+        (value,) = _TAGGED[tag].unpack_from(payload, pos)
+        return value, pos + _TAGGED[tag].size
+    if tag == b's':
+        return _decode_str(payload, pos)
+    if tag == b'b':
+        (length,) = _BYTES_LENGTH.unpack_from(payload, pos)
+        pos += _BYTES_LENGTH.size
+        if pos + length > len(payload):
+            raise struct.error('bytes value exceeds payload')
+        return bytes(payload[pos:pos + length]), pos + length
+    if tag == b'a':
+        return _decode_array(payload, pos)
+    raise struct.error('unknown frame value tag = {}'.format(str(tag)))
+
+SCHEMAS = {schema.schema_id: schema for schema in [
+    MessageSchema(SCHEMA_TUB_USER, [
+        ('user/angle', 'd'), ('user/throttle', 'd'), ('user/lift_throttle', 'd'),
+        ('user/mode', 's'), ('timestamp', 'd'),
+    ]),
+    MessageSchema(SCHEMA_TUB, [
+        ('user/angle', 'd'), ('user/throttle', 'd'), ('user/lift_throttle', 'd'),
+        ('pilot/angle', 'd'), ('pilot/throttle', 'd'), ('pilot/lift_throttle', 'd'),
+        ('user/mode', 's'), ('timestamp', 'd'),
+    ]),
+    MessageSchema(SCHEMA_HEDGE_USNAV, [
+        ('usnav/id', 's'), ('usnav/x', 'd'), ('usnav/y', 'd'), ('usnav/z', 'd'),
+        ('usnav/angle', 'd'), ('usnav/timestamp', 'd'),
+    ]),
+    MessageSchema(SCHEMA_HEDGE_USNAV_RAW, [
+        ('dist/id', 's'),
+        ('dist/b1', 's'), ('dist/b1d', 'd'), ('dist/b2', 's'), ('dist/b2d', 'd'),
+        ('dist/b3', 's'), ('dist/b3d', 'd'), ('dist/b4', 's'), ('dist/b4d', 'd'),
+        ('dist/timestamp', 'd'),
+    ]),
+    MessageSchema(SCHEMA_HEDGE_IMU, [
+        ('imu/x', 'd'), ('imu/y', 'd'), ('imu/z', 'd'),
+        ('imu/qw', 'd'), ('imu/qx', 'd'), ('imu/qy', 'd'), ('imu/qz', 'd'),
+        ('imu/vx', 'd'), ('imu/vy', 'd'), ('imu/vz', 'd'),
+        ('imu/ax', 'd'), ('imu/ay', 'd'), ('imu/az', 'd'),
+        ('imu/gx', 'd'), ('imu/gy', 'd'), ('imu/gz', 'd'),
+        ('imu/mx', 'd'), ('imu/my', 'd'), ('imu/mz', 'd'),
+        ('imu/timestamp', 'd'),
+    ]),
+    MessageSchema(SCHEMA_MPU6050, [
+        ('imu/acl_x', 'd'), ('imu/acl_y', 'd'), ('imu/acl_z', 'd'),
+        ('imu/gyr_x', 'd'), ('imu/gyr_y', 'd'), ('imu/gyr_z', 'd'),
+        ('imu/recent', 'a'), ('imu/mpu_timestamp', 'd'),
+    ]),
+    MessageSchema(SCHEMA_MPU9250, [
+        ('imu/acl_x', 'd'), ('imu/acl_y', 'd'), ('imu/acl_z', 'd'),
+        ('imu/gyr_x', 'd'), ('imu/gyr_y', 'd'), ('imu/gyr_z', 'd'),
+        ('imu/mgt_x', 'd'), ('imu/mgt_y', 'd'), ('imu/mgt_z', 'd'),
+        ('imu/temp', 'd'), ('imu/recent', 'a'), ('imu/mpu_timestamp', 'd'),
+    ]),
+    MessageSchema(SCHEMA_JOYSTICK, [
+        ('user/angle', 'd'), ('user/throttle', 'd'), ('user/lift_throttle', 'd'),
+        ('user/mode', 's'), ('recording', '?'),
+    ]),
+    FrameSchema(SCHEMA_FRAME),
+]}
+
+def encode_message(schema_id, message):
+    """
+    辞書をスキーマIDに対応するバイナリメッセージへ変換する。
+    引数：
+        schema_id   スキーマID
+        message     JSONメッセージと同じキーを持つ辞書
+    戻り値：
+        バイナリメッセージ(bytes)
+    例外：
+        ValueError  未知のスキーマIDの場合
+    """
+    schema = SCHEMAS.get(schema_id)
+    if schema is None:
+        raise ValueError('unknown schema id = {}'.format(str(schema_id)))
+    return schema.encode(message)
+
+def decode_message(payload):
+    """
+    バイナリメッセージを辞書に変換する。
+    引数：
+        payload     バイナリメッセージ(bytes/bytearray)
+    戻り値：
+        JSONメッセージと同じキーを持つ辞書
+    例外：
+        ValueError  バージョン不一致、未知のスキーマID、長さ不正の場合
+    """
+    if len(payload) < _HEADER.size:
+        raise ValueError('too short message length = {}'.format(str(len(payload))))
+    version, schema_id = _HEADER.unpack_from(payload, 0)
+    if version != CODEC_VERSION:
+        raise ValueError('unsupported message version = {}'.format(str(version)))
+    schema = SCHEMAS.get(schema_id)
+    if schema is None:
+        raise ValueError('unknown schema id = {}'.format(str(schema_id)))
+    try:
+        return schema.decode(payload)
+    except (struct.error, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('broken message schema id = {}: {}'.format(str(schema_id), str(e)))
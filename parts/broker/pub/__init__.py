@@ -4,9 +4,15 @@ AWS IoT Core へPubSubするためのクラス群
 """
 # Tubデータ(手動・自動、手動のみ、イメージ)
 from .tub import Publisher, UserPublisher, ImagePublisher, FwdImagePublisher
+# イメージ送信用適応型エンコーダ
+from .stream import AdaptiveImageEncoder
 # Marvelmindデータ(位置・距離・IMU:9軸+四元数)
 from .hedge import USNavPublisher, USNavRawPublisher, IMUPublisher
 # IMUデータ(MPU6050:6軸、MPU9250:9軸)
 from .mpu import Mpu6050Publisher, Mpu9250Publisher
 # ジョイスティックデータ
 from .joystick import JoystickPublisher
+# 複数キーをまとめたフレームデータ
+from .frame import FramePublisher
+# パーツ別処理時間の集計データ
+from .profile import ProfilePublisher
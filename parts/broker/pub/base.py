@@ -2,21 +2,25 @@
 """
 AWS IoT Core Publisher 基底クラスを定義するモジュール。
 """
+import json
 import donkeycar as dk
 import numpy as np
+from .topic import to_bin_topic
+from ..codec import encode_message
 
 class PublisherBase:
     """
     Tubデータ(イメージ、JSONデータ)をMQTTプロトコルで送信する
     パブリッシャパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, name='Base', debug=False):
+    def __init__(self, aws_iot_client_factory, name='Base', debug=False, use_bin=False):
         """
         フィールドを初期化する。
         引数：
             aws_iot_client_factory  AWSIoTClientFactoryオブジェクト
             name                    ターゲット名
             debug                   デバッグフラグ
+            use_bin                 辞書型データをJSONではなくバイナリ形式で送信する
         戻り値：
             なし
         """
@@ -28,8 +32,50 @@ class PublisherBase:
         if debug:
             print('[{}Publisher] thing_name = {}'.format(
                 self.name,self.thing_name))
-        self.client = aws_iot_client_factory.get_mqtt_client()
+        # 送信ワーカが有効な場合は publish をワーカのキューに積むだけで戻る
+        self.worker = aws_iot_client_factory.get_publish_worker()
+        if self.worker is None:
+            self.client = aws_iot_client_factory.get_mqtt_client()
+        else:
+            self.client = self.worker
         self.debug = debug
+        self.use_bin = use_bin
+
+    def data_topic(self, json_topic):
+        """
+        辞書型データの送信先トピック名を返却する。
+        use_bin が真の場合は DATA_TYPE_BIN のトピック名となる。
+        引数：
+            json_topic          JSONデータ用トピック名
+        戻り値：
+            トピック名
+        """
+        if self.use_bin:
+            return to_bin_topic(json_topic)
+        return json_topic
+
+    def dumps(self, schema_id, message):
+        """
+        辞書型データを送信メッセージに変換する。
+        引数：
+            schema_id           バイナリ形式のスキーマID
+            message             辞書型データ
+        戻り値：
+            use_bin が真の場合バイナリメッセージ(bytes)、偽の場合JSON文字列
+        """
+        if self.use_bin:
+            return encode_message(schema_id, message)
+        return json.dumps(message)
+
+    def is_backlogged(self, topic):
+        """
+        送信ワーカに指定トピックの未送信メッセージが残っているかどうか判別する。
+        引数：
+            topic               トピック名
+        戻り値：
+            真偽値(送信ワーカを使用しない場合は常に偽)
+        """
+        return self.worker is not None and self.worker.is_pending(topic)
 
     def encode_image_message(self, image_array):
         """
@@ -54,6 +100,7 @@ class PublisherBase:
             なし
         """
         self.client = None
+        self.worker = None
         if self.debug:
             print('[{}Publisher] shutdown'.format(self.name))
 
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+複数の車両メモリキーを1つのフレームメッセージにまとめて
+AWS IoT Core へ Publish するパーツクラスを定義するモジュール。
+"""
+from .base import PublisherBase, arr_to_bytearray
+from ..codec import encode_message, SCHEMA_FRAME
+from .topic import pub_frame_bin_topic, pub_frame_image_topic
+
+class FramePublisher(PublisherBase):
+    """
+    指定したキーの値を window ティック分まとめ、1回の publish で送信するパーツクラス。
+    イメージはフレームとは別のイメージトピックへシーケンス番号付きで送信し、
+    フレームからはシーケンス番号で参照する(window 毎に最終ティックのイメージのみ送信)。
+    """
+    def __init__(self, aws_iot_client_factory, keys, image_keys=[], window=1, debug=False):
+        """
+        トピック名を生成する。
+        引数：
+            aws_iot_client_factory  AWSIoTClientFactoryオブジェクト
+            keys                    フレームに含めるキーのリスト
+            image_keys              イメージトピックで送信するキーのリスト
+            window                  1フレームにまとめるティック数
+            debug                   デバッグフラグ
+        戻り値：
+            なし
+        例外：
+            ValueError  window が1未満の場合
+        """
+        super().__init__(aws_iot_client_factory, 'Frame', debug)
+        if window < 1:
+            raise ValueError('illegal window = {}'.format(str(window)))
+        self.keys = list(keys)
+        self.image_keys = list(image_keys)
+        self.window = window
+        self.topic = pub_frame_bin_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name)
+        self.image_topic = pub_frame_image_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name)
+        if self.debug:
+            print('[FramePublisher] topic name = {}, {} keys={} image_keys={} window={}'.format(
+                self.topic, self.image_topic, str(self.keys), str(self.image_keys), str(window)))
+        self.qos = 0
+        self.seq = 0
+        self.rows = []
+
+    def run(self, *args):
+        """
+        1ティック分の値をバッファに追加し、window ティック分たまったら送信する。
+        引数：
+            *args       keys、image_keys の順に並べた値
+        戻り値：
+            なし
+        """
+        self.seq += 1
+        self.rows.append(list(args[:len(self.keys)]))
+        if len(self.rows) >= self.window:
+            self.publish_frame(args[len(self.keys):])
+
+    def publish_frame(self, images=None):
+        """
+        バッファ内の行をフレームメッセージとして送信する。
+        イメージが指定された場合は最終行のシーケンス番号でイメージを送信する。
+        引数：
+            images      image_keys 順のイメージデータ(nd.array型)のリスト
+        戻り値：
+            なし
+        """
+        if len(self.rows) == 0:
+            return
+        image_seq = -1
+        if images is not None and len(self.image_keys) > 0:
+            image_seq = self.seq
+            ret = self.client.publish(
+                self.image_topic,
+                self.to_image_message(image_seq, images),
+                self.qos)
+            if self.debug:
+                print('[FramePublisher] publish topic={} seq={} ret={}'.format(
+                    self.image_topic, str(image_seq), str(ret)))
+        ret = self.client.publish(
+            self.topic,
+            self.to_message(self.seq - len(self.rows) + 1, image_seq, self.rows),
+            self.qos)
+        if self.debug:
+            print('[FramePublisher] publish topic={} rows={} ret={}'.format(
+                self.topic, str(len(self.rows)), str(ret)))
+        self.rows = []
+
+    def to_message(self, seq, image_seq, rows):
+        """
+        フレームメッセージを作成する。
+        引数：
+            seq         先頭行のシーケンス番号
+            image_seq   参照するイメージのシーケンス番号(なしの場合 -1)
+            rows        keys 順の値リストのリスト
+        戻り値：
+            バイナリメッセージ(bytes)
+        """
+        return encode_message(SCHEMA_FRAME, {
+            'seq':          seq,
+            'image_seq':    image_seq,
+            'keys':         self.keys,
+            'rows':         rows,
+        })
+
+    def to_image_message(self, seq, images):
+        """
+        イメージメッセージを作成する。
+        引数：
+            seq         シーケンス番号
+            images      image_keys 順のイメージデータ(nd.array型)のリスト
+        戻り値：
+            バイナリメッセージ(bytes)
+        """
+        return encode_message(SCHEMA_FRAME, {
+            'seq':          seq,
+            'image_seq':    seq,
+            'keys':         self.image_keys,
+            'rows':         [[None if image is None else arr_to_bytearray(image) for image in images]],
+        })
+
+    def shutdown(self):
+        """
+        バッファに残った行を送信する。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self.client is not None:
+            self.publish_frame()
+        super().shutdown()
@@ -3,8 +3,8 @@
 MarvelmindデータをAWS IoT Core へ Publish するパーツクラスを定義するモジュール。
 """
 import time
-import json
 from .base import PublisherBase, to_float, to_str
+from ..codec import SCHEMA_HEDGE_USNAV, SCHEMA_HEDGE_USNAV_RAW, SCHEMA_HEDGE_IMU
 from .topic import pub_hedge_usnav_json_topic, pub_hedge_usnav_raw_json_topic, pub_hedge_imu_json_topic
 
 
@@ -12,10 +12,10 @@ class USNavPublisher(PublisherBase):
     """
     Marvelmindデータ(辞書型、位置情報データのみ)をAWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory, 'USNav', debug)
-        self.topic = pub_hedge_usnav_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, 'USNav', debug, use_bin)
+        self.topic = self.data_topic(pub_hedge_usnav_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[USNavPublisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -65,17 +65,17 @@ class USNavPublisher(PublisherBase):
             'usnav/angle':      to_float(usnav_angle),
             'usnav/timestamp':  to_float(usnav_timestamp),
         }
-        return json.dumps(message)
+        return self.dumps(SCHEMA_HEDGE_USNAV, message)
 
 class USNavRawPublisher(PublisherBase):
     """
     Marvelmindデータ(辞書型、ビーコン間距離データのみ)を
     AWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory, 'USNavRaw', debug)
-        self.topic = pub_hedge_usnav_raw_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, 'USNavRaw', debug, use_bin)
+        self.topic = self.data_topic(pub_hedge_usnav_raw_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[USNavRawPublisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -141,17 +141,17 @@ class USNavRawPublisher(PublisherBase):
             'dist/b4d':         to_float(dist_b4d),
             'dist/timestamp':   to_float(dist_timestamp),
         }
-        return json.dumps(message)
+        return self.dumps(SCHEMA_HEDGE_USNAV_RAW, message)
 
 class IMUPublisher(PublisherBase):
     """
     Marvelmindデータ(辞書型、IMUデータのみ)を
     AWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory, 'IMU', debug)
-        self.topic = pub_hedge_imu_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, 'IMU', debug, use_bin)
+        self.topic = self.data_topic(pub_hedge_imu_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[IMUPublisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -258,4 +258,4 @@ class IMUPublisher(PublisherBase):
             'imu/mz':           to_float(imu_mz),
             'imu/timestamp':    to_float(imu_timestamp),
         }
-        return json.dumps(message)
\ No newline at end of file
+        return self.dumps(SCHEMA_HEDGE_IMU, message)
\ No newline at end of file
@@ -3,18 +3,18 @@
 Joystick データをAWS IoT Core へ Publish するパーツクラスを定義するモジュール。
 """
 import time
-import json
 from .base import PublisherBase, to_float, to_str
+from ..codec import SCHEMA_JOYSTICK
 from .topic import pub_joystick_json_topic
 
 class JoystickPublisher(PublisherBase):
     """
     ジョイスティックデータをAWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory, 'Joystick', debug)
-        self.topic = pub_joystick_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, 'Joystick', debug, use_bin)
+        self.topic = self.data_topic(pub_joystick_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[JoystickPublisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -58,4 +58,4 @@ class JoystickPublisher(PublisherBase):
             'user/mode':            to_str(user_mode),
             'recording':            recording,
         }
-        return json.dumps(message)
\ No newline at end of file
+        return self.dumps(SCHEMA_JOYSTICK, message)
\ No newline at end of file
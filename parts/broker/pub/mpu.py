@@ -3,18 +3,19 @@
 MPU9250から取得したIMUデータをPublishするパーツクラス群。
 """
 import time
-import json
-from .base import PublisherBase, to_str, to_float
+from .base import PublisherBase, to_float
+from ..codec import SCHEMA_MPU6050, SCHEMA_MPU9250
 from .topic import pub_mpu6050_json_topic, pub_mpu9250_json_topic
+from ...sensors.imu import encode_recent, decode_recent
 
 class Mpu6050Publisher(PublisherBase):
     """
     MPU5050 IMUデータ(辞書型)をAWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory, 'Mpu6050', debug)
-        self.topic = pub_mpu6050_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, 'Mpu6050', debug, use_bin)
+        self.topic = self.data_topic(pub_mpu6050_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[Mpu6050Publisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -29,7 +30,7 @@ class Mpu6050Publisher(PublisherBase):
             imu_gx              重力加速度(X軸)
             imu_gy              重力加速度(Y軸)
             imu_gz              重力加速度(Z軸)
-            imu_recent          過去データ文字列
+            imu_recent          過去データ(nd.array)
             imu_mpu_timestamp   取得時時刻
         戻り値：
             なし
@@ -52,7 +53,7 @@ class Mpu6050Publisher(PublisherBase):
             imu_gx          角速度(X軸)
             imu_gy          角速度(Y軸)
             imu_gz          角速度(Z軸)
-            imu_recent          過去データ文字列
+            imu_recent          過去データ(nd.array)
             imu_mpu_timestamp   取得時時刻
         戻り値：
             メッセージ文字列
@@ -64,19 +65,19 @@ class Mpu6050Publisher(PublisherBase):
             'imu/gyr_x':            to_float(imu_gx),
             'imu/gyr_y':            to_float(imu_gy),
             'imu/gyr_z':            to_float(imu_gz),
-            'imu/recent':           to_str(imu_recent),
+            'imu/recent':           decode_recent(imu_recent) if self.use_bin else encode_recent(imu_recent),
             'imu/mpu_timestamp':    to_float(imu_mpu_timestamp),
         }
-        return json.dumps(message)
+        return self.dumps(SCHEMA_MPU6050, message)
 
 class Mpu9250Publisher(PublisherBase):
     """
     MPU9250 IMUデータ(辞書型)をAWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory, 'Mpu9250', debug)
-        self.topic = pub_mpu9250_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, 'Mpu9250', debug, use_bin)
+        self.topic = self.data_topic(pub_mpu9250_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[Mpu9250Publisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -96,7 +97,7 @@ class Mpu9250Publisher(PublisherBase):
             imu_my              磁束密度(Y軸)
             imu_mz              磁束密度(Z軸)
             imu_temp            温度(C)
-            imu_recent          過去データ
+            imu_recent          過去データ(nd.array)
             imu_mpu_timestamp   取得時時刻
         戻り値：
             なし
@@ -124,7 +125,7 @@ class Mpu9250Publisher(PublisherBase):
             imu_my              磁束密度(Y軸)
             imu_mz              磁束密度(Z軸)
             imu_temp            温度(C)
-            imu_recent          過去データ
+            imu_recent          過去データ(nd.array)
             imu_mpu_timestamp   取得時時刻
         戻り値：
             メッセージ文字列
@@ -140,7 +141,7 @@ class Mpu9250Publisher(PublisherBase):
             'imu/mgt_y':            to_float(imu_my),
             'imu/mgt_z':            to_float(imu_mz),
             'imu/temp':             to_float(imu_temp),
-            'imu/recent':           to_str(imu_recent),
+            'imu/recent':           decode_recent(imu_recent) if self.use_bin else encode_recent(imu_recent),
             'imu/mpu_timestamp':    to_float(imu_mpu_timestamp),
         }
-        return json.dumps(message)
\ No newline at end of file
+        return self.dumps(SCHEMA_MPU9250, message)
\ No newline at end of file
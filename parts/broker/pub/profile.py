@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+パーツ別処理時間の集計データをAWS IoT Core へ Publish するパーツクラスを定義するモジュール。
+"""
+import json
+import time
+from .base import PublisherBase
+from .topic import pub_profile_json_topic
+
+class ProfilePublisher(PublisherBase):
+    """
+    parts.profiler.LatencyProfiler の集計データを一定間隔でAWS IoT CoreへPublishするパーツクラス。
+    集計データはスキーマが可変のため常にJSON形式で送信する。
+    """
+    def __init__(self, aws_iot_client_factory, profiler, interval=10.0, debug=False):
+        """
+        送信先トピック名を初期化する。
+        引数：
+            aws_iot_client_factory  AWSIoTClientFactoryオブジェクト
+            profiler                LatencyProfiler オブジェクト
+            interval                送信間隔(秒)
+            debug                   デバッグフラグ
+        戻り値：
+            なし
+        """
+        super().__init__(aws_iot_client_factory, 'Profile', debug, False)
+        self.profiler = profiler
+        self.interval = interval
+        self.topic = pub_profile_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name)
+        if self.debug:
+            print('[ProfilePublisher] topic name = {}'.format(self.topic))
+        self.qos = 0
+        self.last_time = time.time()
+
+    def run(self):
+        """
+        前回送信から interval 秒経過した場合、集計データ(辞書型)をPublishする。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        now = time.time()
+        if now - self.last_time < self.interval:
+            return
+        self.last_time = now
+        self.publish()
+
+    def publish(self):
+        """
+        集計データ(辞書型)をPublishする。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        ret = self.client.publish(self.topic, self.to_message(), self.qos)
+        if self.debug:
+            print('[ProfilePublisher] publish topic={} ret={}'.format(self.topic, str(ret)))
+
+    def to_message(self):
+        """
+        集計データをメッセージ文字列化する。
+        引数：
+            なし
+        戻り値：
+            メッセージ文字列
+        """
+        message = self.profiler.summary()
+        message['thing_name'] = self.thing_name
+        message['timestamp'] = time.time()
+        return json.dumps(message)
+
+    def shutdown(self):
+        """
+        停止時点の集計データをPublishする。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self.client is not None:
+            self.publish()
+        super().shutdown()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+イメージデータを回線容量に合わせて JPEG 化するエンコーダクラスを定義するモジュール。
+目標ビットレートを超えないよう JPEG 品質・解像度を段階的に調整し、
+送信キューが詰まっている場合、前回送信イメージとほぼ同じ場合、
+姿勢(位置・方位)が変化していない場合はイメージを送信しない。
+"""
+import io
+import time
+import numpy as np
+from PIL import Image
+
+class AdaptiveImageEncoder:
+    """
+    ImagePublisher/FwdImagePublisher 用の適応型 JPEG エンコーダクラス。
+    目標ビットレートはトークンバケットで管理し、予算不足で間引いた場合は
+    品質→解像度の順に1段階下げ、予算に余裕がある場合は逆の順に1段階戻す。
+    """
+    def __init__(self, target_bitrate=None, quality=75, min_quality=30, max_quality=90,
+    quality_step=10, scales=[1.0, 0.5], diff_threshold=2.0, keyframe_interval=1.0,
+    pose_tolerance=0.01, debug=False):
+        """
+        エンコード条件を初期化する。
+        引数：
+            target_bitrate      目標ビットレート(bps)、None の場合は制限しない
+            quality             JPEG品質の初期値
+            min_quality         JPEG品質の下限
+            max_quality         JPEG品質の上限
+            quality_step        JPEG品質の調整幅
+            scales              解像度倍率の候補(大きい順)
+            diff_threshold      前回送信イメージとの平均輝度差(0-255)がこの値未満の場合送信しない
+                                (0以下の場合は比較しない)
+            keyframe_interval   変化がなくてもこの秒数経過したら送信する
+            pose_tolerance      姿勢の各要素の差がすべてこの値以下の場合変化なしとする
+            debug               デバッグフラグ
+        戻り値：
+            なし
+        """
+        self.target_bitrate = target_bitrate
+        self.quality = quality
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.quality_step = quality_step
+        self.scales = list(scales)
+        self.scale_index = 0
+        self.diff_threshold = diff_threshold
+        self.keyframe_interval = keyframe_interval
+        self.pose_tolerance = pose_tolerance
+        self.debug = debug
+        # 1秒分をバケット容量とする
+        self.capacity = None if target_bitrate is None else target_bitrate / 8.0
+        self.bucket = self.capacity
+        self.bucket_time = None
+        self.estimated_size = 0
+        self.last_thumbnail = None
+        self.last_pose = None
+        self.last_sent_time = None
+        self.sent = 0
+        self.sent_bytes = 0
+        self.skipped_backlog = 0
+        self.skipped_similar = 0
+        self.skipped_pose = 0
+        self.skipped_budget = 0
+
+    def process(self, image_array, pose=None, backlogged=False, now=None):
+        """
+        送信条件を満たす場合のみイメージを JPEG 化する。
+        引数：
+            image_array     イメージデータ(nd.array型)
+            pose            姿勢(数値のタプル)、None の場合はイメージ差分で判定する
+            backlogged      送信キューに同じトピックの未送信メッセージがある場合真
+            now             現在時刻(省略時 time.time())
+        戻り値：
+            JPEGバイナリ(bytes)、送信しない場合 None
+        """
+        if image_array is None:
+            return None
+        now = time.time() if now is None else now
+        self.refill(now)
+        if backlogged:
+            # 送信が追いついていないため間引き、画質を落とす
+            self.skipped_backlog += 1
+            self.degrade()
+            return None
+        keyframe = self.last_sent_time is None or \
+            now - self.last_sent_time >= self.keyframe_interval
+        if pose is not None:
+            if not keyframe and not self.is_pose_changed(pose):
+                self.skipped_pose += 1
+                return None
+            thumbnail = None
+        else:
+            thumbnail = self.thumbnail(image_array)
+            if not keyframe and self.is_similar(thumbnail):
+                self.skipped_similar += 1
+                return None
+        if self.capacity is not None and self.bucket < self.estimated_size:
+            self.skipped_budget += 1
+            self.degrade()
+            return None
+        payload = self.encode(image_array)
+        size = len(payload)
+        self.estimated_size = size if self.sent == 0 else \
+            0.8 * self.estimated_size + 0.2 * size
+        if self.capacity is not None:
+            self.bucket -= size
+            if self.bucket >= self.capacity * 0.8:
+                self.upgrade()
+        self.sent += 1
+        self.sent_bytes += size
+        self.last_sent_time = now
+        self.last_pose = pose
+        self.last_thumbnail = thumbnail
+        return payload
+
+    def refill(self, now):
+        """
+        前回呼び出しからの経過時間分の送信予算をバケットに加算する。
+        引数：
+            now             現在時刻
+        戻り値：
+            なし
+        """
+        if self.capacity is None:
+            return
+        if self.bucket_time is not None:
+            self.bucket = min(self.capacity,
+                self.bucket + (now - self.bucket_time) * self.capacity)
+        self.bucket_time = now
+
+    def degrade(self):
+        """
+        JPEG品質を1段階下げる。下限の場合は解像度を1段階下げる。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality - self.quality_step)
+        elif self.scale_index < len(self.scales) - 1:
+            self.scale_index += 1
+        else:
+            return
+        if self.debug:
+            print('[AdaptiveImageEncoder] degrade quality={} scale={}'.format(
+                str(self.quality), str(self.scales[self.scale_index])))
+
+    def upgrade(self):
+        """
+        解像度を1段階上げる。最大解像度の場合はJPEG品質を1段階上げる。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self.scale_index > 0:
+            self.scale_index -= 1
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + self.quality_step)
+        else:
+            return
+        if self.debug:
+            print('[AdaptiveImageEncoder] upgrade quality={} scale={}'.format(
+                str(self.quality), str(self.scales[self.scale_index])))
+
+    def thumbnail(self, image_array):
+        """
+        差分判定用に8画素おきに間引いた輝度配列を作成する。
+        引数：
+            image_array     イメージデータ(nd.array型)
+        戻り値：
+            間引き後の配列(nd.array型、int16)
+        """
+        thumbnail = np.asarray(image_array)[::8, ::8]
+        if thumbnail.ndim == 3:
+            thumbnail = thumbnail.mean(axis=2)
+        return thumbnail.astype(np.int16)
+
+    def is_similar(self, thumbnail):
+        """
+        前回送信イメージとほぼ同じかどうか判別する。
+        引数：
+            thumbnail       thumbnail() の戻り値
+        戻り値：
+            真偽値
+        """
+        if self.diff_threshold <= 0 or self.last_thumbnail is None or \
+            self.last_thumbnail.shape != thumbnail.shape:
+            return False
+        return np.mean(np.abs(thumbnail - self.last_thumbnail)) < self.diff_threshold
+
+    def is_pose_changed(self, pose):
+        """
+        前回送信時から姿勢が変化したかどうか判別する。
+        引数：
+            pose            姿勢(数値のタプル)
+        戻り値：
+            真偽値
+        """
+        if self.last_pose is None or len(self.last_pose) != len(pose):
+            return True
+        return any([abs(value - last) > self.pose_tolerance
+            for value, last in zip(pose, self.last_pose)])
+
+    def encode(self, image_array):
+        """
+        現在の品質・解像度でイメージを JPEG 化する。
+        引数：
+            image_array     イメージデータ(nd.array型)
+        戻り値：
+            JPEGバイナリ(bytes)
+        """
+        img = Image.fromarray(np.uint8(image_array))
+        scale = self.scales[self.scale_index]
+        if scale < 1.0:
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                Image.BILINEAR)
+        f = io.BytesIO()
+        img.save(f, format='jpeg', quality=self.quality)
+        return f.getvalue()
+
+    def stats(self):
+        """
+        送信・間引き状況のカウンタを取得する。
+        引数：
+            なし
+        戻り値：
+            辞書
+        """
+        return {
+            'sent':             self.sent,
+            'sent_bytes':       self.sent_bytes,
+            'skipped_backlog':  self.skipped_backlog,
+            'skipped_similar':  self.skipped_similar,
+            'skipped_pose':     self.skipped_pose,
+            'skipped_budget':   self.skipped_budget,
+            'quality':          self.quality,
+            'scale':            self.scales[self.scale_index],
+        }
@@ -55,6 +55,8 @@ MESSAGE_TYPE_HEDGE_IMU = 'imu'
 MESSAGE_TYPE_MPU6050 = 'mpu6050'
 MESSAGE_TYPE_MPU9250 = 'mpu9250'
 MESSAGE_TYPE_JOYSTICK = 'joystick'
+MESSAGE_TYPE_FRAME = 'frame'
+MESSAGE_TYPE_PROFILE = 'profile'
 MESSAGE_TYPES = [
     MESSAGE_TYPE_TUB,
     MESSAGE_TYPE_TUB_FWD,
@@ -65,6 +67,8 @@ MESSAGE_TYPES = [
     MESSAGE_TYPE_MPU6050,
     MESSAGE_TYPE_MPU9250,
     MESSAGE_TYPE_JOYSTICK,
+    MESSAGE_TYPE_FRAME,
+    MESSAGE_TYPE_PROFILE,
     #WILDCARD_ONE,
 ]
 
@@ -246,3 +250,64 @@ def pub_joystick_json_topic(system, thing_type, thing_group, thing_name):
     """
     return _pub_base_topic(system, thing_type, thing_group, thing_name, 
         MESSAGE_TYPE_JOYSTICK, DATA_TYPE_JSON)
+
+def pub_frame_bin_topic(system, thing_type, thing_group, thing_name):
+    """
+    複数キーをまとめたフレームデータ(バイナリ)をPublishする際に
+    使用するトピック名を返却する。
+    引数：
+        system      システムの種類
+        thing_type  モノのタイプ
+        thing_group モノのグループ
+        thing_name  モノの名前
+    戻り値：
+        トピック名
+    """
+    return _pub_base_topic(system, thing_type, thing_group, thing_name, 
+        MESSAGE_TYPE_FRAME, DATA_TYPE_BIN)
+
+def pub_frame_image_topic(system, thing_type, thing_group, thing_name):
+    """
+    フレームデータから参照されるイメージ群をPublishする際に
+    使用するトピック名を返却する。
+    引数：
+        system      システムの種類
+        thing_type  モノのタイプ
+        thing_group モノのグループ
+        thing_name  モノの名前
+    戻り値：
+        トピック名
+    """
+    return _pub_base_topic(system, thing_type, thing_group, thing_name, 
+        MESSAGE_TYPE_FRAME, DATA_TYPE_IMAGE)
+
+def pub_profile_json_topic(system, thing_type, thing_group, thing_name):
+    """
+    パーツ別処理時間の集計データ(辞書型)をPublishする際に
+    使用するトピック名を返却する。
+    引数：
+        system      システムの種類
+        thing_type  モノのタイプ
+        thing_group モノのグループ
+        thing_name  モノの名前
+    戻り値：
+        トピック名
+    """
+    return _pub_base_topic(system, thing_type, thing_group, thing_name, 
+        MESSAGE_TYPE_PROFILE, DATA_TYPE_JSON)
+
+
+def to_bin_topic(topic_name):
+    """
+    JSONデータ用トピック名を同じメッセージタイプのバイナリデータ用トピック名に変換する。
+    引数：
+        topic_name  JSONデータ用トピック名
+    戻り値：
+        トピック名
+    例外：
+        ValueError  JSONデータ用トピック名でない場合
+    """
+    suffix = SEP + DATA_TYPE_JSON
+    if topic_name is None or not topic_name.endswith(suffix):
+        raise ValueError('not json topic = {}'.format(str(topic_name)))
+    return topic_name[:-len(suffix)] + SEP + DATA_TYPE_BIN
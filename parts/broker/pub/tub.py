@@ -3,18 +3,18 @@
 TubデータをAWS IoT Core へ Publish するパーツクラスを定義するモジュール。
 """
 import time
-import json
 from .base import PublisherBase, to_float, to_str, arr_to_bytearray
+from ..codec import SCHEMA_TUB_USER, SCHEMA_TUB
 from .topic import pub_tub_json_topic, pub_tub_image_topic, pub_tub_fwd_image_topic
 
 class UserPublisher(PublisherBase):
     """
     Tubデータ(辞書型、手動運転データのみ)をAWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory,'User', debug)
-        self.topic = pub_tub_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, 'User', debug, use_bin)
+        self.topic = self.data_topic(pub_tub_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[UserPublisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -57,17 +57,17 @@ class UserPublisher(PublisherBase):
             'user/mode':            to_str(user_mode),
             'timestamp':            to_float(time.time()),
         }
-        return json.dumps(message)
+        return self.dumps(SCHEMA_TUB_USER, message)
 
 class Publisher(PublisherBase):
     """
     Tubデータ(辞書型、手動・自動運転データ両方)を
     AWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
-        super().__init__(aws_iot_client_factory, '', debug)
-        self.topic = pub_tub_json_topic(
-            self.system, self.thing_type, self.thing_group, self.thing_name)
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
+        super().__init__(aws_iot_client_factory, '', debug, use_bin)
+        self.topic = self.data_topic(pub_tub_json_topic(
+            self.system, self.thing_type, self.thing_group, self.thing_name))
         if self.debug:
             print('[Publisher] topic name = {}'.format(self.topic))
         self.qos = 0
@@ -121,60 +121,124 @@ class Publisher(PublisherBase):
             'user/mode':            to_str(user_mode),
             'timestamp':            to_float(time.time()),
         }
-        return json.dumps(message)
+        return self.dumps(SCHEMA_TUB, message)
 
 class ImagePublisher(PublisherBase):
     """
     Tubデータ(nd.array:cam/image_array)を
     AWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, encoder=None):
+        """
+        トピック名を生成する。
+        引数：
+            aws_iot_client_factory  AWSIoTClientFactoryオブジェクト
+            debug                   デバッグフラグ
+            encoder                 AdaptiveImageEncoder オブジェクト
+                                    (None の場合は毎回元の解像度で JPEG 化して送信する)
+        戻り値：
+            なし
+        """
         super().__init__(aws_iot_client_factory, 'Image', debug)
         self.topic = pub_tub_image_topic(
             self.system, self.thing_type, self.thing_group, self.thing_name)
         if self.debug:
             print('[ImagePublisher] topic name = {}'.format(self.topic))
         self.qos = 0
+        self.encoder = encoder
 
-    def run(self, image_array):
+    def run(self, image_array, pose=None):
         """
         Tubデータ(nd.array:cam/image_array)をPublishする。
+        encoder が指定されている場合は送信条件を満たすイメージのみ送信する。
         引数：
-            image_array     fwd/image_arrayデータ(nd.array型)
+            image_array     cam/image_arrayデータ(nd.array型)
+            pose            姿勢(MAPカメラの場合 map/pose、省略可)
         戻り値：
             なし
         """
+        if self.encoder is None:
+            payload = arr_to_bytearray(image_array)
+        else:
+            payload = self.encoder.process(
+                image_array, pose=pose, backlogged=self.is_backlogged(self.topic))
+            if payload is None:
+                return
         ret = self.client.publish(
             self.topic, 
-            arr_to_bytearray(image_array), 
+            payload, 
                 self.qos)
         if self.debug:
             print('[ImagePublisher] publish topic={} ret={}'.format(self.topic, str(ret)))
 
+    def shutdown(self):
+        """
+        送信・間引き状況を表示する(デバッグ時)。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self.debug and self.encoder is not None:
+            print('[ImagePublisher] stream stats {}'.format(str(self.encoder.stats())))
+        super().shutdown()
+
 class FwdImagePublisher(PublisherBase):
     """
     Tubデータ(nd.array:fwd/image_array)を
     AWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, encoder=None):
+        """
+        トピック名を生成する。
+        引数：
+            aws_iot_client_factory  AWSIoTClientFactoryオブジェクト
+            debug                   デバッグフラグ
+            encoder                 AdaptiveImageEncoder オブジェクト
+                                    (None の場合は毎回元の解像度で JPEG 化して送信する)
+        戻り値：
+            なし
+        """
         super().__init__(aws_iot_client_factory, 'Image', debug)
         self.topic = pub_tub_fwd_image_topic(
             self.system, self.thing_type, self.thing_group, self.thing_name)
         if self.debug:
             print('[FwdImagePublisher] topic name = {}'.format(self.topic))
         self.qos = 0
+        self.encoder = encoder
 
-    def run(self, image_array):
+    def run(self, image_array, pose=None):
         """
         Tubデータ(nd.array:fwd/image_array)をPublishする。
+        encoder が指定されている場合は送信条件を満たすイメージのみ送信する。
         引数：
             image_array     fwd/image_arrayデータ(nd.array型)
+            pose            姿勢(MAPカメラの場合 map/pose、省略可)
         戻り値：
             なし
         """
+        if self.encoder is None:
+            payload = arr_to_bytearray(image_array)
+        else:
+            payload = self.encoder.process(
+                image_array, pose=pose, backlogged=self.is_backlogged(self.topic))
+            if payload is None:
+                return
         ret = self.client.publish(
             self.topic, 
-            arr_to_bytearray(image_array), 
+            payload, 
                 self.qos)
         if self.debug:
-            print('[FwdImagePublisher] publish topic={} ret={}'.format(self.topic, str(ret)))
\ No newline at end of file
+            print('[FwdImagePublisher] publish topic={} ret={}'.format(self.topic, str(ret)))
+
+    def shutdown(self):
+        """
+        送信・間引き状況を表示する(デバッグ時)。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self.debug and self.encoder is not None:
+            print('[FwdImagePublisher] stream stats {}'.format(str(self.encoder.stats())))
+        super().shutdown()
\ No newline at end of file
@@ -10,3 +10,5 @@ from .hedge import USNavSubscriber, USNavRawSubscriber, IMUSubscriber
 from .mpu import Mpu6050Subscriber, Mpu9250Subscriber
 # ジョイスティックデータ
 from .joystick import JoystickSubscriber
+# 複数キーをまとめたフレームデータ
+from .frame import FrameSubscriber
@@ -2,18 +2,22 @@
 """
 AWS IoT Core Subscriber基底クラスを定義するモジュール。
 """
+import io
 import time
 import json
+import threading
 import donkeycar as dk
 import numpy as np
+from PIL import Image
 from .topic import is_json, is_image, is_bin, is_thing_name
+from ..codec import decode_message
 
 class SubscriberBase:
     """
     AWS IoT CoreへMQTTプロトコルで送信するSubscriberパーツクラス。
     """
     def __init__(self, aws_iot_client_factory, name='Base', topic_name='#', 
-    callback=None, retry=10, debug=False):
+    callback=None, retry=10, debug=False, decode_pool=None):
         """
         フィールドを初期化する。
         引数：
@@ -23,6 +27,9 @@ class SubscriberBase:
             callback                callback関数
             retry                   Subscribe失敗時繰り返す回数
             debug                   デバッグフラグ
+            decode_pool             イメージをデコードするスレッドプール
+                                    (concurrent.futures.Executor、None の場合は
+                                    latest_image() 呼び出し時にデコードする)
         戻り値：
             なし
         """
@@ -35,6 +42,16 @@ class SubscriberBase:
         self.message = None
         self.debug = debug
         self.arrive = False
+        # 受信した最新のイメージペイロード(未デコード)とデコード済みイメージ
+        self.decode_pool = decode_pool
+        self.decode_future = None
+        self.image_lock = threading.Lock()
+        self.decode_lock = threading.Lock()
+        self.raw_image = None
+        self.raw_seq = 0
+        self.image = None
+        self.image_seq = 0
+        self.image_buffers = [None, None]
         if self.debug:
             print('[{}Publisher] init thing_name = {}'.format(
                 self.name, self.thing_name))
@@ -79,7 +96,8 @@ class SubscriberBase:
 
     def image_callback(self, client, userdata, message):
         """
-        イメージデータがSubscribeされた場合、self.messageへnd.array形式で格納する。
+        イメージデータがSubscribeされた場合、ペイロードをコピーせずに最新の1件として保持する。
+        デコードは latest_image() 呼び出し時、または decode_pool 上で行う。
         引数：
             client          MQTTクライアントオブジェクト
             userdata        ユーザデータ
@@ -89,7 +107,75 @@ class SubscriberBase:
         """
         if self.debug:
             print('[{}Subscriber] image subscribed topic={}'.format(self.name, self.topic_name))
-        self.message = bytearray_to_arr(message.payload)
+        with self.image_lock:
+            self.raw_image = memoryview(message.payload)
+            self.raw_seq += 1
+            if self.decode_pool is not None:
+                self.submit_decode()
+
+    def submit_decode(self):
+        """
+        実行中のデコードがなければ decode_pool へデコードを投入する。
+        self.image_lock を取得した状態で呼び出すこと。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self.decode_future is None or self.decode_future.done():
+            self.decode_future = self.decode_pool.submit(self.decode_image)
+
+    def latest_image(self):
+        """
+        最新のイメージデータを取得する。
+        decode_pool を使用しない場合、前回取得以降に新しいイメージを受信していれば
+        ここでデコードする(受信済みでも取得されなかったイメージはデコードしない)。
+        decode_pool を使用する場合、実行中のデコードの最終確認後に受信した
+        イメージが未デコードのまま残っていれば、ここでデコードを投入する。
+        返却する配列は2つのバッファを交互に再利用するため、
+        2回後のデコードで上書きされる。
+        引数：
+            なし
+        戻り値：
+            イメージデータ(nd.array形式)、未受信の場合 None
+        """
+        if self.decode_pool is None:
+            return self.decode_image()
+        with self.image_lock:
+            if self.raw_image is not None and self.raw_seq != self.image_seq:
+                self.submit_decode()
+        return self.image
+
+    def decode_image(self):
+        """
+        未デコードの最新イメージがあればデコードし、現在表示していない方の
+        バッファへ書き込んでから self.image を切り替える。
+        引数：
+            なし
+        戻り値：
+            デコード済みの最新イメージデータ(nd.array形式)
+        """
+        with self.decode_lock:
+            while True:
+                with self.image_lock:
+                    seq, raw = self.raw_seq, self.raw_image
+                if raw is None or seq == self.image_seq:
+                    return self.image
+                try:
+                    decoded = np.asarray(Image.open(io.BytesIO(raw)))
+                except Exception as e:
+                    if self.debug:
+                        print('[{}Subscriber] ignore image: {}'.format(self.name, str(e)))
+                    self.image_seq = seq
+                    continue
+                index = 1 if self.image is self.image_buffers[0] else 0
+                buffer = self.image_buffers[index]
+                if buffer is None or buffer.shape != decoded.shape or buffer.dtype != decoded.dtype:
+                    buffer = np.empty_like(decoded)
+                    self.image_buffers[index] = buffer
+                np.copyto(buffer, decoded)
+                self.image = buffer
+                self.image_seq = seq
 
     def json_callback(self, client, userdata, message):
         """
@@ -107,7 +193,8 @@ class SubscriberBase:
 
     def bin_callback(self, client, userdata, message):
         """
-        イメージデータがSubscribeされた場合、self.messageへbytearray形式で格納する。
+        バイナリデータがSubscribeされた場合、JSONデータと同じキーの辞書へ
+        デコードしself.messageへ格納する。デコードできない場合は破棄する。
         引数：
             client          MQTTクライアントオブジェクト
             userdata        ユーザデータ
@@ -116,8 +203,12 @@ class SubscriberBase:
             なし
         """
         if self.debug:
-            print('[{}Subscriber] image subscribed topic={}'.format(self.name, self.topic_name))
-        self.message = message.payload
+            print('[{}Subscriber] bin subscribed topic={}'.format(self.name, self.topic_name))
+        try:
+            self.message = decode_message(message.payload)
+        except ValueError as e:
+            if self.debug:
+                print('[{}Subscriber] ignore bin message: {}'.format(self.name, str(e)))
 
     def is_subscribed(self):
         """
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+FramePublisher が送信したフレームメッセージを AWS IoT Core から Subscribe し、
+元の車両メモリキーの値に展開するパーツクラスを定義するモジュール。
+real/agent/loaderをSubscribeする。
+"""
+import threading
+from collections import deque, OrderedDict
+from .base import SubscriberBase, bytearray_to_arr
+from .topic import sub_frame_bin_topic, sub_frame_image_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER
+from ..codec import decode_message
+
+class FrameSubscriber(SubscriberBase):
+    """
+    フレームメッセージを受信し、keys、image_keys の値を出力するパーツクラス。
+    受信した行は1ティックに1行ずつ出力し、未出力の行がない場合は最終行を出力し続ける。
+    """
+    def __init__(self, aws_iot_client_factory, keys, image_keys=[], buffer_size=20, debug=False):
+        """
+        フレームトピックとイメージトピックをSubscribeする。
+        引数：
+            aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
+            keys                    出力するキーのリスト
+            image_keys              出力するイメージキーのリスト
+            buffer_size             保持する未出力行の最大数
+            debug                   デバッグフラグ
+        戻り値：
+            なし
+        """
+        self.keys = list(keys)
+        self.image_keys = list(image_keys)
+        self.lock = threading.Lock()
+        self.rows = deque(maxlen=buffer_size)
+        self.images = OrderedDict()
+        self.max_images = 8
+        self.topic = sub_frame_bin_topic(
+            SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        self.image_topic = sub_frame_image_topic(
+            SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if debug:
+            print('[FrameSubscriber] topic name = {}, {}'.format(self.topic, self.image_topic))
+        super().__init__(aws_iot_client_factory, name='Frame', topic_name=self.topic, debug=debug)
+        if len(self.image_keys) > 0:
+            if not self.client.subscribe(self.image_topic, 0, self.mycallback):
+                print('[FrameSubscriber] failed subscribing topic={}'.format(self.image_topic))
+
+    def bin_callback(self, client, userdata, message):
+        """
+        フレームメッセージを keys 順の行に展開し、未出力行に追加する。
+        デコードできない場合は破棄する。
+        引数：
+            client          MQTTクライアントオブジェクト
+            userdata        ユーザデータ
+            message         メッセージ
+        戻り値：
+            なし
+        """
+        frame = self.decode(message)
+        if frame is None:
+            return
+        index = {key: i for i, key in enumerate(frame['keys'])}
+        with self.lock:
+            for row in frame['rows']:
+                self.rows.append((
+                    [row[index[key]] if key in index else None for key in self.keys],
+                    frame['image_seq']))
+
+    def image_callback(self, client, userdata, message):
+        """
+        イメージメッセージを image_keys 順の nd.array リストに展開し、
+        シーケンス番号をキーに保持する。デコードできない場合は破棄する。
+        引数：
+            client          MQTTクライアントオブジェクト
+            userdata        ユーザデータ
+            message         メッセージ
+        戻り値：
+            なし
+        """
+        frame = self.decode(message)
+        if frame is None or len(frame['rows']) == 0:
+            return
+        index = {key: i for i, key in enumerate(frame['keys'])}
+        row = frame['rows'][0]
+        images = [None if key not in index or row[index[key]] is None
+            else bytearray_to_arr(row[index[key]]) for key in self.image_keys]
+        with self.lock:
+            self.images[frame['seq']] = images
+            while len(self.images) > self.max_images:
+                self.images.popitem(last=False)
+
+    def decode(self, message):
+        """
+        フレームメッセージをデコードする。
+        引数：
+            message         メッセージ
+        戻り値：
+            フレーム辞書、デコードできない場合 None
+        """
+        try:
+            frame = decode_message(message.payload)
+        except ValueError as e:
+            if self.debug:
+                print('[FrameSubscriber] ignore frame message: {}'.format(str(e)))
+            return None
+        if 'rows' not in frame:
+            if self.debug:
+                print('[FrameSubscriber] ignore non frame message topic={}'.format(message.topic))
+            return None
+        return frame
+
+    def run(self):
+        """
+        未出力行のうち最も古い行の値と、その行が参照するイメージを出力する。
+        参照するイメージが未受信の場合は最新のイメージを出力する。
+        引数：
+            なし
+        戻り値：
+            keys、image_keys 順の値(未受信の場合 None)
+        """
+        if self.debug:
+            print('[FrameSubscriber] subscribed:{} rows:{}'.format(str(self.arrive), str(len(self.rows))))
+        with self.lock:
+            if len(self.rows) == 0:
+                values, image_seq = [None] * len(self.keys), -1
+            elif len(self.rows) == 1:
+                values, image_seq = self.rows[0]
+            else:
+                values, image_seq = self.rows.popleft()
+            if image_seq in self.images:
+                images = self.images[image_seq]
+            elif len(self.images) > 0:
+                images = next(reversed(self.images.values()))
+            else:
+                images = [None] * len(self.image_keys)
+        outputs = list(values) + list(images)
+        if len(outputs) == 1:
+            return outputs[0]
+        return tuple(outputs)
@@ -4,7 +4,7 @@ MarvelmindデータをAWS IoT Core から Subscribeするパーツクラスを
 real/agent/loaderをSubscribeする。
 """
 from .base import SubscriberBase
-from .topic import sub_hedge_usnav_json_topic, sub_hedge_usnav_raw_json_topic, sub_hedge_imu_json_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER
+from .topic import sub_hedge_usnav_json_topic, sub_hedge_usnav_raw_json_topic, sub_hedge_imu_json_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER, to_bin_topic
 
 
 class USNavSubscriber(SubscriberBase):
@@ -12,18 +12,21 @@ class USNavSubscriber(SubscriberBase):
     Marvelmindデータ(辞書型、位置情報データのみ)をAWS IoT Core から
     Subscribe するパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            use_bin                 JSONではなくバイナリ形式のトピックをSubscribeする
         戻り値：
             なし
         """
         self.topic = sub_hedge_usnav_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[USNavSubscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='USNav', topic_name=self.topic, debug=debug)
@@ -57,18 +60,21 @@ class USNavRawSubscriber(SubscriberBase):
     Marvelmindデータ(辞書型、ビーコン間距離データのみ)を
     AWS IoT Core から Subscribe するパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            use_bin                 JSONではなくバイナリ形式のトピックをSubscribeする
         戻り値：
             なし
         """
         self.topic = sub_hedge_usnav_raw_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[USNavRawSubscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='USNavRaw', topic_name=self.topic, debug=debug)
@@ -110,18 +116,21 @@ class IMUSubscriber(SubscriberBase):
     Marvelmindデータ(辞書型、IMUデータのみ)を
     AWS IoT Core から Subscirbe するパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            use_bin                 JSONではなくバイナリ形式のトピックをSubscribeする
         戻り値：
             なし
         """
         self.topic = sub_hedge_imu_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[IMUSubscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='IMU', topic_name=self.topic, debug=debug)
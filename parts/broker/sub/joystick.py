@@ -3,15 +3,17 @@
 Joystick データをAWS IoT Core から Subscribe するパーツクラスを定義するモジュール。
 """
 from .base import SubscriberBase
-from .topic import sub_joystick_json_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER
+from .topic import sub_joystick_json_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER, to_bin_topic
 
 class JoystickSubscriber(SubscriberBase):
     """
     ジョイスティックデータをAWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         self.topic = sub_joystick_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[USNavSubscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='Joystick', topic_name=self.topic, debug=debug)
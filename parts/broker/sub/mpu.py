@@ -4,25 +4,29 @@ MPU9250から取得したIMUデータをSubscribeするパーツクラス群。
 real/agent/loaderをSubscribeする。
 """
 from .base import SubscriberBase
-from .topic import sub_mpu6050_json_topic, sub_mpu9250_json_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER
+from ...sensors.imu import decode_recent
+from .topic import sub_mpu6050_json_topic, sub_mpu9250_json_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER, to_bin_topic
 
 class Mpu6050Subscriber(SubscriberBase):
     """
     MPU5050 IMUデータ(辞書型)をAWS IoT Core から
     Subscribe するパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            use_bin                 JSONではなくバイナリ形式のトピックをSubscribeする
         戻り値：
             なし
         """
         self.topic = sub_mpu6050_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[Mpu6050Subscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='Mpu6050', topic_name=self.topic, debug=debug)
@@ -39,7 +43,7 @@ class Mpu6050Subscriber(SubscriberBase):
             imu/gyr_x           角速度(X軸)
             imu/gyr_y           角速度(Y軸)
             imu/gyr_z           角速度(Z軸)
-            imu/recent          過去データ文字列
+            imu/recent          過去データ(nd.array)
             imu/mpu_timestamp   Subscribeした時刻(time.time()結果)
         """
         if self.debug:
@@ -52,7 +56,7 @@ class Mpu6050Subscriber(SubscriberBase):
             self.message.get('imu/gyr_x', 0.0), \
             self.message.get('imu/gyr_y', 0.0), \
             self.message.get('imu/gyr_z', 0.0), \
-            self.message.get('imu/recent', '{}'), \
+            decode_recent(self.message.get('imu/recent', '{}')), \
             self.message.get('imu/mpu_timestamp', 0.0)
 
 class Mpu9250Subscriber(SubscriberBase):
@@ -60,18 +64,21 @@ class Mpu9250Subscriber(SubscriberBase):
     MPU9250 IMUデータ(辞書型)をAWS IoT Core から
     Subscribe するパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            use_bin                 JSONではなくバイナリ形式のトピックをSubscribeする
         戻り値：
             なし
         """
         self.topic = sub_mpu9250_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[Mpu9250Subscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='Mpu9250', topic_name=self.topic, debug=debug)
@@ -92,7 +99,7 @@ class Mpu9250Subscriber(SubscriberBase):
             imu_my              磁束密度(Y軸)
             imu_mz              磁束密度(Z軸)
             imu_temp            温度(C)
-            imu_recent          過去データ文字列
+            imu_recent          過去データ(nd.array)
             imu_mpu_timestamp   Subscribeした時刻(time.time()結果)
         """
         if self.debug:
@@ -109,5 +116,5 @@ class Mpu9250Subscriber(SubscriberBase):
             self.message.get('imu/mgt_y', 0.0), \
             self.message.get('imu/mgt_z', 0.0), \
             self.message.get('imu/temp', 0.0), \
-            self.message.get('imu/recent', '{}'), \
+            decode_recent(self.message.get('imu/recent', '{}')), \
             self.message.get('imu/mpu_timestamp', 0.0)
@@ -55,6 +55,8 @@ MESSAGE_TYPE_HEDGE_IMU = 'imu'
 MESSAGE_TYPE_MPU6050 = 'mpu6050'
 MESSAGE_TYPE_MPU9250 = 'mpu9250'
 MESSAGE_TYPE_JOYSTICK = 'joystick'
+MESSAGE_TYPE_FRAME = 'frame'
+MESSAGE_TYPE_PROFILE = 'profile'
 MESSAGE_TYPES = [
     MESSAGE_TYPE_TUB,
     MESSAGE_TYPE_TUB_FWD,
@@ -65,6 +67,8 @@ MESSAGE_TYPES = [
     MESSAGE_TYPE_MPU6050,
     MESSAGE_TYPE_MPU9250,
     MESSAGE_TYPE_JOYSTICK,
+    MESSAGE_TYPE_FRAME,
+    MESSAGE_TYPE_PROFILE,
     WILDCARD_ONE,
 ]
 
@@ -238,6 +242,48 @@ def sub_joystick_json_topic(system=WILDCARD_ONE, thing_type=WILDCARD_ONE, thing_
     return _sub_base_topic(system, thing_type, thing_group, WILDCARD_ONE,
         MESSAGE_TYPE_JOYSTICK, DATA_TYPE_JSON)
 
+def sub_frame_bin_topic(system=WILDCARD_ONE, thing_type=WILDCARD_ONE, thing_group=WILDCARD_ONE):
+    """
+    複数キーをまとめたフレームデータ(バイナリ)をSubscribeする際に
+    使用するトピック名を返却する。
+    引数：
+        system      システムの種類
+        thing_type  モノのタイプ
+        thing_group モノのグループ
+    戻り値：
+        トピック名
+    """
+    return _sub_base_topic(system, thing_type, thing_group, WILDCARD_ONE,
+        MESSAGE_TYPE_FRAME, DATA_TYPE_BIN)
+
+def sub_frame_image_topic(system=WILDCARD_ONE, thing_type=WILDCARD_ONE, thing_group=WILDCARD_ONE):
+    """
+    フレームデータから参照されるイメージ群をSubscribeする際に
+    使用するトピック名を返却する。
+    引数：
+        system      システムの種類
+        thing_type  モノのタイプ
+        thing_group モノのグループ
+    戻り値：
+        トピック名
+    """
+    return _sub_base_topic(system, thing_type, thing_group, WILDCARD_ONE,
+        MESSAGE_TYPE_FRAME, DATA_TYPE_IMAGE)
+
+def sub_profile_json_topic(system=WILDCARD_ONE, thing_type=WILDCARD_ONE, thing_group=WILDCARD_ONE):
+    """
+    パーツ別処理時間の集計データ(辞書型)をSubscribeする際に
+    使用するトピック名を返却する。
+    引数：
+        system      システムの種類
+        thing_type  モノのタイプ
+        thing_group モノのグループ
+    戻り値：
+        トピック名
+    """
+    return _sub_base_topic(system, thing_type, thing_group, WILDCARD_ONE,
+        MESSAGE_TYPE_PROFILE, DATA_TYPE_JSON)
+
 ''' トピック名分類ユーティリティ '''
 
 def is_json(topic_name):
@@ -295,3 +341,18 @@ def is_thing_name(system, thing_type, thing_group, thing_name, topic_name):
         return False
     return topic_name.startswith(prefix)
 
+
+def to_bin_topic(topic_name):
+    """
+    JSONデータ用トピック名を同じメッセージタイプのバイナリデータ用トピック名に変換する。
+    引数：
+        topic_name  JSONデータ用トピック名
+    戻り値：
+        トピック名
+    例外：
+        ValueError  JSONデータ用トピック名でない場合
+    """
+    suffix = SEP + DATA_TYPE_JSON
+    if topic_name is None or not topic_name.endswith(suffix):
+        raise ValueError('not json topic = {}'.format(str(topic_name)))
+    return topic_name[:-len(suffix)] + SEP + DATA_TYPE_BIN
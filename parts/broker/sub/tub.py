@@ -4,24 +4,27 @@ TubデータをAWS IoT Core から Subscribe するパーツクラスを定義
 real/agent/loaderをSubscribeする。
 """
 from .base import SubscriberBase, bytearray_to_arr
-from .topic import sub_tub_json_topic, sub_tub_image_topic, sub_tub_fwd_image_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER
+from .topic import sub_tub_json_topic, sub_tub_image_topic, sub_tub_fwd_image_topic, SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER, to_bin_topic
 
 class UserSubscriber(SubscriberBase):
     """
     Tubデータ(辞書型、手動運転データのみ)をAWS IoT Coreから Subscribe するパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            use_bin                 JSONではなくバイナリ形式のトピックをSubscribeする
         戻り値：
             なし
         """
         self.topic = sub_tub_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[UserSubscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='User', topic_name=self.topic, debug=debug)
@@ -53,18 +56,21 @@ class Subscriber(SubscriberBase):
     Tubデータ(辞書型、手動・自動運転データ両方)を
     AWS IoT Coreから Subscribe するパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, use_bin=False):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            use_bin                 JSONではなくバイナリ形式のトピックをSubscribeする
         戻り値：
             なし
         """
         self.topic = sub_tub_json_topic(
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
+        if use_bin:
+            self.topic = to_bin_topic(self.topic)
         if debug:
             print('[Subscriber] topic name = {}'.format(self.topic))
         super().__init__(aws_iot_client_factory, name='', topic_name=self.topic, debug=debug)
@@ -102,13 +108,14 @@ class ImageSubscriber(SubscriberBase):
     Tubデータ(cam/image_array)を
     AWS IoT CoreへPublishするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, decode_pool=None):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            decode_pool             イメージをデコードするスレッドプール(省略可)
         戻り値：
             なし
         """
@@ -116,7 +123,8 @@ class ImageSubscriber(SubscriberBase):
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
         if debug:
             print('[ImageSubscriber] topic name = {}'.format(self.topic))
-        super().__init__(aws_iot_client_factory, name='Image', topic_name=self.topic, debug=debug)
+        super().__init__(aws_iot_client_factory, name='Image', topic_name=self.topic, debug=debug,
+            decode_pool=decode_pool)
 
     def run(self):
         """
@@ -128,20 +136,21 @@ class ImageSubscriber(SubscriberBase):
         """
         if self.debug:
             print('[ImageSubscriber] subscribed:{}'.format(str(self.arrive)))
-        return self.message
+        return self.latest_image()
 
 class FwdImageSubscriber(SubscriberBase):
     """
     Tubデータ(fwd/image_array)を
     Subscribeするパーツクラス。
     """
-    def __init__(self, aws_iot_client_factory, debug=False):
+    def __init__(self, aws_iot_client_factory, debug=False, decode_pool=None):
         """
         Subscribeを実行する。
         real/agent/loaderをSubscribeする。
         引数：
             aws_iot_client_factory  AWS IoT Coreファクトリオブジェクト
             debug                   デバッグフラグ
+            decode_pool             イメージをデコードするスレッドプール(省略可)
         戻り値：
             なし
         """
@@ -149,7 +158,8 @@ class FwdImageSubscriber(SubscriberBase):
             SYSTEM_REAL, THING_TYPE_AGENT, THING_GROUP_LOADER)
         if debug:
             print('[FwdImageSubscriber] topic name = {}'.format(self.topic))
-        super().__init__(aws_iot_client_factory, name='Image', topic_name=self.topic, debug=debug)
+        super().__init__(aws_iot_client_factory, name='Image', topic_name=self.topic, debug=debug,
+            decode_pool=decode_pool)
 
     def run(self):
         """
@@ -161,4 +171,4 @@ class FwdImageSubscriber(SubscriberBase):
         """
         if self.debug:
             print('[FwdImageSubscriber] subscribed:{}'.format(str(self.arrive)))
-        return self.message
\ No newline at end of file
+        return self.latest_image()
\ No newline at end of file
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+MQTTメッセージの送信をバックグラウンドスレッドで行うワーカクラスを定義するモジュール。
+AWS IoT Core への接続が遅延・再接続中の場合でも運転ループを停止させないよう、
+各Publisherパーツは送信要求をキューに積むだけで処理を戻す。
+キューはトピック毎に未送信の最新メッセージ1件のみを保持する(古いメッセージは上書き)。
+"""
+import time
+import threading
+from collections import OrderedDict
+
+class PublishWorker:
+    """
+    MQTTクライアントの publish をバックグラウンドスレッドで実行するクラス。
+    MQTTクライアントと同じシグネチャの publish メソッドを持つため、
+    Publisherパーツの self.client の代わりに使用できる。
+    """
+    def __init__(self, client, max_topics=64, debug=False):
+        """
+        送信スレッドを開始する。
+        引数：
+            client          MQTTクライアント(AWSIoTMQTTClient など)
+            max_topics      未送信メッセージを保持するトピック数の上限
+                            (超過した場合最も古いメッセージを破棄する)
+            debug           デバッグフラグ
+        戻り値：
+            なし
+        """
+        self.client = client
+        self.max_topics = max_topics
+        self.debug = debug
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.busy = False
+        self.on = True
+        self.enqueued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.latency_last = 0.0
+        self.thread = threading.Thread(target=self.update, daemon=True)
+        self.thread.start()
+        if self.debug:
+            print('[PublishWorker] start max_topics={}'.format(str(max_topics)))
+
+    def publish(self, topic, payload, qos):
+        """
+        送信要求をキューに積む(送信完了を待たない)。
+        同じトピックの未送信メッセージが存在する場合は上書きする。
+        引数：
+            topic           トピック名
+            payload         メッセージ
+            qos             QoS
+        戻り値：
+            キューに積んだ場合真、停止済みの場合偽
+        """
+        with self.condition:
+            if not self.on:
+                self.dropped += 1
+                return False
+            if topic in self.pending:
+                self.coalesced += 1
+            elif len(self.pending) >= self.max_topics:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[topic] = (payload, qos, time.time())
+            self.enqueued += 1
+            self.condition.notify()
+        return True
+
+    def is_pending(self, topic):
+        """
+        指定したトピックに未送信メッセージがあるかどうか判別する。
+        引数：
+            topic           トピック名
+        戻り値：
+            真偽値
+        """
+        with self.condition:
+            return topic in self.pending
+
+    def update(self):
+        """
+        キューに積まれたメッセージを古い順に送信する(スレッド処理)。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        while True:
+            with self.condition:
+                while self.on and len(self.pending) == 0:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    break
+                topic, (payload, qos, enqueue_time) = self.pending.popitem(last=False)
+                self.busy = True
+            try:
+                ret = self.client.publish(topic, payload, qos)
+            except Exception as e:
+                ret = False
+                if self.debug:
+                    print('[PublishWorker] publish topic={} error: {}'.format(topic, str(e)))
+            latency = time.time() - enqueue_time
+            with self.condition:
+                self.busy = False
+                if ret is False:
+                    self.failed += 1
+                else:
+                    self.sent += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    self.latency_last = latency
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        未送信メッセージがすべて送信されるまで待機する。
+        引数：
+            timeout         最大待機時間(秒)、None の場合無制限
+        戻り値：
+            すべて送信済みの場合真、タイムアウトした場合偽
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: len(self.pending) == 0 and not self.busy, timeout)
+
+    def stats(self):
+        """
+        送信状況のカウンタを取得する。
+        引数：
+            なし
+        戻り値：
+            辞書(enqueued, sent, coalesced, dropped, failed, pending,
+            latency_avg, latency_max, latency_last、latency は秒)
+        """
+        with self.condition:
+            return {
+                'enqueued':     self.enqueued,
+                'sent':         self.sent,
+                'coalesced':    self.coalesced,
+                'dropped':      self.dropped,
+                'failed':       self.failed,
+                'pending':      len(self.pending),
+                'latency_avg':  self.latency_total / self.sent if self.sent > 0 else 0.0,
+                'latency_max':  self.latency_max,
+                'latency_last': self.latency_last,
+            }
+
+    def shutdown(self, timeout=1.0):
+        """
+        未送信メッセージを最大 timeout 秒送信した後、送信スレッドを停止する。
+        送信しきれなかったメッセージは dropped に加算する。
+        引数：
+            timeout         最大待機時間(秒)
+        戻り値：
+            なし
+        """
+        self.flush(timeout)
+        with self.condition:
+            self.on = False
+            self.dropped += len(self.pending)
+            self.pending.clear()
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        if self.debug:
+            print('[PublishWorker] shutdown {}'.format(str(self.stats())))
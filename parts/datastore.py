@@ -9,48 +9,117 @@ donkeycar.parts.datastore をオーバライドして作成。
 import os
 import time
 import glob
+import json
+import threading
+import collections
 import datetime
 import numpy as np
 import pandas as pd
 from PIL import Image
 from donkeycar.parts.datastore import Tub as OldTub
+from .loader.data import get_tubs
+from .loader.packed import is_packed_tub, get_packed_tub, PackedTub
+from .loader.columns import TubColumns
+from .sensors.imu import encode_recent, BINARY_RECENT_KEYS
 
 CAMERA_PREFIX = 'cam'
 FWD_CAMERA_PREFIX = 'fwd'
 CAMERA_DIR = FWD_CAMERA_PREFIX
 FWD_CAMERA_KEY = '{}/image_array'.format(str(FWD_CAMERA_PREFIX))
 
+# 非同期書き込み時、待ち行列が満杯の場合の動作
+WRITE_POLICY_BLOCK = 'block'                # 空きができるまで待つ
+WRITE_POLICY_DROP_OLDEST = 'drop_oldest'    # 最も古い書き込み待ちレコードを破棄する
+WRITE_POLICIES = [
+    WRITE_POLICY_BLOCK,
+    WRITE_POLICY_DROP_OLDEST,
+]
+
 class Tub(OldTub):
     """
     TubディレクトリをDecorateして前方画像、Map画像両方を格納する機能を追加したクラス。
+    async_write が真の場合、put_record はレコードを待ち行列へ追加するのみとし、
+    JPEGエンコード・ファイル書き込みはバックグラウンドスレッドがまとめて行う。
     """
-    def __init__(self, path, inputs=None, types=None, user_meta=[], camera_dir=FWD_CAMERA_PREFIX):
+    def __init__(self, path, inputs=None, types=None, user_meta=[], camera_dir=FWD_CAMERA_PREFIX,
+    async_write=False, queue_size=100, write_policy=WRITE_POLICY_BLOCK, write_batch_size=10, fsync=False):
         """
         親クラスのコンストラクタ処理後、前方画像格納ディレクトリを作成する。
+        非同期書き込みの場合は書き込みスレッドを開始する。
         引数：
-            path        Tubディレクトリパス
-            inputs      入力キー群
-            types       入力値タイプ群
-            user_meta   メタ配列
-            camera_dir  前方視界画像格納サブディレクトリ名
+            path                Tubディレクトリパス
+            inputs              入力キー群
+            types               入力値タイプ群
+            user_meta           メタ配列
+            camera_dir          前方視界画像格納サブディレクトリ名
+            async_write         バックグラウンドスレッドで書き込む場合真
+            queue_size          書き込み待ちレコードの最大件数
+            write_policy        待ち行列が満杯の場合の動作(WRITE_POLICIES)
+            write_batch_size    1回にまとめて書き込む最大件数
+            fsync               バッチ書き込み毎にディスクへ同期する場合真
+        例外：
+            ValueError          write_policy が不正な場合
         """
         super().__init__(path, inputs, types, user_meta)
         self.camera_path = os.path.join(self.path, camera_dir)
         if not os.path.exists(self.camera_path):
             print('                    Creating new camera dir...')
             os.makedirs(self.camera_path)
+        if write_policy not in WRITE_POLICIES:
+            raise ValueError('illegal write_policy={}'.format(str(write_policy)))
+        self.async_write = async_write
+        self.queue_size = max(int(queue_size), 1)
+        self.write_policy = write_policy
+        self.write_batch_size = max(int(write_batch_size), 1)
+        self.fsync = fsync
+        # 書き込み済み・破棄件数
+        self.written = 0
+        self.dropped = 0
+        self._queue = collections.deque()
+        self._writing = 0
+        self._stopping = False
+        self._cond = threading.Condition()
+        self._thread = None
+        if self.async_write:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
 
     def put_record(self, data):
         """
         引数dataで渡されたTubデータをmeta.jsonで定義されたタイプ別にファイルへ書き込む。
+        非同期書き込みの場合は連番を確定させて待ち行列へ追加するのみとする。
         元クラスの同名メソッドをオーバライド。
         引数：
             data    Tubデータ（辞書型）
+        戻り値：
+            連番
+        """
+        self.current_ix += 1
+        milliseconds = int((time.time() - self.start_time) * 1000)
+        if self.async_write:
+            # 呼び出し元がバッファを再利用しても影響を受けないようコピーする
+            record = {key: (val.copy() if isinstance(val, np.ndarray) else val)
+                for key, val in data.items()}
+            self._enqueue((self.current_ix, record, milliseconds))
+        else:
+            self._write_record(self.current_ix, data, milliseconds)
+        return self.current_ix
+
+    def _write_record(self, ix, data, milliseconds, paths=None):
+        """
+        連番ixのTubデータをファイルへ書き込む。
+        JSON化できない値を含む場合はrecordファイルを書き込まない(元クラスと同じくメッセージ表示のみ)。
+        引数：
+            ix              連番
+            data            Tubデータ（辞書型）
+            milliseconds    Tub生成時からの経過ミリ秒
+            paths           書き込んだファイルパスを追加するリスト(None の場合追加しない)
         戻り値：
             なし
+        例外：
+            TypeError       meta.jsonに未定義のタイプが指定された場合
         """
         json_data = {}
-        self.current_ix += 1
         
         for key, val in data.items():
             typ = self.get_input_type(key)
@@ -59,42 +128,178 @@ class Tub(OldTub):
                 # in case val is a numpy.float32, which json doesn't like
                 json_data[key] = float(val)
 
+            elif typ == 'str' and isinstance(val, np.ndarray):
+                # imu/recent などの配列は文字列化して格納する(imu/batch のみBase64形式)
+                json_data[key] = encode_recent(val, binary=(key in BINARY_RECENT_KEYS))
+
             elif typ in ['str', 'float', 'int', 'boolean', 'vector']:
                 json_data[key] = val
 
-            elif typ is 'image':
-                path = self.make_file_name(key)
+            elif typ == 'image':
+                path = self._make_file_name(ix, key)
                 val.save(path)
                 json_data[key]=path
+                if paths is not None:
+                    paths.append(path)
 
             elif typ == 'image_array':
                 img = Image.fromarray(np.uint8(val))
-                name = self.make_file_name(key, ext='.jpg')
+                name = self._make_file_name(ix, key, ext='.jpg')
                 if key == FWD_CAMERA_KEY:
                     name = name.replace(FWD_CAMERA_PREFIX, CAMERA_PREFIX)
-                    img.save(os.path.join(self.camera_path, name))
+                    path = os.path.join(self.camera_path, name)
                 else:
-                    img.save(os.path.join(self.path, name))
+                    path = os.path.join(self.path, name)
+                img.save(path)
                 json_data[key]=name
+                if paths is not None:
+                    paths.append(path)
 
             else:
                 msg = 'Tub does not know what to do with this type {}'.format(typ)
                 raise TypeError(msg)
 
-        json_data['milliseconds'] = int((time.time() - self.start_time) * 1000)
+        json_data['milliseconds'] = milliseconds
+
+        # 書き込み途中で例外となり不完全なrecordファイルが残らないよう先に文字列化する
+        try:
+            text = json.dumps(json_data)
+        except TypeError:
+            print('[Tub] troubles with record: {}'.format(str(json_data)))
+            return
+        path = self.get_json_record_path(ix)
+        with open(path, 'w') as fp:
+            fp.write(text)
+        if paths is not None:
+            paths.append(path)
+
+    def _make_file_name(self, ix, key, ext='.png'):
+        """
+        連番ixのファイル名を作成する(元クラスのmake_file_nameはcurrent_ixを使用するため)。
+        引数：
+            ix      連番
+            key     Tubデータキー
+            ext     拡張子
+        戻り値：
+            ファイル名
+        """
+        name = '_'.join([str(ix), key, ext])
+        return name.replace('/', '-')
 
-        self.write_json_record(json_data)
-        return self.current_ix
+    def _enqueue(self, item):
+        """
+        書き込み待ち行列へ追加する。満杯の場合は write_policy に従い
+        空くまで待つか最も古いレコードを破棄する。
+        引数：
+            item    (連番, Tubデータ, 経過ミリ秒)
+        戻り値：
+            なし
+        """
+        with self._cond:
+            while len(self._queue) >= self.queue_size:
+                if self.write_policy == WRITE_POLICY_DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                else:
+                    self._cond.wait()
+            self._queue.append(item)
+            self._cond.notify_all()
+
+    def _write_loop(self):
+        """
+        書き込みスレッド処理。待ち行列から最大 write_batch_size 件ずつ取り出して書き込む。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        while True:
+            with self._cond:
+                while len(self._queue) == 0 and not self._stopping:
+                    self._cond.wait()
+                if len(self._queue) == 0:
+                    return
+                batch = [self._queue.popleft()
+                    for _ in range(min(self.write_batch_size, len(self._queue)))]
+                self._writing = len(batch)
+                self._cond.notify_all()
+            paths = [] if self.fsync else None
+            for ix, data, milliseconds in batch:
+                try:
+                    self._write_record(ix, data, milliseconds, paths)
+                except Exception as e:
+                    print('[Tub] failed to write record {}: {}'.format(str(ix), str(e)))
+            if self.fsync:
+                self._fsync(paths)
+            with self._cond:
+                self._writing = 0
+                self.written += len(batch)
+                self._cond.notify_all()
+
+    def _fsync(self, paths):
+        """
+        書き込んだファイルと格納ディレクトリをディスクへ同期する。
+        引数：
+            paths   ファイルパスのリスト
+        戻り値：
+            なし
+        """
+        for path in paths + sorted(set(os.path.dirname(path) for path in paths)):
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                print('[Tub] failed to fsync {}: {}'.format(path, str(e)))
+
+    def flush(self):
+        """
+        書き込み待ちレコードがすべて書き込まれるまで待つ。
+        同期書き込みの場合は何もしない。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self._thread is None:
+            return
+        with self._cond:
+            while len(self._queue) > 0 or self._writing > 0:
+                self._cond.wait()
+
+    def shutdown(self):
+        """
+        書き込み待ちレコードをすべて書き込み、書き込みスレッドを停止する。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        if self._thread is not None:
+            self.flush()
+            with self._cond:
+                self._stopping = True
+                self._cond.notify_all()
+            self._thread.join()
+            self._thread = None
+            if self.dropped > 0:
+                print('[Tub] written {} records, dropped {} records'.format(
+                    str(self.written), str(self.dropped)))
+        super().shutdown()
 
     def erase_record(self, i):
         """
         引数iで指定された連番のTubデータを削除する。
+        非同期書き込みの場合は書き込み待ちレコードを書き込んでから削除する。
         同名のメソッドをオーバライド。
         引数：
             i   連番
         戻り値：
             なし
         """
+        self.flush()
         #print('arrived erase_record i={}'.format(str(i)))
         super().erase_record(i)
         img_filename = '%d_cam-image_array_.jpg' % (i)
@@ -137,14 +342,14 @@ class TubWriter(Tub):
         引数：
             可変(meta.json定義と同じ数のデータ値)
         戻り値：
-            なし
+            レコード件数(tub/num_records、待ち行列から破棄した件数を除く)
         """
         assert len(self.inputs) == len(args)
 
         self.record_time = int(time.time() - self.start_time)
         record = dict(zip(self.inputs, args))
         self.put_record(record)
-        return self.current_ix
+        return self.current_ix - self.dropped
 
 
 class TubReader(Tub):
@@ -236,23 +441,27 @@ class TubHandler():
         tub_path = os.path.join(self.path, name)
         return tub_path
 
-    def new_tub_writer(self, inputs, types, user_meta=[]):
+    def new_tub_writer(self, inputs, types, user_meta=[], **kwargs):
         """
         前方画像、2D Map画像両方格納するライタークラスを返却する。
         引数：
             inputs      入力キー群
             types       入力値タイプ群
             user_meta   メタ配列
+            kwargs      Tubの書き込みオプション(async_write, queue_size など)
         戻り値：
             TubWriter インスタンス
         """
         tub_path = self.create_tub_path()
-        tw = TubWriter(path=tub_path, inputs=inputs, types=types, user_meta=user_meta)
+        tw = TubWriter(path=tub_path, inputs=inputs, types=types, user_meta=user_meta, **kwargs)
         return tw
 
 '''
-以下donkeyrar.parts.datastoreの同名クラスと同じ。
+以下donkeyrar.parts.datastoreの同名クラスをもとに作成。
 ただし、親クラスは本モジュール内Tubクラスとなる。
+学習時は連番順に読み込まれることが多いため、直近のJSONレコードと
+グレースケール変換済みイメージを保持し、前のサンプルで読み込み済みのデータは
+再度読み込み・デコードしない。
 '''
 
 class TubImageStacker(Tub):
@@ -263,57 +472,179 @@ class TubImageStacker(Tub):
     If you drive with the ImageFIFO part, then you don't need this.
     Just make sure your inference pass uses the ImageFIFO that the NN will now expect.
     '''
-    
+
+    def __init__(self, *args, cache_size=8, **kwargs):
+        """
+        読み込み済みデータの保持領域を初期化後、親クラスのコンストラクタを呼び出す。
+        引数：
+            args        Tubクラスのコンストラクタ引数
+            cache_size  保持するJSONレコード・グレースケールイメージの件数
+            kwargs      Tubクラスのコンストラクタ引数
+        戻り値：
+            なし
+        """
+        self.cache_size = max(int(cache_size), 3)
+        self.json_cache_size = self.cache_size
+        self._json_cache = collections.OrderedDict()
+        self._gray_cache = collections.OrderedDict()
+        self._cache_lock = threading.Lock()
+        super(TubImageStacker, self).__init__(*args, **kwargs)
+
     def rgb2gray(self, rgb):
         '''
         take a numpy rgb image return a new single channel image converted to greyscale
         '''
         return np.dot(rgb[...,:3], [0.299, 0.587, 0.114])
 
-    def stack3Images(self, img_a, img_b, img_c):
+    def to_gray(self, img):
+        """
+        イメージを1回の行列積でグレースケール(uint8, 高さ x 幅)に変換する。
+        引数：
+            img     イメージデータ(nd.array型またはPIL Image)
+        戻り値：
+            グレースケールイメージ(nd.array型)
+        """
+        img = np.asarray(img)
+        if img.ndim == 2:
+            return img.astype(np.uint8, copy=False)
+        return self.rgb2gray(img).astype(np.uint8)
+
+    def stack_gray(self, grays, out=None):
+        """
+        グレースケールイメージ群を各チャネルに格納した1枚のイメージを作成する。
+        引数：
+            grays   グレースケールイメージ(高さ x 幅)のリスト
+            out     書き込み先配列(高さ x 幅 x len(grays))、None の場合は新規に確保する
+        戻り値：
+            スタック済みイメージ(nd.array型, uint8)
+        """
+        if out is None:
+            out = np.empty(grays[0].shape + (len(grays),), dtype=np.uint8)
+        for ch, gray in enumerate(grays):
+            out[..., ch] = gray
+        return out
+
+    def stack3Images(self, img_a, img_b, img_c, out=None):
         '''
         convert 3 rgb images into grayscale and put them into the 3 channels of
         a single output image
         '''
-        width, height, _ = img_a.shape
-
-        gray_a = self.rgb2gray(img_a)
-        gray_b = self.rgb2gray(img_b)
-        gray_c = self.rgb2gray(img_c)
-        
-        img_arr = np.zeros([width, height, 3], dtype=np.dtype('B'))
+        return self.stack_gray(
+            [self.to_gray(img_a), self.to_gray(img_b), self.to_gray(img_c)], out)
 
-        img_arr[...,0] = np.reshape(gray_a, (width, height))
-        img_arr[...,1] = np.reshape(gray_b, (width, height))
-        img_arr[...,2] = np.reshape(gray_c, (width, height))
+    def get_json_record(self, ix):
+        """
+        連番ixのJSONレコードを返却する。直近 json_cache_size 件は再読み込みしない。
+        同名のメソッドをオーバライド。
+        引数：
+            ix      連番
+        戻り値：
+            JSONレコード(辞書型、呼び出し側で変更してもよい複製)
+        """
+        with self._cache_lock:
+            json_data = self._json_cache.get(ix)
+            if json_data is not None:
+                self._json_cache.move_to_end(ix)
+                return dict(json_data)
+        json_data = super(TubImageStacker, self).get_json_record(ix)
+        with self._cache_lock:
+            self._json_cache[ix] = json_data
+            while len(self._json_cache) > self.json_cache_size:
+                self._json_cache.popitem(last=False)
+        return dict(json_data)
+
+    def load_image(self, ix, key):
+        """
+        連番ixのイメージキーkeyのイメージファイルを読み込む。
+        引数：
+            ix      連番
+            key     イメージキー
+        戻り値：
+            イメージデータ(nd.array型)
+        """
+        json_data = self.get_json_record(ix)
+        return np.array(Image.open(os.path.join(self.path, json_data[key])))
 
-        return img_arr
+    def get_gray(self, ix, key, img=None):
+        """
+        連番ixのイメージキーkeyのグレースケールイメージを返却する。
+        直近 cache_size 件は再読み込み・再変換しない。
+        引数：
+            ix      連番
+            key     イメージキー
+            img     デコード済みイメージ(None の場合はファイルから読み込む)
+        戻り値：
+            グレースケールイメージ(nd.array型, uint8)
+        """
+        cache_key = (ix, key)
+        with self._cache_lock:
+            gray = self._gray_cache.get(cache_key)
+            if gray is not None:
+                self._gray_cache.move_to_end(cache_key)
+                return gray
+        gray = self.to_gray(self.load_image(ix, key) if img is None else img)
+        with self._cache_lock:
+            self._gray_cache[cache_key] = gray
+            while len(self._gray_cache) > self.cache_size:
+                self._gray_cache.popitem(last=False)
+        return gray
 
     def get_record(self, ix):
         '''
         get the current record and two previous.
         stack the 3 images into a single image.
         '''
-        data = super(TubImageStacker, self).get_record(ix)
+        json_data = self.get_json_record(ix)
+        data = self.read_record(json_data)
 
         if ix > 1:
-            data_ch1 = super(TubImageStacker, self).get_record(ix - 1)
-            data_ch0 = super(TubImageStacker, self).get_record(ix - 2)
-
-            json_data = self.get_json_record(ix)
-            for key, val in json_data.items():
+            for key in json_data.keys():
                 typ = self.get_input_type(key)
 
-                #load objects that were saved as separate files
-                if typ == 'image':
-                    val = self.stack3Images(data_ch0[key], data_ch1[key], data[key])
-                    data[key] = val
-                elif typ == 'image_array':
-                    img = self.stack3Images(data_ch0[key], data_ch1[key], data[key])
-                    val = np.array(img)
+                #previous frames are reused from the grayscale cache
+                if typ == 'image' or typ == 'image_array':
+                    data[key] = self.stack_gray([
+                        self.get_gray(ix - 2, key),
+                        self.get_gray(ix - 1, key),
+                        self.get_gray(ix, key, data[key])])
 
         return data
 
+    def iter_stacked(self, key, batch_size=128, indexes=None):
+        """
+        Tubを連番順に走査し、スタック済みイメージを事前に確保したバッチ配列へ
+        書き込んで返却する。直前2件のグレースケールイメージを保持するため、
+        1サンプルあたりのイメージデコードは1回となる。
+        連番1以下のイメージは get_record と同様にスタックせずに書き込む。
+        引数：
+            key         スタック対象のイメージキー
+            batch_size  バッチサイズ
+            indexes     走査する連番のリスト(None の場合全件を昇順に走査)
+        戻り値：
+            (JSONレコードのリスト, バッチ配列) を返却するジェネレータ
+            バッチ配列(uint8, 件数 x 高さ x 幅 x 3)は次のバッチで再利用するため、
+            保持する場合は呼び出し側で複製すること
+        """
+        if indexes is None:
+            indexes = sorted(self.get_index(shuffled=False))
+        batch = None
+        records = []
+        for ix in indexes:
+            gray = self.get_gray(ix, key)
+            if batch is None:
+                batch = np.empty((batch_size,) + gray.shape + (3,), dtype=np.uint8)
+            out = batch[len(records)]
+            if ix > 1:
+                self.stack_gray([self.get_gray(ix - 2, key), self.get_gray(ix - 1, key), gray], out)
+            else:
+                out[...] = self.load_image(ix, key)
+            records.append(self.get_json_record(ix))
+            if len(records) == batch_size:
+                yield records, batch
+                records = []
+        if len(records) > 0:
+            yield records, batch[:len(records)]
+
 
 
 class TubTimeStacker(TubImageStacker):
@@ -332,6 +663,9 @@ class TubTimeStacker(TubImageStacker):
         '''
         super(TubTimeStacker, self).__init__(*args, **kwargs)
         self.frame_list = frame_list
+        # keep every JSON record inside the offset window so sequential reads hit the cache
+        self.json_cache_size = max(self.cache_size,
+            (max(frame_list) - min(frame_list) + 1) * 2)
   
     def get_record(self, ix):
         '''
@@ -358,8 +692,7 @@ class TubTimeStacker(TubImageStacker):
                     val = Image.open(os.path.join(self.path, val))
                     data[key] = val                    
                 elif typ == 'image_array' and i == 0 and key != FWD_CAMERA_KEY:
-                    d = super(TubTimeStacker, self).get_record(ix)
-                    data[key] = d[key]
+                    data[key] = self.load_image(ix, key)
                 else:
                     '''
                     we append a _offset to the key
@@ -371,28 +704,201 @@ class TubTimeStacker(TubImageStacker):
 
 
 class TubGroup(Tub):
-    def __init__(self, tub_paths):
+    """
+    複数のTubディレクトリ(packed tub 可)を1つのTubデータとして扱うクラス。
+    生成時は各Tubの件数からなる軽量なインデックスのみ作成し、スカラ値の列は
+    Tub単位で必要になった時点で読み込む(recordファイルは chunk_size 件ずつ列へ変換)。
+    変換した列はTub毎の列キャッシュファイルに保存し、Tubが更新されていなければ
+    次回以降はrecordファイルを読まずに再利用する。
+    メモリ上に保持する列は直近 max_cached_tubs 個のTub分のみとする。
+    """
+    def __init__(self, tub_paths, chunk_size=10000, max_cached_tubs=2, use_cache=True, debug=False):
+        """
+        各Tubのメタ情報と件数を読み込み、インデックスを作成する。
+        引数：
+            tub_paths       Tubディレクトリパス(カンマ区切り、ワイルドカード可)
+            chunk_size      1回に読み込むrecordファイル数、iter_chunks の1チャンクの件数
+            max_cached_tubs 列をメモリ上に保持するTub数
+            use_cache       Tub毎の列キャッシュファイルを使用する場合真
+            debug           デバッグフラグ
+        戻り値：
+            なし
+        """
         tub_paths = self.resolve_tub_paths(tub_paths)
         print('TubGroup:tubpaths:', tub_paths)
-        tubs = [Tub(path) for path in tub_paths]
+        self.tub_paths = tub_paths
+        self.chunk_size = max(int(chunk_size), 1)
+        self.max_cached_tubs = max(int(max_cached_tubs), 1)
+        self.use_cache = use_cache
+        self.debug = debug
         self.input_types = {}
+        self._columns = collections.OrderedDict()
+        self._columns_lock = threading.Lock()
+        self._df = None
+
+        counts = []
+        tub_keys = []
+        for i, path in enumerate(tub_paths):
+            if is_packed_tub(path):
+                packed = get_packed_tub(path)
+                counts.append(packed.total())
+                tub_keys.append(packed.keys())
+                self.input_types.update(packed.meta['types'])
+                self.input_types.update({key: 'image_array' for key in packed.image_keys()})
+            else:
+                counts.append(get_tubs(path).total())
+                inputs, types = self._load_meta(path)
+                self.input_types.update(dict(zip(inputs, types)))
+                if len(inputs) > 0:
+                    # Tub.put_record は常に milliseconds を書き込む
+                    tub_keys.append(inputs + ['milliseconds'])
+                else:
+                    tub_keys.append(self.get_tub_columns(i).keys())
+        # 軽量インデックス：Tub毎の先頭位置(最後の要素は全件数)
+        self.offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+        # すべてのTubに共通するキーのみ扱う(pandas.concat の join='inner' と同じ)
+        self.column_keys = [key for key in (tub_keys[0] if len(tub_keys) > 0 else [])
+            if all([key in keys for keys in tub_keys[1:]])]
 
-        record_count = 0
-        for t in tubs:
-            t.update_df()
-            record_count += len(t.df)
-            self.input_types.update(dict(zip(t.inputs, t.types)))
-
-        print('joining the tubs {} records together. This could take {} minutes.'.format(record_count,
-                                                                                         int(record_count / 300000)))
+        print('indexed the tubs {} records together.'.format(self.get_num_records()))
 
         self.meta = {'inputs': list(self.input_types.keys()),
                      'types': list(self.input_types.values())}
 
+    def _load_meta(self, path):
+        """
+        Tubディレクトリの meta.json から入力キー群・入力値タイプ群を読み込む。
+        引数：
+            path    Tubディレクトリパス
+        戻り値：
+            (入力キー群, 入力値タイプ群) のタプル、meta.json がない場合は空リストの組
+        """
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return [], []
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        return list(meta.get('inputs', [])), list(meta.get('types', []))
+
+    def get_num_records(self):
+        """
+        全Tubの件数合計を返却する。
+        引数：
+            なし
+        戻り値：
+            件数
+        """
+        return int(self.offsets[-1])
 
-        self.df = pd.concat([t.df for t in tubs], axis=0, join='inner')
+    def locate(self, index):
+        """
+        通し位置に対応するTubと、Tub内の位置を返却する。
+        引数：
+            index   全Tubを連結した通し位置
+        戻り値：
+            (Tubの位置, Tub内の位置) のタプル
+        例外：
+            IndexError  範囲外の場合
+        """
+        if index < 0 or index >= self.get_num_records():
+            raise IndexError('index={} out of range'.format(str(index)))
+        tub_index = int(np.searchsorted(self.offsets, index, side='right')) - 1
+        return tub_index, int(index - self.offsets[tub_index])
 
+    def get_tub_columns(self, tub_index):
+        """
+        Tubの列オブジェクトを返却する。直近 max_cached_tubs 個を超えた
+        Tubの列はメモリ上から破棄する(列キャッシュファイルには残る)。
+        引数：
+            tub_index   Tubの位置
+        戻り値：
+            PackedTub または parts.loader.columns.TubColumns オブジェクト
+        """
+        with self._columns_lock:
+            columns = self._columns.get(tub_index)
+            if columns is not None:
+                self._columns.move_to_end(tub_index)
+                return columns
+        path = self.tub_paths[tub_index]
+        if is_packed_tub(path):
+            columns = get_packed_tub(path)
+        else:
+            columns = TubColumns(path, chunk_size=self.chunk_size,
+                use_cache=self.use_cache, debug=self.debug)
+        with self._columns_lock:
+            self._columns[tub_index] = columns
+            while len(self._columns) > self.max_cached_tubs:
+                self._columns.popitem(last=False)
+        return columns
+
+    def get_tub_dataframe(self, tub_index, start=0, end=None):
+        """
+        Tubの指定範囲の列を pandas.DataFrame に変換する。
+        イメージキーの値はTubディレクトリからの絶対パスとし、packed tub の場合は
+        JPEGバイナリ(PackedTub.image_bytes() の戻り値)とする。
+        インデックスには全Tubを連結した通し位置を使用する。
+        引数：
+            tub_index   Tubの位置
+            start       Tub内の開始位置
+            end         Tub内の終了位置(この位置を含まない、None の場合末尾)
+        戻り値：
+            pandas.DataFrame オブジェクト
+        """
+        columns = self.get_tub_columns(tub_index)
+        count = columns.total()
+        end = count if end is None else min(end, count)
+        path = self.tub_paths[tub_index]
+        data = collections.OrderedDict()
+        is_packed = isinstance(columns, PackedTub)
+        for key in self.column_keys:
+            if is_packed and key in columns.image_keys():
+                data[key] = columns.image_column(key, start, end)
+                continue
+            try:
+                values = columns.column(key)[start:end]
+            except KeyError:
+                values = np.full(end - start, np.nan)
+            if self.input_types.get(key) in ['image', 'image_array']:
+                # 前方画像は前方画像格納ディレクトリに格納されている
+                image_dir = os.path.join(path, CAMERA_DIR) if key == FWD_CAMERA_KEY else path
+                values = [None if name is None else os.path.join(image_dir, name)
+                    for name in values.tolist()]
+            data[key] = values
+        offset = int(self.offsets[tub_index])
+        return pd.DataFrame(data, index=pd.RangeIndex(offset + start, offset + end))
+
+    def iter_chunks(self, chunk_size=None):
+        """
+        全Tubを先頭から chunk_size 件ずつの pandas.DataFrame として返却する。
+        チャンクはTubをまたがない。
+        引数：
+            chunk_size  1チャンクの件数(None の場合コンストラクタ引数の値)
+        戻り値：
+            pandas.DataFrame を返却するジェネレータ
+        """
+        chunk_size = self.chunk_size if chunk_size is None else max(int(chunk_size), 1)
+        for tub_index in range(len(self.tub_paths)):
+            count = int(self.offsets[tub_index + 1] - self.offsets[tub_index])
+            for start in range(0, count, chunk_size):
+                yield self.get_tub_dataframe(tub_index, start, start + chunk_size)
+
+    @property
+    def df(self):
+        """
+        全Tubを連結した pandas.DataFrame (初回参照時に作成)。
+        全件がメモリ上に展開されるため、大量のTubを扱う場合は iter_chunks を使用すること。
+        """
+        if self._df is None:
+            frames = list(self.iter_chunks())
+            if len(frames) > 0:
+                self._df = pd.concat(frames, axis=0)
+            else:
+                self._df = pd.DataFrame(columns=self.column_keys)
+        return self._df
 
+    @df.setter
+    def df(self, df):
+        self._df = df
 
     def find_tub_paths(self, path):
         matches = []
@@ -6,6 +6,7 @@
 """
 from .VisionGenerator.SpoolMobile import SpoolMobileVision
 from .VisionGenerator.madgwickahrs import MadgwickAHRS
+from .sensors.imu import decode_recent, ahrs_samples, RECENT_TIMESTAMP, RECENT_ACCEL, RECENT_GYRO, RECENT_MAGNET
 import donkeycar as dk
 from PIL import Image
 import numpy as np
@@ -17,15 +18,18 @@ class MapImageCreator:
     位置情報システムの出力データをもとにマップ画像を生成する
     パーツクラス。
     """
-    def __init__(self, base_image_path, debug=False):
+    def __init__(self, base_image_path, output_pose=False, debug=False):
         """
         ベースイメージパス、エージェントイメージパスを
         インスタンス変数へ格納する。
         引数：
             base_image_path             ベースイメージパス
+            output_pose                 真の場合、run はマップ画像に加えて
+                                        描画したエージェントの姿勢(x, y, angle)を返却する
             debug                       デバッグフラグ
         """
         self.base_image_path = base_image_path
+        self.output_pose = output_pose
         self.angle = 90  # x-axis +direction
 
         self.dead_zone = 0.05  # looks like we may consider the mobile beacon stationary in this range
@@ -45,6 +49,11 @@ class MapImageCreator:
         4, 0, self.scale, landscape=Image.open(self.base_image_path))
 
         self.heading = MadgwickAHRS(sampleperiod=1/20, beta=2)
+        # 前回処理したFIFOサンプルの時刻
+        self.batch_timestamp = None
+
+        # ベースイメージはファイルから1回だけ読み込む
+        self.base_array = self.dt_vision.get_landscape_array()
 
     '''Marvelmind IMU利用
     def run(self, x, y, qw, qx, qy, qz, timestamp, qw_f, qx_f, qy_f, qz_f, timestamp_f):
@@ -122,22 +131,30 @@ class MapImageCreator:
 
     '''MPU9250からIMUデータ取得'''
 
-    def run(self, x, y, recent):
+    def run(self, x, y, recent, batch=None):
         """
         位置情報システムのX,Y,Z座標とMPU9250の最新IMUデータ2件から
         マップ画像を生成し返却する。
+        FIFOモードの全サンプル batch が与えられた場合は、最新IMUデータ2件の代わりに
+        前回呼び出し以降の全サンプルで方位を更新する。
         引数：
             x           Marvelmind位置情報システムX座標(float)
             y           Marvelmind位置情報システムY座標(float)
-            recent      MPU9260最新データ群(JSON形式文字列)
+            recent      MPU9260最新データ群(nd.array形式、encode_recent文字列も可)
+            batch       MPU9260 FIFO全サンプル(nd.array形式、encode_recent文字列も可、省略可)
         戻り値：
             image_array マップ画像
+            pose        エージェントの姿勢(x, y, angle)のタプル、ベースイメージの場合 None
+                        (output_pose が真の場合のみ)
         """
         # 引数チェック
         #print('[MapImageCreator] x:{}, y:{}, recent:{}'.format(str(x), str(y), str(recent)))
-        if x is None or y is None or recent is None:
+        recent = decode_recent(recent)
+        if x is None or y is None or recent is None or len(recent) < 2:
             if self.debug:
                 print('[MapImageCreator] return base image because None exists')
+            if self.output_pose:
+                return self.base_to_array(), None
             return self.base_to_array()
 
         # 座標
@@ -159,54 +176,41 @@ class MapImageCreator:
         # print('rotated %f to p( %f, %f )' % (rotation_angle, rotated_position[0, 0], rotated_position[1,0]))
         rotated_position = rotated_position + self.origin_ref
 
-        ## 最新IMUデータ2件を復元
-        from .sensors.imu import array_recent_data, unpack
-        recent_array = array_recent_data(recent)
-        cur_timestamp, _, cur_accel_data, cur_gyro_data, cur_magnet_data = unpack(recent_array[-1])
-        pre_timestamp, _, pre_accel_data, pre_gyro_data, pre_magnet_data = unpack(recent_array[-2])
-
         delta_yaw = 0
 
-        #elapsed_time = hedge.valuesImuRawData[-1][9] - hedge.valuesImuRawData[-2][9]
-        elapsed_time = cur_timestamp - pre_timestamp
-
-        ## heading.sampleperiod = elapsed_time / 1000
-        #gyr = np.array([math.radians(hedge.valuesImuRawData[-1][3]), math.radians(hedge.valuesImuRawData[-1][4]),
-        #            math.radians(hedge.valuesImuRawData[-1][5])])
-        gyr = np.array([
-            math.radians(cur_gyro_data['x']),
-            math.radians(cur_gyro_data['y']),
-            math.radians(cur_gyro_data['z']),
-        ])
-        #acc = np.array([hedge.valuesImuRawData[-1][0], hedge.valuesImuRawData[-1][1], hedge.valuesImuRawData[-1][2]])
-        acc = np.array([
-            cur_accel_data['x'], cur_accel_data['y'], cur_accel_data['z'],
-        ])
-        #mgt = np.array([hedge.valuesImuRawData[-1][6], hedge.valuesImuRawData[-1][7], hedge.valuesImuRawData[-1][8]])
-        mgt = np.array([
-            cur_magnet_data['x'], cur_magnet_data['y'], cur_magnet_data['z'],
-        ])
-        self.heading.update(gyr, acc, mgt)
-        _, _, yaw = self.heading.quaternion.to_euler123()  # roll, pitch, 最初の角度
-
-        if self.skip_very_first_data != 0:  # 2回目以降は常に実行
-            #gyr1 = np.array([math.radians(hedge.valuesImuRawData[-2][3]), math.radians(hedge.valuesImuRawData[-2][4]),
-            #             math.radians(hedge.valuesImuRawData[-2][5])])
-            gyr1 = np.array([
-                math.radians(pre_gyro_data['x']),
-                math.radians(pre_gyro_data['y']),
-                math.radians(pre_gyro_data['z']),
-            ])
-            #acc1 = np.array([hedge.valuesImuRawData[-2][0], hedge.valuesImuRawData[-2][1], hedge.valuesImuRawData[-2][2]])
-            acc1 = np.array([
-                pre_accel_data['x'], pre_accel_data['y'], pre_accel_data['z'],
-            ])
-            #mgt1 = np.array([hedge.valuesImuRawData[-2][6], hedge.valuesImuRawData[-2][7], hedge.valuesImuRawData[-2][8]])
-            mgt1 = np.array([
-                pre_magnet_data['x'], pre_magnet_data['y'], pre_magnet_data['z'],
-            ])
-            self.heading.update(gyr1, acc1, mgt1)
-            _, _, yaw1 = self.heading.quaternion.to_euler123()  # roll1, pitch1, 最初の角度
+        batch = decode_recent(batch)
+        if batch is not None and len(batch) > 0:
+            ## FIFO全サンプルで方位を更新し、更新前後の差分をとる
+            _, _, yaw1 = self.heading.quaternion.to_euler123()
+            first_period = self.heading.samplePeriod
+            if self.batch_timestamp is not None and batch[0, RECENT_TIMESTAMP] > self.batch_timestamp:
+                first_period = batch[0, RECENT_TIMESTAMP] - self.batch_timestamp
+            self.batch_timestamp = batch[-1, RECENT_TIMESTAMP]
+            samples, sampleperiods = ahrs_samples(batch, first_period)
+            self.heading.update_batch(samples, sampleperiods)
+            _, _, yaw = self.heading.quaternion.to_euler123()
+            elapsed_time = float(np.sum(sampleperiods))
+        else:
+            ## 最新IMUデータ2件を取得
+            cur = recent[-1]
+            pre = recent[-2]
+
+            #elapsed_time = hedge.valuesImuRawData[-1][9] - hedge.valuesImuRawData[-2][9]
+            elapsed_time = cur[RECENT_TIMESTAMP] - pre[RECENT_TIMESTAMP]
+
+            ## heading.sampleperiod = elapsed_time / 1000
+            gyr = np.radians(cur[RECENT_GYRO])
+            acc = cur[RECENT_ACCEL]
+            mgt = cur[RECENT_MAGNET]
+            self.heading.update(gyr, acc, mgt)
+            _, _, yaw = self.heading.quaternion.to_euler123()  # roll, pitch, 最初の角度
+
+            if self.skip_very_first_data != 0:  # 2回目以降は常に実行
+                gyr1 = np.radians(pre[RECENT_GYRO])
+                acc1 = pre[RECENT_ACCEL]
+                mgt1 = pre[RECENT_MAGNET]
+                self.heading.update(gyr1, acc1, mgt1)
+                _, _, yaw1 = self.heading.quaternion.to_euler123()  # roll1, pitch1, 最初の角度
 
         if self.skip_very_first_data == 0:
             self.angle = math.degrees(yaw)  # 方向を最初の角度に設定
@@ -223,13 +227,22 @@ class MapImageCreator:
         if self.debug:
             print('[MapImageCreator] turn %f degeres heading %f degrees elapsed time:%f' % (delta_yaw, self.angle % 360, elapsed_time))
         #self.dt_vision.update_vision(76, 60, self.angle)
-        im = self.dt_vision.get_vision(rotated_position[0, 0] / self.stud, rotated_position[1, 0] / self.stud, self.angle)
-        return dk.utils.img_to_arr(im)
+        im = self.dt_vision.get_vision_array(rotated_position[0, 0] / self.stud, rotated_position[1, 0] / self.stud, self.angle)
+        # 描画バッファは次回上書きされるため、後続スレッドパーツ向けにコピーを返す
+        if self.output_pose:
+            return im.copy(), (rotated_position[0, 0] / self.stud, rotated_position[1, 0] / self.stud, self.angle)
+        return im.copy()
 
     def base_to_array(self):
-            with open(self.base_image_path, 'rb') as f:
-                data = f.read()
-            return dk.utils.img_to_arr(dk.utils.binary_to_img(data))
+        """
+        ベースイメージを nd.array 形式で返却する。
+        初期化時にデコード済みの配列を返却する(書き込み不可)。
+        引数：
+            なし
+        戻り値：
+            image_array ベースイメージ
+        """
+        return self.base_array
 
     def shutdown(self):
         """
@@ -240,6 +253,7 @@ class MapImageCreator:
             なし
         """
         self.base_image_path = None
+        self.base_array = None
         self.dt_vision = None
         if self.debug:
             print('[MapImageCreator] shutdown called')
\ No newline at end of file
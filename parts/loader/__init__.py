@@ -1,2 +1,5 @@
 # -*- coding: utf-8 -*-
-from .tub import UserLoader, ImageLoader
\ No newline at end of file
+from .tub import UserLoader, ImageLoader
+from .packed import PackedTub, pack_tub, is_packed_tub, get_packed_tub
+from .replay import ReplaySource, ReplayCache, get_replay_source, default_cache_dir
+from .columns import TubColumns, default_columns_path
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Tubデータのrecordをキー別の列(np.ndarray)に変換して保持するクラス群。
+parts.datastore.TubGroup が使用する。
+
+recordファイルは chunk_size 件ずつ読み込んで列に変換するため、変換中も
+record(辞書型)を全件保持しない。変換結果は列キャッシュファイル
+(<Tubディレクトリ>.columns.npz)に保存し、Tubディレクトリが更新されていなければ
+次回以降は recordファイルを読まずに再利用する。
+
+列キャッシュファイルは以下の配列で構成される。
+
+    meta        バージョン・ディレクトリ更新時刻・ファイル数・件数(int64)
+    keys        列キーと列種別の組のリスト(JSON文字列)
+    numbers     連番(int64)
+    c<N>        N番目の列(float64/int64/bool、それ以外の値はJSON文字列)
+"""
+import os
+import json
+import numpy as np
+
+from .data import get_tubs
+
+# 列キャッシュファイル名の接尾辞
+COLUMNS_SUFFIX = '.columns.npz'
+# 列キャッシュのフォーマットバージョン
+COLUMNS_VERSION = 1
+
+# 列種別
+KIND_BOOL = 'bool'
+KIND_INT = 'int'
+KIND_FLOAT = 'float'
+KIND_OBJECT = 'object'
+
+def default_columns_path(tub_dir):
+    """
+    Tubディレクトリに対するデフォルトの列キャッシュファイルパスを返却する。
+    Tubディレクトリ内に作成するとディレクトリ更新時刻が変わりインデックスが
+    再作成されるため、Tubディレクトリと同じ階層に作成する。
+
+    引数
+        tub_dir     Tubデータディレクトリのパス
+    戻り値
+        列キャッシュファイルパス(ex. data/tub_1_20-01-01.columns.npz)
+    """
+    return os.path.expanduser(tub_dir).rstrip(os.sep) + COLUMNS_SUFFIX
+
+class TubColumns:
+    """
+    1つのインスタンスで1つのTubデータディレクトリの全recordを列として保持するクラス。
+    parts.loader.packed.PackedTub と同じ total()/keys()/numbers()/column() を提供する。
+    """
+    def __init__(self, tub_dir, chunk_size=10000, cache_path=None, use_cache=True, debug=False):
+        """
+        列キャッシュが最新であれば読み込み、そうでなければ recordファイルを
+        chunk_size 件ずつ読み込んで列を作成し、列キャッシュへ保存する。
+
+        引数
+            tub_dir     Tubデータディレクトリのパス
+            chunk_size  1回に読み込むrecordファイル数
+            cache_path  列キャッシュファイルパス(None の場合 default_columns_path())
+            use_cache   列キャッシュを使用する場合真
+            debug       デバッグフラグ
+        戻り値
+            なし
+        例外
+            Tubデータディレクトリが不正な場合
+        """
+        tubs = get_tubs(tub_dir)
+        self.tub_dir = tubs.tub_dir
+        self.chunk_size = max(int(chunk_size), 1)
+        self.cache_path = default_columns_path(tub_dir) if cache_path is None \
+            else os.path.expanduser(cache_path)
+        self.debug = debug
+        self.mtime = tubs.mtime
+        self.file_count = tubs.file_count
+        self._numbers = np.asarray(tubs.numbers, dtype=np.int64)
+        self._kinds = {}
+        self._columns = {}
+        if use_cache and self.load():
+            return
+        self.build(tubs)
+        if use_cache:
+            self.save()
+
+    def total(self):
+        return len(self._numbers)
+
+    def keys(self):
+        """
+        列キーの一覧を返却する。
+
+        引数
+            なし
+        戻り値
+            キーのリスト(recordファイル上の出現順)
+        """
+        return list(self._columns.keys())
+
+    def numbers(self):
+        """
+        連番列を返却する。
+
+        引数
+            なし
+        戻り値
+            連番(np.ndarray, dtype=int64)
+        """
+        return self._numbers
+
+    def column(self, key):
+        """
+        列を返却する。数値・真偽値以外の列は dtype=object の配列となる。
+
+        引数
+            key     Tubデータキー
+        戻り値
+            列データ(np.ndarray)
+        例外
+            KeyError    存在しないキーの場合
+        """
+        return self._columns[key]
+
+    def build(self, tubs):
+        """
+        recordファイルを chunk_size 件ずつ読み込み、チャンク毎に列へ変換して連結する。
+
+        引数
+            tubs        parts.loader.data.Tubs オブジェクト
+        戻り値
+            なし
+        """
+        total = tubs.total()
+        paths = tubs.sorted_records
+        chunks = {}
+        for start in range(0, total, self.chunk_size):
+            records = []
+            for path in paths[start:start + self.chunk_size]:
+                with open(path, 'r') as f:
+                    records.append(json.load(f))
+            for record in records:
+                for key in record.keys():
+                    if key not in chunks:
+                        chunks[key] = []
+            for key, key_chunks in chunks.items():
+                key_chunks.append((start, _to_column([record.get(key) for record in records])))
+            if self.debug:
+                print('[TubColumns] read {}/{} records in {}'.format(
+                    str(start + len(records)), str(total), self.tub_dir))
+        for key, key_chunks in chunks.items():
+            self._kinds[key], self._columns[key] = _concat_columns(key_chunks, total)
+
+    def load(self):
+        """
+        列キャッシュファイルを読み込む。Tubディレクトリの更新時刻・ファイル数・
+        件数が一致しない場合は何もしない。
+
+        引数
+            なし
+        戻り値
+            読み込めた場合真
+        """
+        if not os.path.isfile(self.cache_path):
+            return False
+        try:
+            with np.load(self.cache_path) as cache:
+                meta = cache['meta']
+                if int(meta[0]) != COLUMNS_VERSION or int(meta[1]) != self.mtime or \
+                    int(meta[2]) != self.file_count or int(meta[3]) != self.total():
+                    if self.debug:
+                        print('[TubColumns] ignore stale cache {}'.format(self.cache_path))
+                    return False
+                kinds = {}
+                columns = {}
+                for i, (key, kind) in enumerate(json.loads(str(cache['keys']))):
+                    values = cache['c{}'.format(str(i))]
+                    if kind == KIND_OBJECT:
+                        values = _from_json_strings(values)
+                    kinds[key] = kind
+                    columns[key] = values
+        except (OSError, ValueError, KeyError) as e:
+            print('[TubColumns] ignore broken cache {}: {}'.format(self.cache_path, str(e)))
+            return False
+        self._kinds = kinds
+        self._columns = columns
+        if self.debug:
+            print('[TubColumns] load {} columns from {}'.format(str(len(columns)), self.cache_path))
+        return True
+
+    def save(self):
+        """
+        列キャッシュファイルを書き出す。書き込めない場合は何もしない。
+
+        引数
+            なし
+        戻り値
+            なし
+        """
+        arrays = {
+            'meta':     np.array([COLUMNS_VERSION, self.mtime, self.file_count, self.total()],
+                dtype=np.int64),
+            'keys':     np.array(json.dumps([[key, self._kinds[key]] for key in self._columns])),
+            'numbers':  self._numbers,
+        }
+        for i, (key, values) in enumerate(self._columns.items()):
+            if self._kinds[key] == KIND_OBJECT:
+                values = _to_json_strings(values)
+            arrays['c{}'.format(str(i))] = values
+        try:
+            with open(self.cache_path, 'wb') as f:
+                np.savez(f, **arrays)
+        except OSError as e:
+            print('[TubColumns] cannot write cache {}: {}'.format(self.cache_path, str(e)))
+
+def _column_kind(values):
+    """
+    値リストを格納する列種別を判定する。
+
+    引数
+        values      値のリスト
+    戻り値
+        列種別(KIND_*)
+    """
+    kind = KIND_BOOL
+    for value in values:
+        if isinstance(value, bool):
+            continue
+        elif isinstance(value, int) and kind in [KIND_BOOL, KIND_INT]:
+            kind = KIND_INT
+        elif isinstance(value, (int, float)) or value is None:
+            kind = KIND_FLOAT
+        else:
+            return KIND_OBJECT
+    return kind
+
+def _to_column(values):
+    """
+    値リストを列種別に応じた np.ndarray に変換する。
+    数値列の None は NaN とする(pandas.DataFrame と同じ)。
+
+    引数
+        values      値のリスト
+    戻り値
+        (列種別, 列データ) のタプル
+    """
+    kind = _column_kind(values)
+    if kind == KIND_OBJECT:
+        return kind, _object_column(values)
+    if kind == KIND_FLOAT:
+        return kind, np.array([np.nan if value is None else value for value in values],
+            dtype=np.float64)
+    return kind, np.array(values, dtype=np.bool_ if kind == KIND_BOOL else np.int64)
+
+def _concat_columns(chunks, total):
+    """
+    チャンク毎の列を連結する。チャンク間で列種別が異なる場合は
+    数値同士であれば float64、それ以外は object に揃える。
+    キーが出現する前のチャンクは None(数値列では NaN)で埋める。
+
+    引数
+        chunks      (開始位置, (列種別, 列データ)) のリスト
+        total       件数
+    戻り値
+        (列種別, 列データ) のタプル
+    """
+    kinds = set(kind for _, (kind, _) in chunks)
+    if len(kinds) == 1:
+        kind = kinds.pop()
+    elif KIND_OBJECT in kinds:
+        kind = KIND_OBJECT
+    else:
+        kind = KIND_FLOAT
+    covered = sum(len(column) for _, (_, column) in chunks)
+    if covered < total and kind in [KIND_BOOL, KIND_INT]:
+        kind = KIND_FLOAT
+    if kind == KIND_OBJECT:
+        result = np.empty(total, dtype=object)
+    elif kind == KIND_FLOAT:
+        result = np.full(total, np.nan, dtype=np.float64)
+    else:
+        result = np.empty(total, dtype=np.bool_ if kind == KIND_BOOL else np.int64)
+    for start, (_, column) in chunks:
+        result[start:start + len(column)] = column
+    return kind, result
+
+def _to_json_strings(values):
+    """
+    object 列を JSON 文字列の列に変換する。
+
+    引数
+        values      列データ(dtype=object)
+    戻り値
+        JSON文字列の列(np.ndarray, unicode)
+    """
+    return np.array([json.dumps(value) for value in values.tolist()], dtype=str)
+
+def _from_json_strings(values):
+    """
+    JSON 文字列の列を object 列に復元する。
+
+    引数
+        values      JSON文字列の列
+    戻り値
+        列データ(dtype=object)
+    """
+    return _object_column([json.loads(value) for value in values.tolist()])
+
+def _object_column(values):
+    """
+    値リストを dtype=object の列に変換する(リスト値を次元として展開しない)。
+
+    引数
+        values      値のリスト
+    戻り値
+        列データ(dtype=object)
+    """
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
@@ -4,24 +4,67 @@ Tubデータ上のオブジェクトをあらわすクラス群。
 part.pyが使用する。
 """
 import os
-import glob
 import json
 import time
+import threading
+import numpy as np
 
 try:
     import donkeycar as dk
 except ImportError:
     exit('This code requires donkeycar package.')
 
+# Tubインデックスファイル名
+INDEX_FILE_NAME = '.tub_index.npz'
+# Tubインデックスファイルのフォーマットバージョン
+INDEX_VERSION = 1
+# recordファイル名の接頭辞・接尾辞
+RECORD_PREFIX = 'record_'
+RECORD_SUFFIX = '.json'
+# イメージファイル名の接尾辞
+IMAGE_SUFFIX = '_cam-image_array_.jpg'
+
+# プロセス内で共有するTubsオブジェクト(キー：Tubディレクトリの絶対パス)
+_tubs_cache = {}
+_tubs_cache_lock = threading.Lock()
+
+def get_tubs(tub_dir):
+    """
+    プロセス内で共有されるTubsオブジェクトを取得する。
+    同一Tubディレクトリに対しては同一のTubsオブジェクトを返却し、
+    ディレクトリが更新されている場合はインデックスを差分更新する。
+
+    引数
+        tub_dir     Tubデータディレクトリのパス
+    戻り値
+        Tubsオブジェクト
+    例外
+        妥当性検査に不合格の場合
+    """
+    if tub_dir is None:
+        raise Exception('no tub_dir')
+    key = os.path.realpath(os.path.expanduser(tub_dir))
+    with _tubs_cache_lock:
+        tubs = _tubs_cache.get(key)
+        if tubs is None:
+            tubs = Tubs(tub_dir)
+            _tubs_cache[key] = tubs
+        else:
+            tubs.refresh()
+        return tubs
+
 class Tubs:
     """
     1つのインスタンスで1つのTubデータディレクトリをあらわすクラス。
     連番の昇順に送信データを生成するジェネレータとして機能する。
+    連番一覧はTubディレクトリ上のインデックスファイル(.tub_index.npz)に
+    ディレクトリ更新時刻・ファイル数とともに保存し、次回以降の生成時に再利用する。
     """
     def __init__(self, tub_dir):
         """
         引数指定先Tubデータディレクトリの妥当性を検査し、連番の昇順にファイルパスを
         ならべなおし、recordファイル、imageファイル別のリスト（インスタンス変数）へ格納する。
+        インデックスファイルが最新の場合はディレクトリを走査しない。
 
         引数
             tub_dir     Tubデータディレクトリのパス
@@ -37,42 +80,188 @@ class Tubs:
             raise Exception('{} is not exists'.format(self.tub_dir))
         if not os.path.isdir(self.tub_dir):
             raise Exception('{} is not a directory'.format(self.tub_dir))
-        
-        records = glob.glob(os.path.join(self.tub_dir, 'record_*.json'))
-        #print(records)
-        images = glob.glob(os.path.join(self.tub_dir, '*_cam-image_array_.jpg'))
-
-        record_dict = {}
-        for record in records:
-            cnt = int(record.rsplit('record_')[-1].rsplit('.json')[0])
-            record_dict[cnt] = record
-        
-        self.sorted_records = []
-        sorted_record_keys = sorted(list(record_dict.keys()))
-        for sorted_record_key in sorted_record_keys:
-            self.sorted_records.append(record_dict[sorted_record_key])
-        
-        image_dict = {}
-        for image in images:
-            cnt = int(os.path.basename(image).rsplit('_cam-image_array_.jpg')[0])
-            image_dict[cnt] = image
-        
-        self.sorted_images = []
-        sorted_image_keys = sorted(list(image_dict.keys()))
-        for sorted_image_key in sorted_image_keys:
-            self.sorted_images.append(image_dict[sorted_image_key])
-
-        if sorted_record_keys != sorted_image_keys:
+        self.index_path = os.path.join(self.tub_dir, INDEX_FILE_NAME)
+        self.numbers = np.zeros(0, dtype=np.int64)
+        self.mtime = -1
+        self.file_count = -1
+        self._sorted_records = None
+        self._sorted_images = None
+        if not self.load_index():
+            self.rebuild()
+        else:
+            self.refresh()
+
+    def load_index(self):
+        """
+        インデックスファイルを読み込み、インスタンス変数へ格納する。
+
+        引数
+            なし
+        戻り値
+            読み込めた場合真、インデックスファイルが存在しないか不正な場合偽
+        """
+        if not os.path.isfile(self.index_path):
+            return False
+        try:
+            with np.load(self.index_path) as index:
+                meta = index['meta']
+                if int(meta[0]) != INDEX_VERSION:
+                    return False
+                self.mtime = int(meta[1])
+                self.file_count = int(meta[2])
+                self._set_numbers(index['numbers'])
+        except Exception as e:
+            print('[Tubs] ignore broken index {}: {}'.format(self.index_path, str(e)))
+            return False
+        return True
+
+    def save_index(self):
+        """
+        インデックスファイルを書き出す。
+        ファイルの新規作成・置き換えはディレクトリ更新時刻を変えてしまうため、
+        初回のみ空ファイルを作成して更新時刻を取り直し、以降は既存ファイルへ
+        上書きする。書き込み権限がない場合は何もしない。
+
+        引数
+            なし
+        戻り値
+            なし
+        """
+        try:
+            if not os.path.exists(self.index_path):
+                open(self.index_path, 'ab').close()
+                self.mtime = os.stat(self.tub_dir).st_mtime_ns
+            meta = np.array([INDEX_VERSION, self.mtime, self.file_count], dtype=np.int64)
+            with open(self.index_path, 'wb') as f:
+                np.savez(f, meta=meta, numbers=self.numbers)
+        except OSError as e:
+            print('[Tubs] cannot write index {}: {}'.format(self.index_path, str(e)))
+
+    def refresh(self):
+        """
+        ディレクトリ更新時刻がインデックス作成時から変化している場合、
+        インデックスを更新する。最終連番の次から連続して追加された
+        recordのみであれば差分のみを追加し、それ以外(削除など)の場合は
+        インデックスを再作成する。
+
+        引数
+            なし
+        戻り値
+            なし
+        例外
+            record/イメージの連番が一致しない場合
+        """
+        mtime = os.stat(self.tub_dir).st_mtime_ns
+        if mtime == self.mtime:
+            return
+        file_count = self._count_files(os.listdir(self.tub_dir))
+        next_number = int(self.numbers[-1]) + 1 if len(self.numbers) > 0 else 0
+        appended = []
+        while os.path.isfile(self._record_path(next_number)) and \
+            os.path.isfile(self._image_path(next_number)):
+            appended.append(next_number)
+            next_number += 1
+        if file_count == self.file_count + 2 * len(appended):
+            if len(appended) > 0:
+                self._set_numbers(np.concatenate(
+                    [self.numbers, np.array(appended, dtype=np.int64)]))
+            self.mtime = mtime
+            self.file_count = file_count
+            self.save_index()
+        else:
+            self.rebuild()
+
+    def rebuild(self):
+        """
+        ディレクトリを走査しインデックスを再作成する。
+
+        引数
+            なし
+        戻り値
+            なし
+        例外
+            record/イメージの連番が一致しない場合
+        """
+        mtime = os.stat(self.tub_dir).st_mtime_ns
+        names = os.listdir(self.tub_dir)
+        record_keys = set()
+        image_keys = set()
+        for name in names:
+            if name.startswith(RECORD_PREFIX) and name.endswith(RECORD_SUFFIX):
+                try:
+                    record_keys.add(int(name[len(RECORD_PREFIX):-len(RECORD_SUFFIX)]))
+                except ValueError:
+                    pass
+            elif name.endswith(IMAGE_SUFFIX):
+                try:
+                    image_keys.add(int(name[:-len(IMAGE_SUFFIX)]))
+                except ValueError:
+                    pass
+
+        if record_keys != image_keys:
             raise Exception('unmatch magic numner no_records={}, no_images={}'.format(
-                str(sorted_record_keys - sorted_image_keys), str(sorted_image_keys - sorted_record_keys)
+                str(sorted(image_keys - record_keys)), str(sorted(record_keys - image_keys))
             ))
-    
+        self._set_numbers(np.array(sorted(record_keys), dtype=np.int64))
+        self.mtime = mtime
+        self.file_count = self._count_files(names)
+        self.save_index()
+
+    def _set_numbers(self, numbers):
+        """
+        連番一覧を更新し、パスリストのキャッシュを破棄する。
+
+        引数
+            numbers     連番一覧(np.ndarray, dtype=int64, 昇順)
+        戻り値
+            なし
+        """
+        self.numbers = np.asarray(numbers, dtype=np.int64)
+        self._sorted_records = None
+        self._sorted_images = None
+
+    def _count_files(self, names):
+        """
+        インデックスファイルを除いたファイル数を返却する。
+
+        引数
+            names       ディレクトリ上のファイル名リスト
+        戻り値
+            ファイル数
+        """
+        return len(names) - (1 if INDEX_FILE_NAME in names else 0)
+
+    def _record_path(self, number):
+        return os.path.join(self.tub_dir, '{}{}{}'.format(RECORD_PREFIX, number, RECORD_SUFFIX))
+
+    def _image_path(self, number):
+        return os.path.join(self.tub_dir, '{}{}'.format(number, IMAGE_SUFFIX))
+
+    @property
+    def sorted_records(self):
+        """
+        連番昇順のrecordファイルパスリスト(初回参照時に生成)。
+        """
+        if self._sorted_records is None:
+            self._sorted_records = [self._record_path(n) for n in self.numbers.tolist()]
+        return self._sorted_records
+
+    @property
+    def sorted_images(self):
+        """
+        連番昇順のイメージファイルパスリスト(初回参照時に生成)。
+        """
+        if self._sorted_images is None:
+            self._sorted_images = [self._image_path(n) for n in self.numbers.tolist()]
+        return self._sorted_images
+
     def total(self):
-        return len(self.sorted_records)
+        return len(self.numbers)
     
     def indexOf(self, index):
-        record = TubRecord(self.sorted_records[index]).get()
-        image = TubImage(self.sorted_images[index]).get()
+        number = int(self.numbers[index])
+        record = TubRecord(self._record_path(number)).get()
+        image = TubImage(self._image_path(number)).get()
         return record, image
 
 class Tub:
@@ -126,34 +315,7 @@ class TubRecord(Tub):
         戻り値
             送信用JSONデータ（辞書型）
         """
-        if 'pilot/angle' not in self.record:
-            self.record['pilot/angle'] = 0.0
-        if 'pilot/throttle' not in self.record:
-            if self.record['user/mode'] == 'local_angle':
-                self.record['pilot/throttle'] = 0.5
-            else:
-                self.record['pilot/throttle'] = 0.0
-
-        if self.record['user/mode'] == 'user':
-            if 'angle' not in self.record:
-                self.record['angle'] = self.record['user/angle']
-            if 'throttle' not in self.record:
-                self.record['throttle'] = self.record['user/throttle']
-        elif self.record['user/mode'] == 'local_angle':
-            if 'angle' not in self.record:
-                self.record['angle'] = self.record['pilot/angle']
-            if 'throttle' not in self.record:
-                self.record['throttle'] = self.record['user/throttle']
-        else:
-            if 'angle' not in self.record:
-                self.record['angle'] = self.record['pilot/angle']
-            if 'throttle' not in self.record:
-                self.record['throttle'] = self.record['pilot/throttle']
-
-        if use_timestamp and 'timestamp' not in self.record:
-            self.record['timestamp'] = float(time.time())
-
-        return self.record
+        return complete_record(self.record, use_timestamp)
 
 class TubImage(Tub):
     """
@@ -187,4 +349,42 @@ class TubImage(Tub):
         """
         return self.image_array
 
+def complete_record(record, use_timestamp=False):
+    """
+    送信用JSONデータとして不足しているキー(pilot/*、angle、throttle)を
+    運転モードに合わせて補完する。
+
+    引数
+        record          Tubデータ（辞書型）
+        use_timestamp   オリジナルのタイムスタンプを送信する：真、現在時刻を使用する：偽
+    戻り値
+        補完後のTubデータ（辞書型、引数recordと同一オブジェクト）
+    """
+    if 'pilot/angle' not in record:
+        record['pilot/angle'] = 0.0
+    if 'pilot/throttle' not in record:
+        if record['user/mode'] == 'local_angle':
+            record['pilot/throttle'] = 0.5
+        else:
+            record['pilot/throttle'] = 0.0
+
+    if record['user/mode'] == 'user':
+        if 'angle' not in record:
+            record['angle'] = record['user/angle']
+        if 'throttle' not in record:
+            record['throttle'] = record['user/throttle']
+    elif record['user/mode'] == 'local_angle':
+        if 'angle' not in record:
+            record['angle'] = record['pilot/angle']
+        if 'throttle' not in record:
+            record['throttle'] = record['user/throttle']
+    else:
+        if 'angle' not in record:
+            record['angle'] = record['pilot/angle']
+        if 'throttle' not in record:
+            record['throttle'] = record['pilot/throttle']
+
+    if use_timestamp and 'timestamp' not in record:
+        record['timestamp'] = float(time.time())
 
+    return record
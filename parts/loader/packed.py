@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+"""
+Tubデータを列指向の1ディレクトリ(packed tub)へまとめて格納・参照するクラス群。
+
+packed tub ディレクトリは以下のファイルで構成される。
+
+    packed_meta.json            列名・型・件数などのメタ情報
+    meta.json                   元Tubディレクトリのmeta.json(存在する場合のみコピー)
+    _number.npy                 連番(int64)
+    <キー>.npy                  スカラ値列(float64/int64/bool/文字列は辞書符号int32、
+                                float64列の欠損値はNaN)
+    <キー>.bin                  イメージ(JPEG)を連結したバイナリ
+    <キー>.offsets.npy          イメージバイナリのオフセット表(int64, 件数+1)
+
+キー中の'/'はファイル名では'__'に置き換える。
+すべての列・イメージは np.memmap で参照するため、読み込み時にコピーは発生しない。
+イメージはmemmap上のバイナリを MemoryviewFile 経由で直接デコードする。
+"""
+import io
+import os
+import json
+import shutil
+import threading
+import numpy as np
+from PIL import Image
+
+try:
+    import donkeycar as dk
+except ImportError:
+    exit('This code requires donkeycar package.')
+
+from .data import get_tubs, complete_record, RECORD_PREFIX, RECORD_SUFFIX
+
+# packed tub メタ情報ファイル名
+PACKED_META_FILE_NAME = 'packed_meta.json'
+# packed tub フォーマットバージョン(2: float列をfloat64・欠損値NaNで格納)
+PACKED_VERSION = 2
+# 読み込み可能なフォーマットバージョン(1 はfloat列がfloat32のため時刻列の精度が不足する)
+PACKED_READABLE_VERSIONS = [1, 2]
+# 変換時のデフォルト出力先ディレクトリ名の接尾辞
+PACKED_SUFFIX = '.packed'
+# 連番列名
+NUMBER_KEY = '_number'
+# メインカメラのイメージキー
+IMAGE_KEY = 'cam/image_array'
+# 前方カメラのイメージキー・格納サブディレクトリ名(parts.datastoreと同じ)
+FWD_IMAGE_KEY = 'fwd/image_array'
+FWD_IMAGE_DIR = 'fwd'
+
+# Tub meta.json の型名と列のdtypeの対応
+COLUMN_DTYPES = {
+    'float':    'float64',
+    'int':      'int64',
+    'boolean':  'bool',
+}
+
+# プロセス内で共有するPackedTubオブジェクト(キー：packed tubディレクトリの絶対パス)
+_packed_cache = {}
+_packed_cache_lock = threading.Lock()
+
+def is_packed_tub(path):
+    """
+    引数pathが packed tub ディレクトリかどうかを判別する。
+
+    引数
+        path    ディレクトリパス
+    戻り値
+        packed tub の場合真
+    """
+    if path is None:
+        return False
+    return os.path.isfile(os.path.join(os.path.expanduser(path), PACKED_META_FILE_NAME))
+
+def get_packed_tub(path):
+    """
+    プロセス内で共有されるPackedTubオブジェクトを取得する。
+
+    引数
+        path    packed tub ディレクトリのパス
+    戻り値
+        PackedTubオブジェクト
+    例外
+        packed tub ディレクトリではない場合
+    """
+    key = os.path.realpath(os.path.expanduser(path))
+    with _packed_cache_lock:
+        packed = _packed_cache.get(key)
+        if packed is None:
+            packed = PackedTub(path)
+            _packed_cache[key] = packed
+        return packed
+
+def key_to_file_name(key):
+    """
+    Tubデータキーを packed tub 内のファイル名(拡張子なし)に変換する。
+
+    引数
+        key     Tubデータキー(ex. 'user/angle')
+    戻り値
+        ファイル名(ex. 'user__angle')
+    """
+    return key.replace('/', '__')
+
+class PackedTub:
+    """
+    1つのインスタンスで1つの packed tub ディレクトリをあらわすクラス。
+    parts.loader.data.Tubs と同じ total()/indexOf() を提供するため、
+    Loaderからそのまま使用できる。
+    """
+    def __init__(self, path):
+        """
+        メタ情報を読み込み、各列・イメージバイナリをmemmapで開く。
+
+        引数
+            path    packed tub ディレクトリのパス
+        戻り値
+            なし
+        例外
+            packed tub ディレクトリではない場合、バージョンが異なる場合
+        """
+        if path is None:
+            raise Exception('no packed tub path')
+        self.path = os.path.expanduser(path)
+        meta_path = os.path.join(self.path, PACKED_META_FILE_NAME)
+        if not os.path.isfile(meta_path):
+            raise Exception('{} is not a packed tub'.format(self.path))
+        with open(meta_path, 'r') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') not in PACKED_READABLE_VERSIONS:
+            raise Exception('unsupported packed tub version={}'.format(
+                str(self.meta.get('version'))))
+        if self.meta.get('version') != PACKED_VERSION:
+            print('[PackedTub] {} stores float columns as float32, repack it to keep timestamps'.format(
+                self.path))
+        self.count = int(self.meta['count'])
+        self.columns = {}
+        for key in list(self.meta['columns'].keys()) + [NUMBER_KEY]:
+            self.columns[key] = self._load_array(key_to_file_name(key) + '.npy')
+        self.categories = {}
+        for key, values in self.meta.get('categories', {}).items():
+            self.categories[key] = np.array(values, dtype=object)
+        self.blobs = {}
+        self.offsets = {}
+        for key in self.meta['images']:
+            name = key_to_file_name(key)
+            self.offsets[key] = self._load_array(name + '.offsets.npy')
+            blob_path = os.path.join(self.path, name + '.bin')
+            if os.path.getsize(blob_path) > 0:
+                self.blobs[key] = np.memmap(blob_path, dtype=np.uint8, mode='r')
+            else:
+                self.blobs[key] = np.zeros(0, dtype=np.uint8)
+
+    def _load_array(self, file_name):
+        """
+        npyファイルをmemmapで開く。
+
+        引数
+            file_name   packed tub ディレクトリ内のファイル名
+        戻り値
+            np.memmap オブジェクト
+        """
+        return np.load(os.path.join(self.path, file_name), mmap_mode='r')
+
+    def total(self):
+        return self.count
+
+    def keys(self):
+        """
+        スカラ値列・イメージのキー一覧を返却する。
+
+        引数
+            なし
+        戻り値
+            キーのリスト(スカラ値列、イメージの順)
+        """
+        return list(self.meta['columns'].keys()) + \
+            [key for key in self.meta['images'] if key not in self.meta['columns']]
+
+    def image_keys(self):
+        """
+        イメージのキー一覧を返却する。
+
+        引数
+            なし
+        戻り値
+            キーのリスト
+        """
+        return list(self.meta['images'])
+
+    def numbers(self):
+        """
+        元Tubデータの連番列を返却する。
+
+        引数
+            なし
+        戻り値
+            連番(np.memmap, dtype=int64)
+        """
+        return self.columns[NUMBER_KEY]
+
+    def column(self, key):
+        """
+        列を返却する。数値列はmemmapをそのまま返却し、
+        文字列列は辞書符号から文字列配列へ復元する(コピーが発生する)。
+        イメージキーの場合は image_column() の全件分を返却する。
+
+        引数
+            key     Tubデータキー
+        戻り値
+            列データ(np.ndarray)
+        例外
+            KeyError    存在しないキーの場合
+        """
+        if key in self.offsets and key not in self.columns:
+            return self.image_column(key)
+        values = self.columns[key]
+        if key in self.categories:
+            return self.categories[key][values]
+        return values
+
+    def image_bytes(self, index, key=IMAGE_KEY):
+        """
+        index番目のイメージ(JPEG)バイナリをコピーせずに返却する。
+
+        引数
+            index   先頭からの位置(連番ではない)
+            key     イメージキー
+        戻り値
+            JPEGバイナリ(memoryview)
+        """
+        offsets = self.offsets[key]
+        return memoryview(self.blobs[key][int(offsets[index]):int(offsets[index + 1])])
+
+    def image_column(self, key=IMAGE_KEY, start=0, end=None):
+        """
+        指定範囲のイメージ(JPEG)バイナリを列として返却する。
+        各要素は image_bytes() の戻り値(memoryview)で、イメージがない場合は None とする。
+
+        引数
+            key     イメージキー
+            start   開始位置
+            end     終了位置(この位置を含まない、None の場合末尾)
+        戻り値
+            列データ(np.ndarray, dtype=object)
+        例外
+            KeyError    存在しないキーの場合
+        """
+        offsets = self.offsets[key]
+        end = self.count if end is None else min(end, self.count)
+        values = np.empty(max(end - start, 0), dtype=object)
+        for i, index in enumerate(range(start, end)):
+            if offsets[index + 1] > offsets[index]:
+                values[i] = self.image_bytes(index, key)
+        return values
+
+    def image_file(self, index, key=IMAGE_KEY):
+        """
+        index番目のイメージ(JPEG)バイナリを読み込むファイルオブジェクトを返却する。
+        PIL.Image.open などへそのまま渡すことができる。
+
+        引数
+            index   先頭からの位置(連番ではない)
+            key     イメージキー
+        戻り値
+            MemoryviewFile オブジェクト
+        """
+        return MemoryviewFile(self.image_bytes(index, key))
+
+    def image(self, index, key=IMAGE_KEY):
+        """
+        index番目のイメージをデコードして返却する。
+        JPEGバイナリを bytes へコピーせず、memmap上から直接デコードする。
+
+        引数
+            index   先頭からの位置(連番ではない)
+            key     イメージキー
+        戻り値
+            イメージデータ(np.ndarray, dtype=uint8, shape=(120,160,3))
+        """
+        img = Image.open(self.image_file(index, key))
+        return dk.utils.img_to_arr(img)
+
+    def get_record(self, index):
+        """
+        index番目のスカラ値を辞書型で返却する。
+
+        引数
+            index   先頭からの位置(連番ではない)
+        戻り値
+            Tubデータ(辞書型、イメージを除く)
+        """
+        record = {}
+        for key in self.meta['columns'].keys():
+            value = self.columns[key][index]
+            if key in self.categories:
+                record[key] = self.categories[key][value]
+            else:
+                record[key] = value.item()
+        return record
+
+    def indexOf(self, index):
+        record = complete_record(self.get_record(index))
+        image = self.image(index)
+        return record, image
+
+    def to_dataframe(self):
+        """
+        スカラ値列を pandas.DataFrame に変換する。
+        インデックスには元Tubデータの連番を使用する。
+
+        引数
+            なし
+        戻り値
+            pandas.DataFrame オブジェクト
+        """
+        import pandas as pd
+        data = {}
+        for key in self.meta['columns'].keys():
+            data[key] = self.column(key)
+        return pd.DataFrame(data, index=np.asarray(self.numbers()))
+
+class MemoryviewFile(io.RawIOBase):
+    """
+    memoryview を読み取り専用のファイルオブジェクトとして扱うクラス。
+    io.BytesIO と異なり生成時にバッファ全体をコピーしない。
+    """
+    def __init__(self, view):
+        """
+        読み込み位置を先頭に初期化する。
+
+        引数
+            view    memoryview オブジェクト
+        戻り値
+            なし
+        """
+        super().__init__()
+        self.view = view.cast('B') if view.format != 'B' else view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(int(offset), 0)
+        return self.position
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.position + size, len(self.view))
+        data = self.view[self.position:end].tobytes() if end > self.position else b''
+        self.position = max(self.position, end)
+        return data
+
+    def readinto(self, buffer):
+        size = max(min(len(buffer), len(self.view) - self.position), 0)
+        buffer[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+def pack_tub(tub_dir, packed_dir=None, overwrite=False, debug=False):
+    """
+    既存のTubディレクトリを packed tub ディレクトリへ変換する。
+    列の型は元Tubディレクトリの meta.json の types から決定し、
+    meta.json がない場合は先頭recordの値から推定する。
+
+    引数
+        tub_dir     変換元Tubディレクトリのパス
+        packed_dir  出力先ディレクトリのパス(Noneの場合tub_dirに'.packed'を付与)
+        overwrite   出力先が存在する場合上書きする：真
+        debug       デバッグフラグ
+    戻り値
+        出力先ディレクトリのパス
+    例外
+        出力先が存在しoverwriteが偽の場合、元Tubディレクトリが不正な場合
+    """
+    tubs = get_tubs(tub_dir)
+    tub_dir = tubs.tub_dir
+    if packed_dir is None:
+        packed_dir = os.path.normpath(tub_dir) + PACKED_SUFFIX
+    writer = PackedTubWriter(packed_dir, _load_types(tub_dir, tubs),
+        source=tub_dir, overwrite=overwrite)
+    try:
+        for number in tubs.numbers.tolist():
+            record_path = os.path.join(tub_dir, '{}{}{}'.format(RECORD_PREFIX, number, RECORD_SUFFIX))
+            with open(record_path, 'r') as f:
+                record = json.load(f)
+            writer.append(number, record, {key: _read_image(tub_dir, key, record.get(key), number)
+                for key in writer.image_keys})
+            if debug and number % 1000 == 0:
+                print('[pack_tub] packed record {}'.format(str(number)))
+    finally:
+        writer.close_files()
+    writer.close(os.path.join(tub_dir, 'meta.json'))
+    if debug:
+        print('[pack_tub] packed {} records into {}'.format(str(writer.total()), writer.packed_dir))
+    return writer.packed_dir
+
+class PackedTubWriter:
+    """
+    record とイメージ(JPEG)を1件ずつ受け取り、packed tub ディレクトリを作成するクラス。
+    イメージは受け取った時点でバイナリファイルへ追記し、スカラ値は close() 時に列へ変換する。
+    """
+    def __init__(self, packed_dir, types, source=None, overwrite=False):
+        """
+        出力先ディレクトリを作成し、イメージバイナリファイルを開く。
+
+        引数
+            packed_dir  出力先ディレクトリのパス
+            types       Tubデータキーと型名の辞書
+            source      元データのパス(メタ情報に記録する)
+            overwrite   出力先が存在する場合上書きする：真
+        戻り値
+            なし
+        例外
+            出力先が存在しoverwriteが偽の場合
+        """
+        packed_dir = os.path.expanduser(packed_dir)
+        if os.path.exists(packed_dir):
+            if not overwrite:
+                raise Exception('{} already exists'.format(packed_dir))
+            shutil.rmtree(packed_dir)
+        os.makedirs(packed_dir)
+        self.packed_dir = packed_dir
+        self.source = None if source is None else os.path.abspath(source)
+        self.types = types
+        self.scalar_keys = [key for key, typ in types.items() if typ in COLUMN_DTYPES or typ == 'str']
+        self.image_keys = [key for key, typ in types.items() if typ == 'image_array']
+        if IMAGE_KEY not in self.image_keys:
+            self.image_keys.insert(0, IMAGE_KEY)
+        self.numbers = []
+        self.values = {key: [] for key in self.scalar_keys}
+        self.blob_files = {}
+        self.offsets = {}
+        for key in self.image_keys:
+            self.blob_files[key] = open(os.path.join(packed_dir, key_to_file_name(key) + '.bin'), 'wb')
+            self.offsets[key] = [0]
+
+    def total(self):
+        return len(self.numbers)
+
+    def append(self, number, record, images):
+        """
+        1件分の record とイメージを追加する。
+
+        引数
+            number      連番
+            record      Tubデータ(辞書型)
+            images      イメージキーとJPEGバイナリの辞書(存在しないキーは空とする)
+        戻り値
+            なし
+        """
+        self.numbers.append(number)
+        for key in self.scalar_keys:
+            self.values[key].append(record.get(key))
+        for key in self.image_keys:
+            binary = images.get(key) or b''
+            self.blob_files[key].write(binary)
+            self.offsets[key].append(self.offsets[key][-1] + len(binary))
+
+    def close_files(self):
+        """
+        イメージバイナリファイルを閉じる。
+
+        引数
+            なし
+        戻り値
+            なし
+        """
+        for blob_file in self.blob_files.values():
+            blob_file.close()
+
+    def close(self, tub_meta_path=None):
+        """
+        スカラ値を列へ変換して保存し、メタ情報を書き出す。
+
+        引数
+            tub_meta_path   コピーする元Tubの meta.json のパス(None の場合コピーしない)
+        戻り値
+            出力先ディレクトリのパス
+        """
+        self.close_files()
+        columns = {}
+        categories = {}
+        for key in self.scalar_keys:
+            typ = self.types[key]
+            values = self.values[key]
+            if typ == 'str':
+                labels = sorted(set(str(v) for v in values if v is not None))
+                lookup = {label: i for i, label in enumerate(labels)}
+                # Noneは末尾のカテゴリ(None)へ割り当てる
+                labels.append(None)
+                arr = np.array([lookup.get(str(v), len(labels) - 1) if v is not None else len(labels) - 1
+                    for v in values], dtype=np.int32)
+                categories[key] = labels
+                columns[key] = 'int32'
+            else:
+                dtype = COLUMN_DTYPES[typ]
+                # 欠損値は float列ではNaN(parts.loader.columns と同じ)、それ以外は0とする
+                missing = np.nan if typ == 'float' else 0
+                arr = np.array([missing if v is None else v for v in values], dtype=dtype)
+                columns[key] = dtype
+            np.save(os.path.join(self.packed_dir, key_to_file_name(key) + '.npy'), arr)
+        np.save(os.path.join(self.packed_dir, NUMBER_KEY + '.npy'),
+            np.array(self.numbers, dtype=np.int64))
+        for key in self.image_keys:
+            np.save(os.path.join(self.packed_dir, key_to_file_name(key) + '.offsets.npy'),
+                np.array(self.offsets[key], dtype=np.int64))
+
+        if tub_meta_path is not None and os.path.isfile(tub_meta_path):
+            shutil.copy(tub_meta_path, os.path.join(self.packed_dir, 'meta.json'))
+        meta = {
+            'version':      PACKED_VERSION,
+            'source':       self.source,
+            'count':        self.total(),
+            'columns':      columns,
+            'types':        {key: self.types[key] for key in self.scalar_keys},
+            'categories':   categories,
+            'images':       self.image_keys,
+        }
+        with open(os.path.join(self.packed_dir, PACKED_META_FILE_NAME), 'w') as f:
+            json.dump(meta, f)
+        return self.packed_dir
+
+def _load_types(tub_dir, tubs):
+    """
+    Tubデータキーと型名の対応辞書を作成する。
+
+    引数
+        tub_dir     Tubディレクトリのパス
+        tubs        Tubsオブジェクト
+    戻り値
+        キーと型名の辞書
+    """
+    meta_path = os.path.join(tub_dir, 'meta.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        types = dict(zip(meta.get('inputs', []), meta.get('types', [])))
+        if len(types) > 0:
+            return types
+    if tubs.total() <= 0:
+        return {}
+    with open(tubs.sorted_records[0], 'r') as f:
+        record = json.load(f)
+    return infer_types(record)
+
+def infer_types(record):
+    """
+    recordの値からTubデータキーと型名の対応辞書を推定する。
+    NumPy のスカラ値(np.float32 など)は対応するPythonの型として扱う。
+
+    引数
+        record      Tubデータ(辞書型)
+    戻り値
+        キーと型名の辞書
+    """
+    types = {}
+    for key, value in record.items():
+        if isinstance(value, np.generic):
+            value = value.item()
+        if key.endswith('image_array'):
+            types[key] = 'image_array'
+        elif isinstance(value, bool):
+            types[key] = 'boolean'
+        elif isinstance(value, int):
+            types[key] = 'int'
+        elif isinstance(value, float):
+            types[key] = 'float'
+        elif isinstance(value, str):
+            types[key] = 'str'
+    return types
+
+def _read_image(tub_dir, key, name, number):
+    """
+    recordに記録されたイメージファイルを読み込む。
+    前方カメライメージは parts.datastore.Tub と同じく fwd サブディレクトリから読み込む。
+
+    引数
+        tub_dir     Tubディレクトリのパス
+        key         イメージキー
+        name        recordに記録されたイメージファイル名
+        number      連番
+    戻り値
+        JPEGバイナリ(存在しない場合は空バイト列)
+    """
+    if name is None:
+        name = '{}_{}_.jpg'.format(number, key.replace('/', '-'))
+    if key == FWD_IMAGE_KEY:
+        path = os.path.join(tub_dir, FWD_IMAGE_DIR, name.replace(FWD_IMAGE_DIR, 'cam', 1))
+    else:
+        path = os.path.join(tub_dir, name)
+    if not os.path.isfile(path):
+        return b''
+    with open(path, 'rb') as f:
+        return f.read()
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+"""
+Tubデータを再生する複数のLoader間で共有する再生ソースを提供する。
+先読みスレッドが次の read_ahead 件の record/イメージを読み込み・デコードし、
+同じ位置を要求したLoaderには同じデコード結果を返却する。
+
+キャッシュディレクトリを指定した場合、デコード済みイメージを np.memmap の
+npyファイル、recordをJSONファイルに保存し、2周目以降(および次回起動時)は
+デコードせずにキャッシュから返却する。
+
+キャッシュディレクトリは以下のファイルで構成される。
+
+    replay_meta.json            件数・イメージ形状・元Tubディレクトリなどのメタ情報
+    images.npy                  デコード済みイメージ(uint8, 件数 x 高さ x 幅 x チャネル)
+    filled.npy                  キャッシュ済みフラグ(bool, 件数)
+    records.json                record(辞書型)のリスト
+"""
+import os
+import json
+import threading
+import numpy as np
+
+from .data import get_tubs
+from .packed import is_packed_tub, get_packed_tub
+
+# キャッシュメタ情報ファイル名
+REPLAY_META_FILE_NAME = 'replay_meta.json'
+# キャッシュフォーマットバージョン
+REPLAY_VERSION = 1
+# デフォルトキャッシュディレクトリ名の接尾辞
+REPLAY_SUFFIX = '.replay'
+
+# プロセス内で共有するReplaySourceオブジェクト
+# (キー：(Tubディレクトリの絶対パス, repeat, read_ahead, キャッシュディレクトリ))
+_source_cache = {}
+_source_cache_lock = threading.Lock()
+
+def default_cache_dir(tub_dir):
+    """
+    Tubディレクトリに対するデフォルトのキャッシュディレクトリパスを返却する。
+
+    引数
+        tub_dir     Tubデータディレクトリのパス
+    戻り値
+        キャッシュディレクトリパス(ex. data/tub_1_20-01-01.replay)
+    """
+    return os.path.expanduser(tub_dir).rstrip(os.sep) + REPLAY_SUFFIX
+
+def get_replay_source(tub_dir, repeat=False, read_ahead=8, cache_dir=None, debug=False):
+    """
+    プロセス内で共有される ReplaySource オブジェクトを取得する。
+    同一引数に対しては同一のオブジェクトを返却する。
+
+    引数
+        tub_dir     Tubデータディレクトリ(packed tub 可)のパス
+        repeat      末尾の次を先頭とする場合真
+        read_ahead  先読み件数(0の場合は先読みしない)
+        cache_dir   デコード済みキャッシュディレクトリ(None の場合キャッシュしない)
+        debug       デバッグフラグ
+    戻り値
+        ReplaySource オブジェクト
+    """
+    key = (os.path.realpath(os.path.expanduser(tub_dir)), repeat, read_ahead,
+        None if cache_dir is None else os.path.realpath(os.path.expanduser(cache_dir)))
+    with _source_cache_lock:
+        source = _source_cache.get(key)
+        if source is None or not source.on:
+            if is_packed_tub(tub_dir):
+                tubs = get_packed_tub(tub_dir)
+            else:
+                tubs = get_tubs(tub_dir)
+            cache = None
+            if cache_dir is not None:
+                cache = ReplayCache(cache_dir, tub_dir, tubs.total(), debug=debug)
+            source = ReplaySource(tubs, repeat=repeat, read_ahead=read_ahead,
+                cache=cache, debug=debug)
+            _source_cache[key] = source
+        return source
+
+class ReplaySource:
+    """
+    再生位置(0から単調増加する通し番号)ごとに record/イメージを返却するクラス。
+    repeat が真の場合、再生位置を件数で割った余りの位置のデータを返却する。
+    """
+    def __init__(self, tubs, repeat=False, read_ahead=8, cache=None, debug=False):
+        """
+        先読みスレッドを開始する。
+
+        引数
+            tubs        Tubs/PackedTub オブジェクト
+            repeat      末尾の次を先頭とする場合真
+            read_ahead  先読み件数(0の場合は先読みせず get() 呼び出し時に読み込む)
+            cache       ReplayCache オブジェクト(None の場合キャッシュしない)
+            debug       デバッグフラグ
+        戻り値
+            なし
+        """
+        self.tubs = tubs
+        self.count = tubs.total()
+        self.repeat = repeat
+        self.read_ahead = read_ahead
+        self.cache = cache
+        self.debug = debug
+        self.condition = threading.Condition()
+        self.frames = {}
+        self.requested = 0
+        self.next_position = 0
+        self.loading = None
+        self.on = True
+        self.thread = None
+        if read_ahead > 0:
+            self.thread = threading.Thread(target=self.update, daemon=True)
+            self.thread.start()
+
+    def total(self):
+        return self.count
+
+    def get(self, position):
+        """
+        再生位置のデータを返却する。先読み済みでない場合は読み込みを待つ。
+
+        引数
+            position    再生位置
+        戻り値
+            record      Tubデータ(辞書型)
+            image       イメージデータ(np.ndarray)
+        """
+        with self.condition:
+            if position + 1 > self.requested:
+                self.requested = position + 1
+                self.condition.notify_all()
+            if self.thread is not None:
+                # 未読み込み、または先読みスレッドが読み込み中の場合は待つ
+                self.condition.wait_for(lambda: position in self.frames or not self.on or \
+                    (position < self.next_position and position != self.loading))
+            frame = self.frames.get(position)
+            # 要求済み位置より read_ahead 件以上前のデータは破棄する
+            for old in [p for p in self.frames if p < self.requested - 1 - self.read_ahead]:
+                del self.frames[old]
+        if frame is None:
+            frame = self.load(position)
+        return frame
+
+    def update(self):
+        """
+        要求済み位置の read_ahead 件先までを順に読み込む(スレッド処理)。
+
+        引数
+            なし
+        戻り値
+            なし
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.on or (
+                    self.next_position < self.requested + self.read_ahead and
+                    (self.repeat or self.next_position < self.count)))
+                if not self.on:
+                    break
+                position = self.next_position
+                self.next_position += 1
+                self.loading = position
+            try:
+                frame = self.load(position)
+            except Exception as e:
+                # 読み込みに失敗した位置は get() 呼び出し元で再度読み込み、例外を通知する
+                print('[ReplaySource] failed to load position={}: {}'.format(str(position), str(e)))
+                frame = None
+            with self.condition:
+                self.frames[position] = frame
+                self.loading = None
+                self.condition.notify_all()
+
+    def load(self, position):
+        """
+        再生位置のデータをキャッシュまたはTubから読み込む。
+
+        引数
+            position    再生位置
+        戻り値
+            record      Tubデータ(辞書型)
+            image       イメージデータ(np.ndarray)
+        """
+        index = position % self.count
+        if self.cache is not None:
+            frame = self.cache.get(index)
+            if frame is not None:
+                return frame
+        record, image = self.tubs.indexOf(index)
+        if self.cache is not None:
+            self.cache.put(index, record, image)
+        return record, image
+
+    def shutdown(self):
+        """
+        先読みスレッドを停止し、キャッシュを書き出す。
+
+        引数
+            なし
+        戻り値
+            なし
+        """
+        with self.condition:
+            if not self.on:
+                return
+            self.on = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(1.0)
+        if self.cache is not None:
+            self.cache.flush()
+        self.frames = {}
+        if self.debug:
+            print('[ReplaySource] shutdown requested={}'.format(str(self.requested)))
+
+class ReplayCache:
+    """
+    デコード済みイメージと record をキャッシュディレクトリに保持するクラス。
+    イメージは初回 put() 時のイメージ形状で np.memmap の npy ファイルを作成する。
+    """
+    def __init__(self, cache_dir, tub_dir, count, debug=False):
+        """
+        キャッシュディレクトリが同じTubディレクトリ・件数のものであれば開き、
+        そうでなければ空のキャッシュとして扱う。
+
+        引数
+            cache_dir   キャッシュディレクトリのパス
+            tub_dir     元Tubデータディレクトリのパス
+            count       Tubデータ件数
+            debug       デバッグフラグ
+        戻り値
+            なし
+        """
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.tub_dir = os.path.realpath(os.path.expanduser(tub_dir))
+        self.count = count
+        self.debug = debug
+        self.lock = threading.Lock()
+        self.images = None
+        self.filled = np.zeros(count, dtype=bool)
+        self.records = [None] * count
+        self.dirty = False
+        self.disabled = False
+        self.load()
+
+    def _path(self, file_name):
+        return os.path.join(self.cache_dir, file_name)
+
+    def load(self):
+        """
+        既存のキャッシュを開く。メタ情報が一致しない場合は何もしない。
+
+        引数
+            なし
+        戻り値
+            なし
+        """
+        meta_path = self._path(REPLAY_META_FILE_NAME)
+        if not os.path.isfile(meta_path):
+            return
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            if meta.get('version') != REPLAY_VERSION or meta.get('count') != self.count or \
+                meta.get('tub_dir') != self.tub_dir:
+                if self.debug:
+                    print('[ReplayCache] ignore stale cache {}'.format(self.cache_dir))
+                return
+            images = np.load(self._path('images.npy'), mmap_mode='r+')
+            filled = np.load(self._path('filled.npy'))
+            with open(self._path('records.json'), 'r') as f:
+                records = json.load(f)
+            if len(images) != self.count or len(filled) != self.count or len(records) != self.count:
+                return
+        except (OSError, ValueError, KeyError) as e:
+            print('[ReplayCache] ignore broken cache {}: {}'.format(self.cache_dir, str(e)))
+            return
+        self.images = images
+        self.filled = filled
+        self.records = records
+        if self.debug:
+            print('[ReplayCache] open {} cached={}/{}'.format(
+                self.cache_dir, str(int(np.sum(filled))), str(self.count)))
+
+    def get(self, index):
+        """
+        キャッシュ済みの場合 record とイメージ(memmap上のビュー)を返却する。
+
+        引数
+            index   先頭からの位置
+        戻り値
+            (record, image) のタプル、キャッシュされていない場合 None
+        """
+        if not self.filled[index]:
+            return None
+        return dict(self.records[index]), self.images[index]
+
+    def put(self, index, record, image):
+        """
+        record とイメージをキャッシュする。イメージ形状が異なる場合、
+        キャッシュファイルを作成できない場合はキャッシュを無効にする。
+
+        引数
+            index   先頭からの位置
+            record  Tubデータ(辞書型)
+            image   イメージデータ(np.ndarray)
+        戻り値
+            なし
+        """
+        with self.lock:
+            if self.disabled:
+                return
+            image = np.asarray(image)
+            if self.images is None:
+                try:
+                    os.makedirs(self.cache_dir, exist_ok=True)
+                    self.images = np.lib.format.open_memmap(self._path('images.npy'),
+                        mode='w+', dtype=np.uint8, shape=(self.count,) + image.shape)
+                except OSError as e:
+                    print('[ReplayCache] disable cache {}: {}'.format(self.cache_dir, str(e)))
+                    self.disabled = True
+                    return
+            if self.images.shape[1:] != image.shape:
+                print('[ReplayCache] disable cache because image shape {} != {}'.format(
+                    str(image.shape), str(self.images.shape[1:])))
+                self.disabled = True
+                return
+            self.images[index] = image
+            self.records[index] = {key: _to_json_value(value) for key, value in record.items()}
+            self.filled[index] = True
+            self.dirty = True
+            complete = bool(self.filled.all())
+        if complete:
+            # 全件そろった時点で保存し、次回起動時から再利用できるようにする
+            self.flush()
+
+    def flush(self):
+        """
+        イメージを書き出し、record・キャッシュ済みフラグ・メタ情報を保存する。
+
+        引数
+            なし
+        戻り値
+            なし
+        """
+        with self.lock:
+            if self.images is None or not self.dirty or self.disabled:
+                return
+            try:
+                self.images.flush()
+                with open(self._path('records.json'), 'w') as f:
+                    json.dump(self.records, f)
+                np.save(self._path('filled.npy'), self.filled)
+                with open(self._path(REPLAY_META_FILE_NAME), 'w') as f:
+                    json.dump({
+                        'version':  REPLAY_VERSION,
+                        'count':    self.count,
+                        'shape':    list(self.images.shape[1:]),
+                        'tub_dir':  self.tub_dir,
+                    }, f)
+            except OSError as e:
+                print('[ReplayCache] cannot write cache {}: {}'.format(self.cache_dir, str(e)))
+                return
+            self.dirty = False
+            if self.debug:
+                print('[ReplayCache] flush {} cached={}/{}'.format(
+                    self.cache_dir, str(int(np.sum(self.filled))), str(self.count)))
+
+def _to_json_value(value):
+    """
+    NumPy のスカラ値をJSONに保存できる値に変換する。
+
+    引数
+        value   値
+    戻り値
+        変換後の値
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
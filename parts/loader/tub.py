@@ -6,22 +6,40 @@ Tubディレクトリ上のTubデータを連番の昇順にVehicleフレーム
 表示する Donkey パーツ TubPrinter を提供する。
 """
 import time
-from .data import Tubs
+from .data import get_tubs
+from .packed import is_packed_tub, get_packed_tub
+from .replay import get_replay_source
 
 class Loader:
-    def __init__(self, tub_dir, repeat=False):
+    def __init__(self, tub_dir, repeat=False, read_ahead=0, cache_dir=None, debug=False):
         """
-        Tubデータを連番昇順に取得するTubsオブジェクトを生成し、
+        Tubデータを連番昇順に取得するTubsオブジェクトを取得し、
         インスタンス変数へ格納する。
+        Tubsオブジェクトは同一プロセス内の他のLoaderと共有される。
+        tub_dirが packed tub ディレクトリの場合は PackedTub を使用する。
+        read_ahead、cache_dir のいずれかを指定した場合は、同じ引数の他のLoaderと
+        ReplaySource を共有し、1件につき1回だけ読み込み・デコードする。
 
         引数
             tub_dir         Tubデータディレクトリのパス
+            repeat          末尾まで読み込んだら先頭から繰り返す場合真
+            read_ahead      先読みスレッドでデコードしておく件数(0の場合先読みしない)
+            cache_dir       デコード済みデータのキャッシュディレクトリ(None の場合キャッシュしない)
+            debug           デバッグフラグ
         戻り値
             なし
         例外
             Tubディレクトリパスの妥当性検査に不合格の場合
         """
-        self.tubs = Tubs(tub_dir)
+        self.source = None
+        if read_ahead > 0 or cache_dir is not None:
+            self.source = get_replay_source(tub_dir, repeat=repeat,
+                read_ahead=read_ahead, cache_dir=cache_dir, debug=debug)
+            self.tubs = self.source
+        elif is_packed_tub(tub_dir):
+            self.tubs = get_packed_tub(tub_dir)
+        else:
+            self.tubs = get_tubs(tub_dir)
         if self.tubs.total() <= 0:
             exit('No data in {}'.format(tub_dir))
         #print(tub_dir)
@@ -50,8 +68,14 @@ class Loader:
         total = self.tubs.total()
         #print(total)
         #print(self.index)
-        if self.index < total:
-            r, i = self.tubs.indexOf(self.index)
+        if self.index >= total and self.repeat and self.source is None:
+            self.index = 0
+        if self.index < total or self.repeat:
+            if self.source is None:
+                r, i = self.tubs.indexOf(self.index)
+            else:
+                # ReplaySource は通し番号で管理する(repeat時は件数で割った余りの位置を返却)
+                r, i = self.source.get(self.index)
             user_mode = r.get('user/mode', 'user')
             user_angle = r.get('user/angle', 0.0)
             user_throttle = r.get('user/throttle', 0.0)
@@ -63,13 +87,13 @@ class Loader:
             self.index += 1
             return i, user_mode, user_angle, user_throttle, user_lift_throttle, \
                 pilot_angle, pilot_throttle, pilot_lift_throttle, timestamp
-        elif self.index >= total and self.repeat:
-            self.index = 0
-            return self.run()
         else:
             raise StopIteration()
     
     def shutdown(self):
+        if self.source is not None:
+            self.source.shutdown()
+        self.source = None
         self.tubs = None
         self.index = 0
         self.repeat = False
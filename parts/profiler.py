@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Vehicleループ上の各パーツの処理時間を計測するクラス群。
+manage.drive で Vehicle へ追加済みのパーツを ProfiledPart でラップし、
+run/run_threaded の処理時間をパーツ別のヒストグラムに記録する。
+停止時に p50/p95/p99・ループ周期超過回数を表示し、必要に応じてJSONファイルへ保存する。
+"""
+import json
+import time
+import threading
+import numpy as np
+
+# ヒストグラムのビン境界(秒)：0.05ミリ秒～10秒を対数で約5%刻み
+LATENCY_BOUNDS = np.logspace(np.log10(0.00005), 1.0, 256)
+
+class LatencyHistogram:
+    """
+    処理時間(秒)を対数ビンのヒストグラムに記録するクラス。
+    パーセンタイルはビンの上端値で返却する(誤差はビン幅の約5%)。
+    """
+    def __init__(self, period=None):
+        """
+        カウンタを初期化する。
+        引数：
+            period      ループ周期(秒)、None の場合は周期超過を数えない
+        戻り値：
+            なし
+        """
+        self.period = period
+        self.counts = np.zeros(len(LATENCY_BOUNDS) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.overruns = 0
+
+    def add(self, latency):
+        """
+        処理時間を1件記録する。
+        引数：
+            latency     処理時間(秒)
+        戻り値：
+            なし
+        """
+        self.counts[int(np.searchsorted(LATENCY_BOUNDS, latency))] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+        if self.period is not None and latency > self.period:
+            self.overruns += 1
+
+    def percentile(self, q):
+        """
+        パーセンタイル値を返却する。
+        引数：
+            q           パーセント(0-100)
+        戻り値：
+            処理時間(秒)、未記録の場合 0.0
+        """
+        if self.count == 0:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count * q / 100.0))
+        if index >= len(LATENCY_BOUNDS):
+            return self.max
+        return min(float(LATENCY_BOUNDS[index]), self.max)
+
+    def summary(self):
+        """
+        集計値を辞書型で返却する(時間はミリ秒)。
+        引数：
+            なし
+        戻り値：
+            辞書(count, mean, p50, p95, p99, max, overruns, overrun_rate)
+        """
+        return {
+            'count':        self.count,
+            'mean':         1000.0 * self.total / self.count if self.count > 0 else 0.0,
+            'p50':          1000.0 * self.percentile(50),
+            'p95':          1000.0 * self.percentile(95),
+            'p99':          1000.0 * self.percentile(99),
+            'max':          1000.0 * self.max,
+            'overruns':     self.overruns,
+            'overrun_rate': float(self.overruns) / self.count if self.count > 0 else 0.0,
+        }
+
+class LatencyProfiler:
+    """
+    パーツ別・ループ全体の処理時間ヒストグラムを保持するクラス。
+    """
+    def __init__(self, loop_hz, part_names=None, debug=False):
+        """
+        カウンタを初期化する。
+        引数：
+            loop_hz     Vehicleループの周波数(cfg.DRIVE_LOOP_HZ)
+            part_names  計測対象パーツのクラス名のリスト(None の場合すべて)
+            debug       デバッグフラグ
+        戻り値：
+            なし
+        """
+        self.loop_hz = loop_hz
+        self.period = 1.0 / loop_hz if loop_hz else None
+        self.part_names = None if part_names is None else list(part_names)
+        self.debug = debug
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.names = []
+        self.loop = LatencyHistogram(self.period)
+        self.tick_total = 0.0
+        self.start_time = time.time()
+
+    def instrument(self, vehicle):
+        """
+        Vehicle に追加済みのパーツのうち計測対象を ProfiledPart でラップする。
+        V.start() 呼び出し前に実行すること(スレッドは元パーツの update を実行する)。
+        引数：
+            vehicle     donkeycar.vehicle.Vehicle オブジェクト
+        戻り値：
+            ラップしたパーツ名のリスト
+        """
+        used = {}
+        wrapped = []
+        for entry in vehicle.parts:
+            part = entry['part']
+            class_name = type(part).__name__
+            used[class_name] = used.get(class_name, 0) + 1
+            if self.part_names is not None and class_name not in self.part_names:
+                continue
+            name = class_name if used[class_name] == 1 else '{}#{}'.format(class_name, str(used[class_name]))
+            entry['part'] = ProfiledPart(part, name, self)
+            # donkeycar 側の Vehicle.profiler はパーツオブジェクトをキーに記録するため登録し直す
+            vehicle_profiler = getattr(vehicle, 'profiler', None)
+            if vehicle_profiler is not None and hasattr(vehicle_profiler, 'profile_part'):
+                vehicle_profiler.profile_part(entry['part'])
+            wrapped.append(name)
+        if self.debug:
+            print('[LatencyProfiler] instrument {}'.format(str(wrapped)))
+        return wrapped
+
+    def register(self, name):
+        """
+        パーツ名のヒストグラムを作成する。
+        引数：
+            name        パーツ名
+        戻り値：
+            LatencyHistogram オブジェクト
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = LatencyHistogram(self.period)
+                self.histograms[name] = histogram
+                self.names.append(name)
+            return histogram
+
+    def record(self, histogram, latency):
+        """
+        パーツの処理時間を記録し、現在のループの合計処理時間に加算する。
+        引数：
+            histogram   register() の戻り値
+            latency     処理時間(秒)
+        戻り値：
+            なし
+        """
+        with self.lock:
+            histogram.add(latency)
+            self.tick_total += latency
+
+    def run(self):
+        """
+        ループ末尾で呼び出し、ループ1回分の合計処理時間を記録する(パーツとして使用)。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        with self.lock:
+            self.loop.add(self.tick_total)
+            self.tick_total = 0.0
+
+    def summary(self):
+        """
+        集計値を辞書型で返却する(時間はミリ秒)。
+        引数：
+            なし
+        戻り値：
+            辞書(loop_hz, period, elapsed, loop, parts)
+        """
+        with self.lock:
+            return {
+                'loop_hz':  self.loop_hz,
+                'period':   1000.0 * self.period if self.period is not None else None,
+                'elapsed':  time.time() - self.start_time,
+                'loop':     self.loop.summary(),
+                'parts':    {name: self.histograms[name].summary() for name in self.names},
+            }
+
+    def dump(self, path=None):
+        """
+        集計値を処理時間 p95 の降順に表示し、path 指定時はJSONファイルへ保存する。
+        引数：
+            path        保存先JSONファイルパス(None の場合保存しない)
+        戻り値：
+            summary() の戻り値
+        """
+        summary = self.summary()
+        print('[LatencyProfiler] loop {}Hz (period {:.1f}ms) ticks={} p50={:.1f}ms p95={:.1f}ms p99={:.1f}ms overruns={} ({:.1%})'.format(
+            str(self.loop_hz), summary['period'] or 0.0, summary['loop']['count'],
+            summary['loop']['p50'], summary['loop']['p95'], summary['loop']['p99'],
+            summary['loop']['overruns'], summary['loop']['overrun_rate']))
+        print('{:<32} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>14}'.format(
+            'part', 'calls', 'mean', 'p50', 'p95', 'p99', 'max', 'overruns'))
+        for name, part in sorted(summary['parts'].items(), key=lambda item: -item[1]['p95']):
+            print('{:<32} {:>8} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>6} ({:>5.1%})'.format(
+                name[:32], part['count'], part['mean'], part['p50'], part['p95'], part['p99'],
+                part['max'], part['overruns'], part['overrun_rate']))
+        if path is not None:
+            try:
+                with open(path, 'w') as f:
+                    json.dump(summary, f, indent=2)
+                print('[LatencyProfiler] saved {}'.format(path))
+            except OSError as e:
+                print('[LatencyProfiler] cannot write {}: {}'.format(path, str(e)))
+        return summary
+
+    def shutdown(self):
+        pass
+
+class ProfiledPart:
+    """
+    パーツをラップし、run/run_threaded の処理時間を LatencyProfiler へ記録するクラス。
+    その他の属性参照はラップ対象パーツへ委譲する。
+    """
+    def __init__(self, part, name, profiler):
+        """
+        ラップ対象パーツを保持する。
+        引数：
+            part        ラップ対象パーツ
+            name        パーツ名
+            profiler    LatencyProfiler オブジェクト
+        戻り値：
+            なし
+        """
+        self.part = part
+        self.name = name
+        self.profiler = profiler
+        self.histogram = profiler.register(name)
+
+    def run(self, *args):
+        start = time.perf_counter()
+        try:
+            return self.part.run(*args)
+        finally:
+            self.profiler.record(self.histogram, time.perf_counter() - start)
+
+    def run_threaded(self, *args):
+        start = time.perf_counter()
+        try:
+            return self.part.run_threaded(*args)
+        finally:
+            self.profiler.record(self.histogram, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.part, name)
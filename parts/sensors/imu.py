@@ -5,40 +5,96 @@ MPU6050/MPU9250モジュールを操作するパーツクラスを提供する
 """
 import time
 import json
+import base64
+import struct
+import threading
+import collections
+import numpy as np
+
+# imu/recent 配列の列定義
+RECENT_TIMESTAMP = 0
+RECENT_TEMP = 1
+RECENT_ACCEL = slice(2, 5)
+RECENT_GYRO = slice(5, 8)
+RECENT_MAGNET = slice(8, 11)
+RECENT_WIDTH = 11
+# encode_recent で Base64 形式として格納するTubデータキー(件数の多いFIFO全サンプル)
+BINARY_RECENT_KEYS = ['imu/batch']
+
+# 加速度(3)・温度(1)・ジャイロ(3)レジスタを連続読み込みするバイト数と書式(ビッグエンディアン符号付16ビット)
+BURST_SIZE = 14
+_BURST_STRUCT = struct.Struct('>7h')
+
+# FIFOモード：加速度・温度・ジャイロを BURST_SIZE バイト/サンプルで格納する
+# (MPU6050/MPU9250 共通のレジスタアドレス)
+FIFO_REG_SMPLRT_DIV = 0x19
+FIFO_REG_CONFIG = 0x1A
+FIFO_REG_FIFO_EN = 0x23
+FIFO_REG_INT_STATUS = 0x3A
+FIFO_REG_USER_CTRL = 0x6A
+FIFO_REG_COUNTH = 0x72
+FIFO_REG_R_W = 0x74
+FIFO_EN_ACCEL_TEMP_GYRO = 0xF8
+FIFO_USER_CTRL_EN = 0x40
+FIFO_USER_CTRL_RST = 0x04
+FIFO_OFLOW_INT = 0x10
+# pigpio のブロック読み込みは最大32バイトのため、2サンプル単位で読み込む
+FIFO_CHUNK_SIZE = BURST_SIZE * 2
 
 class Mpu6050:
     """
     MPU6050からIMUデータを読み取るパーツクラス。
-    シングルスレッドでのみ動作する。
+    threaded=True で追加した場合、update() がバックグラウンドで sample_rate 周期の
+    バースト読み込みを行い、run_threaded() は最新サンプルを待たずに返却する。
+    fifo=True の場合はハードウェアFIFOを使用し、前回呼び出し以降の全サンプルを
+    imu/recent と同じ列構成の配列として最後の戻り値に追加する。
     """
-    def __init__(self, pgio=None, bus=1, address=0x68, depth=3, debug=False):
+    def __init__(self, pgio=None, bus=1, address=0x68, depth=3, sample_rate=100,
+    fifo=False, fifo_rate=200, debug=False):
         """
         MPU6050ドライバを生成しインスタンス変数へ格納する。
         引数：
-            pgip    pgio.pi()インスタンス(デフォルトNone)
-            address アドレス値(デフォルト0x68)
-            bus     バス値(デフォルト1)
-            depth   残しておく最新データ件数(1以上、デフォルト3)
-            debug   デバッグフラグ(デフォルトFalse)
+            pgip        pgio.pi()インスタンス(デフォルトNone)
+            address     アドレス値(デフォルト0x68)
+            bus         バス値(デフォルト1)
+            depth       残しておく最新データ件数(1以上、デフォルト3)
+            sample_rate threaded=True 時のサンプリング周波数(Hz、デフォルト100)、
+                        fifo=True の場合はFIFO読み出し周波数
+            fifo        ハードウェアFIFOを使用する場合真(デフォルトFalse)
+            fifo_rate   FIFO格納周波数(Hz、デフォルト200)
+            debug       デバッグフラグ(デフォルトFalse)
         戻り値：
             なし
         例外：
-            ValueError          depthがNoneや負の場合
+            ValueError          depthやsample_rateがNoneや負の場合
         """
         self.mpu = _mpu6050(pgio, address, bus)
         self.debug = debug
         self.depth = depth
         if self.depth is None or self.depth <= 0:
-            raise ValueError('[Mpu9250] illegal value depth = {}'.format(
+            raise ValueError('[Mpu6050] illegal value depth = {}'.format(
                 str(self.depth)))
+        self.sample_rate = sample_rate
+        if self.sample_rate is None or self.sample_rate <= 0:
+            raise ValueError('[Mpu6050] illegal value sample_rate = {}'.format(
+                str(self.sample_rate)))
         if self.debug:
-            print('[Mpu6050] depth={}'.format(str(self.depth)))
+            print('[Mpu6050] depth={} sample_rate={}'.format(
+                str(self.depth), str(self.sample_rate)))
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.stopped.set()
+        self.on = True
+        self.errors = 0
         self.init_imu_data()
         for _ in range(self.depth):
             self._update()
             time.sleep(0.1)
         if self.debug:
             print('[Mpu6050] pre-read data in {} times'.format(str(self.depth)))
+        self.fifo = fifo
+        if self.fifo:
+            self.init_fifo(fifo_rate)
 
     def init_imu_data(self):
         """
@@ -48,14 +104,14 @@ class Mpu6050:
         戻り値：
             なし
         """
-        self.temp = 0
-        self.accel_data = {'x': 0, 'y': 0, 'z': 0}
-        self.gyro_data =  {'x': 0, 'y': 0, 'z': 0}
-        self.timestamp = time.time()
-        self.recent_data = []
-        packed_data = pack(self.timestamp, self.temp, self.accel_data, self.gyro_data)
-        for _ in range(self.depth):
-            self.recent_data.append(packed_data)
+        with self.lock:
+            self.temp = 0
+            self.accel_data = {'x': 0, 'y': 0, 'z': 0}
+            self.gyro_data =  {'x': 0, 'y': 0, 'z': 0}
+            self.timestamp = time.time()
+            self.recent_data = RecentBuffer(self.depth)
+            for _ in range(self.depth):
+                self.recent_data.push(self.timestamp, self.temp, self.accel_data, self.gyro_data)
 
     def _update(self):
         """
@@ -65,13 +121,134 @@ class Mpu6050:
         戻り値：
             なし
         """
-        temp = self.mpu.get_temp()
-        if temp is not None:
-            self.temp = temp
-        self.accel_data = omit_none(self.accel_data, self.mpu.get_accel_data())
-        self.gyro_data = omit_none(self.gyro_data, self.mpu.get_gyro_data())
-        self.timestamp = time.time()
-        push_recent_data(self.recent_data, pack(self.timestamp, self.temp, self.accel_data, self.gyro_data))
+        accel_data, temp, gyro_data = self.mpu.get_burst_data()
+        self._store(temp, accel_data, gyro_data)
+
+    def _store(self, temp, accel_data, gyro_data):
+        """
+        読み取ったIMU情報をインスタンス変数と最新データバッファへ格納する。
+        引数：
+            temp        温度
+            accel_data  加速度データ（辞書）
+            gyro_data   角速度データ（辞書）
+        戻り値：
+            なし
+        """
+        with self.lock:
+            if temp is not None:
+                self.temp = temp
+            self.accel_data = omit_none(self.accel_data, accel_data)
+            self.gyro_data = omit_none(self.gyro_data, gyro_data)
+            self.timestamp = time.time()
+            self.recent_data.push(self.timestamp, self.temp, self.accel_data, self.gyro_data)
+
+    def init_fifo(self, fifo_rate):
+        """
+        ハードウェアFIFOを有効化し、FIFO読み込み状態を初期化する。
+        引数：
+            fifo_rate   FIFO格納周波数(Hz)
+        戻り値：
+            なし
+        """
+        self.fifo_rate = self.mpu.enable_fifo(fifo_rate)
+        self.fifo_last_time = None
+        self.overflows = 0
+        # run_threaded 未呼び出し時に溜まり続けないよう約1秒分で打ち切る
+        self.batches = collections.deque(maxlen=int(self.sample_rate) + 1)
+        if self.debug:
+            print('[Mpu6050] fifo enabled rate={}'.format(str(self.fifo_rate)))
+
+    def _read_fifo(self):
+        """
+        FIFOに溜まっている全サンプルを読み込み、インスタンス変数と最新データバッファへ格納する。
+        引数：
+            なし
+        戻り値：
+            batch   IMUデータ(nd.array形式、(N, RECENT_WIDTH)、後ろが最新)
+        """
+        data = self.mpu.read_fifo()
+        now = time.time()
+        if data is None:
+            self.overflows += 1
+            self.fifo_last_time = None
+            if self.debug:
+                print('[Mpu6050] fifo overflow({} times)'.format(str(self.overflows)))
+            return np.zeros((0, RECENT_WIDTH))
+        batch = np.zeros((len(data), RECENT_WIDTH))
+        if len(data) == 0:
+            return batch
+        batch[:, RECENT_TIMESTAMP] = fifo_timestamps(len(data), self.fifo_last_time, now, 1.0 / self.fifo_rate)
+        batch[:, RECENT_TEMP] = data[:, 3]
+        batch[:, RECENT_ACCEL] = data[:, 0:3]
+        batch[:, RECENT_GYRO] = data[:, 4:7]
+        self.fifo_last_time = now
+        last = batch[-1]
+        with self.lock:
+            self.temp = float(last[RECENT_TEMP])
+            self.accel_data = to_dict(last[RECENT_ACCEL])
+            self.gyro_data = to_dict(last[RECENT_GYRO])
+            self.timestamp = float(last[RECENT_TIMESTAMP])
+            self.recent_data.extend(batch)
+        return batch
+
+    def _pop_batch(self):
+        """
+        update() スレッドが読み込んだFIFOサンプルをまとめて取り出す。
+        引数：
+            なし
+        戻り値：
+            batch   IMUデータ(nd.array形式、(N, RECENT_WIDTH)、後ろが最新)
+        """
+        with self.lock:
+            batches = list(self.batches)
+            self.batches.clear()
+        if len(batches) == 0:
+            return np.zeros((0, RECENT_WIDTH))
+        return np.concatenate(batches)
+
+    def _outputs(self):
+        """
+        最新のIMU情報を run の戻り値形式で返却する(fifo=True の場合の batch を除く)。
+        引数：
+            なし
+        戻り値：
+            run の戻り値と同じ
+        """
+        with self.lock:
+            return self.accel_data['x'], self.accel_data['y'], self.accel_data['z'], \
+                self.gyro_data['x'], self.gyro_data['y'], self.gyro_data['z'], \
+                self.recent_data.to_array(), self.timestamp
+
+    def update(self):
+        """
+        shutdown されるまで sample_rate 周期でセンサを読み込み続ける。
+        threaded=True の場合にVehicleフレームワークから別スレッドで呼び出される。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        self.stopped.clear()
+        period = 1.0 / self.sample_rate
+        next_time = time.time()
+        try:
+            while self.on:
+                try:
+                    if self.fifo:
+                        batch = self._read_fifo()
+                        if len(batch) > 0:
+                            with self.lock:
+                                self.batches.append(batch)
+                    else:
+                        self._update()
+                except Exception as e:
+                    # I2Cエラー(pigpio.error, ConnectionError など)は数えるのみとし、サンプリングを継続する
+                    self.errors += 1
+                    if self.debug:
+                        print('[Mpu6050] read error({} times): {}'.format(str(self.errors), str(e)))
+                next_time = wait_next(next_time, period)
+        finally:
+            self.stopped.set()
 
     def run(self):
         """
@@ -85,45 +262,50 @@ class Mpu6050:
             gyro_x      角速度X座標値(float)
             gyro_x      角速度X座標値(float)
             gyro_x      角速度X座標値(float)
-            recent_data 過去最新情報(JSON形式の文字列)
+            recent_data 過去最新情報(nd.array形式、(depth, RECENT_WIDTH)、後ろが最新)
             timestamp   データ読み取り時時刻(datetime.now()結果:float)
+            batch       fifo=True の場合のみ、前回呼び出し以降の全サンプル
+                        (nd.array形式、(N, RECENT_WIDTH)、後ろが最新)
         """
+        if self.fifo:
+            # FIFOを読み出して最新値を更新してから出力を作成する
+            batch = self._read_fifo()
+            return self._outputs() + (batch,)
         self._update()
-        accel_x, accel_y, accel_z = \
-            self.accel_data['x'], self.accel_data['y'] ,self.accel_data['z']
-        gyro_x, gyro_y, gyro_z = \
-            self.gyro_data['x'], self.gyro_data['y'] ,self.gyro_data['z']
+        outputs = self._outputs()
         if self.debug:
             print('temp:[{}], acc:[{}, {}, {}], gyro:[{}, {}, {}] ts:{}'.format(
-                str(self.temp), str(accel_x), str(accel_y), str(accel_z), 
-                str(gyro_x), str(gyro_y), str(gyro_z), str(self.timestamp)))
-        return accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z, \
-            str_recent_data(self.recent_data), self.timestamp
+                str(self.temp), str(outputs[0]), str(outputs[1]), str(outputs[2]), 
+                str(outputs[3]), str(outputs[4]), str(outputs[5]), str(outputs[7])))
+        return outputs
 
     def run_threaded(self):
         """
-        サポートされていない。
+        update() スレッドが最後に読み込んだIMU情報を返却する。
+        センサの読み込みは待たない。
         引数：
             なし
         戻り値：
-            なし
-        例外：
-            RuntimeError 必ず発生する。
+            run の戻り値と同じ
         """
-        raise RuntimeError('[Mpu6050] unsupported run on threaded=True')
+        if self.fifo:
+            return self._outputs() + (self._pop_batch(),)
+        return self._outputs()
 
     def shutdown(self):
         """
-        処理なし
+        サンプリングスレッドを停止し、IMU情報を初期化する。
         引数：
             なし
         戻り値：
             なし
         """
+        self.on = False
+        self.stopped.wait(1.0)
         self.init_imu_data()
         self.mpu = None
         if self.debug:
-            print('Mpu6050 shutdown')
+            print('[Mpu6050] shutdown errors:{}'.format(str(self.errors)))
 
 class _mpu6050:
     """
@@ -196,6 +378,8 @@ class _mpu6050:
         self.handler = self.pi.i2c_open(bus, address)
         # MPU6050を起動
         self.pi.i2c_write_byte_data(self.handler, self.PWR_MGMT_1, 0x00)
+        # バースト読み込み用に範囲設定からスケールを求めておく
+        self.update_scale_modifiers()
 
     # I2C 通信関連メソッド
 
@@ -245,6 +429,7 @@ class _mpu6050:
 
         # ACCEL_CONFIG レジスタに範囲を書き込む
         self.pi.i2c_write_byte_data(self.handler, self.ACCEL_CONFIG, accel_range)
+        self.update_scale_modifiers()
 
     def read_accel_range(self, raw = False):
         """
@@ -322,6 +507,7 @@ class _mpu6050:
 
         # GYRO_CONFIG レジスタに範囲を書き込む
         self.pi.i2c_write_byte_data(self.handler, self.GYRO_CONFIG, gyro_range)
+        self.update_scale_modifiers()
 
     def read_gyro_range(self, raw = False):
         """
@@ -380,6 +566,84 @@ class _mpu6050:
 
         return {'x': x, 'y': y, 'z': z}
 
+    def update_scale_modifiers(self):
+        """
+        加速度計・ジャイロスコープの範囲設定を読み取り、
+        get_burst_data で使用するスケールを更新する。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        accel_range = self.read_accel_range(True)
+        self.accel_scale_modifier = {
+            self.ACCEL_RANGE_2G: self.ACCEL_SCALE_MODIFIER_2G,
+            self.ACCEL_RANGE_4G: self.ACCEL_SCALE_MODIFIER_4G,
+            self.ACCEL_RANGE_8G: self.ACCEL_SCALE_MODIFIER_8G,
+            self.ACCEL_RANGE_16G: self.ACCEL_SCALE_MODIFIER_16G,
+        }.get(accel_range, self.ACCEL_SCALE_MODIFIER_2G)
+        gyro_range = self.read_gyro_range(True)
+        self.gyro_scale_modifier = {
+            self.GYRO_RANGE_250DEG: self.GYRO_SCALE_MODIFIER_250DEG,
+            self.GYRO_RANGE_500DEG: self.GYRO_SCALE_MODIFIER_500DEG,
+            self.GYRO_RANGE_1000DEG: self.GYRO_SCALE_MODIFIER_1000DEG,
+            self.GYRO_RANGE_2000DEG: self.GYRO_SCALE_MODIFIER_2000DEG,
+        }.get(gyro_range, self.GYRO_SCALE_MODIFIER_250DEG)
+
+    def get_burst_data(self):
+        """
+        ACCEL_XOUT0 から GYRO_ZOUT 下位までの14バイトを1回のI2C転送で読み込み、
+        加速度(m.s^2)、温度、ジャイロスコープ座標値を返却する。
+        範囲設定は update_scale_modifiers 実行時のものを使用する。
+        引数：
+            なし
+        戻り値：
+            加速度座標辞書、温度、ジャイロスコープ座標辞書
+        例外：
+            ConnectionError I2C読み込みに失敗した場合
+        """
+        (count, data) = self.pi.i2c_read_i2c_block_data(self.handler, self.ACCEL_XOUT0, BURST_SIZE)
+        if count != BURST_SIZE:
+            raise ConnectionError('Error:{} in i2c_read_i2c_block_data'.format(str(count)))
+        ax, ay, az, raw_temp, gx, gy, gz = _BURST_STRUCT.unpack(bytes(data))
+        accel_scale = self.GRAVITIY_MS2 / self.accel_scale_modifier
+        gyro_scale = 1.0 / self.gyro_scale_modifier
+        return {'x': ax * accel_scale, 'y': ay * accel_scale, 'z': az * accel_scale}, \
+            (raw_temp / 340.0) + 36.53, \
+            {'x': gx * gyro_scale, 'y': gy * gyro_scale, 'z': gz * gyro_scale}
+
+    def enable_fifo(self, sample_rate=200):
+        """
+        DLPFを有効化して内部サンプリングを1kHzとし、sample_rate 周期で
+        加速度・温度・ジャイロをハードウェアFIFOへ格納させる。
+        引数：
+            sample_rate     FIFO格納周波数(Hz、4～1000)
+        戻り値：
+            実際のFIFO格納周波数(Hz)
+        """
+        return enable_fifo(self.pi, self.handler, sample_rate)
+
+    def read_fifo(self):
+        """
+        ハードウェアFIFOに溜まっている全サンプルを読み込む。
+        FIFOがオーバーフローしていた場合は、FIFOをリセットし空配列を返却する。
+        引数：
+            なし
+        戻り値：
+            (N, 7) 配列(加速度(m.s^2) xyz、温度、ジャイロ xyz、古い順)、
+            オーバーフロー時None
+        例外：
+            ConnectionError I2C読み込みに失敗した場合
+        """
+        raw = read_fifo(self.pi, self.handler)
+        if raw is None:
+            return None
+        data = np.empty(raw.shape)
+        data[:, 0:3] = raw[:, 0:3] * (self.GRAVITIY_MS2 / self.accel_scale_modifier)
+        data[:, 3] = raw[:, 3] / 340.0 + 36.53
+        data[:, 4:7] = raw[:, 4:7] / self.gyro_scale_modifier
+        return data
+
     def get_all_data(self):
         """
         すべての値を標準出力へ表示する。
@@ -408,10 +672,15 @@ class _mpu6050:
 class Mpu9250:
     """
     MPU9250からIMUデータを読み取るパーツクラス。
-    シングルスレッドのみで動作する。
+    threaded=True で追加した場合、update() がバックグラウンドで sample_rate 周期の
+    加速度・温度・ジャイロのバースト読み込みを行い、AK8963 は magnet_rate 周期で別途読み込む。
+    run_threaded() は最新サンプルを待たずに返却する。
+    fifo=True の場合はハードウェアFIFOを使用し、前回呼び出し以降の全サンプルを
+    imu/recent と同じ列構成の配列として最後の戻り値に追加する(磁束密度は最新値)。
     """
     def __init__(self, pgio=None, bus=1, 
-    mpu9250_address=None, ak8963_address=None, depth=3, delay_time=0.01, debug=False):
+    mpu9250_address=None, ak8963_address=None, depth=3, delay_time=0.01,
+    sample_rate=100, magnet_rate=8, fifo=False, fifo_rate=200, debug=False):
         """
         MPU9250ドライバを生成しインスタンス変数へ格納する。
         引数：
@@ -421,11 +690,16 @@ class Mpu9250:
             ak8963_address      AK8963 I2Cスレーブアドレス(デフォルトNone)
             depth               最新データを残す件数(1以上、デフォルト:3)
             delay_time          連続読み込み間隔(sec, デフォルト:0.01)
+            sample_rate         threaded=True 時のサンプリング周波数(Hz、デフォルト:100)、
+                                fifo=True の場合はFIFO読み出し周波数
+            magnet_rate         threaded=True もしくは fifo=True 時のAK8963読み込み周波数(Hz、デフォルト:8)
+            fifo                ハードウェアFIFOを使用する場合真(デフォルト:False)
+            fifo_rate           FIFO格納周波数(Hz、デフォルト:200)
             debug               デバッグフラグ(デフォルト:False)
         戻り値：
             なし
         例外：
-            ValueError          depthがNoneや負の場合
+            ValueError          depth、sample_rate、magnet_rateがNoneや負の場合
         """
         self.mpu = _mpu9250(
             pgio=pgio, 
@@ -440,6 +714,20 @@ class Mpu9250:
         if self.depth is None or self.depth <= 0:
             raise ValueError('[Mpu9250] illegal value depth = {}'.format(
                 str(self.depth)))
+        self.sample_rate = sample_rate
+        if self.sample_rate is None or self.sample_rate <= 0:
+            raise ValueError('[Mpu9250] illegal value sample_rate = {}'.format(
+                str(self.sample_rate)))
+        self.magnet_rate = magnet_rate
+        if self.magnet_rate is None or self.magnet_rate <= 0:
+            raise ValueError('[Mpu9250] illegal value magnet_rate = {}'.format(
+                str(self.magnet_rate)))
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.stopped.set()
+        self.on = True
+        self.errors = 0
+        self.next_magnet = 0.0
 
         # initial set zeros
         self.init_imu_data()
@@ -453,6 +741,9 @@ class Mpu9250:
             time.sleep(0.1)
         if self.debug:
             print('[Mpu9250] pre-read mpu9250 in {} times'.format(str(self.depth + cnt)))
+        self.fifo = fifo
+        if self.fifo:
+            self.init_fifo(fifo_rate)
 
     def init_imu_data(self):
         """
@@ -462,52 +753,34 @@ class Mpu9250:
         戻り値：
             なし
         """
-        self.temp = 0
-        self.accel_data = {'x': 0, 'y': 0, 'z': 0}
-        self.gyro_data =  {'x': 0, 'y': 0, 'z': 0}
-        self.magnet_data = {'x': 0, 'y': 0, 'z': 0}
-        self.timestamp = time.time()
-        self.recent_data = []
-        packed_data = pack(self.timestamp, self.temp, 
-            self.accel_data, self.gyro_data, self.magnet_data)
-        for _ in range(self.depth):
-            self.recent_data.append(packed_data)
+        with self.lock:
+            self.temp = 0
+            self.accel_data = {'x': 0, 'y': 0, 'z': 0}
+            self.gyro_data =  {'x': 0, 'y': 0, 'z': 0}
+            self.magnet_data = {'x': 0, 'y': 0, 'z': 0}
+            self.timestamp = time.time()
+            self.recent_data = RecentBuffer(self.depth)
+            for _ in range(self.depth):
+                self.recent_data.push(self.timestamp, self.temp,
+                    self.accel_data, self.gyro_data, self.magnet_data)
 
     def _update(self):
         """
         IMU情報をセンサから読み取りインスタンス変数へ格納する。
+        各データが取得できるまで delay_time 間隔で読み込みを繰り返す。
         引数：
             なし
         戻り値：
             なし
         """
-        temp = self.mpu.readTemperature()
-        cnt = 1
-        while temp is None:
-            time.sleep(self.delay_time)
-            temp = self.mpu.readTemperature()
-            cnt = cnt + 1
-        if self.debug and cnt > 1:
-            print('[Mpu9250] read temp in {} times'.format(str(cnt)))
-        self.temp = temp
-        accel_data = self.mpu.readAccel()
+        accel_data, temp, gyro_data = self.mpu.readBurst()
         cnt = 1
-        while is_zeros(accel_data):
+        while is_zeros(accel_data) or is_zeros(gyro_data):
             time.sleep(self.delay_time)
-            accel_data = self.mpu.readAccel()
+            accel_data, temp, gyro_data = self.mpu.readBurst()
             cnt = cnt + 1
         if self.debug and cnt > 1:
-            print('[Mpu9250] read accel data in {} times'.format(str(cnt)))
-        self.accel_data = omit_none(self.accel_data, accel_data)
-        gyro_data = self.mpu.readGyro()
-        cnt = 1
-        while is_zeros(gyro_data):
-            time.sleep(self.delay_time)
-            gyro_data = self.mpu.readGyro()
-            cnt = cnt + 1
-        if self.debug and cnt > 1:
-            print('[Mpu9250] read gyro data in {} times'.format(str(cnt)))
-        self.gyro_data = omit_none(self.gyro_data, gyro_data)
+            print('[Mpu9250] read accel/temp/gyro data in {} times'.format(str(cnt)))
         magnet_data = self.mpu.readMagnet()
         cnt = 1
         while is_zeros(magnet_data):
@@ -516,23 +789,178 @@ class Mpu9250:
             cnt = cnt + 1
         if self.debug and cnt > 1:
             print('[Mpu9250] read magnet data in {} times'.format(str(cnt)))
-        self.magnet_data = omit_none(self.magnet_data, magnet_data)
-        self.timestamp = time.time()
-        current_dict = pack(self.timestamp, self.temp,
-            self.accel_data, self.gyro_data, self.magnet_data)
-        self.recent_data = push_recent_data(self.recent_data, current_dict)
+        self._store(temp, accel_data, gyro_data, magnet_data)
 
-    def run_threaded(self):
+    def _store(self, temp, accel_data, gyro_data, magnet_data=None):
         """
-        サポートされていない。
+        読み取ったIMU情報をインスタンス変数と最新データバッファへ格納する。
         引数：
+            temp        温度
+            accel_data  加速度データ（辞書）
+            gyro_data   角速度データ（辞書）
+            magnet_data 磁束密度データ（辞書）、Noneの場合は前回値を使用する
+        戻り値：
             なし
+        """
+        with self.lock:
+            if temp is not None:
+                self.temp = temp
+            self.accel_data = omit_none(self.accel_data, accel_data)
+            self.gyro_data = omit_none(self.gyro_data, gyro_data)
+            if magnet_data is not None:
+                self.magnet_data = omit_none(self.magnet_data, magnet_data)
+            self.timestamp = time.time()
+            self.recent_data.push(self.timestamp, self.temp,
+                self.accel_data, self.gyro_data, self.magnet_data)
+
+    def _poll_magnet(self, now):
+        """
+        magnet_rate 周期に達していればAK8963を読み込む。
+        データ準備ができていない場合は次回呼び出し時に再確認する。
+        引数：
+            now         現在時刻
+        戻り値：
+            磁束密度データ（辞書）、読み込まなかった場合None
+        """
+        if now < self.next_magnet:
+            return None
+        magnet_data = self.mpu.readMagnet()
+        if is_zeros(magnet_data):
+            return None
+        self.next_magnet = now + 1.0 / self.magnet_rate
+        return magnet_data
+
+    def init_fifo(self, fifo_rate):
+        """
+        ハードウェアFIFOを有効化し、FIFO読み込み状態を初期化する。
+        引数：
+            fifo_rate   FIFO格納周波数(Hz)
         戻り値：
             なし
-        例外：
-            RuntimeError 必ず発生する。
         """
-        raise RuntimeError('[Mpu9250] unsupported on threaded=True')
+        self.fifo_rate = self.mpu.enableFIFO(fifo_rate)
+        self.fifo_last_time = None
+        self.overflows = 0
+        # run_threaded 未呼び出し時に溜まり続けないよう約1秒分で打ち切る
+        self.batches = collections.deque(maxlen=int(self.sample_rate) + 1)
+        if self.debug:
+            print('[Mpu9250] fifo enabled rate={}'.format(str(self.fifo_rate)))
+
+    def _read_fifo(self):
+        """
+        FIFOに溜まっている全サンプルを読み込み、インスタンス変数と最新データバッファへ格納する。
+        磁束密度列には読み込み時点の最新値を格納する。
+        引数：
+            なし
+        戻り値：
+            batch   IMUデータ(nd.array形式、(N, RECENT_WIDTH)、後ろが最新)
+        """
+        data = self.mpu.readFIFO()
+        now = time.time()
+        magnet_data = self._poll_magnet(now)
+        if magnet_data is not None:
+            with self.lock:
+                self.magnet_data = omit_none(self.magnet_data, magnet_data)
+        if data is None:
+            self.overflows += 1
+            self.fifo_last_time = None
+            if self.debug:
+                print('[Mpu9250] fifo overflow({} times)'.format(str(self.overflows)))
+            return np.zeros((0, RECENT_WIDTH))
+        batch = np.zeros((len(data), RECENT_WIDTH))
+        if len(data) == 0:
+            return batch
+        batch[:, RECENT_TIMESTAMP] = fifo_timestamps(len(data), self.fifo_last_time, now, 1.0 / self.fifo_rate)
+        batch[:, RECENT_TEMP] = data[:, 3]
+        batch[:, RECENT_ACCEL] = data[:, 0:3]
+        batch[:, RECENT_GYRO] = data[:, 4:7]
+        batch[:, RECENT_MAGNET] = (self.magnet_data['x'], self.magnet_data['y'], self.magnet_data['z'])
+        self.fifo_last_time = now
+        last = batch[-1]
+        with self.lock:
+            self.temp = float(last[RECENT_TEMP])
+            self.accel_data = to_dict(last[RECENT_ACCEL])
+            self.gyro_data = to_dict(last[RECENT_GYRO])
+            self.timestamp = float(last[RECENT_TIMESTAMP])
+            self.recent_data.extend(batch)
+        return batch
+
+    def _pop_batch(self):
+        """
+        update() スレッドが読み込んだFIFOサンプルをまとめて取り出す。
+        引数：
+            なし
+        戻り値：
+            batch   IMUデータ(nd.array形式、(N, RECENT_WIDTH)、後ろが最新)
+        """
+        with self.lock:
+            batches = list(self.batches)
+            self.batches.clear()
+        if len(batches) == 0:
+            return np.zeros((0, RECENT_WIDTH))
+        return np.concatenate(batches)
+
+    def _outputs(self):
+        """
+        最新のIMU情報を run の戻り値形式で返却する(fifo=True の場合の batch を除く)。
+        引数：
+            なし
+        戻り値：
+            run の戻り値と同じ
+        """
+        with self.lock:
+            return self.accel_data['x'], self.accel_data['y'], self.accel_data['z'], \
+                self.gyro_data['x'], self.gyro_data['y'], self.gyro_data['z'], \
+                self.magnet_data['x'], self.magnet_data['y'], self.magnet_data['z'], \
+                self.temp, self.recent_data.to_array(), self.timestamp
+
+    def update(self):
+        """
+        shutdown されるまで sample_rate 周期で加速度・温度・ジャイロを読み込み続ける。
+        AK8963 は magnet_rate 周期でデータ準備完了を確認し、準備できていなければ
+        次のサンプリング時に再確認する。fifo=True の場合は sample_rate 周期でFIFOを読み出す。
+        threaded=True の場合にVehicleフレームワークから別スレッドで呼び出される。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        self.stopped.clear()
+        period = 1.0 / self.sample_rate
+        next_time = time.time()
+        try:
+            while self.on:
+                try:
+                    if self.fifo:
+                        batch = self._read_fifo()
+                        if len(batch) > 0:
+                            with self.lock:
+                                self.batches.append(batch)
+                    else:
+                        accel_data, temp, gyro_data = self.mpu.readBurst()
+                        magnet_data = self._poll_magnet(time.time())
+                        self._store(temp, accel_data, gyro_data, magnet_data)
+                except Exception as e:
+                    # I2Cエラー(pigpio.error, ConnectionError など)は数えるのみとし、サンプリングを継続する
+                    self.errors += 1
+                    if self.debug:
+                        print('[Mpu9250] read error({} times): {}'.format(str(self.errors), str(e)))
+                next_time = wait_next(next_time, period)
+        finally:
+            self.stopped.set()
+
+    def run_threaded(self):
+        """
+        update() スレッドが最後に読み込んだIMU情報を返却する。
+        センサの読み込みは待たない。
+        引数：
+            なし
+        戻り値：
+            run の戻り値と同じ
+        """
+        if self.fifo:
+            return self._outputs() + (self._pop_batch(),)
+        return self._outputs()
 
     def run(self):
         """
@@ -549,38 +977,39 @@ class Mpu9250:
             magnet_x    磁束密度X座標値(float)
             magnet_x    磁束密度X座標値(float)
             magnet_x    磁束密度X座標値(float)
-            recent_data 過去最新情報(JSON形式の文字列)
+            recent_data 過去最新情報(nd.array形式、(depth, RECENT_WIDTH)、後ろが最新)
             timestamp   データ読み取り時時刻(datetime.now()結果:float)
+            batch       fifo=True の場合のみ、前回呼び出し以降の全サンプル
+                        (nd.array形式、(N, RECENT_WIDTH)、後ろが最新)
         """
+        if self.fifo:
+            # FIFOを読み出して最新値を更新してから出力を作成する
+            batch = self._read_fifo()
+            return self._outputs() + (batch,)
         self._update()
-        accel_x, accel_y, accel_z = \
-            self.accel_data['x'], self.accel_data['y'] ,self.accel_data['z']
-        gyro_x, gyro_y, gyro_z = \
-            self.gyro_data['x'], self.gyro_data['y'] ,self.gyro_data['z']
-        magnet_x, magnet_y, magnet_z = \
-            self.magnet_data['x'], self.magnet_data['y'] ,self.magnet_data['z']
+        outputs = self._outputs()
         if self.debug:
             print('temp:[{}], acc:[{}, {}, {}], gyro:[{}, {}, {}] magnet:[{}, {}, {}] ts:{}'.format(
-                str(self.temp), str(accel_x), str(accel_y), str(accel_z), 
-                str(gyro_x), str(gyro_y), str(gyro_z), 
-                str(magnet_x), str(magnet_y), str(magnet_z), str(self.timestamp)))
-        return accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z, \
-            magnet_x, magnet_y, magnet_z, \
-            self.temp, str_recent_data(self.recent_data), self.timestamp
+                str(outputs[9]), str(outputs[0]), str(outputs[1]), str(outputs[2]), 
+                str(outputs[3]), str(outputs[4]), str(outputs[5]), 
+                str(outputs[6]), str(outputs[7]), str(outputs[8]), str(outputs[11])))
+        return outputs
 
     def shutdown(self):
         """
-        MPU9250をクローズする。
+        サンプリングスレッドを停止し、MPU9250をクローズする。
         引数：
             なし
         戻り値：
             なし
         """
+        self.on = False
+        self.stopped.wait(1.0)
         self.mpu.close()
         self.init_imu_data()
         self.mpu = None
         if self.debug:
-            print('[Mpu9250] shutdown')
+            print('[Mpu9250] shutdown errors:{}'.format(str(self.errors)))
 
 class _mpu9250:
     """
@@ -890,6 +1319,60 @@ class _mpu9250:
 
         return {"x":x, "y":y, "z":z}
 
+    def readBurst(self):
+        """
+        加速度・温度・ジャイロデータを ACCEL_OUT からの14バイト1回の読み込みで取得する。
+        各値は readAccel、readTemperature、readGyro と同じ単位・丸めとなる。
+        引数：
+            なし
+        戻り値：
+            加速度辞書(x, y, z)、温度(C)、ジャイロ辞書(x, y, z)
+        例外：
+            ConnectionError I2C読み込みに失敗した場合
+        """
+        (count, data) = self.pi.i2c_read_i2c_block_data(
+            self.mpu9250_handler, self.ACCEL_OUT, BURST_SIZE)
+        if count != BURST_SIZE:
+            raise ConnectionError('Error:{} in i2c_read_i2c_block_data'.format(str(count)))
+        ax, ay, az, temp, gx, gy, gz = _BURST_STRUCT.unpack(bytes(data))
+        ares = self.ares
+        gres = self.gres
+        return {'x': round(ax * ares, 3), 'y': round(ay * ares, 3), 'z': round(az * ares, 3)}, \
+            round((temp / 333.87 + 21.0), 3), \
+            {'x': round(gx * gres, 3), 'y': round(gy * gres, 3), 'z': round(gz * gres, 3)}
+
+    def enableFIFO(self, sample_rate=200):
+        """
+        sample_rate 周期で加速度・温度・ジャイロをハードウェアFIFOへ格納させる。
+        AK8963 はバイパス接続のためFIFOには含まれない。
+        引数：
+            sample_rate     FIFO格納周波数(Hz、4～1000)
+        戻り値：
+            実際のFIFO格納周波数(Hz)
+        """
+        return enable_fifo(self.pi, self.mpu9250_handler, sample_rate)
+
+    def readFIFO(self):
+        """
+        ハードウェアFIFOに溜まっている全サンプルを読み込む。
+        各値は readAccel、readTemperature、readGyro と同じ単位となる(丸めは行わない)。
+        引数：
+            なし
+        戻り値：
+            (N, 7) 配列(加速度 xyz、温度、ジャイロ xyz、古い順)、
+            FIFOがオーバーフローしリセットした場合None
+        例外：
+            ConnectionError I2C読み込みに失敗した場合
+        """
+        raw = read_fifo(self.pi, self.mpu9250_handler)
+        if raw is None:
+            return None
+        data = np.empty(raw.shape)
+        data[:, 0:3] = raw[:, 0:3] * self.ares
+        data[:, 3] = raw[:, 3] / 333.87 + 21.0
+        data[:, 4:7] = raw[:, 4:7] * self.gres
+        return data
+
     def readTemperature(self):
         """
         温度を読み取る。
@@ -982,34 +1465,116 @@ class PrintMpu9250:
 
 # ユーティリティ関数群
 
-def push_recent_data(recent_data, current_dict):
+class RecentBuffer:
     """
-    引数recent_dataで渡された配列の最期に引数current_data値を
-    格納し、先頭データを削除した配列を返却する。
+    最新IMUデータを固定長のNumPy配列で保持するリングバッファ。
+    各行は (timestamp, temp, accel xyz, gyro xyz, magnet xyz) の RECENT_WIDTH 列。
+    """
+    def __init__(self, depth):
+        """
+        バッファを確保する。
+        引数：
+            depth   保持する件数
+        戻り値：
+            なし
+        """
+        self.depth = depth
+        # 同じ行を2箇所へ書き込み、古い順の連続領域を切り出せるようにする
+        self.buffer = np.zeros((depth * 2, RECENT_WIDTH))
+        self.head = 0
+
+    def push(self, timestamp, temp, accel_data, gyro_data, magnet_data=None):
+        """
+        最新データを追加し、最も古いデータを上書きする。
+        引数：
+            timestamp   時刻
+            temp        気温(float)
+            accel_data  加速度データ（辞書）
+            gyro_data   角速度データ（辞書）
+            magnet_data 磁束密度データ（辞書）：オプション
+        戻り値：
+            なし
+        """
+        row = self.buffer[self.head]
+        row[RECENT_TIMESTAMP] = timestamp
+        row[RECENT_TEMP] = to_float(temp)
+        row[RECENT_ACCEL] = (to_float(accel_data['x']), to_float(accel_data['y']), to_float(accel_data['z']))
+        row[RECENT_GYRO] = (to_float(gyro_data['x']), to_float(gyro_data['y']), to_float(gyro_data['z']))
+        if magnet_data is None:
+            row[RECENT_MAGNET] = 0.0
+        else:
+            row[RECENT_MAGNET] = (to_float(magnet_data['x']), to_float(magnet_data['y']), to_float(magnet_data['z']))
+        self.buffer[self.head + self.depth] = row
+        self.head = (self.head + 1) % self.depth
+
+    def extend(self, rows):
+        """
+        (N, RECENT_WIDTH) 配列の各行を古い順に追加する。
+        引数：
+            rows    追加するIMUデータ(nd.array形式、後ろが最新)
+        戻り値：
+            なし
+        """
+        for row in rows[-self.depth:]:
+            self.buffer[self.head] = row
+            self.buffer[self.head + self.depth] = row
+            self.head = (self.head + 1) % self.depth
+
+    def to_array(self):
+        """
+        保持しているデータを古い順に並べた配列を返却する。
+        返却値はバッファのコピーのため、以降のpushの影響を受けない。
+        引数：
+            なし
+        戻り値：
+            最新IMUデータ(nd.array形式、(depth, RECENT_WIDTH)、後ろが最新)
+        """
+        return self.buffer[self.head:self.head + self.depth].copy()
+
+def encode_recent(recent, binary=False):
+    """
+    最新IMUデータ配列をTub/MQTTメッセージ格納用の文字列に変換する。
+    既定では従来と同じJSON形式({"0": {"accel": {...}, "gyro": {...}, "magnet": {...},
+    "temp": ..., "timestamp": ...}, ...}、"0"が最も古い)とし、外部の利用者に影響を与えない。
+    binary が真の場合は float64リトルエンディアンのバイト列をBase64化したものとする
+    (件数の多い imu/batch 用)。
     引数：
-        recent_data     配列、編集元
-        current_data    追加する要素
+        recent      最新IMUデータ(nd.array形式)、文字列の場合はそのまま返却する
+        binary      Base64形式とする場合真
     戻り値：
-        編集後配列
+        文字列化された最新IMUデータ
     """
-    return_data = recent_data[1:]
-    return_data.append(current_dict)
-    return return_data
-
-def str_recent_data(recent_data):
+    if recent is None or isinstance(recent, str):
+        return recent
+    data = np.ascontiguousarray(recent, dtype='<f8').reshape(-1, RECENT_WIDTH)
+    if binary:
+        return base64.b64encode(data.tobytes()).decode('ascii')
+    to_dict = lambda values: {'x': float(values[0]), 'y': float(values[1]), 'z': float(values[2])}
+    return json.dumps({str(i): pack(float(row[RECENT_TIMESTAMP]), float(row[RECENT_TEMP]),
+        to_dict(row[RECENT_ACCEL]), to_dict(row[RECENT_GYRO]), to_dict(row[RECENT_MAGNET]))
+        for i, row in enumerate(data)})
+
+def decode_recent(value):
     """
-    引数recent_data で渡された配列の要素すべてを辞書化して
-    文字列に変換する。
+    encode_recent で文字列化された最新IMUデータ、もしくは
+    従来のJSON形式文字列を配列に変換する。
     引数：
-        recent_data     文字列化対象の配列(最新データ群)
+        value       最新IMUデータ(文字列もしくはnd.array)
     戻り値：
-        文字列化化された最新データ群
+        最新IMUデータ(nd.array形式、(depth, RECENT_WIDTH)、後ろが最新)、valueがNoneの場合None
     """
-    return_dict = {}
-    depth = len(recent_data)
-    for i in range(depth):
-        return_dict[str(i)] = recent_data[i]
-    return json.dumps(return_dict)
+    if value is None or isinstance(value, np.ndarray):
+        return value
+    if value.startswith('{'):
+        # 従来のJSON形式
+        recent_array = array_recent_data(value)
+        recent = RecentBuffer(max(len(recent_array), 1))
+        for imu_dict in recent_array:
+            timestamp, temp, accel_data, gyro_data, magnet_data = unpack(imu_dict)
+            recent.push(timestamp, temp, accel_data, gyro_data, magnet_data)
+        return recent.to_array()[:len(recent_array)]
+    data = np.frombuffer(base64.b64decode(value), dtype='<f8')
+    return data.reshape(-1, RECENT_WIDTH)
 
 def array_recent_data(recent_str):
     """
@@ -1060,11 +1625,120 @@ def unpack(imu_dict):
     zeros = {'x':0, 'y':0, 'z':0}
     accel_data = imu_dict.get('accel', zeros)
     gyro_data = imu_dict.get('gyro', zeros)
-    magnet_data = imu_dict['magnet']
+    magnet_data = imu_dict.get('magnet', zeros)
     temp = imu_dict.get('temp', 0)
     timestamp = imu_dict.get('timestamp', 0.0)
     return timestamp, temp, accel_data, gyro_data, magnet_data
 
+def enable_fifo(pi, handler, sample_rate):
+    """
+    MPU6050/MPU9250 共通のFIFO有効化処理。DLPF(44Hz)を有効化して内部サンプリングを1kHzとし、
+    SMPLRT_DIV で sample_rate に近い周期を設定したうえでFIFOをリセットし有効化する。
+    引数：
+        pi              pigpio.pi() インスタンス
+        handler         I2Cハンドラ
+        sample_rate     FIFO格納周波数(Hz)
+    戻り値：
+        実際のFIFO格納周波数(Hz)
+    例外：
+        ValueError      sample_rateが範囲外の場合
+    """
+    if sample_rate is None or sample_rate < 4 or sample_rate > 1000:
+        raise ValueError('illegal fifo sample_rate = {}'.format(str(sample_rate)))
+    div = int(round(1000.0 / sample_rate)) - 1
+    # DLPF_CFG=3
+    pi.i2c_write_byte_data(handler, FIFO_REG_CONFIG, 0x03)
+    pi.i2c_write_byte_data(handler, FIFO_REG_SMPLRT_DIV, div)
+    pi.i2c_write_byte_data(handler, FIFO_REG_FIFO_EN, 0x00)
+    pi.i2c_write_byte_data(handler, FIFO_REG_USER_CTRL, FIFO_USER_CTRL_RST)
+    pi.i2c_write_byte_data(handler, FIFO_REG_FIFO_EN, FIFO_EN_ACCEL_TEMP_GYRO)
+    pi.i2c_write_byte_data(handler, FIFO_REG_USER_CTRL, FIFO_USER_CTRL_EN)
+    # 既存のオーバーフローフラグをクリア
+    pi.i2c_read_byte_data(handler, FIFO_REG_INT_STATUS)
+    return 1000.0 / (div + 1)
+
+def read_fifo(pi, handler):
+    """
+    MPU6050/MPU9250 共通のFIFO読み込み処理。FIFOカウントを読み取り、
+    格納済みのサンプルすべてを FIFO_CHUNK_SIZE バイト単位のブロック読み込みで取り出す。
+    引数：
+        pi              pigpio.pi() インスタンス
+        handler         I2Cハンドラ
+    戻り値：
+        (N, 7) 整数配列(加速度 xyz、温度、ジャイロ xyz の生値、古い順)、
+        FIFOがオーバーフローしリセットした場合None
+    例外：
+        ConnectionError I2C読み込みに失敗した場合
+    """
+    if pi.i2c_read_byte_data(handler, FIFO_REG_INT_STATUS) & FIFO_OFLOW_INT:
+        # サンプル境界が不明となるためリセットする
+        pi.i2c_write_byte_data(handler, FIFO_REG_USER_CTRL, FIFO_USER_CTRL_EN | FIFO_USER_CTRL_RST)
+        return None
+    (count, data) = pi.i2c_read_i2c_block_data(handler, FIFO_REG_COUNTH, 2)
+    if count != 2:
+        raise ConnectionError('Error:{} in i2c_read_i2c_block_data'.format(str(count)))
+    size = (((data[0] & 0x1F) << 8) | data[1]) // BURST_SIZE * BURST_SIZE
+    buffer = bytearray(size)
+    pos = 0
+    while pos < size:
+        length = min(FIFO_CHUNK_SIZE, size - pos)
+        (count, data) = pi.i2c_read_i2c_block_data(handler, FIFO_REG_R_W, length)
+        if count != length:
+            raise ConnectionError('Error:{} in i2c_read_i2c_block_data'.format(str(count)))
+        buffer[pos:pos + length] = data
+        pos += length
+    return np.frombuffer(bytes(buffer), dtype='>i2').reshape(-1, 7)
+
+def fifo_timestamps(count, last_time, now, period):
+    """
+    FIFOから読み込んだサンプルの時刻を、前回読み込み時刻から今回読み込み時刻までの
+    等間隔で補間する。前回読み込み時刻がない場合はFIFO格納周期から逆算する。
+    引数：
+        count       サンプル件数
+        last_time   前回読み込み時刻(None可)
+        now         今回読み込み時刻
+        period      FIFO格納周期(sec)
+    戻り値：
+        (count,) 時刻配列(古い順)
+    """
+    if last_time is None:
+        return now - period * np.arange(count - 1, -1, -1)
+    return last_time + (now - last_time) * np.arange(1, count + 1) / count
+
+def ahrs_samples(batch, default_period):
+    """
+    imu/batch(imu/recent と同じ列構成)を MadgwickAHRS.update_batch の入力形式へ変換する。
+    引数：
+        batch           IMUデータ(nd.array形式、(N, RECENT_WIDTH)、後ろが最新)
+        default_period  先頭サンプルのサンプリング周期(sec)
+    戻り値：
+        samples         (N, 9) 配列(ジャイロ(rad/s) xyz、加速度 xyz、磁束密度 xyz)
+        sampleperiods   (N,) サンプリング周期配列(sec)
+    """
+    samples = np.empty((len(batch), 9))
+    samples[:, 0:3] = np.radians(batch[:, RECENT_GYRO])
+    samples[:, 3:6] = batch[:, RECENT_ACCEL]
+    samples[:, 6:9] = batch[:, RECENT_MAGNET]
+    sampleperiods = np.diff(batch[:, RECENT_TIMESTAMP], prepend=batch[0, RECENT_TIMESTAMP] - default_period)
+    return samples, sampleperiods
+
+def wait_next(next_time, period):
+    """
+    前回のサンプリング予定時刻から period 秒後まで待機する。
+    処理が間に合わず予定時刻を過ぎている場合は待機せず、予定時刻を現在時刻に合わせる。
+    引数：
+        next_time   前回のサンプリング予定時刻
+        period      サンプリング周期(sec)
+    戻り値：
+        今回のサンプリング予定時刻
+    """
+    next_time += period
+    delay = next_time - time.time()
+    if delay > 0:
+        time.sleep(delay)
+        return next_time
+    return time.time()
+
 def omit_none(recent_dict, current_dict):
     """
     None値を１件前のデータに置き換える。
@@ -1096,6 +1770,16 @@ def is_zeros(target_dict):
         return True
     return False
 
+def to_dict(xyz):
+    """
+    3要素の配列を 'x', 'y', 'z' キーの辞書に変換する。
+    引数：
+        xyz     対象配列
+    戻り値：
+        辞書(x, y, z)
+    """
+    return {'x': float(xyz[0]), 'y': float(xyz[1]), 'z': float(xyz[2])}
+
 def to_float(value):
     """
     Noneを0.0に置き換えfloat化する。
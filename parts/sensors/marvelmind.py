@@ -62,6 +62,7 @@
 ###
 
 import crcmod
+import crcmod.predefined
 import serial
 import struct
 import collections
@@ -72,12 +73,138 @@ import math
 # import numpy as np
 # import marvelmindQuaternion as mq
 
+# packet kinds returned by MarvelmindParser
+PACKET_ULTRASOUND_POSITION = 'us_position'
+PACKET_IMU_RAW_DATA = 'imu_raw'
+PACKET_ULTRASOUND_RAW_DATA = 'us_raw'
+PACKET_IMU_DATA = 'imu'
+
+PACKET_HEADER = b'\xff\x47'
+_HEADER_STRUCT = struct.Struct('<HB')   # data code, payload length
+_CRC_STRUCT = struct.Struct('<H')
+# payload layouts, the trailing CRC16 is read separately
+_CM_STRUCT = struct.Struct('<LhhhxBhxx')
+_MM_STRUCT = struct.Struct('<LlllxBhxx')
+_RAW_IMU_STRUCT = struct.Struct('<hhhhhhhhhxxxxxxLxxxx')
+_IMU_STRUCT = struct.Struct('<lllhhhhhhhhhhxxLxxxx')
+_DISTANCES_STRUCT = struct.Struct('<BBlxBlxBlxBlxLxxx')
+
+# CRC16/MODBUS (table driven, built once)
+crc16 = crcmod.predefined.mkPredefinedCrcFun('modbus')
+
+
+def _cm_position(values):
+    usnTimestamp, usnX, usnY, usnZ, usnAdr, usnAngle = values
+    return [usnAdr, usnX/100.0, usnY/100.0, usnZ/100.0, 0b0000111111111111&usnAngle, usnTimestamp]
+
+def _mm_position(values):
+    usnTimestamp, usnX, usnY, usnZ, usnAdr, usnAngle = values
+    return [usnAdr, usnX/1000.0, usnY/1000.0, usnZ/1000.0, 0b0000111111111111&usnAngle, usnTimestamp]
+
+def _imu_raw_data(values):
+    return list(values)
+
+def _imu_data(values):
+    x, y, z, qw, qx, qy, qz, vx, vy, vz, ax, ay, az, timestamp = values
+    return [x/1000.0, y/1000.0, z/1000.0, qw/10000.0, qx/10000.0, qy/10000.0, qz/10000.0, vx/1000.0, vy/1000.0, vz/1000.0, ax/1000.0,ay/1000.0,az/1000.0, timestamp]
+
+def _distances(values):
+    HedgeAdr, b1, b1d, b2, b2d, b3, b3d, b4, b4d, timestamp = values
+    return [HedgeAdr, b1, b1d/1000.0, b2, b2d/1000.0, b3, b3d/1000.0, b4, b4d/1000.0, timestamp]
+
+# data code -> (packet kind, payload struct, converter)
+_DECODERS = {
+    0x0001: (PACKET_ULTRASOUND_POSITION, _CM_STRUCT, _cm_position),
+    0x0011: (PACKET_ULTRASOUND_POSITION, _MM_STRUCT, _mm_position),
+    0x0003: (PACKET_IMU_RAW_DATA, _RAW_IMU_STRUCT, _imu_raw_data),
+    0x0004: (PACKET_ULTRASOUND_RAW_DATA, _DISTANCES_STRUCT, _distances),
+    0x0005: (PACKET_IMU_DATA, _IMU_STRUCT, _imu_data),
+}
+
+
+class MarvelmindParser:
+    """
+    Incremental parser of the hedgehog serial stream.
+    Bytes are appended to a preallocated buffer and complete packets are
+    decoded in place, so a whole chunk read from the port is handled at once.
+    """
+    def __init__(self, capacity=4096, debug=False):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.debug = debug
+        self.start = 0  # first unparsed byte
+        self.end = 0    # end of received bytes
+        self.crc_errors = 0
+
+    def reset(self):
+        self.start = 0
+        self.end = 0
+
+    def feed(self, data):
+        """
+        Append received bytes and return the decoded packets
+        as a list of (packet kind, value list).
+        """
+        size = len(data)
+        if self.end + size > len(self.buffer):
+            # move the unparsed tail (at most one partial packet) to the front
+            remain = self.end - self.start
+            if remain + size > len(self.buffer):
+                # grow for a chunk larger than the buffer
+                buffer = bytearray(max(len(self.buffer) * 2, remain + size))
+                buffer[0:remain] = self.view[self.start:self.end]
+                self.view.release()
+                self.buffer, self.view = buffer, memoryview(buffer)
+            else:
+                self.buffer[0:remain] = self.view[self.start:self.end]
+            self.start, self.end = 0, remain
+        self.buffer[self.end:self.end + size] = data
+        self.end += size
+        return self.parse()
+
+    def parse(self):
+        packets = []
+        buf, pos, end = self.buffer, self.start, self.end
+        while True:
+            pos = buf.find(PACKET_HEADER, pos, end)
+            if pos < 0:
+                # keep a trailing 0xff which may start the next header
+                pos = end - 1 if end > self.start and buf[end - 1] == 0xff else end
+                break
+            if pos + 5 > end:
+                break
+            code, msgLen = _HEADER_STRUCT.unpack_from(buf, pos + 2)
+            if pos + msgLen + 7 > end:
+                break
+            usnCRC16, = _CRC_STRUCT.unpack_from(buf, pos + 5 + msgLen)
+            if crc16(self.view[pos:pos + 5 + msgLen]) != usnCRC16:
+                self.crc_errors += 1
+                if self.debug:
+                    print ('\n*** CRC ERROR')
+                pos += len(PACKET_HEADER)  # resynchronize on the next header
+                continue
+            decoder = _DECODERS.get(code)
+            if decoder is not None and decoder[1].size == msgLen:
+                kind, payload, convert = decoder
+                packets.append((kind, convert(payload.unpack_from(buf, pos + 5))))
+                if self.debug:
+                    print ('\n>> Found USNAV beacon packet code 0x%04x at offset %d' % (code, pos))
+            elif self.debug:
+                print ('\n>> Skip USNAV beacon packet code 0x%04x length %d' % (code, msgLen))
+            pos += msgLen + 7
+        if pos >= end:
+            self.start = self.end = 0
+        else:
+            self.start = pos
+        return packets
+
+
 class MarvelmindHedge (Thread):
     def __init__ (self, adr=None, tty="/dev/ttyACM0", baud=9600, maxvaluescount=3, debug=False, recieveUltrasoundPositionCallback=None, recieveImuRawDataCallback=None, recieveImuDataCallback=None, recieveUltrasoundRawDataCallback=None):
         self.tty = tty  # serial
         self.baud = baud  # baudrate
         self.debug = debug  # debug flag
-        self._bufferSerialDeque = collections.deque(maxlen=255)  # serial buffer
+        self._parser = MarvelmindParser(debug=debug)  # serial buffer and packet parser
 
         self.valuesUltrasoundPosition = collections.deque([[0]*6]*maxvaluescount, maxlen=maxvaluescount) # ultrasound position buffer
         self.recieveUltrasoundPositionCallback = recieveUltrasoundPositionCallback
@@ -109,129 +236,53 @@ class MarvelmindHedge (Thread):
             print ("Hedge {:d}: X: {:.3f}, Y: {:.3f}, Z: {:.3f}, Angle: {:d} at time T: {:.2f}".format(self.position()[0], self.position()[1], self.position()[2], self.position()[3], self.position()[4], self.position()[5]/1000.0))
 
     def position(self):
-        return list(self.valuesUltrasoundPosition)[-1]
+        return self.valuesUltrasoundPosition[-1]
            
     def print_distances(self):
         self.distancesUpdated = False
         print ("Distances: B{:d}:{:.3f}, B{:d}:{:.3f}, B{:d}:{:.3f}, B{:d}:{:.3f}   at time T: {:.2f}".format(self.distances()[1], self.distances()[2], self.distances()[3], self.distances()[4], self.distances()[5], self.distances()[6], self.distances()[7], self.distances()[8], self.distances()[9]/1000.0))
 
     def distances(self):
-        return list(self.valuesUltrasoundRawData)[-1]
+        return self.valuesUltrasoundRawData[-1]
     
     def stop(self):
         self.terminationRequired = True
         print ("stopping")
 
+    def dispatch(self, kind, value):
+        if (kind == PACKET_ULTRASOUND_POSITION):
+            if (self.adr == value[0] or self.adr is None):
+                self.valuesUltrasoundPosition.append(value)
+                if (self.recieveUltrasoundPositionCallback is not None):
+                    self.recieveUltrasoundPositionCallback()
+        elif (kind == PACKET_IMU_RAW_DATA):
+            self.valuesImuRawData.append(value)
+            if (self.recieveImuRawDataCallback is not None):
+                self.recieveImuRawDataCallback()
+        elif (kind == PACKET_ULTRASOUND_RAW_DATA):
+            self.valuesUltrasoundRawData.append(value)
+            self.distancesUpdated= True
+            if (self.recieveUltrasoundRawDataCallback is not None):
+                self.recieveUltrasoundRawDataCallback()
+        elif (kind == PACKET_IMU_DATA):
+            self.valuesImuData.append(value)
+            if (self.recieveImuDataCallback is not None):
+                self.recieveImuDataCallback()
+
     def run(self):      
         while (not self.terminationRequired):
             if (not self.pause):
                 try:
                     if (self.serialPort is None):
                         self.serialPort = serial.Serial(self.tty, self.baud, timeout=3)
-                    readChar = self.serialPort.read(1)
-                    while (readChar is not None) and (readChar is not '') and (not self.terminationRequired):
-                        self._bufferSerialDeque.append(readChar)
-                        readChar = self.serialPort.read(1)
-                        bufferList = list(self._bufferSerialDeque)
-                        
-                        strbuf = (b''.join(bufferList))
-
-                        pktHdrOffset = strbuf.find(b'\xff\x47')
-                        if (pktHdrOffset >= 0 and len(bufferList) > pktHdrOffset + 4 and pktHdrOffset<220):
-#                           print(bufferList)
-                            isMmMessageDetected = False
-                            isCmMessageDetected = False
-                            isRawImuMessageDetected = False
-                            isImuMessageDetected = False
-                            isDistancesMessageDetected = False
-                            pktHdrOffsetCm = strbuf.find(b'\xff\x47\x01\x00')
-                            pktHdrOffsetMm = strbuf.find(b'\xff\x47\x11\x00')
-                            pktHdrOffsetRawImu = strbuf.find(b'\xff\x47\x03\x00')
-                            pktHdrOffsetDistances = strbuf.find(b'\xff\x47\x04\x00')
-                            pktHdrOffsetImu = strbuf.find(b'\xff\x47\x05\x00')
-
-                            if (pktHdrOffsetMm!=-1):
-                                isMmMessageDetected = True
-                                if (self.debug): print ('Message with US-position(mm) was detected')
-                            elif (pktHdrOffsetCm!=-1):
-                                isCmMessageDetected = True
-                                if (self.debug): print ('Message with US-position(cm) was detected')
-                            elif (pktHdrOffsetRawImu!=-1):
-                                isRawImuMessageDetected = True
-                                if (self.debug): print ('Message with raw IMU data was detected')
-                            elif (pktHdrOffsetDistances!=-1):
-                                isDistancesMessageDetected = True
-                                if (self.debug): print ('Message with distances was detected')
-                            elif (pktHdrOffsetImu!=-1):
-                                isImuMessageDetected = True
-                                if (self.debug): print ('Message with processed IMU data was detected')
-                            msgLen = ord(bufferList[pktHdrOffset + 4])
-                            if (self.debug): print ('Message length: ', msgLen)
-
-                            try:
-                                if (len(bufferList) > pktHdrOffset + 4 + msgLen + 2):
-                                    usnCRC16 = 0
-                                    if (isCmMessageDetected):
-                                        usnTimestamp, usnX, usnY, usnZ, usnAdr, usnAngle, usnCRC16 = struct.unpack_from ('<LhhhxBhxxH', strbuf, pktHdrOffset + 5)
-                                        usnX = usnX/100.0
-                                        usnY = usnY/100.0
-                                        usnZ = usnZ/100.0
-                                        usnAngle = 0b0000111111111111&usnAngle
-                                    elif (isMmMessageDetected):
-                                        usnTimestamp, usnX, usnY, usnZ, usnAdr, usnAngle, usnCRC16 = struct.unpack_from ('<LlllxBhxxH', strbuf, pktHdrOffset + 5)
-                                        usnX = usnX/1000.0
-                                        usnY = usnY/1000.0
-                                        usnZ = usnZ/1000.0
-                                        usnAngle = 0b0000111111111111&usnAngle
-                                    elif (isRawImuMessageDetected):
-                                        ax, ay, az, gx, gy, gz, mx, my, mz, timestamp, usnCRC16 = struct.unpack_from ('<hhhhhhhhhxxxxxxLxxxxH', strbuf, pktHdrOffset + 5)
-                                    elif (isImuMessageDetected):
-                                        x, y, z, qw, qx, qy, qz, vx, vy, vz, ax, ay, az, timestamp, usnCRC16 = struct.unpack_from ('<lllhhhhhhhhhhxxLxxxxH', strbuf, pktHdrOffset + 5)
-                                    elif (isDistancesMessageDetected):
-                                        HedgeAdr, b1, b1d, b2, b2d, b3, b3d, b4, b4d, timestamp,usnCRC16 = struct.unpack_from ('<BBlxBlxBlxBlxLxxxH', strbuf, pktHdrOffset + 5)
-
-                                    crc16 = crcmod.predefined.Crc('modbus')
-                                    crc16.update(strbuf[ pktHdrOffset : pktHdrOffset + msgLen + 5 ])
-                                    CRC_calc = int(crc16.hexdigest(), 16)
-
-                                    if CRC_calc == usnCRC16:
-                                        if (isMmMessageDetected or isCmMessageDetected):
-                                            value = [usnAdr, usnX, usnY, usnZ, usnAngle, usnTimestamp]
-                                            if (self.adr == usnAdr or self.adr is None):
-                                                self.valuesUltrasoundPosition.append(value)
-                                                if (self.recieveUltrasoundPositionCallback is not None):
-                                                    self.recieveUltrasoundPositionCallback()
-                                        elif (isRawImuMessageDetected):
-                                            value = [ax, ay, az, gx, gy, gz, mx, my, mz, timestamp]
-                                            self.valuesImuRawData.append(value)
-                                            if (self.recieveImuRawDataCallback is not None):
-                                                self.recieveImuRawDataCallback()
-                                        elif (isDistancesMessageDetected):
-                                            value = [HedgeAdr, b1, b1d/1000.0, b2, b2d/1000.0, b3, b3d/1000.0, b4, b4d/1000.0, timestamp]
-                                            self.valuesUltrasoundRawData.append(value)
-                                            self.distancesUpdated= True
-                                            if (self.recieveUltrasoundRawDataCallback is not None):
-                                                self.recieveUltrasoundRawDataCallback()
-                                        elif (isImuMessageDetected):
-                                            value = [x/1000.0, y/1000.0, z/1000.0, qw/10000.0, qx/10000.0, qy/10000.0, qz/10000.0, vx/1000.0, vy/1000.0, vz/1000.0, ax/1000.0,ay/1000.0,az/1000.0, timestamp]
-                                            self.valuesImuData.append(value)
-                                            if (self.recieveImuDataCallback is not None):
-                                                self.recieveImuDataCallback()
-                                    else:
-                                        if self.debug:
-                                            print ('\n*** CRC ERROR')
-
-                                    if pktHdrOffset == -1:
-                                        if self.debug:
-                                            print ('\n*** ERROR: Marvelmind USNAV beacon packet header not found (check modem board or radio link)')
-                                        continue
-                                    elif pktHdrOffset >= 0:
-                                        if self.debug:
-                                            print ('\n>> Found USNAV beacon packet header at offset %d' % pktHdrOffset)
-                                    for x in range(0, pktHdrOffset + msgLen + 7):
-                                        self._bufferSerialDeque.popleft()
-                            except struct.error:
-                                print ('smth wrong')
+                        self._parser.reset()
+                    while (not self.pause) and (not self.terminationRequired):
+                        # block for the first byte, then take everything already received
+                        data = self.serialPort.read(max(1, self.serialPort.in_waiting))
+                        if not data:
+                            break
+                        for kind, value in self._parser.feed(data):
+                            self.dispatch(kind, value)
                 except OSError:
                     if self.debug:
                         print ('\n*** ERROR: OS error (possibly serial port is not available)')
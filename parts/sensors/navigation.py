@@ -305,13 +305,17 @@ class IMUCopier:
 class HedgehogController:
     """
     Marvelmind側のコールバック機能を使用したモバイルビーコンデータ取得パーツクラス。
+    Marvelmindスレッドはメッセージ種別ごとの値をタプル(変更不可)として作成し、
+    run_threaded が返却する出力タプル全体を1回の代入で差し替える。
+    このため出力タプルが複数パケットの値の途中状態を含むことはない。
     """
-    def __init__(self, tty='/dev/ttyACM0', adr=79, debug=False):
+    def __init__(self, tty='/dev/ttyACM0', adr=79, output_sequence=False, debug=False):
         """
         インスタンス変数を初期化し、Marvelmindスレッドを開始する。
         引数：
             tty             シリアルポートを表すキャラクタデバイスパス
             adr             ビーコン側アドレス(ID)
+            output_sequence 真の場合、出力の末尾に usnav/imu/dist の受信連番を追加する
             debug           marvelmind.pyにてデバッグ出力するか
         戻り値：
             なし
@@ -319,6 +323,7 @@ class HedgehogController:
         if debug:
             print('[HedgehogController] __init__ called adr={}'.format(str(adr)))
         self.id = adr
+        self.output_sequence = output_sequence
         self.debug = debug
         self.init()
         self.hedge = MarvelmindHedge(
@@ -342,49 +347,40 @@ class HedgehogController:
         戻り値：
             なし
         """
-        self.usnav_id = self.id
-        self.usnav_x = 0
-        self.usnav_y = 0
-        self.usnav_z = 0
-        self.usnav_angle = 0
-        self.usnav_timestamp = 0
-        self.imu_x = 0
-        self.imu_y = 0
-        self.imu_z = 0
-        self.imu_qw = 0
-        self.imu_qx = 0
-        self.imu_qy = 0
-        self.imu_qz = 0
-        self.imu_vx = 0
-        self.imu_vy = 0
-        self.imu_vz = 0
-        self.imu_ax = 0
-        self.imu_ay = 0
-        self.imu_az = 0
-        self.imu_gx = 0
-        self.imu_gy = 0
-        self.imu_gz = 0
-        self.imu_mx = 0
-        self.imu_my = 0
-        self.imu_mz = 0
-        self.imu_timestamp = 0
-        self.dist_id = self.id
-        self.dist_b1 = 0
-        self.dist_b1d = 0
-        self.dist_b2 = 0
-        self.dist_b2d = 0
-        self.dist_b3 = 0
-        self.dist_b3d = 0
-        self.dist_b4 = 0
-        self.dist_b4d = 0
-        self.dist_timestamp = 0
+        # (usnav_id, usnav_x, usnav_y, usnav_z, usnav_angle, usnav_timestamp)
+        self.usnav = (self.id, 0, 0, 0, 0, 0)
+        # (imu_x, imu_y, imu_z, imu_qw, imu_qx, imu_qy, imu_qz,
+        #  imu_vx, imu_vy, imu_vz, imu_ax, imu_ay, imu_az,
+        #  imu_gx, imu_gy, imu_gz, imu_mx, imu_my, imu_mz, imu_timestamp)
+        self.imu = (0,) * 20
+        # (dist_id, dist_b1, dist_b1d, dist_b2, dist_b2d,
+        #  dist_b3, dist_b3d, dist_b4, dist_b4d, dist_timestamp)
+        self.dist = (self.id, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        # 受信連番(値が更新されていない場合は変化しない)
+        self.usnav_seq = 0
+        self.imu_seq = 0
+        self.dist_seq = 0
+        self.publish()
         if self.debug:
             print('[HedgehogController] init instance values')
 
+    def publish(self):
+        """
+        run_threaded が返却する出力タプルを作成し差し替える。
+        Marvelmindスレッドからのみ呼び出される。
+        引数：
+            なし
+        戻り値：
+            なし
+        """
+        outputs = self.usnav + self.imu + self.dist
+        if self.output_sequence:
+            outputs += (self.usnav_seq, self.imu_seq, self.dist_seq)
+        self.outputs = outputs
 
     def usnav_callback(self):
         """
-        位置情報をインスタンス変数へ格納する。
+        位置情報を取り込み出力タプルを更新する。
         引数：
             なし
         戻り値：
@@ -397,11 +393,6 @@ class HedgehogController:
             if self.debug:
                 print('[HedgehogController] hedge is None')
             return
-        values_usnav = getattr(self.hedge, 'valuesUltrasoundPosition', None)
-        if values_usnav is None:
-            if self.debug:
-                print('[HedgehogController] self.hedge has no valuesUltrasoundPosition')
-            return
         usnav = self.hedge.position()
         if self.debug:
             print(usnav)
@@ -412,20 +403,12 @@ class HedgehogController:
                     str(self.id)
                 ))
         if isinstance(usnav, list) and len(usnav) == 6:
-            self.usnav_id = usnav[0]
-            self.usnav_x = usnav[1]
-            self.usnav_y = usnav[2]
-            self.usnav_z = usnav[3]
-            self.usnav_angle = usnav[4]
-            self.usnav_timestamp = usnav[5]/1000.0
+            self.usnav = (usnav[0], usnav[1], usnav[2], usnav[3], usnav[4], usnav[5]/1000.0)
+            self.usnav_seq += 1
+            self.publish()
             if self.debug:
                 print('[HedgehogController] (x, y, z)=({}, {}, {}), angle={}, timestamp={}'.format(
-                    str(self.usnav_x),
-                    str(self.usnav_y),
-                    str(self.usnav_z),
-                    str(self.usnav_angle),
-                    str(self.usnav_timestamp)
-                ))
+                    *[str(v) for v in self.usnav[1:]]))
         else:
             if self.debug:
                 print('[HedgehogController] usnav data ignored no match format')
@@ -433,7 +416,7 @@ class HedgehogController:
 
     def imu_raw_callback(self):
         """
-        加速度、ジャイロ、磁束密度を取得し、インスタンス変数へ格納する。
+        加速度、ジャイロ、磁束密度を取り込み出力タプルを更新する。
         引数：
             なし
         戻り値：
@@ -442,53 +425,32 @@ class HedgehogController:
         # [ax, ay, az, gx, gy, gz, mx, my, mz, timestamp]
         if self.debug:
             print('[HedgehogController] imu raw data recieved')
-        values_raw_imu = getattr(self.hedge, 'valuesImuRawData', None)
-        if values_raw_imu is None:
-            if self.debug:
-                print('[HedgehogController] imu raw data has no valuesImuRawData')
-            return
-        raw_imu = list(values_raw_imu)[-1]
-        if raw_imu is None:
+        if self.hedge is None:
             if self.debug:
-                print('[HedgehogController] imu raw data is None')
+                print('[HedgehogController] self.hedge is None')
             return
+        raw_imu = self.hedge.valuesImuRawData[-1]
         if self.debug:
             print(raw_imu)
         if len(raw_imu) == 10:
-            self.imu_ax = raw_imu[0]
-            self.imu_ay = raw_imu[1]
-            self.imu_az = raw_imu[2]
-            self.imu_gx = raw_imu[3]
-            self.imu_gy = raw_imu[4]
-            self.imu_gz = raw_imu[5]
-            self.imu_mx = raw_imu[6]
-            self.imu_my = raw_imu[7]
-            self.imu_mz = raw_imu[8]
-            #self.imu_timestamp = raw_imu[9]
+            # 加速度、ジャイロ、磁束密度を差し替える(タイムスタンプはIMUデータ側を維持)
+            self.imu = self.imu[0:10] + tuple(raw_imu[0:9]) + self.imu[19:20]
+            self.imu_seq += 1
+            self.publish()
             if self.debug:
                 print('[HedgehogController] (ax, ay, az) = ({}, {}, {}), timestamp={}'.format(
-                    str(self.imu_ax),
-                    str(self.imu_ay),
-                    str(self.imu_az),
-                    str(self.imu_timestamp)
-                ))
+                    *[str(v) for v in self.imu[10:13] + self.imu[19:20]]))
                 print('[HedgehogController] (gx, gy, gz) = ({}, {}, {})'.format(
-                    str(self.imu_gx),
-                    str(self.imu_gy),
-                    str(self.imu_gz)
-                ))
+                    *[str(v) for v in self.imu[13:16]]))
                 print('[HedgehogController] (mx, my, mz) = ({}, {}, {})'.format(
-                    str(self.imu_mx),
-                    str(self.imu_my),
-                    str(self.imu_mz)
-                ))
+                    *[str(v) for v in self.imu[16:19]]))
             return
         if self.debug:
             print('[HedgehogController] no match format')
 
     def imu_callback(self):
         """
-        IMUデータをインスタンス変数へ格納する。
+        IMUデータを取り込み出力タプルを更新する。
         引数：
             なし
         戻り値：
@@ -505,56 +467,27 @@ class HedgehogController:
             if self.debug:
                 print('[HedgehogController] self.hedge is None')
             return
-        values_dist = getattr(self.hedge, 'valuesImuData', None)
-        if values_dist is None:
-            if self.debug:
-                print('[HedgehogController] self.hedge has no valuesImuData')
-            return
-        imu = list(self.hedge.valuesImuData)[-1]
+        imu = self.hedge.valuesImuData[-1]
         if self.debug:
             print(imu)
         if isinstance(imu, list) and len(imu) == 14:
-            self.imu_x = imu[0]
-            self.imu_y = imu[1]
-            self.imu_z = imu[2]
-            self.imu_qw = imu[3]
-            self.imu_qx = imu[4]
-            self.imu_qy = imu[5]
-            self.imu_qz = imu[6]
-            self.imu_vx = imu[7]
-            self.imu_vy = imu[8]
-            self.imu_vz = imu[9]
-            self.imu_ax = imu[10]
-            self.imu_ay = imu[11]
-            self.imu_az = imu[12]
-            self.imu_timestamp = imu[13]
+            # ジャイロ、磁束密度はRaw IMUデータ側を維持
+            self.imu = tuple(imu[0:13]) + self.imu[13:19] + (imu[13],)
+            self.imu_seq += 1
+            self.publish()
             if self.debug:
                 print('[HedgehogController] (x, y, z) = ({}, {}, {})'.format(
-                    str(self.imu_x),
-                    str(self.imu_y),
-                    str(self.imu_z)
-                ))
+                    *[str(v) for v in self.imu[0:3]]))
                 print('[HedgehogController] (qw, qx, qy, qz) = ({}, {}, {}, {})'.format(
-                    str(self.imu_qw),
-                    str(self.imu_qx),
-                    str(self.imu_qy),
-                    str(self.imu_qz)
-                ))
+                    *[str(v) for v in self.imu[3:7]]))
                 print('[HedgehogController] (vx, vy, vz) = ({}, {}, {})'.format(
-                    str(self.imu_vx),
-                    str(self.imu_vy),
-                    str(self.imu_vz)
-                ))
+                    *[str(v) for v in self.imu[7:10]]))
                 print('[HedgehogController] (ax, ay, az) = ({}, {}, {}), timestamp={}'.format(
-                    str(self.imu_ax),
-                    str(self.imu_ay),
-                    str(self.imu_az),
-                    str(self.imu_timestamp)
-                ))
+                    *[str(v) for v in self.imu[10:13] + self.imu[19:20]]))
 
     def usnav_raw_callback(self):
         """
-        ビーコン間距離データをインスタンス変数へ格納する。
+        ビーコン間距離データを取り込み出力タプルを更新する。
         引数： 
             なし
         戻り値：
@@ -568,38 +501,16 @@ class HedgehogController:
             if self.debug:
                 print('self.hedge is None')
             return
-        values_dist = getattr(self.hedge, 'valuesUltrasoundRawData', None)
-        if values_dist is None:
-            if self.debug:
-                print('self.hedge has no valuesUltrasoundRawData')
-            return
         dist = self.hedge.distances()
         if self.debug:
             print(dist)
         if len(dist) == 10 and dist[0] == self.id:
-            self.dist_id = dist[0]
-            self.dist_b1 = dist[1]
-            self.dist_b1d = dist[2]
-            self.dist_b2 = dist[3]
-            self.dist_b2d = dist[4]
-            self.dist_b3 = dist[5]
-            self.dist_b3d = dist[6]
-            self.dist_b4 = dist[7]
-            self.dist_b4d = dist[8]
-            self.dist_timestamp = dist[9]/1000.0
+            self.dist = tuple(dist[0:9]) + (dist[9]/1000.0,)
+            self.dist_seq += 1
+            self.publish()
             if self.debug:
                 print('[HedgehogController] Adr:{} B1:{}:{}, B2:{}:{}, B3:{},{}, B4:{},{}, t={}'.format(
-                    str(self.dist_id),
-                    str(self.dist_b1),
-                    str(self.dist_b1d),
-                    str(self.dist_b2),
-                    str(self.dist_b2d),
-                    str(self.dist_b3),
-                    str(self.dist_b3d),
-                    str(self.dist_b4),
-                    str(self.dist_b4d),
-                    str(self.dist_timestamp)
-                ))
+                    *[str(v) for v in self.dist]))
         else:
             if self.debug:
                 print('[HedgehogController] usnav raw data ignored id:{} is not {} or len={}'.format(
@@ -659,6 +570,9 @@ class HedgehogController:
             dist_b4         ステーショナリビーコン4のアドレス
             dist_b4d        ステーショナリビーコン4までの距離
             dist_timestamp  Distance取得タイムスタンプ
+            usnav_seq       USNav受信連番(output_sequence=True の場合のみ)
+            imu_seq         IMU受信連番(output_sequence=True の場合のみ)
+            dist_seq        Distance受信連番(output_sequence=True の場合のみ)
         """
         self.update()
         return self.run_threaded()
@@ -702,50 +616,14 @@ class HedgehogController:
             dist_b4         ステーショナリビーコン4のアドレス
             dist_b4d        ステーショナリビーコン4までの距離
             dist_timestamp  Distance取得タイムスタンプ
+            usnav_seq       USNav受信連番(output_sequence=True の場合のみ)
+            imu_seq         IMU受信連番(output_sequence=True の場合のみ)
+            dist_seq        Distance受信連番(output_sequence=True の場合のみ)
         """
         if self.debug:
-            print('[HedgehogController] run_threaded called')
-            print('dist_id={}, b1:{}, b1d:{}'.format(
-                str(self.dist_id),
-                str(self.dist_b1),
-                str(self.dist_b1d)
-            ))
-        return  self.usnav_id, \
-                self.usnav_x, \
-                self.usnav_y, \
-                self.usnav_z, \
-                self.usnav_angle, \
-                self.usnav_timestamp, \
-                self.imu_x, \
-                self.imu_y, \
-                self.imu_z, \
-                self.imu_qw, \
-                self.imu_qx, \
-                self.imu_qy, \
-                self.imu_qz, \
-                self.imu_vx, \
-                self.imu_vy, \
-                self.imu_vz, \
-                self.imu_ax, \
-                self.imu_ay, \
-                self.imu_az, \
-                self.imu_gx, \
-                self.imu_gy, \
-                self.imu_gz, \
-                self.imu_mx, \
-                self.imu_my, \
-                self.imu_mz, \
-                self.imu_timestamp, \
-                self.dist_id, \
-                self.dist_b1, \
-                self.dist_b1d, \
-                self.dist_b2, \
-                self.dist_b2d, \
-                self.dist_b3, \
-                self.dist_b3d, \
-                self.dist_b4, \
-                self.dist_b4d, \
-                self.dist_timestamp
+            print('[HedgehogController] run_threaded called seq usnav:{} imu:{} dist:{}'.format(
+                str(self.usnav_seq), str(self.imu_seq), str(self.dist_seq)))
+        return self.outputs
 
     def shutdown(self):
         """
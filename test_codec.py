@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+辞書型データを送信する各Publisherについて、JSON形式とバイナリ形式
+(parts.broker.codec)のメッセージサイズ・エンコード時間を比較し、
+Subscriberのrun()がどちらの形式でも同じ値を返すことを確認する。
+AWS IoT Core へは接続せず、MQTTクライアントはダミーを使用する。
+"""
+import time
+import numpy as np
+
+class DummyClient:
+    """
+    publish/subscribe を記録するだけのMQTTクライアント。
+    """
+    def __init__(self):
+        self.published = []
+    def publish(self, topic, payload, qos):
+        self.published.append((topic, payload))
+        return True
+    def subscribe(self, topic, qos, callback):
+        return True
+
+class DummyFactory:
+    """
+    AWSShadowClientFactory の代わりにダミークライアントを返すファクトリ。
+    """
+    def __init__(self, thing_name='smith'):
+        self.system = 'real'
+        self.thing_type = 'agent'
+        self.thing_group = 'loader'
+        self.thing_name = thing_name
+        self.client = DummyClient()
+    def get_mqtt_client(self):
+        return self.client
+    def get_publish_worker(self):
+        return None
+
+class DummyMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+def make_cases():
+    """
+    (Publisherクラス, Subscriberクラス, runの引数) のリストを返却する。
+    """
+    from parts.broker.pub import Publisher, UserPublisher, USNavPublisher, \
+        USNavRawPublisher, IMUPublisher, Mpu6050Publisher, Mpu9250Publisher, JoystickPublisher
+    from parts.broker.sub import Subscriber, UserSubscriber, USNavSubscriber, \
+        USNavRawSubscriber, IMUSubscriber, Mpu6050Subscriber, Mpu9250Subscriber, JoystickSubscriber
+    recent = np.random.RandomState(0).normal(size=(3, 11))
+    return [
+        (Publisher, Subscriber, [0.25, 0.5, -0.1, 0.3, 0.6, 0.0, 'local_angle']),
+        (UserPublisher, UserSubscriber, [0.25, 0.5, -0.1, 'user']),
+        (USNavPublisher, USNavSubscriber, [59, 1.234, 2.345, 0.0, 123.0, 1581234567.0]),
+        (USNavRawPublisher, USNavRawSubscriber, [59, 1, 1.1, 2, 2.2, 3, 3.3, 4, 4.4, 1581234567.0]),
+        (IMUPublisher, IMUSubscriber, [float(i) / 7 for i in range(19)] + [1581234567.0]),
+        (Mpu6050Publisher, Mpu6050Subscriber, [0.1, 0.2, 9.8, 0.01, 0.02, 0.03, recent, 1581234567.123]),
+        (Mpu9250Publisher, Mpu9250Subscriber, [0.1, 0.2, 9.8, 0.01, 0.02, 0.03, 20.0, -5.0, 40.0, 25.5, recent, 1581234567.123]),
+        (JoystickPublisher, JoystickSubscriber, [0.25, 0.5, -0.1, 'user', True]),
+    ]
+
+def subscribe(sub_class, topic, payload):
+    """
+    Subscriberへメッセージを渡し、run() の戻り値を返却する。
+    """
+    sub = sub_class(DummyFactory('jones'), debug=False, use_bin=topic.endswith('/bin'))
+    sub.mycallback(None, None, DummyMessage(topic, payload))
+    return sub.run()
+
+def assert_same(outputs, expected):
+    for output, value in zip(outputs, expected):
+        if isinstance(value, np.ndarray):
+            assert np.array_equal(output, value), '{} != {}'.format(str(output), str(value))
+        else:
+            assert output == value, '{} != {}'.format(str(output), str(value))
+
+def test_codec(count=10000):
+    for pub_class, sub_class, args in make_cases():
+        results = {}
+        for use_bin in [False, True]:
+            pub = pub_class(DummyFactory(), debug=False, use_bin=use_bin)
+            pub.run(*args)
+            topic, payload = pub.client.published[-1]
+            start = time.time()
+            for _ in range(count):
+                pub.to_message(*args)
+            elapsed = time.time() - start
+            results[use_bin] = (topic, payload, elapsed)
+        json_topic, json_payload, json_time = results[False]
+        bin_topic, bin_payload, bin_time = results[True]
+        assert json_topic.endswith('/json') and bin_topic.endswith('/bin')
+        json_outputs = subscribe(sub_class, json_topic, json_payload)
+        bin_outputs = subscribe(sub_class, bin_topic, bin_payload)
+        if pub_class.__name__ in ['Publisher', 'UserPublisher']:
+            # 末尾の timestamp は送信時刻
+            json_outputs, bin_outputs = json_outputs[:-1], bin_outputs[:-1]
+        assert_same(bin_outputs, json_outputs)
+        print('[test_codec] {:18s} size json:{:4d} bin:{:4d} bytes  encode json:{:5.1f} bin:{:5.1f} usec'.format(
+            pub_class.__name__, len(json_payload), len(bin_payload),
+            json_time / count * 1e6, bin_time / count * 1e6))
+
+def test_decode_error():
+    from parts.broker.codec import decode_message, encode_message, SCHEMA_JOYSTICK, CODEC_VERSION
+    payload = encode_message(SCHEMA_JOYSTICK, {
+        'user/angle': 0.0, 'user/throttle': 0.0, 'user/lift_throttle': 0.0,
+        'user/mode': 'user', 'recording': False})
+    for broken in [payload[:5], bytes([CODEC_VERSION + 1]) + payload[1:], payload[:1] + b'\xff' + payload[2:]]:
+        try:
+            decode_message(broken)
+        except ValueError as e:
+            print('[test_decode_error] {}'.format(str(e)))
+        else:
+            raise AssertionError('decoded broken message')
+
+def test_frame(ticks=20, window=5):
+    """
+    FramePublisher で送信したフレーム・イメージを FrameSubscriber に渡し、
+    1ティックずつ元の値に展開されることと、publish 回数を確認する。
+    """
+    from parts.broker.pub import FramePublisher
+    from parts.broker.pub.base import arr_to_bytearray
+    from parts.broker.sub import FrameSubscriber
+    from parts.broker.sub.base import bytearray_to_arr
+    keys = ['user/angle', 'user/mode', 'recording', 'usnav/id', 'imu/recent', 'imu/acl_x']
+    image_keys = ['cam/image_array']
+    rng = np.random.RandomState(0)
+    ticks_values = [[
+        float(i) / ticks, 'user', i % 2 == 0, 59, rng.normal(size=(3, 11)), None,
+        rng.randint(0, 255, (120, 160, 3)).astype(np.uint8)] for i in range(ticks)]
+    pub = FramePublisher(DummyFactory(), keys, image_keys, window=window)
+    for values in ticks_values:
+        pub.run(*values)
+    published = pub.client.published
+    assert len(published) == ticks // window * 2, len(published)
+    sub = FrameSubscriber(DummyFactory('jones'), keys, image_keys, buffer_size=ticks)
+    for topic, payload in published:
+        sub.mycallback(None, None, DummyMessage(topic, payload))
+    for i, values in enumerate(ticks_values):
+        outputs = sub.run()
+        assert_same(outputs[:-1], values[:-1])
+        # イメージは window 毎に最終ティックのものを参照する
+        # (JPEG 変換で非可逆のため送信イメージをJPEG変換・復元したものと比較する)
+        image = ticks_values[i // window * window + window - 1][-1]
+        assert_same(outputs[-1:], [bytearray_to_arr(arr_to_bytearray(image))])
+    print('[test_frame] ticks:{} window:{} publish calls frame:{} 8 parts:{} frame size:{} bytes'.format(
+        str(ticks), str(window), str(len(published)), str(ticks * 8),
+        str(len([payload for topic, payload in published if topic.endswith('/bin')][0]))))
+
+if __name__ == '__main__':
+    test_codec()
+    test_decode_error()
+    test_frame()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+MadgwickAHRS のスカラ演算版 update および update_batch が
+従来の NumPy/Quaternion 実装と同じ四元数を返すことを確認する。
+update_imu_batch は update_imu を1件ずつ呼び出した結果と比較する。
+処理時間の比較(benchmark)は直接実行した場合のみ表示する。
+"""
+import warnings
+import time
+import numpy as np
+from numpy.linalg import norm
+
+def reference_update(quaternion, beta, sampleperiod, gyroscope, accelerometer, magnetometer):
+    """
+    従来の MadgwickAHRS.update と同じ計算を行い、更新後の四元数を返却する。
+    """
+    from parts.VisionGenerator.quaternion import Quaternion
+    q = quaternion
+    gyroscope = np.array(gyroscope, dtype=float).flatten()
+    accelerometer = np.array(accelerometer, dtype=float).flatten()
+    magnetometer = np.array(magnetometer, dtype=float).flatten()
+    accelerometer /= norm(accelerometer)
+    magnetometer /= norm(magnetometer)
+    h = q * (Quaternion(0, magnetometer[0], magnetometer[1], magnetometer[2]) * q.conj())
+    b = np.array([0, norm(h[1:3]), 0, h[3]])
+    f = np.array([
+        2 * (q[1] * q[3] - q[0] * q[2]) - accelerometer[0],
+        2 * (q[0] * q[1] + q[2] * q[3]) - accelerometer[1],
+        2 * (0.5 - q[1] ** 2 - q[2] ** 2) - accelerometer[2],
+        2 * b[1] * (0.5 - q[2] ** 2 - q[3] ** 2) + 2 * b[3] * (q[1] * q[3] - q[0] * q[2]) - magnetometer[0],
+        2 * b[1] * (q[1] * q[2] - q[0] * q[3]) + 2 * b[3] * (q[0] * q[1] + q[2] * q[3]) - magnetometer[1],
+        2 * b[1] * (q[0] * q[2] + q[1] * q[3]) + 2 * b[3] * (0.5 - q[1] ** 2 - q[2] ** 2) - magnetometer[2]
+    ])
+    j = np.array([
+        [-2 * q[2], 2 * q[3], -2 * q[0], 2 * q[1]],
+        [2 * q[1], 2 * q[0], 2 * q[3], 2 * q[2]],
+        [0, -4 * q[1], -4 * q[2], 0],
+        [-2 * b[3] * q[2], 2 * b[3] * q[3], -4 * b[1] * q[2] - 2 * b[3] * q[0], -4 * b[1] * q[3] + 2 * b[3] * q[1]],
+        [-2 * b[1] * q[3] + 2 * b[3] * q[1], 2 * b[1] * q[2] + 2 * b[3] * q[0], 2 * b[1] * q[1] + 2 * b[3] * q[3], -2 * b[1] * q[0] + 2 * b[3] * q[2]],
+        [2 * b[1] * q[2], 2 * b[1] * q[3] - 4 * b[3] * q[1], 2 * b[1] * q[0] - 4 * b[3] * q[2], 2 * b[1] * q[1]]
+    ])
+    step = j.T.dot(f)
+    step /= norm(step)
+    qdot = (q * Quaternion(0, gyroscope[0], gyroscope[1], gyroscope[2])) * 0.5 - beta * step.T
+    q += qdot * sampleperiod
+    return Quaternion(q / norm(q))
+
+def make_samples(n=2000, seed=0):
+    """
+    MPU9250 相当の範囲の (N, 9) 疑似サンプルを生成する。
+    """
+    rng = np.random.RandomState(seed)
+    gyr = rng.normal(0.0, 0.5, (n, 3))
+    acc = rng.normal(0.0, 0.2, (n, 3)) + np.array([0.0, 0.0, 9.8])
+    mgt = rng.normal(0.0, 5.0, (n, 3)) + np.array([20.0, -5.0, 40.0])
+    return np.hstack([gyr, acc, mgt])
+
+def test_update(tolerance=1e-9):
+    from parts.VisionGenerator.madgwickahrs import MadgwickAHRS
+    from parts.VisionGenerator.quaternion import Quaternion
+    samples = make_samples()
+    heading = MadgwickAHRS(sampleperiod=1/20, beta=2)
+    expected = Quaternion(1, 0, 0, 0)
+    max_error = 0.0
+    for row in samples:
+        heading.update(row[0:3], row[3:6], row[6:9])
+        expected = reference_update(expected, 2, 1/20, row[0:3], row[3:6], row[6:9])
+        max_error = max(max_error, np.max(np.abs(heading.quaternion.q - expected.q)))
+    print('[test_update] max error: {}'.format(str(max_error)))
+    assert max_error < tolerance
+
+def test_update_batch(tolerance=1e-9):
+    from parts.VisionGenerator.madgwickahrs import MadgwickAHRS
+    samples = make_samples()
+    heading = MadgwickAHRS(sampleperiod=1/20, beta=2)
+    expected = []
+    for row in samples:
+        heading.update(row[0:3], row[3:6], row[6:9])
+        expected.append(heading.quaternion.q)
+    batch = MadgwickAHRS(sampleperiod=1/20, beta=2).update_batch(samples)
+    max_error = np.max(np.abs(batch - np.array(expected)))
+    print('[test_update_batch] max error: {}'.format(str(max_error)))
+    assert batch.shape == (len(samples), 4)
+    assert max_error < tolerance
+
+def test_update_imu_batch(tolerance=1e-12):
+    from parts.VisionGenerator.madgwickahrs import MadgwickAHRS
+    samples = make_samples()[:, 0:6]
+    # 加速度がゼロのサンプルは読み飛ばされることも確認する
+    samples[100, 3:6] = 0.0
+    periods = np.linspace(1/40, 1/10, len(samples))
+    heading = MadgwickAHRS(sampleperiod=1/20, beta=2)
+    expected = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for row, period in zip(samples, periods):
+            heading.samplePeriod = period
+            heading.update_imu(row[0:3], row[3:6])
+            expected.append(heading.quaternion.q)
+    batch = MadgwickAHRS(sampleperiod=1/20, beta=2).update_imu_batch(samples, periods)
+    max_error = np.max(np.abs(batch - np.array(expected)))
+    print('[test_update_imu_batch] max error: {}'.format(str(max_error)))
+    assert batch.shape == (len(samples), 4)
+    assert np.array_equal(batch[100], batch[99])
+    assert max_error < tolerance
+
+def benchmark(n=2000):
+    from parts.VisionGenerator.madgwickahrs import MadgwickAHRS
+    from parts.VisionGenerator.quaternion import Quaternion
+    samples = make_samples(n)
+    start = time.time()
+    q = Quaternion(1, 0, 0, 0)
+    for row in samples:
+        q = reference_update(q, 2, 1/20, row[0:3], row[3:6], row[6:9])
+    reference = time.time() - start
+    heading = MadgwickAHRS(sampleperiod=1/20, beta=2)
+    start = time.time()
+    for row in samples:
+        heading.update(row[0:3], row[3:6], row[6:9])
+    scalar = time.time() - start
+    start = time.time()
+    MadgwickAHRS(sampleperiod=1/20, beta=2).update_batch(samples)
+    batch = time.time() - start
+    print('[benchmark] usec/sample reference:{:.1f} update:{:.1f} update_batch:{:.1f}'.format(
+        reference / n * 1e6, scalar / n * 1e6, batch / n * 1e6))
+
+if __name__ == '__main__':
+    test_update()
+    test_update_batch()
+    test_update_imu_batch()
+    benchmark()
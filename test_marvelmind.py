@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Marvelmind モバイルビーコンのシリアルストリームを旧パーサ(1バイトずつ処理)と
+MarvelmindParser に流し込み、同じパケットが得られることと処理時間を確認する。
+引数にシリアルから記録したバイナリファイルを指定した場合はそのデータを再生する。
+旧パーサはペイロード中に別種別のヘッダ列(ff 47 xx 00)を含むパケットを取りこぼすため、
+そのようなパケットを含むストリームでは旧パーサの結果が順序通り含まれることを確認する。
+
+Usage:
+    python test_marvelmind.py [recorded stream path]
+"""
+import sys
+import time
+import random
+import struct
+import collections
+
+def legacy_parse(stream):
+    """
+    旧 MarvelmindHedge.run と同じ手順でストリームを解析する。
+    引数：
+        stream      受信バイト列
+    戻り値：
+        (パケット種別, 値リスト) のリスト
+    """
+    import crcmod.predefined
+    from parts.sensors.marvelmind import PACKET_ULTRASOUND_POSITION, PACKET_IMU_RAW_DATA, \
+        PACKET_ULTRASOUND_RAW_DATA, PACKET_IMU_DATA
+    packets = []
+    bufferSerialDeque = collections.deque(maxlen=255)
+    for i in range(len(stream)):
+        bufferSerialDeque.append(stream[i:i + 1])
+        bufferList = list(bufferSerialDeque)
+        strbuf = (b''.join(bufferList))
+        pktHdrOffset = strbuf.find(b'\xff\x47')
+        if (pktHdrOffset >= 0 and len(bufferList) > pktHdrOffset + 4 and pktHdrOffset<220):
+            isMmMessageDetected = strbuf.find(b'\xff\x47\x11\x00') != -1
+            isCmMessageDetected = not isMmMessageDetected and strbuf.find(b'\xff\x47\x01\x00') != -1
+            isRawImuMessageDetected = not (isMmMessageDetected or isCmMessageDetected) and strbuf.find(b'\xff\x47\x03\x00') != -1
+            isDistancesMessageDetected = not (isMmMessageDetected or isCmMessageDetected or isRawImuMessageDetected) and strbuf.find(b'\xff\x47\x04\x00') != -1
+            isImuMessageDetected = not (isMmMessageDetected or isCmMessageDetected or isRawImuMessageDetected or isDistancesMessageDetected) and strbuf.find(b'\xff\x47\x05\x00') != -1
+            msgLen = ord(bufferList[pktHdrOffset + 4])
+            try:
+                if (len(bufferList) > pktHdrOffset + 4 + msgLen + 2):
+                    usnCRC16 = 0
+                    if (isCmMessageDetected):
+                        usnTimestamp, usnX, usnY, usnZ, usnAdr, usnAngle, usnCRC16 = struct.unpack_from ('<LhhhxBhxxH', strbuf, pktHdrOffset + 5)
+                        value = [usnAdr, usnX/100.0, usnY/100.0, usnZ/100.0, 0b0000111111111111&usnAngle, usnTimestamp]
+                        kind = PACKET_ULTRASOUND_POSITION
+                    elif (isMmMessageDetected):
+                        usnTimestamp, usnX, usnY, usnZ, usnAdr, usnAngle, usnCRC16 = struct.unpack_from ('<LlllxBhxxH', strbuf, pktHdrOffset + 5)
+                        value = [usnAdr, usnX/1000.0, usnY/1000.0, usnZ/1000.0, 0b0000111111111111&usnAngle, usnTimestamp]
+                        kind = PACKET_ULTRASOUND_POSITION
+                    elif (isRawImuMessageDetected):
+                        ax, ay, az, gx, gy, gz, mx, my, mz, timestamp, usnCRC16 = struct.unpack_from ('<hhhhhhhhhxxxxxxLxxxxH', strbuf, pktHdrOffset + 5)
+                        value = [ax, ay, az, gx, gy, gz, mx, my, mz, timestamp]
+                        kind = PACKET_IMU_RAW_DATA
+                    elif (isImuMessageDetected):
+                        x, y, z, qw, qx, qy, qz, vx, vy, vz, ax, ay, az, timestamp, usnCRC16 = struct.unpack_from ('<lllhhhhhhhhhhxxLxxxxH', strbuf, pktHdrOffset + 5)
+                        value = [x/1000.0, y/1000.0, z/1000.0, qw/10000.0, qx/10000.0, qy/10000.0, qz/10000.0, vx/1000.0, vy/1000.0, vz/1000.0, ax/1000.0,ay/1000.0,az/1000.0, timestamp]
+                        kind = PACKET_IMU_DATA
+                    elif (isDistancesMessageDetected):
+                        HedgeAdr, b1, b1d, b2, b2d, b3, b3d, b4, b4d, timestamp,usnCRC16 = struct.unpack_from ('<BBlxBlxBlxBlxLxxxH', strbuf, pktHdrOffset + 5)
+                        value = [HedgeAdr, b1, b1d/1000.0, b2, b2d/1000.0, b3, b3d/1000.0, b4, b4d/1000.0, timestamp]
+                        kind = PACKET_ULTRASOUND_RAW_DATA
+                    crc16 = crcmod.predefined.Crc('modbus')
+                    crc16.update(strbuf[ pktHdrOffset : pktHdrOffset + msgLen + 5 ])
+                    CRC_calc = int(crc16.hexdigest(), 16)
+                    if CRC_calc == usnCRC16:
+                        packets.append((kind, value))
+                    for x in range(0, pktHdrOffset + msgLen + 7):
+                        bufferSerialDeque.popleft()
+            except struct.error:
+                pass    # 旧実装では 'smth wrong' を出力する
+    return packets
+
+def make_packet(code, payload):
+    """
+    ヘッダとCRC16を付加したパケットを作成する。
+    """
+    from parts.sensors.marvelmind import crc16
+    body = b'\xff\x47' + struct.pack('<HB', code, len(payload)) + payload
+    return body + struct.pack('<H', crc16(body))
+
+def make_stream(count=2000, seed=0, clean=False):
+    """
+    各種パケットにゴミデータとCRC不正パケットを混ぜた疑似ストリームを作成する。
+    clean が真の場合、ヘッダ以外に ff 47 を含むパケットは作り直す。
+    """
+    rng = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < count:
+        kind = rng.randrange(5)
+        if kind == 0:
+            payload = struct.pack('<LlllxBhxx', i * 100, rng.randint(-5000, 5000), rng.randint(-5000, 5000), 0, 59, rng.randint(0, 4095))
+            code = 0x0011
+        elif kind == 1:
+            payload = struct.pack('<LhhhxBhxx', i * 100, rng.randint(-500, 500), rng.randint(-500, 500), 0, 59, rng.randint(0, 4095))
+            code = 0x0001
+        elif kind == 2:
+            payload = struct.pack('<hhhhhhhhhxxxxxxLxxxx', *[rng.randint(-3000, 3000) for _ in range(9)], i * 100)
+            code = 0x0003
+        elif kind == 3:
+            payload = struct.pack('<BBlxBlxBlxBlxLxxx', 59, 1, rng.randint(0, 9000), 2, rng.randint(0, 9000), 3, rng.randint(0, 9000), 4, rng.randint(0, 9000), i * 100)
+            code = 0x0004
+        else:
+            payload = struct.pack('<lllhhhhhhhhhhxxLxxxx', *[rng.randint(-3000, 3000) for _ in range(13)], i * 100)
+            code = 0x0005
+        packet = bytearray(make_packet(code, payload))
+        if clean and packet.find(b'\xff\x47', 1) >= 0:
+            continue
+        i += 1
+        if rng.random() < 0.02:
+            packet[-1] ^= 0xff  # CRC error
+        if rng.random() < 0.05:
+            chunks.append(bytes(rng.randrange(256) for _ in range(rng.randint(1, 8))).replace(b'\xff', b'\x00'))
+        chunks.append(bytes(packet))
+    return b''.join(chunks)
+
+def new_parse(stream, chunk_size=64):
+    """
+    MarvelmindParser に chunk_size バイトずつ流し込む。
+    """
+    from parts.sensors.marvelmind import MarvelmindParser
+    parser = MarvelmindParser()
+    packets = []
+    for i in range(0, len(stream), chunk_size):
+        packets.extend(parser.feed(stream[i:i + chunk_size]))
+    return packets
+
+def is_subsequence(packets, expected):
+    """
+    expected が packets に順序通り含まれている場合真を返す。
+    """
+    it = iter(packets)
+    return all(packet in it for packet in expected)
+
+def replay(stream, exact):
+    start = time.time()
+    expected = legacy_parse(stream)
+    legacy = time.time() - start
+    for chunk_size in [1, 7, 64, 4096]:
+        start = time.time()
+        packets = new_parse(stream, chunk_size)
+        elapsed = time.time() - start
+        if exact:
+            assert packets == expected, 'chunk_size={} packets:{} expected:{}'.format(
+                str(chunk_size), str(len(packets)), str(len(expected)))
+        else:
+            assert is_subsequence(packets, expected), 'chunk_size={} packets:{} expected:{}'.format(
+                str(chunk_size), str(len(packets)), str(len(expected)))
+        print('[test_replay] chunk:{} packets:{}(legacy:{}) new:{:.3f}s legacy:{:.3f}s ({} bytes)'.format(
+            str(chunk_size), str(len(packets)), str(len(expected)), elapsed, legacy, str(len(stream))))
+
+def test_replay(path=None):
+    if path is None:
+        replay(make_stream(clean=True), exact=True)
+        replay(make_stream(), exact=False)
+    else:
+        with open(path, 'rb') as f:
+            replay(f.read(), exact=False)
+
+if __name__ == '__main__':
+    test_replay(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+PublishWorker を送信に時間のかかるダミーMQTTクライアントで動作させ、
+publish が送信完了を待たずに戻ること、トピック毎に最新メッセージのみ送信されること、
+各カウンタ(sent/coalesced/dropped/failed/latency)が正しく更新されることを確認する。
+AWS IoT Core へは接続しない。
+"""
+import time
+import threading
+
+class SlowClient:
+    """
+    publish 毎に delay 秒待機するMQTTクライアント。
+    fail_topics に含まれるトピックは送信失敗(False)を返す。
+    """
+    def __init__(self, delay=0.05, fail_topics=[]):
+        self.delay = delay
+        self.fail_topics = fail_topics
+        self.published = []
+        self.lock = threading.Lock()
+    def publish(self, topic, payload, qos):
+        time.sleep(self.delay)
+        if topic in self.fail_topics:
+            return False
+        with self.lock:
+            self.published.append((topic, payload))
+        return True
+
+def test_non_blocking(count=100, delay=0.05):
+    from parts.broker.worker import PublishWorker
+    client = SlowClient(delay)
+    worker = PublishWorker(client)
+    start = time.time()
+    for i in range(count):
+        assert worker.publish('smith/tub', i, 0)
+    elapsed = time.time() - start
+    assert worker.flush(5.0)
+    stats = worker.stats()
+    worker.shutdown()
+    print('[test_non_blocking] enqueue {:.1f} usec/msg stats={}'.format(
+        elapsed / count * 1e6, str(stats)))
+    assert elapsed < delay
+    # 最初の1件以外は送信中に上書きされ、最後の値のみ送信される
+    assert client.published[-1] == ('smith/tub', count - 1)
+    assert stats['sent'] == len(client.published)
+    assert stats['sent'] + stats['coalesced'] == count
+    assert stats['latency_max'] >= delay
+
+def test_coalesce(delay=0.05):
+    from parts.broker.worker import PublishWorker
+    client = SlowClient(delay)
+    worker = PublishWorker(client)
+    worker.publish('blocker', 0, 0)
+    time.sleep(delay / 5)
+    for i in range(10):
+        worker.publish('smith/tub', i, 0)
+        worker.publish('smith/hedge', i * 10, 0)
+    assert worker.flush(5.0)
+    stats = worker.stats()
+    worker.shutdown()
+    print('[test_coalesce] published={} stats={}'.format(str(client.published), str(stats)))
+    # 送信順はトピックの最初の要求順
+    assert client.published == [('blocker', 0), ('smith/tub', 9), ('smith/hedge', 90)]
+    assert stats['coalesced'] == 18
+
+def test_drop_and_fail(delay=0.05):
+    from parts.broker.worker import PublishWorker
+    client = SlowClient(delay, fail_topics=['smith/fail'])
+    worker = PublishWorker(client, max_topics=2)
+    worker.publish('blocker', 0, 0)
+    time.sleep(delay / 5)
+    for topic in ['smith/a', 'smith/b', 'smith/fail']:
+        worker.publish(topic, 1, 0)
+    assert worker.flush(5.0)
+    stats = worker.stats()
+    worker.shutdown()
+    assert not worker.publish('smith/a', 2, 0)
+    print('[test_drop_and_fail] published={} stats={}'.format(str(client.published), str(worker.stats())))
+    # 上限2トピックのため smith/a が破棄され、smith/fail は送信失敗
+    assert client.published == [('blocker', 0), ('smith/b', 1)]
+    assert stats['dropped'] == 1 and stats['failed'] == 1 and stats['sent'] == 2
+    assert worker.stats()['dropped'] == 2
+
+def test_shutdown(delay=0.2):
+    from parts.broker.worker import PublishWorker
+    client = SlowClient(delay)
+    worker = PublishWorker(client)
+    for topic in ['smith/a', 'smith/b', 'smith/c']:
+        worker.publish(topic, 1, 0)
+    start = time.time()
+    worker.shutdown(timeout=delay / 2)
+    elapsed = time.time() - start
+    stats = worker.stats()
+    print('[test_shutdown] elapsed={:.3f}s stats={}'.format(elapsed, str(stats)))
+    assert elapsed < delay * 2
+    assert stats['dropped'] == 2
+
+if __name__ == '__main__':
+    test_non_blocking()
+    test_coalesce()
+    test_drop_and_fail()
+    test_shutdown()
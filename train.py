@@ -23,9 +23,14 @@ import random
 import json
 import time
 import zlib
+import io
+import tempfile
 from os.path import basename, join, splitext, dirname
 import pickle
 import datetime
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from tensorflow.python import keras
 from docopt import docopt
@@ -40,6 +45,9 @@ from donkeycar.parts.keras import KerasLinear, KerasIMU,\
 from donkeycar.parts.augment import augment_image
 from donkeycar.utils import *
 
+from parts.loader.packed import is_packed_tub, get_packed_tub, infer_types, PackedTubWriter,\
+    PACKED_META_FILE_NAME, PACKED_SUFFIX, PACKED_VERSION
+
 
 '''
 matplotlib can be a pain to setup on a Mac. So handle the case where it is absent. When present,
@@ -56,103 +64,609 @@ except:
 '''
 Tub management
 '''
-def make_key(sample):
-    tub_path = sample['tub_path']
-    index = sample['index']
-    return tub_path + str(index)
+class SampleTable:
+    '''
+    compact, array backed table of training samples.
+    each row is one record: the tub it came from (an integer id into tub_paths),
+    its record index, the recorded image file name, the labels, the optional
+    imu / behavior vectors and the train/validation mask. the raw json data is not kept.
+    generators refer to samples by row position.
+    '''
+    def __init__(self):
+        self.tub_paths = []
+        self.tub_packed = []
+        self.tub_path_ids = {}
+        self.size = 0
+        self.capacity = 0
+        self.columns = {
+            'tub_id' : np.zeros(0, dtype=np.int32),
+            'index' : np.zeros(0, dtype=np.int64),
+            'packed_index' : np.zeros(0, dtype=np.int64),
+            'train' : np.zeros(0, dtype=bool),
+            'valid' : np.zeros(0, dtype=bool),
+        }
 
-def make_next_key(sample, index_offset):
-    tub_path = sample['tub_path']
-    index = sample['index'] + index_offset
-    return tub_path + str(index)
+    def __len__(self):
+        return self.size
 
+    def get_tub_id(self, tub_path, packed=None):
+        tub_path = os.path.normpath(tub_path)
+        tub_id = self.tub_path_ids.get(tub_path)
+        if tub_id is None:
+            tub_id = len(self.tub_paths)
+            self.tub_paths.append(tub_path)
+            self.tub_packed.append(packed)
+            self.tub_path_ids[tub_path] = tub_id
+        return tub_id
 
-def collate_records(records, gen_records, opts):
-    '''
-    open all the .json records from records list passed in,
-    read their contents,
-    add them to a list of gen_records, passed in.
-    use the opts dict to specify config choices
-    '''
+    def column(self, name):
+        return self.columns[name][:self.size]
 
-    new_records = {}
-    
-    for record_path in records:
+    def has_column(self, name):
+        return name in self.columns
 
-        basepath = os.path.dirname(record_path)        
-        index = get_record_index(record_path)
-        sample = { 'tub_path' : basepath, "index" : index }
-             
-        key = make_key(sample)
+    @property
+    def tub_id(self):
+        return self.column('tub_id')
 
-        if key in gen_records:
-            continue
+    @property
+    def index(self):
+        return self.column('index')
+
+    @property
+    def angle(self):
+        return self.column('angle')
+
+    @property
+    def throttle(self):
+        return self.column('throttle')
+
+    @property
+    def train(self):
+        return self.column('train')
 
+    @property
+    def valid(self):
+        return self.column('valid')
+
+    def indices_of(self, tub_id):
+        return self.index[self.tub_id == tub_id]
+
+    def invalidate(self, tub_id, indices=None):
+        '''
+        mask out the rows of a tub with the given record indices (all rows of the tub when None).
+        '''
+        mask = self.tub_id == tub_id
+        if indices is not None:
+            mask &= np.isin(self.index, indices)
+        self.valid[mask] = False
+
+    def append(self, rows):
+        '''
+        append rows given as a dict of equally long arrays.
+        optional columns (imu, behavior) missing from rows are zero filled
+        and flagged in their has_* mask.
+        '''
+        n = len(rows['index'])
+        if n == 0:
+            return np.arange(self.size, self.size)
+
+        self._reserve(self.size + n, rows)
+        for name, arr in self.columns.items():
+            if name in rows:
+                arr[self.size:self.size + n] = rows[name]
+            else:
+                arr[self.size:self.size + n] = 0
+        start = self.size
+        self.size += n
+        return np.arange(start, self.size)
+
+    def _reserve(self, required, rows):
+        for name, values in rows.items():
+            if name not in self.columns:
+                values = np.asarray(values)
+                self.columns[name] = np.zeros((self.capacity,) + values.shape[1:], dtype=values.dtype)
+        if required <= self.capacity:
+            return
+        capacity = max(required, self.capacity * 2, 1024)
+        for name, arr in self.columns.items():
+            grown = np.zeros((capacity,) + arr.shape[1:], dtype=arr.dtype)
+            grown[:self.size] = arr[:self.size]
+            self.columns[name] = grown
+        self.capacity = capacity
+
+    def split(self, rows, train_ratio):
+        '''
+        randomly mark train_ratio of the given (new) rows as training samples,
+        the remaining ones are used for validation.
+        '''
+        rows = np.random.permutation(rows)
+        target_train_count = int(train_ratio * len(rows))
+        train = self.columns['train']
+        train[rows] = False
+        train[rows[:target_train_count]] = True
+
+    def image_path(self, row):
+        '''
+        path of the image file named by the record's cam/image_array value.
+        falls back to the tub writer's default name for rows without one.
+        '''
+        tub_path = self.tub_paths[self.columns['tub_id'][row]]
+        image_name = self.columns['image_name'][row] if 'image_name' in self.columns else None
+        if not image_name:
+            image_name = '%d_cam-image_array_.jpg' % self.columns['index'][row]
+        return os.path.join(tub_path, image_name)
+
+    def packed_of(self, row):
+        return self.tub_packed[self.columns['tub_id'][row]]
+
+    def load_image(self, row, cfg):
+        '''
+        load and scale the image of a row, reading it from the packed image blob
+        when the row came from a packed tub.
+        '''
+        packed = self.packed_of(row)
+        if packed is not None:
+            return load_scaled_image_arr(packed.image_file(self.columns['packed_index'][row]), cfg)
+        return load_scaled_image_arr(self.image_path(row), cfg)
+
+
+def make_rows(tub_id, indices, angles, throttles, opts, imu=None, has_imu=None, behavior=None, has_behavior=None, packed_index=None, image_names=None):
+    '''
+    build the column dict for SampleTable.append, binning the labels for categorical models.
+    '''
+    n = len(indices)
+    angles = np.asarray(angles, dtype=np.float32)
+    throttles = np.asarray(throttles, dtype=np.float32)
+
+    if n == 0:
+        return { 'index' : np.zeros(0, dtype=np.int64) }
+
+    if opts['categorical']:
+        angles = np.array([dk.utils.linear_bin(a) for a in angles], dtype=np.float32).reshape(n, -1)
+        throttles = np.array([dk.utils.linear_bin(t, N=20, offset=0, R=opts['cfg'].MODEL_CATEGORICAL_MAX_THROTTLE_RANGE) for t in throttles], dtype=np.float32).reshape(n, -1)
+
+    rows = {
+        'tub_id' : np.full(n, tub_id, dtype=np.int32),
+        'index' : np.asarray(indices, dtype=np.int64),
+        'packed_index' : np.asarray(packed_index if packed_index is not None else np.full(n, -1), dtype=np.int64),
+        'angle' : angles,
+        'throttle' : throttles,
+        'train' : np.zeros(n, dtype=bool),
+        'valid' : np.ones(n, dtype=bool),
+    }
+    if image_names is not None:
+        rows['image_name'] = np.empty(n, dtype=object)
+        rows['image_name'][:] = image_names
+    if imu is not None:
+        rows['imu'] = np.asarray(imu, dtype=np.float32).reshape(n, 6)
+        rows['has_imu'] = np.asarray(has_imu if has_imu is not None else np.ones(n), dtype=bool)
+    if behavior is not None:
+        rows['behavior'] = np.asarray(behavior, dtype=np.float32).reshape(n, -1)
+        rows['has_behavior'] = np.asarray(has_behavior if has_behavior is not None else np.ones(n), dtype=bool)
+    return rows
+
+
+def read_json_records(record_paths):
+    '''
+    read the label, imu and behavior values and the image file name
+    of the given .json records of one tub.
+    records that can not be read are skipped.
+    returns the record indices and the value lists.
+    '''
+    indices = []
+    image_names = []
+    angles = []
+    throttles = []
+    imu = []
+    has_imu = []
+    behavior = []
+    has_behavior = []
+    behavior_len = None
+
+    for record_path in record_paths:
         try:
             with open(record_path, 'r') as fp:
                 json_data = json.load(fp)
         except:
             continue
 
-        image_filename = json_data["cam/image_array"]
-        image_path = os.path.join(basepath, image_filename)
+        indices.append(get_record_index(record_path))
+        image_names.append(json_data.get('cam/image_array'))
+        angles.append(float(json_data['user/angle']))
+        throttles.append(float(json_data["user/throttle"]))
 
-        sample['record_path'] = record_path
-        sample["image_path"] = image_path
-        sample["json_data"] = json_data        
+        try:
+            imu.append([float(json_data['imu/acl_x']), float(json_data['imu/acl_y']), float(json_data['imu/acl_z']),
+                float(json_data['imu/gyr_x']), float(json_data['imu/gyr_y']), float(json_data['imu/gyr_z'])])
+            has_imu.append(True)
+        except:
+            imu.append([0.0] * 6)
+            has_imu.append(False)
+
+        behavior_arr = json_data.get('behavior/one_hot_state_array')
+        if behavior_arr is not None and (behavior_len is None or len(behavior_arr) == behavior_len):
+            behavior_len = len(behavior_arr)
+            behavior.append(behavior_arr)
+            has_behavior.append(True)
+        else:
+            behavior.append(None)
+            has_behavior.append(False)
 
-        angle = float(json_data['user/angle'])
-        throttle = float(json_data["user/throttle"])
+    if behavior_len is None:
+        behavior = None
+        has_behavior = None
+    else:
+        behavior = [b if b is not None else [0.0] * behavior_len for b in behavior]
 
-        if opts['categorical']:
-            angle = dk.utils.linear_bin(angle)
-            throttle = dk.utils.linear_bin(throttle, N=20, offset=0, R=opts['cfg'].MODEL_CATEGORICAL_MAX_THROTTLE_RANGE)
+    return indices, angles, throttles, imu, has_imu, behavior, has_behavior, image_names
 
-        sample['angle'] = angle
-        sample['throttle'] = throttle
 
-        try:
-            accl_x = float(json_data['imu/acl_x'])
-            accl_y = float(json_data['imu/acl_y'])
-            accl_z = float(json_data['imu/acl_z'])
+def group_by_tub(records):
+    '''
+    group record paths by their tub directory, keeping their order.
+    '''
+    tub_records = collections.OrderedDict()
+    for record_path in records:
+        tub_records.setdefault(os.path.dirname(record_path), []).append(record_path)
+    return tub_records
 
-            gyro_x = float(json_data['imu/gyr_x'])
-            gyro_y = float(json_data['imu/gyr_y'])
-            gyro_z = float(json_data['imu/gyr_z'])
 
-            sample['imu_array'] = np.array([accl_x, accl_y, accl_z, gyro_x, gyro_y, gyro_z])
-        except:
-            pass
+def collate_records(records, table, opts, skip_known=True):
+    '''
+    open the .json records from records list passed in which are not yet
+    in the sample table, read their labels and append them to the table.
+    use the opts dict to specify config choices
+    skip_known=False trusts the caller to pass only new records (see TubWatcher).
+    '''
+    new_rows = []
+
+    for tub_path, record_paths in group_by_tub(records).items():
+        tub_id = table.get_tub_id(tub_path)
+        if skip_known:
+            known = set(table.indices_of(tub_id).tolist())
+            record_paths = [p for p in record_paths if get_record_index(p) not in known]
+        if len(record_paths) == 0:
+            continue
+
+        indices, angles, throttles, imu, has_imu, behavior, has_behavior, image_names = read_json_records(record_paths)
+        if len(indices) == 0:
+            continue
+
+        new_rows.append(table.append(make_rows(tub_id, indices, angles, throttles, opts,
+            imu=imu, has_imu=has_imu, behavior=behavior, has_behavior=has_behavior,
+            image_names=image_names)))
+
+    if len(new_rows) == 0:
+        return
+
+    # We need to maintain the correct train - validate ratio across the dataset, even if continous training
+    # so split only the new samples with the ratio in CFG file.
+    table.split(np.concatenate(new_rows), opts['cfg'].TRAIN_TEST_SPLIT)
+
+def collate_packed_records(packed, table, opts):
+    '''
+    add the records of a packed tub (see parts/loader/packed.py) to the sample table.
+    labels are read from the memory mapped columns and the images are
+    decoded straight from the packed image blob, so no per record file is opened.
+    '''
+    tub_id = table.get_tub_id(packed.path, packed)
+    if len(table.indices_of(tub_id)) > 0:
+        return
+
+    imu_keys = ['imu/acl_x', 'imu/acl_y', 'imu/acl_z', 'imu/gyr_x', 'imu/gyr_y', 'imu/gyr_z']
+    if all(key in packed.keys() for key in imu_keys):
+        imu = np.stack([np.asarray(packed.column(key), dtype=np.float32) for key in imu_keys], axis=1)
+    else:
+        imu = None
+
+    rows = table.append(make_rows(tub_id, np.asarray(packed.numbers()),
+        packed.column('user/angle'), packed.column('user/throttle'), opts,
+        imu=imu, packed_index=np.arange(packed.total())))
+    table.split(rows, opts['cfg'].TRAIN_TEST_SPLIT)
+
+class TubWatcher:
+    '''
+    incremental record discovery for continuous training.
+    keeps a high water mark (the largest record index read) and the directory
+    mtime per tub, so a pass only stats the tub directories and reads the
+    records written after the last pass instead of re-globbing every tub.
+    erasing the last records (which is how the tub writer erases) is detected
+    by the high water record going away or being rewritten; the tub is then
+    reconciled with one directory listing and erased rows are masked out of
+    the sample table.
+    '''
+    def __init__(self, cfg, tub_names, table, opts):
+        self.cfg = cfg
+        self.tub_names = tub_names
+        self.table = table
+        self.opts = opts
+        self.states = {}
+        scan_time = time.time_ns()
+        for tub_path in self.tub_paths():
+            self.states[tub_path] = self.make_state(tub_path, scan_time)
+
+    def tub_paths(self):
+        return [os.path.normpath(p) for p in gather_tub_paths(self.cfg, self.tub_names) if not is_packed_tub(p)]
+
+    def make_state(self, tub_path, scan_time):
+        tub_id = self.table.get_tub_id(tub_path)
+        indices = self.table.index[(self.table.tub_id == tub_id) & self.table.valid]
+        return {
+            'tub_id' : tub_id,
+            'high_water' : int(indices.max()) if len(indices) > 0 else -1,
+            'mtime' : os.stat(tub_path).st_mtime_ns,
+            'scan_time' : scan_time,
+        }
+
+    def record_path(self, tub_path, index):
+        return os.path.join(tub_path, 'record_%d.json' % index)
+
+    def update(self):
+        '''
+        read the records written since the last pass into the sample table.
+        returns the number of new rows.
+        '''
+        num_rows = len(self.table)
+        seen = set()
+        for tub_path in self.tub_paths():
+            seen.add(tub_path)
+            state = self.states.get(tub_path)
+            if state is None:
+                # a tub created while training, read it whole
+                scan_time = time.time_ns()
+                records = glob.glob(os.path.join(tub_path, 'record_*.json'))
+                records.sort(key=get_record_index)
+                collate_records(records, self.table, self.opts)
+                self.states[tub_path] = self.make_state(tub_path, scan_time)
+            else:
+                self.update_tub(tub_path, state)
+
+        for tub_path in list(self.states.keys()):
+            if tub_path not in seen:
+                # the tub has been removed
+                self.table.invalidate(self.states[tub_path]['tub_id'])
+                del self.states[tub_path]
 
+        return len(self.table) - num_rows
+
+    def update_tub(self, tub_path, state):
         try:
-            behavior_arr = np.array(json_data['behavior/one_hot_state_array'])
-            sample["behavior_arr"] = behavior_arr
-        except:
-            pass
+            mtime = os.stat(tub_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == state['mtime']:
+            return
 
-        sample['img_data'] = None
+        scan_time = time.time_ns()
+        high_water = state['high_water']
+
+        if high_water >= 0 and not self.is_unchanged(self.record_path(tub_path, high_water), state['scan_time']):
+            new_paths, high_water = self.reconcile(tub_path, state)
+        else:
+            new_paths = []
+            index = high_water + 1
+            while os.path.exists(self.record_path(tub_path, index)):
+                new_paths.append(self.record_path(tub_path, index))
+                index += 1
+            high_water = index - 1
+
+        collate_records(new_paths, self.table, self.opts, skip_known=False)
+        state['high_water'] = high_water
+        state['mtime'] = mtime
+        state['scan_time'] = scan_time
+
+    def is_unchanged(self, path, scan_time):
+        try:
+            return os.stat(path).st_mtime_ns < scan_time
+        except FileNotFoundError:
+            return False
+
+    def reconcile(self, tub_path, state):
+        '''
+        list the tub once, mask out the rows whose record is gone or has been
+        rewritten after the last pass and return the records to (re)read.
+        '''
+        existing = set()
+        for name in os.listdir(tub_path):
+            if name.startswith('record_') and name.endswith('.json'):
+                try:
+                    existing.add(int(name[len('record_'):-len('.json')]))
+                except ValueError:
+                    pass
+
+        tub_id = state['tub_id']
+        rows = np.flatnonzero((self.table.tub_id == tub_id) & self.table.valid)
+        known = self.table.index[rows]
+        gone = ~np.isin(known, np.fromiter(existing, dtype=np.int64, count=len(existing)))
+
+        # the writer reuses the erased indices, so walk back from the tail over the
+        # remaining records until one older than the last pass is found
+        rewritten = []
+        for i in sorted(known[~gone].tolist(), reverse=True):
+            if self.is_unchanged(self.record_path(tub_path, i), state['scan_time']):
+                break
+            rewritten.append(i)
+        self.table.invalidate(tub_id, np.concatenate([known[gone], np.array(rewritten, dtype=np.int64)]))
+        if np.any(gone) or len(rewritten) > 0:
+            print('dropped', int(np.count_nonzero(gone)) + len(rewritten), 'erased or rewritten records from', tub_path)
+
+        known_valid = set(known[~gone].tolist()) - set(rewritten)
+        new_indices = sorted(existing - known_valid)
+        high_water = max(existing) if len(existing) > 0 else -1
+        return [self.record_path(tub_path, i) for i in new_indices], high_water
+
+
+def gather_packed_tubs(cfg, tub_names):
+    '''
+    return the packed tubs found in tub_names (or cfg.DATA_PATH).
+    '''
+    return [get_packed_tub(p) for p in gather_tub_paths(cfg, tub_names) if is_packed_tub(p)]
+
+class ImageCache:
+    '''
+    thread safe LRU cache of decoded (scaled) images bounded by a byte budget.
+    a max_bytes of None or less than 1 means no bound.
+    '''
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes if max_bytes is not None and max_bytes > 0 else None
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            img_arr = self.entries.get(key)
+            if img_arr is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return img_arr
+
+    def put(self, key, img_arr):
+        if self.max_bytes is not None and img_arr.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = img_arr
+            self.nbytes += img_arr.nbytes
+            if self.max_bytes is not None:
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+
+    def discard(self, key):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def load_table_image(table, row, cfg, image_cache=None, aug=False):
+    '''
+    load the scaled image of a sample table row, going through the image cache
+    when given. augmentation is applied after the cache so every use gets a
+    fresh augmentation.
+    '''
+    if image_cache is not None:
+        img_arr = image_cache.get(row)
+        if img_arr is None:
+            img_arr = table.load_image(row, cfg)
+            if img_arr is not None:
+                image_cache.put(row, img_arr)
+    else:
+        img_arr = table.load_image(row, cfg)
+
+    if img_arr is not None and aug:
+        img_arr = augment_image(img_arr)
+
+    return img_arr
+
+
+class FrameBuffer:
+    '''
+    decoded image buffer shared by every sequence window of a sample table.
+    frames are decoded once, on first use, and kept as uint8 in one array
+    indexed by table row. colour images are x / 255 so this is lossless;
+    gray images (IMAGE_DEPTH 1) are converted after scaling and get rounded
+    to the nearest 1/255 step, an error of at most 0.5 / 255 per pixel.
+    the rows of each tub are contiguous in the table, so each tub owns a slice
+    of the buffer and overlapping windows over it reuse the decoded frames.
+    when the buffer does not fit in max_bytes it is backed by a temporary
+    file through np.memmap and the OS page cache decides what stays in memory.
+    '''
+    def __init__(self, table, cfg, max_bytes=None):
+        self.table = table
+        self.cfg = cfg
+        self.shape = (cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
+        n = len(table)
+        nbytes = n * int(np.prod(self.shape))
+        if max_bytes is not None and max_bytes > 0 and nbytes > max_bytes:
+            self.file = tempfile.TemporaryFile()
+            self.frames = np.memmap(self.file, dtype=np.uint8, mode='w+', shape=(max(n, 1),) + self.shape)
+        else:
+            self.file = None
+            self.frames = np.zeros((n,) + self.shape, dtype=np.uint8)
+        self.decoded = np.zeros(n, dtype=bool)
+        self.lock = threading.Lock()
+
+    def decode(self, rows):
+        '''
+        decode the rows not yet in the buffer. returns False if an image could not be loaded.
+        '''
+        rows = np.unique(rows)
+        missing = rows[~self.decoded[rows]]
+        for row in missing:
+            img_arr = self.table.load_image(row, self.cfg)
+            if img_arr is None:
+                return False
+            self.frames[row] = np.rint(np.asarray(img_arr).reshape(self.shape) * 255.0).astype(np.uint8)
+        with self.lock:
+            self.decoded[missing] = True
+        return True
+
+    def gather(self, rows):
+        '''
+        return the scaled float32 images of an array of rows (any shape),
+        shaped rows.shape + (TARGET_H, TARGET_W, TARGET_D), or None on failure.
+        '''
+        rows = np.asarray(rows)
+        if not self.decode(rows.ravel()):
+            return None
+        return self.frames[rows].astype(np.float32) / 255.0
+
+    def close(self):
+        self.frames = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def sequence_windows(table, target_len):
+    '''
+    return an (N, target_len) array of table rows, one line per window of
+    target_len consecutive records of the same tub. rows of a tub are appended
+    sorted by record index, so a window starting at row r is valid when every
+    step r+i -> r+i+1 stays in the tub and advances the record index by one.
+    '''
+    n = len(table)
+    if n < target_len:
+        return np.zeros((0, target_len), dtype=np.int64)
+    tub_ids = table.tub_id
+    indices = table.index
+    step_ok = (tub_ids[1:] == tub_ids[:-1]) & (indices[1:] == indices[:-1] + 1)
+    breaks = np.concatenate([[0], np.cumsum(~step_ok)])
+    starts = np.flatnonzero(breaks[target_len - 1:] == breaks[:n - target_len + 1])
+    return starts.reshape(-1, 1) + np.arange(target_len)
+
+
+def prefetch(items, func, num_prefetch, executor):
+    '''
+    map func over items in the executor, keeping up to num_prefetch calls
+    in flight ahead of the consumer, and yield the results in order.
+    with no executor (or num_prefetch < 1) func is called inline.
+    '''
+    if executor is None or num_prefetch < 1:
+        for item in items:
+            yield func(item)
+        return
+
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) > num_prefetch:
+            yield pending.popleft().result()
+    while len(pending) > 0:
+        yield pending.popleft().result()
 
-        # Initialise 'train' to False
-        sample['train'] = False
-        
-        # We need to maintain the correct train - validate ratio across the dataset, even if continous training
-        # so don't add this sample to the main records list (gen_records) yet.
-        new_records[key] = sample
-        
-    # new_records now contains all our NEW samples
-    # - set a random selection to be the training samples based on the ratio in CFG file
-    shufKeys = list(new_records.keys())
-    random.shuffle(shufKeys)
-    trainCount = 0
-    #  Ratio of samples to use as training data, the remaining are used for evaluation
-    targetTrainCount = int(opts['cfg'].TRAIN_TEST_SPLIT * len(shufKeys))
-    for key in shufKeys:
-        new_records[key]['train'] = True
-        trainCount += 1
-        if trainCount >= targetTrainCount:
-            break
-    # Finally add all the new records to the existing list
-    gen_records.update(new_records)
 
 def save_json_and_weights(model, filename):
     '''
@@ -303,7 +817,10 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
     if continuous:
         print("continuous training")
     
-    gen_records = {}
+    # extract before the model is built, so the worker processes fork from a process without tensorflow state
+    packed_pickles = extract_data_from_pickles(cfg, tub_names)
+
+    table = SampleTable()
     opts = { 'cfg' : cfg}
 
     if "linear" in model_type:
@@ -340,15 +857,92 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
     opts['continuous'] = continuous
     opts['model_type'] = model_type
 
-    extract_data_from_pickles(cfg, tub_names)
-
     records = gather_records(cfg, tub_names, opts, verbose=True)
+    if len(packed_pickles) > 0:
+        # records of the pickle tubs are read from their packed tubs instead
+        packed_dirs = set(os.path.realpath(p) for p in packed_pickles)
+        records = [r for r in records if os.path.realpath(os.path.dirname(r)) not in packed_dirs]
     print('collating %d records ...' % (len(records)))
-    collate_records(records, gen_records, opts)
+    collate_records(records, table, opts)
+    packed_tubs = gather_packed_tubs(cfg, tub_names)
+    packed_known = set(os.path.realpath(packed.path) for packed in packed_tubs)
+    packed_tubs += [get_packed_tub(p) for p in packed_pickles.values()
+        if os.path.realpath(p) not in packed_known]
+    for packed in packed_tubs:
+        print('collating %d packed records from %s ...' % (packed.total(), packed.path))
+        collate_packed_records(packed, table, opts)
+
+    if continuous:
+        # only the records written after this point are read in later passes
+        watcher = TubWatcher(cfg, tub_names, table, opts)
+
+    kl = opts['keras_pilot']
+
+    if type(kl.model.output) is list:
+        model_out_shape = (2, 1)
+    else:
+        model_out_shape = kl.model.output.shape
+
+    has_imu = type(kl) is KerasIMU
+    has_bvh = type(kl) is KerasBehavioral
+    img_out = type(kl) is KerasLatent
+
+    if img_out:
+        import cv2
+
+    # decoded images are kept in a bounded LRU cache keyed by table row
+    image_cache = ImageCache(getattr(cfg, 'CACHE_IMAGES_MAX_BYTES', None)) if cfg.CACHE_IMAGES else None
+
+    # decode and scale the next batches in a thread pool while keras trains on the current one
+    num_prefetch = getattr(cfg, 'PREFETCH_BATCHES', 0)
+    num_workers = getattr(cfg, 'PREFETCH_WORKERS', 0)
+    if num_prefetch > 0 and num_workers > 0:
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+    else:
+        executor = None
+
+    def make_batch(rows):
+        batch_size = len(rows)
+        inputs_img = []
+        out_img = []
+
+        for row in rows:
+            img_arr = load_table_image(table, row, cfg, image_cache, aug)
 
-    def generator(save_best, opts, data, batch_size, isTrainSet=True, min_records_to_train=1000):
+            if img_arr is None:
+                return None
+
+            if img_out:
+                rz_img_arr = cv2.resize(img_arr, (127, 127)) / 255.0
+                out_img.append(rz_img_arr[:,:,0].reshape((127, 127, 1)))
+
+            inputs_img.append(img_arr)
+
+        img_arr = np.array(inputs_img).reshape(batch_size,\
+            cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
+
+        if has_imu:
+            X = [img_arr, table.column('imu')[rows]]
+        elif has_bvh:
+            X = [img_arr, table.column('behavior')[rows]]
+        else:
+            X = [img_arr]
+
+        angles = table.angle[rows]
+        throttles = table.throttle[rows]
+
+        if img_out:
+            y = [out_img, angles, throttles]
+        elif model_out_shape[1] == 2:
+            y = [np.stack([angles, throttles], axis=1).reshape(batch_size, 2) ]
+        else:
+            y = [angles, throttles]
+
+        return X, y
+
+    def batch_generator(save_best, opts, table, batch_size, isTrainSet=True, min_records_to_train=1000):
         
-        num_records = len(data)
+        num_records = len(table)
 
         while True:
 
@@ -357,128 +951,44 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
                 When continuous training, we look for new records after each epoch.
                 This will add new records to the train and validation set.
                 '''
-                records = gather_records(cfg, tub_names, opts)
-                if len(records) > num_records:
-                    collate_records(records, gen_records, opts)
-                    new_num_rec = len(data)
-                    if new_num_rec > num_records:
-                        print('picked up', new_num_rec - num_records, 'new records!')
-                        num_records = new_num_rec 
-                        save_best.reset_best()
+                num_new = watcher.update()
+                if num_new > 0:
+                    print('picked up', num_new, 'new records!')
+                    save_best.reset_best()
+                num_records = int(np.count_nonzero(table.valid))
                 if num_records < min_records_to_train:
                     print("not enough records to train. need %d, have %d. waiting..." % (min_records_to_train, num_records))
                     time.sleep(10)
                     continue
 
-            batch_data = []
+            batch_rows = []
 
-            keys = list(data.keys())
+            rows = np.flatnonzero((table.train == isTrainSet) & table.valid)
 
-            random.shuffle(keys)
+            np.random.shuffle(rows)
 
-            kl = opts['keras_pilot']
-
-            if type(kl.model.output) is list:
-                model_out_shape = (2, 1)
-            else:
-                model_out_shape = kl.model.output.shape
+            for row in rows:
 
-            if type(kl.model.input) is list:
-                model_in_shape = (2, 1)
-            else:    
-                model_in_shape = kl.model.input.shape
-
-            has_imu = type(kl) is KerasIMU
-            has_bvh = type(kl) is KerasBehavioral
-            img_out = type(kl) is KerasLatent
-            
-            if img_out:
-                import cv2
-
-            for key in keys:
-
-                if not key in data:
-                    continue
-
-                _record = data[key]
-
-                if _record['train'] != isTrainSet:
-                    continue
-
-                if continuous:
+                if continuous and table.packed_of(row) is None:
                     #in continuous mode we need to handle files getting deleted
-                    filename = _record['image_path']
-                    if not os.path.exists(filename):
-                        data.pop(key, None)
-                        continue
-
-                batch_data.append(_record)
-
-                if len(batch_data) == batch_size:
-                    inputs_img = []
-                    inputs_imu = []
-                    inputs_bvh = []
-                    angles = []
-                    throttles = []
-                    out_img = []
-                    out = []
-
-                    for record in batch_data:
-                        #get image data if we don't already have it
-                        if record['img_data'] is None:
-                            filename = record['image_path']
-                            
-                            img_arr = load_scaled_image_arr(filename, cfg)
-
-                            if img_arr is None:
-                                break
-                            
-                            if aug:
-                                img_arr = augment_image(img_arr)
-
-                            if cfg.CACHE_IMAGES:
-                                record['img_data'] = img_arr
-                        else:
-                            img_arr = record['img_data']
-                            
-                        if img_out:                            
-                            rz_img_arr = cv2.resize(img_arr, (127, 127)) / 255.0
-                            out_img.append(rz_img_arr[:,:,0].reshape((127, 127, 1)))
-                            
-                        if has_imu:
-                            inputs_imu.append(record['imu_array'])
-                        
-                        if has_bvh:
-                            inputs_bvh.append(record['behavior_arr'])
-
-                        inputs_img.append(img_arr)
-                        angles.append(record['angle'])
-                        throttles.append(record['throttle'])
-                        out.append([record['angle'], record['throttle']])
-
-                    if img_arr is None:
+                    if not os.path.exists(table.image_path(row)):
+                        table.valid[row] = False
+                        if image_cache is not None:
+                            image_cache.discard(row)
                         continue
 
-                    img_arr = np.array(inputs_img).reshape(batch_size,\
-                        cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
-
-                    if has_imu:
-                        X = [img_arr, np.array(inputs_imu)]
-                    elif has_bvh:
-                        X = [img_arr, np.array(inputs_bvh)]
-                    else:
-                        X = [img_arr]
+                batch_rows.append(row)
 
-                    if img_out:
-                        y = [out_img, np.array(angles), np.array(throttles)]
-                    elif model_out_shape[1] == 2:
-                        y = [np.array([out]).reshape(batch_size, 2) ]
-                    else:
-                        y = [np.array(angles), np.array(throttles)]
+                if len(batch_rows) == batch_size:
+                    yield np.array(batch_rows)
+                    batch_rows = []
 
-                    yield X, y
-
-                    batch_data = []
+    def generator(save_best, opts, table, batch_size, isTrainSet=True, min_records_to_train=1000):
+        batches = batch_generator(save_best, opts, table, batch_size, isTrainSet, min_records_to_train)
+        for batch in prefetch(batches, make_batch, num_prefetch, executor):
+            if batch is None:
+                continue
+            yield batch
     
     model_path = os.path.expanduser(model_name)
 
@@ -492,19 +1002,13 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
                                     mode='min',
                                     cfg=cfg)
 
-    train_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, True)
-    val_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, False)
+    train_gen = generator(save_best, opts, table, cfg.BATCH_SIZE, True)
+    val_gen = generator(save_best, opts, table, cfg.BATCH_SIZE, False)
     
-    total_records = len(gen_records)
+    total_records = len(table)
 
-    num_train = 0
-    num_val = 0
-
-    for key, _record in gen_records.items():
-        if _record['train'] == True:
-            num_train += 1
-        else:
-            num_val += 1
+    num_train = int(np.count_nonzero(table.train & table.valid))
+    num_val = int(np.count_nonzero(~table.train & table.valid))
 
     print("train: %d, val: %d" % (num_train, num_val))
     print('total records: %d' %(total_records))
@@ -519,11 +1023,17 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
 
     cfg.model_type = model_type
 
-    go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best)
+    go_train(kl, cfg, train_gen, val_gen, table, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best)
+
+    if executor is not None:
+        executor.shutdown(wait=False)
+    if image_cache is not None:
+        print('image cache: %d images, %d bytes, %d hits, %d misses' % (
+            len(image_cache), image_cache.nbytes, image_cache.hits, image_cache.misses))
 
     
     
-def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best=None):
+def go_train(kl, cfg, train_gen, val_gen, table, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best=None):
 
     start = time.time()
 
@@ -625,12 +1135,8 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
 
         if prepare_for_coral:
             #compile a list of records to calibrate the quantization
-            data_list = []
             max_items = 1000
-            for key, _record in gen_records.items():
-                data_list.append(_record)
-                if len(data_list) == max_items:
-                    break   
+            data_list = np.arange(min(len(table), max_items))
 
             stride = 1
             num_calibration_steps = len(data_list) // stride
@@ -643,9 +1149,8 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
                     batch_data = data_list[start:end]
                     inputs = []
                 
-                    for record in batch_data:
-                        filename = record['image_path']                        
-                        img_arr = load_scaled_image_arr(filename, cfg)
+                    for row in batch_data:
+                        img_arr = table.load_image(row, cfg)
                         inputs.append(img_arr)
 
                     start += stride
@@ -672,78 +1177,136 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
         # print("Saved TensorRT model:", uff_filename)
 
     if cfg.PRUNE_CNN:
-        base_model_path = splitext(model_name)[0]
-        cnn_channels = get_total_channels(kl.model)
-        print('original model with {} channels'.format(cnn_channels))
-        prune_gen = SequencePredictionGenerator(gen_records, cfg)
-        target_channels = int(cnn_channels * (1 - (float(cfg.PRUNE_PERCENT_TARGET) / 100.0)))
+        prune_and_fine_tune(kl, cfg, table, model_name, train_gen, val_gen, steps_per_epoch, val_steps,
+            epochs, max_val_loss, save_best, workers_count, use_multiprocessing, verbose)
 
-        print('Target channels of {0} remaining with {1:.00%} percent removal per iteration'.format(target_channels, cfg.PRUNE_PERCENT_PER_ITERATION / 100))
-        
-        from keras.models import load_model
-        prune_loss = 0
-        while cnn_channels > target_channels:
-            save_best.reset_best()
-            model, channels_deleted = prune(kl.model, prune_gen, 1, cfg)
-            cnn_channels -= channels_deleted
-            kl.model = model
-            kl.compile()
-            kl.model.summary()
-
-            #stop training if the validation error stops improving.
-            early_stop = keras.callbacks.EarlyStopping(monitor='val_loss', 
-                                                        min_delta=cfg.MIN_DELTA, 
-                                                        patience=cfg.EARLY_STOP_PATIENCE, 
-                                                        verbose=verbose, 
-                                                        mode='auto')
-
-            history = kl.model.fit_generator(
-                        train_gen,
-                        steps_per_epoch=steps_per_epoch, 
-                        epochs=epochs, 
-                        verbose=cfg.VEBOSE_TRAIN,
-                        validation_data=val_gen,
-                        validation_steps=val_steps,
-                        workers=workers_count,
-                        callbacks=[early_stop],
-                        use_multiprocessing=use_multiprocessing)
-
-            prune_loss = min(history.history['val_loss'])
-            print('prune val_loss this iteration: {}'.format(prune_loss))
-
-            # If loss breaks the threshhold 
-            if prune_loss < max_val_loss:
-                model.save('{}_prune_{}_filters.h5'.format(base_model_path, cnn_channels))
-            else:
-                break
 
-        print('pruning stopped at {} with a target of {}'.format(cnn_channels, target_channels))
+def prune_and_fine_tune(kl, cfg, table, model_name, train_gen, val_gen, steps_per_epoch, val_steps,
+    epochs, max_val_loss, save_best, workers_count, use_multiprocessing, verbose):
+    '''
+    iteratively prune PRUNE_PERCENT_PER_ITERATION percent of the conv channels
+    and fine tune, until PRUNE_PERCENT_TARGET is reached, the validation loss
+    goes over max_val_loss, or the budget runs out:
+    PRUNE_MAX_ITERATIONS iterations and PRUNE_TIME_BUDGET seconds (0 means no limit).
+    an iteration is not started when the average iteration time would overrun
+    the time budget. fine tuning runs PRUNE_FINE_TUNE_EPOCHS epochs (0 uses epochs)
+    with early stopping. the time spent in each iteration is reported.
+    '''
+    base_model_path = splitext(model_name)[0]
+    cnn_channels = get_total_channels(kl.model)
+    print('original model with {} channels'.format(cnn_channels))
+    prune_gen = SequencePredictionGenerator(table, cfg)
+    target_channels = int(cnn_channels * (1 - (float(cfg.PRUNE_PERCENT_TARGET) / 100.0)))
+
+    print('Target channels of {0} remaining with {1:.00%} percent removal per iteration'.format(target_channels, cfg.PRUNE_PERCENT_PER_ITERATION / 100))
+
+    max_iterations = getattr(cfg, 'PRUNE_MAX_ITERATIONS', 0)
+    time_budget = getattr(cfg, 'PRUNE_TIME_BUDGET', 0)
+    fine_tune_epochs = getattr(cfg, 'PRUNE_FINE_TUNE_EPOCHS', 0) or epochs
+
+    prune_start = time.time()
+    iteration_times = []
+    prune_loss = 0
+    while cnn_channels > target_channels:
+        if max_iterations and len(iteration_times) >= max_iterations:
+            print('pruning iteration budget of {} used up'.format(max_iterations))
+            break
+        elapsed = time.time() - prune_start
+        if time_budget and len(iteration_times) > 0 and \
+            elapsed + np.mean(iteration_times) > time_budget:
+            print('pruning time budget of {}s would be exceeded ({:.1f}s used)'.format(time_budget, elapsed))
+            break
+
+        iteration_start = time.time()
+        save_best.reset_best()
+        model, channels_deleted = prune(kl.model, prune_gen, 1, cfg)
+        cnn_channels -= channels_deleted
+        kl.model = model
+        kl.compile()
+        kl.model.summary()
+        duration_prune = time.time() - iteration_start
+
+        #stop training if the validation error stops improving.
+        early_stop = keras.callbacks.EarlyStopping(monitor='val_loss', 
+                                                    min_delta=cfg.MIN_DELTA, 
+                                                    patience=cfg.EARLY_STOP_PATIENCE, 
+                                                    verbose=verbose, 
+                                                    mode='auto')
+
+        history = kl.model.fit_generator(
+                    train_gen,
+                    steps_per_epoch=steps_per_epoch, 
+                    epochs=fine_tune_epochs, 
+                    verbose=cfg.VEBOSE_TRAIN,
+                    validation_data=val_gen,
+                    validation_steps=val_steps,
+                    workers=workers_count,
+                    callbacks=[early_stop],
+                    use_multiprocessing=use_multiprocessing)
+
+        prune_loss = min(history.history['val_loss'])
+        iteration_times.append(time.time() - iteration_start)
+        print('prune iteration {}: {} channels, val_loss {}, prune {:.1f}s, fine tune {:.1f}s, total {:.1f}s'.format(
+            len(iteration_times), cnn_channels, prune_loss, duration_prune,
+            iteration_times[-1] - duration_prune, iteration_times[-1]))
+
+        # If loss breaks the threshhold 
+        if prune_loss < max_val_loss:
+            model.save('{}_prune_{}_filters.h5'.format(base_model_path, cnn_channels))
+        else:
+            break
+
+    prune_gen.close()
+    print('pruning stopped at {} with a target of {} after {} iterations in {}'.format(
+        cnn_channels, target_channels, len(iteration_times),
+        str(datetime.timedelta(seconds=round(time.time() - prune_start)))))
 
 
 class SequencePredictionGenerator(keras.utils.Sequence):
     """
-    Provides a thread safe data generator for the Keras predict_generator for use with kerasergeon. 
+    Provides a thread safe data generator for the Keras predict_generator for use with kerassurgeon. 
+    The evaluation images are scaled once, on first use, and kept as uint8 in an
+    array backed by a temporary file (np.memmap), so the APoZ pass of every
+    pruning iteration after the first does not touch the tub images again.
+    Colour images round trip exactly; gray images (IMAGE_DEPTH 1) are rounded
+    to the nearest 1/255 step, at most 0.5 / 255 off the uncached value.
     """
-    def __init__(self, data, cfg):
-        data = list(data.values())
-        self.n = int(len(data) * cfg.PRUNE_EVAL_PERCENT_OF_DATASET)
-        self.data = data[:self.n]
+    def __init__(self, table, cfg):
+        self.table = table
+        self.n = int(len(table) * cfg.PRUNE_EVAL_PERCENT_OF_DATASET)
+        self.rows = np.arange(self.n)
         self.batch_size = cfg.BATCH_SIZE
         self.cfg = cfg
+        self.shape = (cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)
+        self.file = tempfile.TemporaryFile()
+        self.images = np.memmap(self.file, dtype=np.uint8, mode='w+', shape=(max(self.n, 1),) + self.shape)
+        self.decoded = np.zeros(self.n, dtype=bool)
+        self.lock = threading.Lock()
 
     def __len__(self):
-        return int(np.ceil(len(self.data) / float(self.batch_size)))
+        return int(np.ceil(len(self.rows) / float(self.batch_size)))
 
     def __getitem__(self, idx):
-        batch_data = self.data[idx * self.batch_size:(idx + 1) * self.batch_size]
+        start = idx * self.batch_size
+        end = min(start + self.batch_size, len(self.rows))
+
+        missing = start + np.flatnonzero(~self.decoded[start:end])
+        for i in missing:
+            img_arr = self.table.load_image(self.rows[i], self.cfg)
+            if img_arr is None:
+                print('failed to load the evaluation image of row', self.rows[i])
+                continue
+            self.images[i] = np.rint(np.asarray(img_arr).reshape(self.shape) * 255.0).astype(np.uint8)
+        with self.lock:
+            self.decoded[missing] = True
 
-        images = []
-        for data in batch_data:
-            path = data['image_path']
-            img_arr = load_scaled_image_arr(path, self.cfg)
-            images.append(img_arr)
+        return self.images[start:end].astype(np.float32) / 255.0, np.array([])
 
-        return np.array(images), np.array([])
+    def close(self):
+        self.images = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
 
 def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, continuous, aug):
     '''
@@ -761,51 +1324,23 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
     
     verbose = cfg.VEBOSE_TRAIN
 
-    records = []
+    table = SampleTable()
+    opts = { 'cfg' : cfg, 'categorical' : False }
 
     for tub in tubs:
         record_paths = glob.glob(os.path.join(tub.path, 'record_*.json'))
         print("Tub:", tub.path, "has", len(record_paths), 'records')
 
         record_paths.sort(key=get_record_index)
-        records += record_paths
-
-
-    print('collating records')
-    gen_records = {}
-
-    for record_path in records:
-
-        with open(record_path, 'r') as fp:
-            json_data = json.load(fp)
-
-        basepath = os.path.dirname(record_path)
-        image_filename = json_data["cam/image_array"]
-        image_path = os.path.join(basepath, image_filename)
-        sample = { 'record_path' : record_path, "image_path" : image_path, "json_data" : json_data }
-
-        sample["tub_path"] = basepath
-        sample["index"] = get_image_index(image_filename)
-
-        angle = float(json_data['user/angle'])
-        throttle = float(json_data["user/throttle"])
-
-        sample['target_output'] = np.array([angle, throttle])
-        sample['angle'] = angle
-        sample['throttle'] = throttle
-
-        sample['img_data'] = None
-
-        key = make_key(sample)
-
-        gen_records[key] = sample
 
+        tub_id = table.get_tub_id(tub.path)
+        indices, angles, throttles, _, _, _, _, image_names = read_json_records(record_paths)
+        table.append(make_rows(tub_id, indices, angles, throttles, opts, image_names=image_names))
 
+    print('collated', len(table), 'records')
 
     print('collating sequences')
 
-    sequences = []
-    
     target_len = cfg.SEQUENCE_LENGTH
     look_ahead = False
     
@@ -813,34 +1348,25 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
         target_len = cfg.SEQUENCE_LENGTH * 2
         look_ahead = True
 
-    for k, sample in gen_records.items():
-
-        seq = []
-
-        for i in range(target_len):
-            key = make_next_key(sample, i)
-            if key in gen_records:
-                seq.append(gen_records[key])
-            else:
-                continue
-
-        if len(seq) != target_len:
-            continue
-
-        sequences.append(seq)
+    sequences = sequence_windows(table, target_len)
 
     print("collated", len(sequences), "sequences of length", target_len)
 
     #shuffle and split the data
-    train_data, val_data  = train_test_split(sequences, test_size=(1 - cfg.TRAIN_TEST_SPLIT))
+    sequences = np.random.permutation(sequences)
+    num_train_seq = int(len(sequences) * cfg.TRAIN_TEST_SPLIT)
+    train_data, val_data = sequences[:num_train_seq], sequences[num_train_seq:]
 
+    # every frame is decoded once and shared by the (up to target_len) windows it is part of
+    frames = FrameBuffer(table, cfg, getattr(cfg, 'CACHE_IMAGES_MAX_BYTES', None))
 
     def generator(data, opt, batch_size=cfg.BATCH_SIZE):
         num_records = len(data)
+        seq_len = cfg.SEQUENCE_LENGTH
 
         while True:
             #shuffle again for good measure
-            random.shuffle(data)
+            data = np.random.permutation(data)
 
             for offset in range(0, num_records, batch_size):
                 batch_data = data[offset:offset+batch_size]
@@ -848,68 +1374,32 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
                 if len(batch_data) != batch_size:
                     break
 
-                b_inputs_img = []
-                b_vec_in = []
-                b_labels = []
-                b_vec_out = []
-
-                for seq in batch_data:
-                    inputs_img = []
-                    vec_in = []
-                    labels = []
-                    vec_out = []
-                    num_images_target = len(seq)
-                    iTargetOutput = -1
-                    if opt['look_ahead']:
-                        num_images_target = cfg.SEQUENCE_LENGTH
-                        iTargetOutput = cfg.SEQUENCE_LENGTH - 1
-
-                    for iRec, record in enumerate(seq):
-                        #get image data if we don't already have it
-                        if len(inputs_img) < num_images_target:
-                            if record['img_data'] is None:
-                                img_arr = load_scaled_image_arr(record['image_path'], cfg)
-                                if img_arr is None:
-                                    break
-                                if aug:
-                                    img_arr = augment_image(img_arr)
-                                
-                                if cfg.CACHE_IMAGES:
-                                    record['img_data'] = img_arr
-                            else:
-                                img_arr = record['img_data']                  
-                                
-                            inputs_img.append(img_arr)
-
-                        if iRec >= iTargetOutput:
-                            vec_out.append(record['angle'])
-                            vec_out.append(record['throttle'])
-                        else:
-                            vec_in.append(0.0) #record['angle'])
-                            vec_in.append(0.0) #record['throttle'])
-                        
-                    label_vec = seq[iTargetOutput]['target_output']
-
-                    if look_ahead:
-                        label_vec = np.array(vec_out)
-
-                    labels.append(label_vec)
-
-                    b_inputs_img.append(inputs_img)
-                    b_vec_in.append(vec_in)
-
-                    b_labels.append(labels)
+                if opt['look_ahead']:
+                    images = frames.gather(batch_data[:, :seq_len])
+                else:
+                    images = frames.gather(batch_data)
 
-                
-                if look_ahead:
-                    X = [np.array(b_inputs_img).reshape(batch_size,\
-                        cfg.TARGET_H, cfg.TARGET_W, cfg.SEQUENCE_LENGTH)]
-                    X.append(np.array(b_vec_in))
-                    y = np.array(b_labels).reshape(batch_size, (cfg.SEQUENCE_LENGTH + 1) * 2)
+                if images is None:
+                    continue
+
+                if aug:
+                    for img_seq in images:
+                        for i in range(len(img_seq)):
+                            img_seq[i] = augment_image(img_seq[i])
+
+                angles = table.angle[batch_data]
+                throttles = table.throttle[batch_data]
+
+                if opt['look_ahead']:
+                    X = [images.reshape(batch_size,\
+                        cfg.TARGET_H, cfg.TARGET_W, seq_len)]
+                    X.append(np.zeros((batch_size, (seq_len - 1) * 2)))
+                    y = np.stack([angles[:, seq_len - 1:], throttles[:, seq_len - 1:]], axis=2)\
+                        .reshape(batch_size, (seq_len + 1) * 2)
                 else:
-                    X = [np.array(b_inputs_img).reshape(batch_size,\
-                        cfg.SEQUENCE_LENGTH, cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)]
-                    y = np.array(b_labels).reshape(batch_size, 2)
+                    X = [images.reshape(batch_size,\
+                        seq_len, cfg.TARGET_H, cfg.TARGET_W, cfg.TARGET_D)]
+                    y = np.stack([angles[:, -1], throttles[:, -1]], axis=1)
 
                 yield X, y
 
@@ -934,7 +1424,9 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
     
     cfg.model_type = model_type
 
-    go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose)
+    go_train(kl, cfg, train_gen, val_gen, table, model_name, steps_per_epoch, val_steps, continuous, verbose)
+
+    frames.close()
     
     ''' 
     kl.train(train_gen, 
@@ -964,7 +1456,9 @@ def prune(model, validation_generator, val_steps, cfg):
 
     apoz_df = get_model_apoz(model, validation_generator)
 
+    start = time.time()
     model = prune_model(model, apoz_df, n_channels_delete)
+    print('deleted {} channels in {:.1f}s'.format(n_channels_delete, time.time() - start))
 
     name = '{}/model_pruned_{}_percent.h5'.format(cfg.MODELS_PATH, percent_pruning)
 
@@ -973,35 +1467,200 @@ def prune(model, validation_generator, val_steps, cfg):
     return model, n_channels_delete
 
 
-def extract_data_from_pickles(cfg, tubs):
+def read_pickle(file_path):
+    '''
+    decompress and unpickle one {id}.pickle, returning its record dict.
+    '''
+    with open(file_path, 'rb') as f:
+        p = zlib.decompress(f.read())
+    data = pickle.loads(p)
+    return data['val']
+
+
+def encode_jpeg(img_arr):
+    '''
+    encode an image array as jpeg bytes (PIL default quality, same as Image.save).
+    '''
+    f = io.BytesIO()
+    Image.fromarray(np.uint8(img_arr)).save(f, format='jpeg')
+    return f.getvalue()
+
+
+def pickle_outputs(file_path):
+    '''
+    return the image and json record paths extracted from {id}.pickle.
+    '''
+    base_path = dirname(file_path)
+    filename = splitext(basename(file_path))[0]
+    return join(base_path, filename + '.jpg'), join(base_path, 'record_{}.json'.format(filename))
+
+
+def is_pickle_extracted(file_path):
+    '''
+    True when the json record of the pickle is at least as new as the pickle.
+    the json is written after the image, so it marks a finished extraction.
+    '''
+    image_path, record_path = pickle_outputs(file_path)
+    try:
+        return os.stat(record_path).st_mtime_ns >= os.stat(file_path).st_mtime_ns and \
+            os.path.isfile(image_path)
+    except OSError:
+        return False
+
+
+def extract_pickle(file_path):
+    '''
+    write {id}.jpg and record_{id}.json along side {id}.pickle.
+    runs in a worker process. the json goes to a temp file first and is renamed
+    in place, so an interrupted run never leaves a json that looks up to date.
+    '''
+    record = read_pickle(file_path)
+    image_path, record_path = pickle_outputs(file_path)
+    with open(image_path, 'wb') as f:
+        f.write(encode_jpeg(record['cam/image_array']))
+
+    record['cam/image_array'] = basename(image_path)
+
+    tmp_path = record_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(record, f)
+    os.replace(tmp_path, record_path)
+    return file_path
+
+
+def encode_pickle(file_path):
+    '''
+    read one pickle for packing. runs in a worker process.
+    returns the record without images and a dict of jpeg bytes per image key.
+    '''
+    record = read_pickle(file_path)
+    images = {}
+    for key in [key for key in record if key.endswith('image_array')]:
+        value = record.pop(key)
+        if value is not None:
+            images[key] = encode_jpeg(value)
+    return record, images
+
+
+def get_pickle_number(file_path):
+    '''
+    return the id of {id}.pickle, or None when the name is not a number.
+    '''
+    try:
+        return int(splitext(basename(file_path))[0])
+    except ValueError:
+        return None
+
+
+def is_packed_up_to_date(packed_dir, file_paths):
+    '''
+    True when packed_dir was packed in the current format after the newest pickle and holds all of them.
+    only {id}.pickle files are counted, as pack_pickles skips the others.
+    '''
+    file_paths = [p for p in file_paths if get_pickle_number(p) is not None]
+    meta_path = join(packed_dir, PACKED_META_FILE_NAME)
+    try:
+        mtime = os.stat(meta_path).st_mtime_ns
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    # packed tubs of an older format are rebuilt
+    return meta.get('version') == PACKED_VERSION and meta.get('count') == len(file_paths) and \
+        all([os.stat(p).st_mtime_ns <= mtime for p in file_paths])
+
+
+def pack_pickles(tub_path, file_paths, packed_dir, executor):
+    '''
+    write the pickles of one tub straight into a packed tub, skipping the
+    per record json/jpg files. pickles are decoded by the executor and written
+    in id order. returns the packed tub path.
+    '''
+    numbered = sorted([(get_pickle_number(p), p) for p in file_paths if get_pickle_number(p) is not None])
+    file_paths = [p for _, p in numbered]
+    results = executor.map(encode_pickle, file_paths, chunksize=64) if executor is not None \
+        else map(encode_pickle, file_paths)
+    writer = None
+    try:
+        for (number, _), (record, images) in zip(numbered, results):
+            if writer is None:
+                types = infer_types(record)
+                for key in images:
+                    types[key] = 'image_array'
+                writer = PackedTubWriter(packed_dir, types, source=tub_path, overwrite=True)
+            writer.append(number, record, images)
+    finally:
+        if writer is not None:
+            writer.close_files()
+    if writer is None:
+        return None
+    return writer.close(join(tub_path, 'meta.json'))
+
+
+def extract_data_from_pickles(cfg, tubs, workers=None, packed=None):
     """
     Extracts record_{id}.json and image from a pickle with the same id if exists in the tub.
     Then writes extracted json/jpg along side the source pickle that tub.
     This assumes the format {id}.pickle in the tub directory.
+    Pickles whose json record is already newer than the pickle are skipped,
+    the rest are extracted across a process pool.
+    With packed, the pickles of each tub are written into a packed tub
+    ({tub}.packed) instead, and the json/jpg files are not written.
     :param cfg: config with data location configuration. Generally the global config object.
     :param tubs: The list of tubs involved in training.
-    :return: implicit None.
+    :param workers: worker processes, None uses cfg.PICKLE_EXTRACT_WORKERS. 1 or less runs in this process.
+    :param packed: write packed tubs, None uses cfg.PICKLE_EXTRACT_PACKED.
+    :return: dict of tub path to the packed tub path written (empty unless packed).
     """
-    t_paths = gather_tub_paths(cfg, tubs)
-    for tub_path in t_paths:
-        file_paths = glob.glob(join(tub_path, '*.pickle'))
-        print('found {} pickles writing json records and images in tub {}'.format(len(file_paths), tub_path))
-        for file_path in file_paths:
-            # print('loading data from {}'.format(file_paths))
-            with open(file_path, 'rb') as f:
-                p = zlib.decompress(f.read())
-            data = pickle.loads(p)
-           
-            base_path = dirname(file_path)
-            filename = splitext(basename(file_path))[0]
-            image_path = join(base_path, filename + '.jpg')
-            img = Image.fromarray(np.uint8(data['val']['cam/image_array']))
-            img.save(image_path)
-            
-            data['val']['cam/image_array'] = filename + '.jpg'
-
-            with open(join(base_path, 'record_{}.json'.format(filename)), 'w') as f:
-                json.dump(data['val'], f)
+    if workers is None:
+        workers = getattr(cfg, 'PICKLE_EXTRACT_WORKERS', None)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if packed is None:
+        packed = getattr(cfg, 'PICKLE_EXTRACT_PACKED', False)
+
+    packed_paths = collections.OrderedDict()
+    executor = None
+    try:
+        t_paths = gather_tub_paths(cfg, tubs)
+        for tub_path in t_paths:
+            if is_packed_tub(tub_path):
+                continue
+            file_paths = glob.glob(join(tub_path, '*.pickle'))
+            if len(file_paths) == 0:
+                continue
+
+            if packed:
+                packed_dir = os.path.normpath(tub_path) + PACKED_SUFFIX
+                if is_packed_up_to_date(packed_dir, file_paths):
+                    print('found {} pickles in tub {}, packed tub {} is up to date'.format(
+                        len(file_paths), tub_path, packed_dir))
+                else:
+                    print('found {} pickles packing them into {}'.format(len(file_paths), packed_dir))
+                    if executor is None and workers > 1:
+                        executor = ProcessPoolExecutor(max_workers=workers)
+                    packed_dir = pack_pickles(tub_path, file_paths, packed_dir, executor)
+                if packed_dir is not None:
+                    packed_paths[tub_path] = packed_dir
+                continue
+
+            stale_paths = [p for p in file_paths if not is_pickle_extracted(p)]
+            print('found {} pickles writing json records and images in tub {} ({} up to date)'.format(
+                len(file_paths), tub_path, len(file_paths) - len(stale_paths)))
+            if len(stale_paths) == 0:
+                continue
+            if executor is None and workers > 1:
+                executor = ProcessPoolExecutor(max_workers=workers)
+            if executor is not None:
+                for _ in executor.map(extract_pickle, stale_paths, chunksize=64):
+                    pass
+            else:
+                for file_path in stale_paths:
+                    extract_pickle(file_path)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return packed_paths
 
 
 def prune_model(model, apoz_df, n_channels_delete):
@@ -1035,20 +1694,54 @@ def get_total_channels(model):
 
 
 def get_model_apoz(model, generator):
-    from kerassurgeon.identify import get_apoz
+    '''
+    compute the APoZ (average percentage of zeros) of every Conv2D channel
+    in a single pass over the generator. one model outputs the activations of
+    all conv layers (found the same way kerassurgeon.identify.get_apoz does),
+    and the zero counts are accumulated per batch, so the activations are
+    never held for the whole evaluation set.
+    returns a DataFrame indexed by layer name with the channel index and apoz.
+    '''
+    from kerassurgeon import utils as surgeon_utils
     import pandas as pd
 
-    # Get APoZ
-    start = None
-    end = None
-    apoz = []
-    for layer in model.layers[start:end]:
+    layers = []
+    outputs = []
+    for layer in model.layers:
         if layer.__class__.__name__ == 'Conv2D':
             print(layer.name)
-            apoz.extend([(layer.name, i, value) for (i, value)
-                         in enumerate(get_apoz(model, layer, generator))])
+            for node_index in surgeon_utils.find_nodes_in_model(model, layer):
+                act_layer, act_index = surgeon_utils.find_activation_layer(layer, node_index)
+                layers.append(layer)
+                outputs.append(act_layer.get_output_at(act_index))
 
-    layer_name, index, apoz_value = zip(*apoz)
+    activation_model = keras.models.Model(model.inputs, outputs)
+    zeros = collections.OrderedDict((layer.name, np.zeros(layer.filters, dtype=np.int64)) for layer in layers)
+    counts = collections.OrderedDict((layer.name, 0) for layer in layers)
+
+    start = time.time()
+    for i in range(len(generator)):
+        x, _ = generator[i]
+        activations = activation_model.predict_on_batch(x)
+        if len(outputs) == 1:
+            activations = [activations]
+        for layer, a in zip(layers, activations):
+            a = np.asarray(a)
+            if getattr(layer, 'data_format', 'channels_last') == 'channels_first':
+                a = np.swapaxes(a, 1, -1)
+            a = a.reshape(-1, a.shape[-1])
+            zeros[layer.name] += np.count_nonzero(a == 0, axis=0)
+            counts[layer.name] += a.shape[0]
+    print('APoZ of {} conv layers computed in one pass over {} batches in {:.1f}s'.format(
+        len(zeros), len(generator), time.time() - start))
+
+    layer_name = []
+    index = []
+    apoz_value = []
+    for name, layer_zeros in zeros.items():
+        layer_name.extend([name] * len(layer_zeros))
+        index.extend(range(len(layer_zeros)))
+        apoz_value.extend((layer_zeros / float(max(counts[name], 1))).tolist())
     apoz_df = pd.DataFrame({'layer': layer_name, 'index': index,
                             'apoz': apoz_value})
     apoz_df = apoz_df.set_index('layer')
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Tubディレクトリを列指向の packed tub ディレクトリへ変換する。
+変換後のディレクトリは train.py の --tub、tub_player.py の --tub にそのまま指定できる。
+
+Usage:
+    tub_packer.py (--tub=<tub1,tub2,..tubn>) [--out=<packed dir path>] [--overwrite] [--debug]
+
+Options:
+    --tub <tub_dir_path>        変換元タブディレクトリ(ex. data/tub_9_99-99-99)、カンマ区切りで複数指定可
+    --out <packed dir path>     出力先ディレクトリ(タブディレクトリを1つだけ指定した場合のみ有効、省略時 <tub>.packed)
+    --overwrite                 出力先が存在する場合上書きする
+    --debug                     デバッグ出力する
+"""
+try:
+    from docopt import docopt
+except ImportError:
+    exit('This code requires docopt package.')
+
+def pack(tub_names, out_dir, overwrite, debug):
+    from parts.loader import pack_tub
+    tub_dirs = [tub_dir for tub_dir in tub_names.split(',') if len(tub_dir) > 0]
+    if out_dir is not None and len(tub_dirs) != 1:
+        raise Exception('--out can be used with one tub only')
+    for tub_dir in tub_dirs:
+        packed_dir = pack_tub(tub_dir, out_dir, overwrite=overwrite, debug=debug)
+        print('[tub_packer] {} -> {}'.format(tub_dir, packed_dir))
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    pack(args['--tub'], args['--out'], args['--overwrite'], args['--debug'])
@@ -3,13 +3,17 @@
 Tubディレクトリ上のデータをAWS IoT Coreへ送信する。
 
 Usage:
-    tub_player.py [--aws_conf <aws config yaml path>] [--aws_target <aws target name>] [--tub=<tub dir path>] [--auto_repeat]
+    tub_player.py [--aws_conf <aws config yaml path>] [--aws_target <aws target name>] [--tub=<tub dir path>] [--auto_repeat] [--read_ahead=<count>] [--cache] [--cache_dir=<cache dir path>] [--rate=<hz>]
 
 Options:
     --tub <tub_dir_path>                タブディレクトリ(ex. data/tub_9_99-99-99)
     --aws_conf <aws config yaml path>   AWS IoT Core設定ファイルパス
     --aws_target <aws target name>      AWS IoT Core設定ファイル内のターゲット名
     --auto_repeat                       無限に繰り返す
+    --read_ahead <count>                先読みスレッドでデコードしておく件数 [default: 8]
+    --cache                             デコード済みデータをキャッシュディレクトリ(memmap)に保持し、2周目以降はデコードしない
+    --cache_dir <cache dir path>        キャッシュディレクトリ(省略時は <tub>.replay)
+    --rate <hz>                         再生レート(省略時は DRIVE_LOOP_HZ、キャッシュ使用時は実時間より速く再生できる)
 """
 import time
 try:
@@ -21,13 +25,12 @@ try:
 except ImportError:
     exit('This code requires donkeycar package.')
 
-def play(cfg, tub_dir, aws_conf, aws_target, repeat):
+def play(cfg, tub_dir, aws_conf, aws_target, repeat, read_ahead=8, cache_dir=None, rate_hz=None):
     V = dk.vehicle.Vehicle()
 
-
-
+    # UserLoader/ImageLoader は同じ引数で生成し、1件につき1回だけ読み込み・デコードする
     from parts.loader import UserLoader, ImageLoader
-    user_loader = UserLoader(tub_dir, repeat=repeat)
+    user_loader = UserLoader(tub_dir, repeat=repeat, read_ahead=read_ahead, cache_dir=cache_dir)
     V.add(user_loader, outputs=[
         'user/mode',
         'user/angle',
@@ -35,7 +38,7 @@ def play(cfg, tub_dir, aws_conf, aws_target, repeat):
         'user/lift_throttle',
         'timestamp',
     ])
-    image_loader = ImageLoader(tub_dir, repeat=repeat)
+    image_loader = ImageLoader(tub_dir, repeat=repeat, read_ahead=read_ahead, cache_dir=cache_dir)
     V.add(image_loader, outputs=[
         'cam/image_array',
     ])
@@ -79,7 +82,7 @@ def play(cfg, tub_dir, aws_conf, aws_target, repeat):
         print('[tub_player] start running')
         #run the vehicle for 20 seconds
         max_loop_count = None if repeat else cfg.MAX_LOOPS
-        V.start(rate_hz=cfg.DRIVE_LOOP_HZ, 
+        V.start(rate_hz=cfg.DRIVE_LOOP_HZ if rate_hz is None else rate_hz, 
                 max_loop_count=max_loop_count)
     except KeyboardInterrupt:
         # Ctrl+C押下時
@@ -104,5 +107,12 @@ if __name__ == '__main__':
     aws_conf = args['--aws_conf']
     aws_target = args['--aws_target']
     repeat = args['--auto_repeat']
+    read_ahead = int(args['--read_ahead'])
+    cache_dir = None
+    if args['--cache'] or args['--cache_dir']:
+        from parts.loader import default_cache_dir
+        cache_dir = args['--cache_dir'] or default_cache_dir(tub_dir)
+    rate_hz = float(args['--rate']) if args['--rate'] else None
 
-    play(cfg, tub_dir, aws_conf, aws_target, repeat)
+    play(cfg, tub_dir, aws_conf, aws_target, repeat,
+        read_ahead=read_ahead, cache_dir=cache_dir, rate_hz=rate_hz)